@@ -26,16 +26,19 @@ class FileFinderOS(actions.ActionPlugin):
     self.stat_cache = utils.StatCache()
 
     action = self._ParseAction(args)
-    for path in _GetExpandedPaths(args):
-      self.Progress()
-      try:
-        matches = self._Validate(args, path)
-        result = rdf_file_finder.FileFinderResult()
-        result.matches = matches
-        action.Execute(path, result)
-        self.SendReply(result)
-      except _SkipFileException:
-        pass
+    try:
+      for path in _GetExpandedPaths(args):
+        self.Progress()
+        try:
+          matches = self._Validate(args, path)
+          result = rdf_file_finder.FileFinderResult()
+          result.matches = matches
+          action.Execute(path, result)
+          self.SendReply(result)
+        except _SkipFileException:
+          pass
+    finally:
+      action.Close()
 
   @classmethod
   def Start(cls, args):
@@ -9,6 +9,7 @@ from future.utils import with_metaclass
 from grr_response_client import client_utils
 from grr_response_client import client_utils_common
 from grr_response_client.client_actions.file_finder_utils import uploading
+from grr_response_core import config
 
 
 class Action(with_metaclass(abc.ABCMeta, object)):
@@ -34,6 +35,9 @@ class Action(with_metaclass(abc.ABCMeta, object)):
     """
     pass
 
+  def Close(self):
+    """Releases the resources held by the action once all paths are done."""
+
 
 class StatAction(Action):
   """Implementation of the stat subaction.
@@ -109,6 +113,12 @@ class DownloadAction(Action):
   def __init__(self, flow, opts):
     super(DownloadAction, self).__init__(flow)
     self.opts = opts
+    self._uploader = None
+
+  def Close(self):
+    if self._uploader is not None:
+      self._uploader.Close()
+      self._uploader = None
 
   def Execute(self, filepath, result):
     stat = self.flow.stat_cache.Get(filepath, follow_symlink=True)
@@ -133,10 +143,23 @@ class DownloadAction(Action):
 
   def _UploadFilePath(self, filepath, truncate=False):
     max_size = self.opts.max_size if truncate else None
-    chunk_size = self.opts.chunk_size
 
-    uploader = uploading.TransferStoreUploader(self.flow, chunk_size=chunk_size)
-    return uploader.UploadFilePath(filepath, amount=max_size)
+    # All files are uploaded by the same uploader, so its worker threads are
+    # only started once per action.
+    if self._uploader is None:
+      # Only servers that check the chunks skipped by the cache ask for it.
+      chunk_cache = None
+      if self.opts.skip_uploaded_chunks:
+        chunk_cache = uploading.GetUploadedChunkCache(
+            config.CONFIG["Client.uploaded_chunk_cache_path"],
+            config.CONFIG["Client.uploaded_chunk_cache_size"])
+
+      self._uploader = uploading.TransferStoreUploader(
+          self.flow,
+          chunk_size=self.opts.chunk_size,
+          workers=config.CONFIG["Client.upload_worker_threads"],
+          chunk_cache=chunk_cache)
+    return self._uploader.UploadFilePath(filepath, amount=max_size)
 
 
 def _HashEntry(stat, flow, max_size=None):
@@ -1,38 +1,248 @@
 #!/usr/bin/env python
 """Utility classes for uploading files to the server."""
 
+import collections
 import hashlib
+import logging
+import os
+import Queue
+import threading
 import zlib
 
+
+from builtins import range  # pylint: disable=redefined-builtin
+
 from grr_response_client import streaming
+from grr_response_core.lib import constants
 from grr_response_core.lib import rdfvalue
 from grr_response_core.lib.rdfvalues import client_fs as rdf_client_fs
 from grr_response_core.lib.rdfvalues import protodict as rdf_protodict
 
 
+class UploadedChunkCache(object):
+  """A persistent cache of the digests of recently uploaded chunks.
+
+  Digests are kept in least recently used order and saved to a file, so chunks
+  uploaded by earlier client runs are remembered as well. The file is only
+  appended to, and rewritten from the cache once it holds twice as many
+  digests as the cache.
+  """
+
+  _DIGEST_SIZE = hashlib.sha256().digest_size
+
+  def __init__(self, path, max_size):
+    """Initializes the cache, loading the digests saved to path.
+
+    Args:
+      path: A path to the file the digests are saved to.
+      max_size: A maximum number of digests to keep.
+    """
+    self.path = path
+    self.max_size = max_size
+
+    self._lock = threading.Lock()
+    self._digests = collections.OrderedDict()
+    # Digests added or used since the cache was last saved.
+    self._unsaved = []
+    self._saved_count = 0
+
+    self._Load()
+
+  def _Load(self):
+    try:
+      with open(self.path, "rb") as fd:
+        data = fd.read()
+    except IOError:
+      return
+
+    # A partially written digest at the end of the file is ignored.
+    count = len(data) // self._DIGEST_SIZE
+    for i in range(count):
+      self._Touch(data[i * self._DIGEST_SIZE:(i + 1) * self._DIGEST_SIZE])
+    self._saved_count = count
+
+  def _Touch(self, digest):
+    """Marks the digest as most recently used. Lock should be held."""
+    self._digests.pop(digest, None)
+    self._digests[digest] = True
+    while len(self._digests) > self.max_size:
+      self._digests.popitem(last=False)
+
+  def Lookup(self, digest):
+    """Checks if a chunk with this digest was uploaded recently."""
+    with self._lock:
+      if digest not in self._digests:
+        return False
+
+      self._Touch(digest)
+      self._unsaved.append(digest)
+      return True
+
+  def Add(self, digest):
+    """Records that a chunk with this digest was uploaded."""
+    with self._lock:
+      self._Touch(digest)
+      self._unsaved.append(digest)
+
+  def Save(self):
+    """Writes the digests added or used since the last save to the file."""
+    with self._lock:
+      if not self._unsaved:
+        return
+
+      try:
+        if self._saved_count + len(self._unsaved) > 2 * self.max_size:
+          tmp_path = self.path + ".tmp"
+          with open(tmp_path, "wb") as fd:
+            fd.write(b"".join(self._digests))
+          os.rename(tmp_path, self.path)
+          self._saved_count = len(self._digests)
+        else:
+          with open(self.path, "ab") as fd:
+            fd.write(b"".join(self._unsaved))
+          self._saved_count += len(self._unsaved)
+      except (IOError, OSError) as e:
+        # The cache only saves bandwidth, uploads work fine without it.
+        logging.warning("Unable to save the uploaded chunk cache: %s", e)
+
+      self._unsaved = []
+
+
+_uploaded_chunk_cache = None
+_uploaded_chunk_cache_lock = threading.Lock()
+
+
+def GetUploadedChunkCache(path, max_size):
+  """Returns the process wide cache of uploaded chunks for the given settings.
+
+  Args:
+    path: A path to the file the digests are saved to.
+    max_size: A maximum number of digests to keep, 0 disables the cache.
+
+  Returns:
+    An `UploadedChunkCache` instance or None if the cache is disabled.
+  """
+  global _uploaded_chunk_cache
+
+  if not max_size:
+    return None
+
+  with _uploaded_chunk_cache_lock:
+    cache = _uploaded_chunk_cache
+    if cache is None or cache.path != path or cache.max_size != max_size:
+      cache = _uploaded_chunk_cache = UploadedChunkCache(path, max_size)
+    return cache
+
+
+class _ChunkTask(object):
+  """Compresses and hashes a single chunk, possibly on a worker thread."""
+
+  def __init__(self, chunk, chunk_cache=None):
+    self.chunk = chunk
+    self.chunk_cache = chunk_cache
+    self.blob = None
+    self.digest = None
+    # Whether the chunk was uploaded recently and does not need to be sent.
+    self.uploaded = False
+    self.exception = None
+    self.done = threading.Event()
+
+  def Run(self):
+    # Both zlib and hashlib release the GIL while working on large buffers, so
+    # chunks processed by different threads really run in parallel.
+    try:
+      self.digest = hashlib.sha256(self.chunk.data).digest()
+      if self.chunk_cache is not None and self.chunk_cache.Lookup(self.digest):
+        self.uploaded = True
+      else:
+        self.blob = _CompressedDataBlob(self.chunk)
+    except Exception as e:  # pylint: disable=broad-except
+      self.exception = e
+    finally:
+      self.done.set()
+
+
+class _ChunkWorkers(object):
+  """A set of threads running submitted chunk tasks."""
+
+  def __init__(self, count):
+    self._tasks = Queue.Queue()
+    self._threads = []
+    for i in range(count):
+      thread = threading.Thread(target=self._Work, name="ChunkWorker%d" % i)
+      thread.daemon = True
+      thread.start()
+      self._threads.append(thread)
+
+  def _Work(self):
+    while True:
+      task = self._tasks.get()
+      if task is None:
+        return
+      task.Run()
+
+  def Submit(self, task):
+    self._tasks.put(task)
+
+  def Stop(self):
+    """Stops the workers once the submitted tasks have run."""
+    for _ in self._threads:
+      self._tasks.put(None)
+
+
 class TransferStoreUploader(object):
   """An utility class for uploading chunked files to the server.
 
   Input is divided into chunks, then these chunks are compressed (using zlib)
   and then they are uploaded to the transfer store (a well-known flow).
+
+  Files of more than one chunk are read by the calling thread while worker
+  threads compress and hash the chunks read so far. Chunks are still sent in
+  order, and bytes are charged to the session and progress is reported by the
+  calling thread, so the action's network and CPU limits keep applying.
+
+  The worker threads are started for the first file of more than one chunk and
+  reused for all the files uploaded afterwards, until `Close` is called.
   """
 
   DEFAULT_CHUNK_SIZE = 512 * 1024
 
   _TRANSFER_STORE_SESSION_ID = rdfvalue.SessionID(flow_name="TransferStore")
 
-  def __init__(self, action, chunk_size=None):
+  # Number of chunks each worker can have waiting to be sent. This bounds the
+  # memory used for chunks read ahead of the one being sent.
+  _CHUNKS_PER_WORKER = 2
+
+  def __init__(self, action, chunk_size=None, workers=1, chunk_cache=None):
     """Initializes the uploader.
 
     Args:
       action: A parent action that creates the uploader. Used to communicate
               with the parent flow.
       chunk_size: A number of (uncompressed) bytes per a chunk.
+      workers: A number of threads compressing and hashing chunks. If it is 1
+          then chunks are processed by the calling thread.
+      chunk_cache: An optional `UploadedChunkCache`. Chunks found in it are not
+          sent again, only their descriptors are returned. The parent flow has
+          to check that the server still has these chunks and fetch missing
+          ones with `TransferBuffer`, so the cache is not used for chunks
+          larger than `TransferBuffer` can read.
     """
     chunk_size = chunk_size or self.DEFAULT_CHUNK_SIZE
+    if chunk_size > constants.CLIENT_MAX_BUFFER_SIZE:
+      chunk_cache = None
 
     self._action = action
     self._streamer = streaming.Streamer(chunk_size=chunk_size)
+    self._workers = workers
+    self._chunk_cache = chunk_cache
+    self._chunk_workers = None
+
+  def Close(self):
+    """Stops the worker threads once the chunks submitted to them have run."""
+    if self._chunk_workers is not None:
+      self._chunk_workers.Stop()
+      self._chunk_workers = None
 
   def UploadFilePath(self, filepath, offset=0, amount=None):
     """Uploads chunks of a file on a given path to the transfer store flow.
@@ -49,13 +259,52 @@ class TransferStoreUploader(object):
     chunk_stream = self._streamer.StreamFilePath(
         filepath, offset=offset, amount=amount)
 
-    chunks = []
-    for chunk in chunk_stream:
-      chunks.append(self.UploadChunk(chunk))
+    try:
+      if self._workers > 1:
+        chunks = self._UploadChunksInParallel(chunk_stream)
+      else:
+        chunks = [self.UploadChunk(chunk) for chunk in chunk_stream]
+    finally:
+      if self._chunk_cache is not None:
+        self._chunk_cache.Save()
 
     return rdf_client_fs.BlobImageDescriptor(
         chunks=chunks, chunk_size=self._streamer.chunk_size)
 
+  def _UploadChunksInParallel(self, chunk_stream):
+    """Uploads chunks, compressing and hashing them on worker threads."""
+    max_pending = self._workers * self._CHUNKS_PER_WORKER
+    pending = collections.deque()
+    parallel = False
+    chunks = []
+
+    for chunk in chunk_stream:
+      task = _ChunkTask(chunk, chunk_cache=self._chunk_cache)
+      pending.append(task)
+
+      # Most files fit in a single chunk, the workers are only used once there
+      # is a second one to process in parallel.
+      if not parallel:
+        if len(pending) < 2:
+          continue
+        if self._chunk_workers is None:
+          self._chunk_workers = _ChunkWorkers(self._workers)
+        self._chunk_workers.Submit(pending[0])
+        parallel = True
+      self._chunk_workers.Submit(task)
+
+      while len(pending) > max_pending:
+        chunks.append(self._SendChunk(pending.popleft()))
+
+    if not parallel:
+      for task in pending:
+        task.Run()
+
+    while pending:
+      chunks.append(self._SendChunk(pending.popleft()))
+
+    return chunks
+
   def UploadChunk(self, chunk):
     """Uploads a single chunk to the transfer store flow.
 
@@ -65,15 +314,29 @@ class TransferStoreUploader(object):
     Returns:
       A `BlobImageChunkDescriptor` object.
     """
-    blob = _CompressedDataBlob(chunk)
+    task = _ChunkTask(chunk, chunk_cache=self._chunk_cache)
+    task.Run()
+    return self._SendChunk(task)
+
+  def _SendChunk(self, task):
+    """Sends a chunk processed by a task once the task is done."""
+    while not task.done.wait(1):
+      self._action.Progress()
+
+    if task.exception is not None:
+      raise task.exception  # pylint: disable=raising-bad-type
 
-    self._action.ChargeBytesToSession(len(chunk.data))
-    self._action.SendReply(blob, session_id=self._TRANSFER_STORE_SESSION_ID)
+    chunk = task.chunk
+    if not task.uploaded:
+      self._action.ChargeBytesToSession(len(chunk.data))
+      self._action.SendReply(
+          task.blob, session_id=self._TRANSFER_STORE_SESSION_ID)
+      if self._chunk_cache is not None:
+        self._chunk_cache.Add(task.digest)
+    self._action.Progress()
 
     return rdf_client_fs.BlobImageChunkDescriptor(
-        digest=hashlib.sha256(chunk.data).digest(),
-        offset=chunk.offset,
-        length=len(chunk.data))
+        digest=task.digest, offset=chunk.offset, length=len(chunk.data))
 
 
 def _CompressedDataBlob(chunk):
@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 import collections
 import hashlib
+import os
 import zlib
 
 import mock
@@ -129,6 +130,63 @@ class UploaderTest(unittest.TestCase):
       self.assertEqual(blobdesc.chunks[2].length, 1)
       self.assertEqual(blobdesc.chunks[2].digest, Sha256("6"))
 
+  def testManyChunksWithWorkers(self):
+    action = FakeAction()
+    uploader = uploading.TransferStoreUploader(action, chunk_size=3, workers=3)
+
+    with test_lib.AutoTempFilePath() as temp_filepath:
+      with open(temp_filepath, "w") as temp_file:
+        temp_file.write("1234567890abcdefghij")
+
+      blobdesc = uploader.UploadFilePath(temp_filepath, offset=1)
+
+      # Chunks are sent in order even though they are processed in parallel.
+      data = ["234", "567", "890", "abc", "def", "ghi", "j"]
+      self.assertEqual(action.charged_bytes, 19)
+      self.assertEqual([message.item.data for message in action.messages],
+                       [zlib.compress(chunk) for chunk in data])
+
+      self.assertEqual(blobdesc.chunk_size, 3)
+      self.assertEqual([chunk.offset for chunk in blobdesc.chunks],
+                       [1, 4, 7, 10, 13, 16, 19])
+      self.assertEqual([chunk.length for chunk in blobdesc.chunks],
+                       [3, 3, 3, 3, 3, 3, 1])
+      self.assertEqual([chunk.digest for chunk in blobdesc.chunks],
+                       [Sha256(chunk) for chunk in data])
+
+  def testWorkersAreReusedForManyFiles(self):
+    action = FakeAction()
+    uploader = uploading.TransferStoreUploader(action, chunk_size=3, workers=2)
+
+    with mock.patch.object(
+        uploading, "_ChunkWorkers", wraps=uploading._ChunkWorkers) as workers:
+      with test_lib.AutoTempFilePath() as temp_filepath:
+        with open(temp_filepath, "w") as temp_file:
+          temp_file.write("1234567890")
+
+        for _ in range(3):
+          blobdesc = uploader.UploadFilePath(temp_filepath)
+          self.assertEqual(len(blobdesc.chunks), 4)
+
+      uploader.Close()
+
+    self.assertEqual(workers.call_count, 1)
+    self.assertEqual(len(action.messages), 12)
+
+  def testWorkersRespectProgress(self):
+    action = FakeAction()
+    action.Progress.side_effect = [None, RuntimeError("CPU limit exceeded")]
+    uploader = uploading.TransferStoreUploader(action, chunk_size=3, workers=2)
+
+    with test_lib.AutoTempFilePath() as temp_filepath:
+      with open(temp_filepath, "w") as temp_file:
+        temp_file.write("1234567890")
+
+      with self.assertRaises(RuntimeError):
+        uploader.UploadFilePath(temp_filepath)
+
+      self.assertEqual(len(action.messages), 2)
+
   def testIncorrectFile(self):
     action = FakeAction()
     uploader = uploading.TransferStoreUploader(action, chunk_size=10)
@@ -137,6 +195,76 @@ class UploaderTest(unittest.TestCase):
       uploader.UploadFilePath("/foo/bar/baz")
 
 
+class UploadedChunkCacheTest(unittest.TestCase):
+
+  def _UploadWithCache(self, workers):
+    with test_lib.AutoTempDirPath(remove_non_empty=True) as temp_dirpath:
+      cache = uploading.UploadedChunkCache(
+          os.path.join(temp_dirpath, "cache"), max_size=10)
+      cache.Add(Sha256("456"))
+
+      action = FakeAction()
+      uploader = uploading.TransferStoreUploader(
+          action, chunk_size=3, workers=workers, chunk_cache=cache)
+
+      with test_lib.AutoTempFilePath() as temp_filepath:
+        with open(temp_filepath, "w") as temp_file:
+          temp_file.write("1234567890")
+
+        blobdesc = uploader.UploadFilePath(temp_filepath)
+
+      # Only the chunks not uploaded before are sent, but all of them are
+      # described.
+      self.assertEqual(action.charged_bytes, 7)
+      self.assertEqual([message.item.data for message in action.messages],
+                       [zlib.compress(data) for data in ["123", "789", "0"]])
+      self.assertEqual([chunk.digest for chunk in blobdesc.chunks],
+                       [Sha256(data) for data in ["123", "456", "789", "0"]])
+
+      # The uploaded chunks are remembered as well.
+      for data in ["123", "789", "0"]:
+        self.assertTrue(cache.Lookup(Sha256(data)))
+
+  def testSkipsUploadedChunks(self):
+    self._UploadWithCache(workers=1)
+
+  def testSkipsUploadedChunksWithWorkers(self):
+    self._UploadWithCache(workers=2)
+
+  def testPersistsDigests(self):
+    with test_lib.AutoTempDirPath(remove_non_empty=True) as temp_dirpath:
+      path = os.path.join(temp_dirpath, "cache")
+
+      cache = uploading.UploadedChunkCache(path, max_size=10)
+      cache.Add(Sha256("foo"))
+      cache.Add(Sha256("bar"))
+      cache.Save()
+
+      cache = uploading.UploadedChunkCache(path, max_size=10)
+      self.assertTrue(cache.Lookup(Sha256("foo")))
+      self.assertTrue(cache.Lookup(Sha256("bar")))
+      self.assertFalse(cache.Lookup(Sha256("baz")))
+
+  def testIsBounded(self):
+    with test_lib.AutoTempDirPath(remove_non_empty=True) as temp_dirpath:
+      path = os.path.join(temp_dirpath, "cache")
+
+      cache = uploading.UploadedChunkCache(path, max_size=2)
+      for i in range(10):
+        cache.Add(Sha256(str(i)))
+        # Recently used digests are kept.
+        self.assertTrue(cache.Lookup(Sha256("0")))
+        cache.Save()
+
+      # The file is rewritten once it gets too large.
+      self.assertLessEqual(os.path.getsize(path), 4 * len(Sha256("")))
+
+      cache = uploading.UploadedChunkCache(path, max_size=2)
+      self.assertTrue(cache.Lookup(Sha256("0")))
+      self.assertTrue(cache.Lookup(Sha256("9")))
+      self.assertFalse(cache.Lookup(Sha256("8")))
+
+
 def Sha256(data):
   return hashlib.sha256(data).digest()
 
@@ -107,6 +107,7 @@ from grr_response_core.lib.rdfvalues import crypto as rdf_crypto
 from grr_response_core.lib.rdfvalues import flows as rdf_flows
 from grr_response_core.lib.rdfvalues import protodict as rdf_protodict
 from grr_response_core.lib.rdfvalues import rekall_types as rdf_rekall_types
+from grr_response_core.lib.rdfvalues import structs as rdf_structs
 
 
 class HTTPObject(object):
@@ -862,6 +863,8 @@ class SizeLimitedQueue(object):
   def __init__(self, heart_beat_cb, maxsize=1024):
     self._queue = collections.deque()
     self._lock = threading.Lock()
+    # Notified whenever messages are removed from the queue.
+    self._space_available = threading.Condition(self._lock)
     self._total_size = 0
     self._maxsize = maxsize
     self._heart_beat_cb = heart_beat_cb
@@ -875,8 +878,7 @@ class SizeLimitedQueue(object):
       message: rdf_flows.GrrMessage The message to put.
       block: bool If True, we block and wait for the queue to have more space.
         Otherwise, if the queue is full, we raise.
-      timeout: int Maximum time (in seconds, with 1 sec resolution) we spend
-        waiting on the queue.
+      timeout: int Maximum time (in seconds) we spend waiting on the queue.
 
     Raises:
       Queue.Full: if the queue is full and block is False, or
@@ -885,22 +887,23 @@ class SizeLimitedQueue(object):
     # We only queue already serialized objects so we know how large they are.
     message = message.SerializeToString()
 
-    if not block:
-      if self.Full():
-        raise Queue.Full
-
-    else:
-      t0 = time.time()
-      while self.Full():
-        time.sleep(1)
-        self._heart_beat_cb()
-
-        if time.time() - t0 > timeout:
+    deadline = time.time() + timeout
+    while True:
+      with self._lock:
+        if not self.Full():
+          self._queue.appendleft(message)
+          self._total_size += len(message)
+          return
+
+        remaining = deadline - time.time()
+        if not block or remaining <= 0:
           raise Queue.Full
 
-    with self._lock:
-      self._queue.appendleft(message)
-      self._total_size += len(message)
+        # Wake up at least once a second to heartbeat while we wait.
+        self._space_available.wait(min(1, remaining))
+
+      # The heartbeat callback may block, so it's called without the lock.
+      self._heart_beat_cb()
 
   def _Generate(self):
     """Yields messages from the queue. Lock should be held by the caller."""
@@ -910,6 +913,9 @@ class SizeLimitedQueue(object):
   def GetMessages(self, soft_size_limit=None):
     """Retrieves and removes the messages from the queue.
 
+    The returned MessageList is built from the serialized messages, they are
+    only parsed when accessed and are not serialized again when the list is.
+
     Args:
       soft_size_limit: int If there is more data in the queue than
         soft_size_limit bytes, the returned list of messages will be
@@ -920,15 +926,22 @@ class SizeLimitedQueue(object):
       rdf_flows.MessageList A list of messages that were .Put on the queue
       earlier.
     """
+    job_tag = rdf_flows.MessageList.type_infos["job"].encoded_tag
+
     with self._lock:
       ret = rdf_flows.MessageList()
       ret_size = 0
       for message in self._Generate():
-        ret.job.append(rdf_flows.GrrMessage.FromSerializedString(message))
+        ret.job.Append(
+            wire_format=(job_tag, rdf_structs.VarintEncode(len(message)),
+                         message))
         ret_size += len(message)
         if soft_size_limit is not None and ret_size > soft_size_limit:
           break
 
+      self._total_size -= ret_size
+      self._space_available.notify_all()
+
       return ret
 
   def Size(self):
@@ -1331,7 +1344,12 @@ class ClientCommunicator(communicator.Communicator):
 
   def __init__(self, certificate=None, private_key=None):
     super(ClientCommunicator, self).__init__(
-        certificate=certificate, private_key=private_key)
+        certificate=certificate,
+        private_key=private_key,
+        compression=communicator.MessageListCompression(
+            level=config.CONFIG["Client.message_compression_level"],
+            min_size=config.CONFIG["Client.message_compression_min_size"],
+            direction="client_to_server"))
     self.InitPrivateKey()
 
   def InitPrivateKey(self):
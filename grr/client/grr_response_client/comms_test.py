@@ -2,6 +2,7 @@
 """Test for client comms."""
 
 import Queue
+import threading
 import time
 
 
@@ -11,6 +12,7 @@ import requests
 
 from grr_response_client import comms
 from grr_response_core.lib import flags
+from grr_response_core.lib import rdfvalue
 from grr_response_core.lib import utils
 from grr_response_core.lib.rdfvalues import flows as rdf_flows
 from grr.test_lib import test_lib
@@ -315,6 +317,52 @@ class SizeLimitedQueueTest(test_lib.GRRBaseTest):
 
     self.assertTrue(heartbeat.called)
 
+  def testSizeLimitedQueueReusesSerializedMessages(self):
+    queue = comms.SizeLimitedQueue(maxsize=10000000, heart_beat_cb=lambda: None)
+
+    messages = [
+        rdf_flows.GrrMessage(name="A", session_id="aff4:/flows/W:1"),
+        rdf_flows.GrrMessage(name="B", payload=rdfvalue.RDFBytes("x" * 1000))
+    ]
+    for message in messages:
+      queue.Put(message)
+    self.assertEqual(queue.Size(),
+                     sum(len(m.SerializeToString()) for m in messages))
+
+    result = queue.GetMessages()
+    self.assertEqual(queue.Size(), 0)
+
+    expected = rdf_flows.MessageList(job=messages)
+    self.assertEqual(result.SerializeToString(), expected.SerializeToString())
+    self.assertEqual(list(result.job), messages)
+
+  def testSizeLimitedQueueWakesBlockedProducers(self):
+    msg_a = rdf_flows.GrrMessage(name="A")
+    msg_b = rdf_flows.GrrMessage(name="B")
+
+    queue = comms.SizeLimitedQueue(
+        maxsize=len(msg_a.SerializeToString()), heart_beat_cb=lambda: None)
+    queue.Put(msg_a)
+
+    put_done = threading.Event()
+
+    def Put():
+      queue.Put(msg_b, timeout=10)
+      put_done.set()
+
+    thread = threading.Thread(target=Put)
+    thread.start()
+    self.assertFalse(put_done.wait(0.1))
+
+    start = time.time()
+    self.assertEqual(list(queue.GetMessages().job), [msg_a])
+    self.assertTrue(put_done.wait(10))
+    thread.join()
+
+    # The producer is woken up right away, not on the next heartbeat.
+    self.assertLess(time.time() - start, 1)
+    self.assertEqual(list(queue.GetMessages().job), [msg_b])
+
 
 def main(argv):
   test_lib.main(argv)
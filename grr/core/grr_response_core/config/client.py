@@ -99,6 +99,32 @@ config_lib.DEFINE_integer("Client.max_post_size", 40000000,
 config_lib.DEFINE_integer("Client.max_out_queue", 51200000,
                           "Maximum size of the output queue.")
 
+config_lib.DEFINE_integer(
+    "Client.message_compression_level", -1,
+    "The zlib level used to compress messages sent to the server. 1 is the "
+    "fastest, 9 compresses best, -1 is the zlib default and 0 disables "
+    "compression.")
+
+config_lib.DEFINE_integer(
+    "Client.message_compression_min_size", 256,
+    "Messages sent to the server are only compressed if they are at least "
+    "this many bytes long.")
+
+config_lib.DEFINE_integer(
+    "Client.upload_worker_threads", 2,
+    "Number of threads compressing and hashing file chunks while a file is "
+    "uploaded to the server. 1 disables the worker threads.")
+
+config_lib.DEFINE_integer(
+    "Client.uploaded_chunk_cache_size", 100000,
+    "Number of digests of recently uploaded file chunks to remember. Chunks "
+    "the server already has are not uploaded again. 0 disables the cache.")
+
+config_lib.DEFINE_string(
+    "Client.uploaded_chunk_cache_path",
+    "%(Logging.path)/uploaded_chunks.cache",
+    "The file where the digests of recently uploaded chunks are kept.")
+
 config_lib.DEFINE_integer(
     "Client.foreman_check_frequency", 1800,
     "The minimum number of seconds before checking with "
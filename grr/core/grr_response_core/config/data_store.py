@@ -38,6 +38,11 @@ config_lib.DEFINE_bool("Database.useForReads.foreman", False,
 config_lib.DEFINE_bool("Database.useForReads.vfs", False,
                        "Use relational database for reading VFS information.")
 
+config_lib.DEFINE_string(
+    "SqliteDB.path",
+    default="%(Datastore.location)/grr.sqlite",
+    help="Location of the SQLite file used by the SqliteDB database.")
+
 DATASTORE_PATHING = [
     r"%{(?P<path>files/hash/generic/sha256/...).*}",
     r"%{(?P<path>files/hash/generic/sha1/...).*}",
@@ -117,6 +117,41 @@ config_lib.DEFINE_integer(
     "Maximum time messages remain valid within the "
     "system.")
 
+config_lib.DEFINE_float(
+    "Frontend.message_batch_window", 0,
+    "If non-zero, client polls arriving within this many seconds of each "
+    "other are processed as a single batch, sharing data store round trips.")
+
+config_lib.DEFINE_integer(
+    "Frontend.message_batch_max_size", 100,
+    "Maximum number of client polls processed in a single batch.")
+
+config_lib.DEFINE_integer(
+    "Frontend.session_cipher_cache_size", 50000,
+    "Number of clients for which the frontend caches the cipher used to send "
+    "them messages. Reusing a cipher saves the RSA operations needed to set up "
+    "a new one on every poll. 0 disables the cache.")
+
+config_lib.DEFINE_semantic_value(
+    rdfvalue.Duration, "Frontend.session_cipher_max_age", "1h",
+    "Time after which a cached client cipher is replaced with a new one.")
+
+config_lib.DEFINE_integer(
+    "Frontend.session_cipher_max_packets", 10000,
+    "Number of packets after which a cached client cipher is replaced with a "
+    "new one. 0 means there is no limit.")
+
+config_lib.DEFINE_integer(
+    "Frontend.message_compression_level", -1,
+    "The zlib level used to compress messages sent to clients. 1 is the "
+    "fastest, 9 compresses best, -1 is the zlib default and 0 disables "
+    "compression.")
+
+config_lib.DEFINE_integer(
+    "Frontend.message_compression_min_size", 256,
+    "Messages sent to clients are only compressed if they are at least this "
+    "many bytes long.")
+
 config_lib.DEFINE_string("Frontend.upload_store", "FileUploadFileStore",
                          "The implementation of the upload file store.")
 
@@ -131,6 +166,23 @@ config_lib.DEFINE_bool(
 config_lib.DEFINE_string("Server.master_watcher_class", "DefaultMasterWatcher",
                          "The master watcher class to use.")
 
+config_lib.DEFINE_string(
+    "Server.notification_bus_class", "",
+    "The notification bus used to wake up workers as soon as new queue "
+    "notifications are written. Empty means workers only poll. "
+    "LocalNotificationBus works within a single process, "
+    "SocketNotificationBus across all processes on one machine.")
+
+config_lib.DEFINE_string(
+    "Server.notification_bus_socket_dir",
+    "%(Config.prefix)/var/run/grr-notification-bus",
+    "Directory holding the sockets used by SocketNotificationBus.")
+
+config_lib.DEFINE_float(
+    "Worker.notification_bus_max_wait", 2,
+    "When a notification bus is used, the maximum time in seconds an idle "
+    "worker waits for the bus before polling its queues anyway.")
+
 config_lib.DEFINE_string("Server.ip_resolver_class", "IPResolver",
                          "The ip resolver class to use.")
 
@@ -12,12 +12,14 @@ from future.utils import with_metaclass
 
 from grr_response_core.lib import rdfvalue
 from grr_response_core.lib import registry
+from grr_response_core.lib import sharded_cache
 from grr_response_core.lib import stats
 from grr_response_core.lib import type_info
 from grr_response_core.lib import utils
 
 from grr_response_core.lib.rdfvalues import crypto as rdf_crypto
 from grr_response_core.lib.rdfvalues import flows as rdf_flows
+from grr_response_core.lib.rdfvalues import protodict as rdf_protodict
 
 
 class CommunicatorInit(registry.InitHook):
@@ -34,6 +36,18 @@ class CommunicatorInit(registry.InitHook):
 
     stats.STATS.RegisterCounterMetric(
         "grr_encrypted_cipher_cache", fields=[("type", str)])
+    stats.STATS.RegisterCounterMetric(
+        "grr_session_cipher_cache", fields=[("type", str)])
+
+    stats.STATS.RegisterCounterMetric(
+        "grr_message_list_compression",
+        fields=[("direction", str), ("result", str)])
+    stats.STATS.RegisterEventMetric(
+        "grr_message_list_compression_ratio",
+        fields=[("direction", str)],
+        bins=[0.05 * x for x in range(1, 21)])
+    stats.STATS.RegisterEventMetric(
+        "grr_message_list_compression_time", fields=[("direction", str)])
 
 
 class Error(stats.CountingExceptionMixin, Exception):
@@ -118,6 +132,113 @@ class Cipher(object):
     return rdf_crypto.HMAC(self.cipher.hmac_key).HMAC("".join(data))
 
 
+class MessageListCompression(object):
+  """Decides how serialized MessageLists are compressed.
+
+  Only the compression types defined in PackedMessageList.CompressionType are
+  used, so every API v3 peer can decompress the result: data compressed with
+  any zlib level is decompressed by zlib.decompress.
+  """
+
+  def __init__(self, level=zlib.Z_DEFAULT_COMPRESSION, min_size=0,
+               direction="unknown"):
+    """Constructor.
+
+    Args:
+      level: The zlib compression level, 0 disables compression.
+      min_size: Message lists smaller than this many bytes are not compressed.
+      direction: Name of the direction the message lists are sent in, used
+        as a field of the compression stats.
+    """
+    self.level = level
+    self.min_size = min_size
+    self.direction = direction
+
+  def _IsMostlyCompressed(self, message_list, size):
+    """Checks if message_list is mostly made of data blobs.
+
+    Data blobs are almost always compressed file chunks. The payloads are not
+    parsed to check, only the size of their serialized form is used.
+
+    Args:
+      message_list: The MessageList.
+      size: The size of the serialized message_list.
+
+    Returns:
+      True if the data blobs make up more than half of the size.
+    """
+    blob_size = 0
+    for message in message_list.job:
+      if message.args_rdf_name == rdf_protodict.DataBlob.__name__:
+        blob_size += len(message.args)
+
+    return blob_size * 2 > size
+
+  def _Count(self, result):
+    stats.STATS.IncrementCounter(
+        "grr_message_list_compression", fields=[self.direction, result])
+
+  def Compress(self, message_list, serialized_message_list):
+    """Compresses a serialized MessageList.
+
+    Args:
+      message_list: The MessageList.
+      serialized_message_list: The serialized message_list.
+
+    Returns:
+      A (PackedMessageList.CompressionType, data) tuple.
+    """
+    uncompressed = (rdf_flows.PackedMessageList.CompressionType.UNCOMPRESSED,
+                    serialized_message_list)
+    size = len(serialized_message_list)
+
+    if self.level == 0:
+      self._Count("disabled")
+      return uncompressed
+
+    if size < self.min_size:
+      self._Count("too_small")
+      return uncompressed
+
+    if self._IsMostlyCompressed(message_list, size):
+      self._Count("precompressed")
+      return uncompressed
+
+    start_time = time.time()
+    compressed_data = zlib.compress(serialized_message_list, self.level)
+    stats.STATS.RecordEvent(
+        "grr_message_list_compression_time",
+        time.time() - start_time,
+        fields=[self.direction])
+
+    # Only compress if it buys us something.
+    if len(compressed_data) >= size:
+      self._Count("no_gain")
+      return uncompressed
+
+    self._Count("compressed")
+    stats.STATS.RecordEvent(
+        "grr_message_list_compression_ratio",
+        len(compressed_data) / size,
+        fields=[self.direction])
+    return (rdf_flows.PackedMessageList.CompressionType.ZCOMPRESSION,
+            compressed_data)
+
+
+# Compresses every message list that gets smaller, like older GRR versions.
+DEFAULT_MESSAGE_LIST_COMPRESSION = MessageListCompression()
+
+
+class _SessionCipher(object):
+  """A cached outbound cipher and the number of packets it was used for."""
+
+  def __init__(self, cipher, remote_public_key):
+    self.cipher = cipher
+    # Keys are compared by value, the key objects may be created per lookup.
+    self.serialized_public_key = remote_public_key.SerializeToString()
+    self.packets = 0
+
+
 class ReceivedCipher(Cipher):
   """A cipher which we received from our peer."""
 
@@ -267,38 +388,66 @@ class Communicator(with_metaclass(abc.ABCMeta, object)):
   """A class responsible for encoding and decoding comms."""
   server_name = None
 
-  def __init__(self, certificate=None, private_key=None):
+  def __init__(self,
+               certificate=None,
+               private_key=None,
+               session_cipher_cache_size=0,
+               session_cipher_max_age=None,
+               session_cipher_max_packets=None,
+               compression=None):
     """Creates a communicator.
 
     Args:
        certificate: Our own certificate.
        private_key: Our own private key.
+       session_cipher_cache_size: If not 0, the ciphers used to send messages
+         to up to this many destinations are cached and reused, saving the RSA
+         operations needed to set up a new cipher for every message.
+       session_cipher_max_age: If set, cached ciphers are used for at most this
+         many seconds.
+       session_cipher_max_packets: If set, cached ciphers are used for at most
+         this many packets.
+       compression: A MessageListCompression deciding how the messages we send
+         are compressed.
     """
     self.private_key = private_key
     self.certificate = certificate
+    self.compression = compression
     self._ClearServerCipherCache()
 
     # A cache for encrypted ciphers
     self.encrypted_cipher_cache = utils.FastStore(max_size=50000)
 
+    # A cache for the ciphers used to send messages, keyed by destination.
+    self.session_cipher_cache = None
+    self.session_cipher_max_packets = session_cipher_max_packets
+    if session_cipher_cache_size:
+      self.session_cipher_cache = sharded_cache.ShardedCache(
+          max_size=session_cipher_cache_size,
+          max_age=session_cipher_max_age,
+          name="session_cipher_cache")
+
   @abc.abstractmethod
   def _GetRemotePublicKey(self, server_name):
     raise NotImplementedError()
 
   @classmethod
-  def EncodeMessageList(cls, message_list, packed_message_list):
-    """Encode the MessageList into the packed_message_list rdfvalue."""
-    # By default uncompress
-    uncompressed_data = message_list.SerializeToString()
-    packed_message_list.message_list = uncompressed_data
+  def EncodeMessageList(cls, message_list, packed_message_list,
+                        compression=None):
+    """Encode the MessageList into the packed_message_list rdfvalue.
 
-    compressed_data = zlib.compress(uncompressed_data)
+    Args:
+      message_list: The MessageList to encode.
+      packed_message_list: The PackedMessageList to fill in.
+      compression: A MessageListCompression deciding how the message list is
+        compressed. If not set, DEFAULT_MESSAGE_LIST_COMPRESSION is used.
+    """
+    compression = compression or DEFAULT_MESSAGE_LIST_COMPRESSION
+    compression_type, data = compression.Compress(
+        message_list, message_list.SerializeToString())
 
-    # Only compress if it buys us something.
-    if len(compressed_data) < len(uncompressed_data):
-      packed_message_list.compression = (
-          rdf_flows.PackedMessageList.CompressionType.ZCOMPRESSION)
-      packed_message_list.message_list = compressed_data
+    packed_message_list.compression = compression_type
+    packed_message_list.message_list = data
 
   def _ClearServerCipherCache(self):
     self.server_cipher = None
@@ -318,6 +467,48 @@ class Communicator(with_metaclass(abc.ABCMeta, object)):
     self.server_cipher_age = rdfvalue.RDFDatetime.Now()
     return self.server_cipher
 
+  def _GetSessionCipher(self, destination):
+    """Returns the cipher to send messages to destination with.
+
+    Ciphers are reused while they are in the session cipher cache. The cipher
+    sent with every message stays the same within a session, so the wire format
+    doesn't change and the receiving end can cache the cipher as well.
+
+    Args:
+      destination: The CN of the remote system.
+
+    Returns:
+      A Cipher object.
+    """
+    remote_public_key = self._GetRemotePublicKey(destination)
+    if self.session_cipher_cache is None:
+      return Cipher(self.common_name, self.private_key, remote_public_key)
+
+    key = utils.SmartStr(destination)
+    try:
+      session = self.session_cipher_cache.Get(key)
+    except KeyError:
+      session = None
+
+    # A changed public key means the remote system was re-enrolled.
+    if (session is not None and
+        session.serialized_public_key ==
+        remote_public_key.SerializeToString() and
+        (self.session_cipher_max_packets is None or
+         session.packets < self.session_cipher_max_packets)):
+      stats.STATS.IncrementCounter("grr_session_cipher_cache", fields=["hits"])
+    else:
+      stats.STATS.IncrementCounter(
+          "grr_session_cipher_cache", fields=["misses"])
+      session = _SessionCipher(
+          Cipher(self.common_name, self.private_key, remote_public_key),
+          remote_public_key)
+      self.session_cipher_cache.Put(key, session)
+
+    # Races between threads only make a cipher rotate a little later.
+    session.packets += 1
+    return session.cipher
+
   def EncodeMessages(self,
                      message_list,
                      result,
@@ -362,15 +553,15 @@ class Communicator(with_metaclass(abc.ABCMeta, object)):
       # it's the only cipher it ever uses.
       cipher = self._GetServerCipher()
     else:
-      remote_public_key = self._GetRemotePublicKey(destination)
-      cipher = Cipher(self.common_name, self.private_key, remote_public_key)
+      cipher = self._GetSessionCipher(destination)
 
     # Make a nonce for this transaction
     if timestamp is None:
       self.timestamp = timestamp = int(time.time() * 1000000)
 
     packed_message_list = rdf_flows.PackedMessageList(timestamp=timestamp)
-    self.EncodeMessageList(message_list, packed_message_list)
+    self.EncodeMessageList(
+        message_list, packed_message_list, compression=self.compression)
 
     result.encrypted_cipher_metadata = cipher.encrypted_cipher_metadata
 
@@ -446,7 +637,10 @@ class Communicator(with_metaclass(abc.ABCMeta, object)):
       raise DecodingError("Compression scheme not supported")
 
     try:
-      result = rdf_flows.MessageList.FromSerializedString(data)
+      # Parsing from a memoryview copies data once and keeps the (possibly
+      # large) message payloads as slices of that copy, they are only copied
+      # again when accessed or when a message is modified and serialized.
+      result = rdf_flows.MessageList.FromSerializedString(memoryview(data))
     except rdfvalue.DecodeError:
       raise DecodingError("RDFValue parsing failed.")
 
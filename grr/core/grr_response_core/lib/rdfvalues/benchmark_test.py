@@ -343,6 +343,95 @@ class RDFValueBenchmark(benchmark_test_lib.AverageMicroBenchmarks):
     self.TimeIt(RDFStructDecodeEncode)
     self.TimeIt(ProtoDecodeEncode)
 
+  def testSplitBuffer(self):
+    """Compare the bytearray decoder to byte-at-a-time decoding."""
+    s = StructGrrMessage(
+        name=u"foo",
+        request_id=1,
+        response_id=1,
+        session_id=u"session",
+        args="x" * 300)
+    data = s.SerializeToString()
+
+    def ReadTagSplitBuffer():
+      # The decoder used before SplitBuffer worked on bytearrays.
+      result = []
+      index = 0
+      while index < len(data):
+        encoded_tag, data_index = rdf_structs.ReadTag(data, index)
+        tag_type = (
+            rdf_structs.ORD_MAP[encoded_tag[0]] & rdf_structs.TAG_TYPE_MASK)
+        if tag_type == rdf_structs.WIRETYPE_VARINT:
+          _, index = rdf_structs.VarintReader(data, data_index)
+          result.append((encoded_tag, "", data[data_index:index]))
+        else:
+          length, start = rdf_structs.VarintReader(data, data_index)
+          index = start + length
+          result.append((encoded_tag, data[data_index:start],
+                         data[start:index]))
+      return result
+
+    def SplitBuffer():
+      return rdf_structs.SplitBuffer(data)
+
+    self.assertEqual(ReadTagSplitBuffer(), SplitBuffer())
+
+    self.TimeIt(ReadTagSplitBuffer)
+    self.TimeIt(SplitBuffer)
+
+  def testDecodeMany(self):
+    """Compare batched decoding to decoding every message on its own."""
+    repeats = 100
+    data = [
+        StructGrrMessage(
+            name=u"foo", request_id=i, response_id=1,
+            session_id=u"session").SerializeToString() for i in range(100)
+    ]
+
+    def RDFStructDecodeSingle():
+      return [StructGrrMessage.FromSerializedString(d) for d in data]
+
+    def RDFStructDecodeMany():
+      return StructGrrMessage.FromManySerializedStrings(data)
+
+    self.assertEqual(RDFStructDecodeSingle(), RDFStructDecodeMany())
+
+    self.TimeIt(
+        RDFStructDecodeSingle, "Decode 100 messages one by one",
+        repetitions=repeats)
+    self.TimeIt(
+        RDFStructDecodeMany, "Decode 100 messages in a batch",
+        repetitions=repeats)
+
+  def testDecodeFromMemoryview(self):
+    """Compare reading and re-serializing a message list from a view."""
+    repeats = 100
+    message_list = FastGrrMessageList(job=[
+        StructGrrMessage(
+            name=u"foo", request_id=i, session_id=u"session", args="x" * 10000)
+        for i in range(100)
+    ])
+    data = message_list.SerializeToString()
+
+    def Reemit(buff):
+      decoded = FastGrrMessageList.FromSerializedString(buff)
+      return [job.SerializeToString() for job in decoded.job if job.request_id]
+
+    def DecodeFromString():
+      return Reemit(data)
+
+    def DecodeFromMemoryview():
+      return Reemit(memoryview(data))
+
+    self.assertEqual(DecodeFromString(), DecodeFromMemoryview())
+
+    self.TimeIt(
+        DecodeFromString, "Decode and re-emit from string",
+        repetitions=repeats)
+    self.TimeIt(
+        DecodeFromMemoryview, "Decode and re-emit from memoryview",
+        repetitions=repeats)
+
 
 def main(argv):
   # Run the full test suite
@@ -693,6 +693,91 @@ class RDFStructsTest(rdf_test_base.RDFValueTestMixin, test_lib.GRRBaseTest):
     self.assertEqual(
         test_struct.ToPrimitiveDict(serialize_leaf_fields=True), expected_dict)
 
+  def testSplitBufferWithLongFields(self):
+    # Fields longer than 127 bytes need multi byte varint lengths.
+    tested = TestStruct(foobar="x" * 1000, int=2**40, repeated=["a", "b" * 300])
+    data = tested.SerializeToString()
+
+    fields = rdf_structs.SplitBuffer(data)
+    self.assertEqual("".join("".join(field) for field in fields), data)
+
+    decoded = TestStruct.FromSerializedString(data)
+    self.assertEqual(decoded.foobar, "x" * 1000)
+    self.assertEqual(decoded.int, 2**40)
+    self.assertEqual(decoded.repeated, ["a", "b" * 300])
+
+  def testSplitBufferTruncated(self):
+    data = TestStruct(int=2**40).SerializeToString()
+
+    self.assertRaises(rdfvalue.DecodeError, rdf_structs.SplitBuffer, data[:-1])
+
+  def testSplitBufferTruncatedLengthDelimitedField(self):
+    data = TestStruct(foobar="x" * 1000).SerializeToString()
+
+    for truncated in [data[:-1], data[:10]]:
+      self.assertRaises(rdfvalue.DecodeError, rdf_structs.SplitBuffer,
+                        truncated)
+
+  def testSplitBuffersTruncated(self):
+    data = TestStruct(foobar="foo", int=2**40).SerializeToString()
+
+    # The truncated buffer is followed by a valid one, the decoder must not
+    # read into it.
+    for truncated in [data[:-1], data[:3]]:
+      self.assertRaises(rdfvalue.DecodeError, rdf_structs.SplitBuffers,
+                        [truncated, data])
+
+  def testFromManySerializedStrings(self):
+    tested = [
+        TestStruct(foobar="foo%d" % i, int=i, nested=TestStruct(int=i * 200))
+        for i in range(10)
+    ]
+    tested.append(TestStruct())
+    data = [t.SerializeToString() for t in tested]
+
+    fields = rdf_structs.SplitBuffers(data)
+    self.assertEqual(fields, [rdf_structs.SplitBuffer(d) for d in data])
+
+    decoded = TestStruct.FromManySerializedStrings(data)
+    self.assertEqual(decoded, tested)
+    self.assertEqual(decoded[3].nested.int, 600)
+    self.assertEqual(TestStruct.FromManySerializedStrings([]), [])
+
+  def testParseFromMemoryview(self):
+    tested = TestStruct(
+        foobar="hello",
+        int=5,
+        repeated=["a", "b"],
+        nested=TestStruct(foobar="nested"))
+    data = tested.SerializeToString()
+
+    decoded = TestStruct.FromSerializedString(memoryview(data))
+    if rdf_structs._semantic is None:
+      # Length delimited fields, nested ones included, are slices of a single
+      # copy of the original buffer.
+      _, wire_format, _ = decoded.GetRawData()["nested"]
+      self.assertIsInstance(wire_format[2], rdf_structs._BufferSlice)
+      _, nested_wire_format, _ = decoded.nested.GetRawData()["foobar"]
+      self.assertIs(nested_wire_format[2].data, wire_format[2].data)
+
+    # Unchanged fields are written back as they were read.
+    self.assertEqual(decoded.SerializeToString(), data)
+
+    self.assertEqual(decoded.foobar, "hello")
+    self.assertIsInstance(decoded.foobar, unicode)
+    self.assertEqual(decoded.repeated, ["a", "b"])
+    self.assertEqual(decoded.nested.foobar, "nested")
+    self.assertEqual(decoded, tested)
+
+    decoded.nested.foobar = "changed"
+    self.assertEqual(
+        TestStruct.FromSerializedString(decoded.SerializeToString()),
+        TestStruct(
+            foobar="hello",
+            int=5,
+            repeated=["a", "b"],
+            nested=TestStruct(foobar="changed")))
+
 
 def main(argv):
   test_lib.main(argv)
@@ -0,0 +1,257 @@
+#!/usr/bin/env python
+"""A sharded LRU cache for caches shared by many threads.
+
+utils.FastStore serializes all access to the cache on a single lock. On hot
+paths like the frontend's public key cache every worker thread competes for
+that lock. The ShardedCache in this module partitions the keys over a number
+of independent LRU shards instead, so threads only contend when they access
+keys that hash to the same shard.
+"""
+
+import collections
+import functools
+import re
+import threading
+import time
+import weakref
+
+
+from builtins import range  # pylint: disable=redefined-builtin
+
+from grr_response_core.lib import registry
+from grr_response_core.lib import stats
+
+# Named caches whose counters are exported through stats.STATS.
+_NAMED_CACHES = weakref.WeakValueDictionary()
+_NAMED_CACHES_LOCK = threading.Lock()
+_METRICS_REGISTERED = False
+
+_COUNTERS = ["hits", "misses", "evictions"]
+
+
+class _CacheShard(object):
+  """A single LRU partition of a ShardedCache."""
+
+  def __init__(self, max_size):
+    self.max_size = max_size
+    # Maps keys to (timestamp, obj) tuples, least recently used first.
+    self.data = collections.OrderedDict()
+    self.lock = threading.Lock()
+
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+
+
+class ShardedCache(object):
+  """An LRU cache which is split into independently locked shards.
+
+  The cache has the same interface as utils.FastStore. The LRU order is only
+  maintained per shard, so an object may be evicted before older objects that
+  live in other shards. The cache never holds more than max_size objects.
+
+  KillObject() is never called while a shard lock is held.
+  """
+
+  def __init__(self, max_size=10, max_age=None, num_shards=16, name=None):
+    """Constructor.
+
+    Args:
+      max_size: The maximum number of objects held in cache.
+      max_age: If set, objects older than this many seconds are not returned
+        anymore. Unlike utils.TimeBasedCache the age is not refreshed on
+        access, i.e. this behaves like utils.AgeBasedCache.
+      num_shards: The number of shards to split the cache into.
+      name: If given, the cache hit, miss and eviction counters are exported
+        through stats.STATS under this name.
+    """
+    self.max_size = max_size
+    self.max_age = max_age
+    self.name = name
+
+    num_shards = max(1, min(num_shards, max_size))
+    shard_size, remainder = divmod(max_size, num_shards)
+    self._shards = [
+        _CacheShard(shard_size + (1 if i < remainder else 0))
+        for i in range(num_shards)
+    ]
+
+    if name is not None:
+      _ExportCacheStats(self)
+
+  def _GetShard(self, key):
+    return self._shards[hash(key) % len(self._shards)]
+
+  def KillObject(self, obj):
+    """Perform cleanup on objects when they expire.
+
+    Should be overridden by classes which need to perform special cleanup.
+    Args:
+      obj: The object which was stored in the cache and is now expired.
+    """
+
+  def Put(self, key, obj):
+    """Add the object to the cache."""
+    shard = self._GetShard(key)
+    evicted = []
+    with shard.lock:
+      # Remove the old entry if it is there so the new one becomes the most
+      # recently used.
+      shard.data.pop(key, None)
+      shard.data[key] = (time.time(), obj)
+
+      while len(shard.data) > shard.max_size:
+        _, (_, evicted_obj) = shard.data.popitem(last=False)
+        evicted.append(evicted_obj)
+        shard.evictions += 1
+
+    for evicted_obj in evicted:
+      self.KillObject(evicted_obj)
+
+    return key
+
+  def Get(self, key):
+    """Fetch the object from cache.
+
+    Objects may be flushed from cache at any time. Callers must always
+    handle the possibility of KeyError raised here.
+
+    Args:
+      key: The key used to access the object.
+
+    Returns:
+      Cached object.
+
+    Raises:
+      KeyError: If the object is not present in the cache.
+    """
+    shard = self._GetShard(key)
+    with shard.lock:
+      try:
+        timestamp, obj = shard.data.pop(key)
+      except KeyError:
+        shard.misses += 1
+        raise
+
+      if self.max_age is None or timestamp + self.max_age >= time.time():
+        # Reinserting moves the key to the most recently used end.
+        shard.data[key] = (timestamp, obj)
+        shard.hits += 1
+        return obj
+
+      shard.misses += 1
+
+    self.KillObject(obj)
+    raise KeyError("Expired")
+
+  def __getitem__(self, key):
+    return self.Get(key)
+
+  def Pop(self, key):
+    """Remove the object from the cache completely."""
+    shard = self._GetShard(key)
+    with shard.lock:
+      stored = shard.data.pop(key, None)
+
+    if stored is not None:
+      return stored[1]
+
+  def ExpireObject(self, key):
+    """Expire a specific object from cache."""
+    obj = self.Pop(key)
+    if obj is not None:
+      self.KillObject(obj)
+
+    return obj
+
+  def ExpireRegEx(self, regex):
+    """Expire all the objects with the key matching the regex."""
+    reg = re.compile(regex)
+    for key, _ in self:
+      if reg.match(key):
+        self.ExpireObject(key)
+
+  def ExpirePrefix(self, prefix):
+    """Expire all the objects with the key having a given prefix."""
+    for key, _ in self:
+      if key.startswith(prefix):
+        self.ExpireObject(key)
+
+  def Flush(self):
+    """Flush all items from cache."""
+    for shard in self._shards:
+      with shard.lock:
+        stored = list(shard.data.values())
+        shard.data.clear()
+
+      for _, obj in stored:
+        self.KillObject(obj)
+
+  def __iter__(self):
+    result = []
+    for shard in self._shards:
+      with shard.lock:
+        result.extend((key, obj) for key, (_, obj) in shard.data.items())
+
+    return iter(result)
+
+  def __contains__(self, key):
+    return key in self._GetShard(key).data
+
+  def __len__(self):
+    return sum(len(shard.data) for shard in self._shards)
+
+  @property
+  def hits(self):
+    return sum(shard.hits for shard in self._shards)
+
+  @property
+  def misses(self):
+    return sum(shard.misses for shard in self._shards)
+
+  @property
+  def evictions(self):
+    return sum(shard.evictions for shard in self._shards)
+
+
+def _GetCacheCounter(name, counter):
+  cache = _NAMED_CACHES.get(name)
+  if cache is None:
+    return 0
+
+  return getattr(cache, counter)
+
+
+def _SetCacheCallbacks(name):
+  for counter in _COUNTERS:
+    stats.STATS.SetGaugeCallback(
+        "sharded_cache_" + counter,
+        functools.partial(_GetCacheCounter, name, counter),
+        fields=[name])
+
+
+def _ExportCacheStats(cache):
+  """Exports the counters of a named cache."""
+  with _NAMED_CACHES_LOCK:
+    _NAMED_CACHES[cache.name] = cache
+    if _METRICS_REGISTERED:
+      _SetCacheCallbacks(cache.name)
+
+
+class ShardedCacheInit(registry.InitHook):
+  """Registers the sharded cache metrics."""
+
+  def RunOnce(self):
+    global _METRICS_REGISTERED  # pylint: disable=global-statement
+
+    # The counters are kept by the shards themselves and only read when the
+    # metrics are collected, so incrementing them does not need the lock
+    # stats.STATS takes for every update.
+    for counter in _COUNTERS:
+      stats.STATS.RegisterGaugeMetric(
+          "sharded_cache_" + counter, int, fields=[("cache", str)])
+
+    with _NAMED_CACHES_LOCK:
+      _METRICS_REGISTERED = True
+      for name in list(_NAMED_CACHES.keys()):
+        _SetCacheCallbacks(name)
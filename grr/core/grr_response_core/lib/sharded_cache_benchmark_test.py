@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+"""Benchmarks the sharded cache against utils.FastStore under contention."""
+
+import threading
+import time
+
+
+from builtins import range  # pylint: disable=redefined-builtin
+import pytest
+
+from grr_response_core.lib import flags
+from grr_response_core.lib import sharded_cache
+from grr_response_core.lib import utils
+from grr.test_lib import benchmark_test_lib
+from grr.test_lib import test_lib
+
+
+@pytest.mark.large
+class ShardedCacheBenchmark(benchmark_test_lib.MicroBenchmarks):
+  """Measures cache throughput with many threads."""
+
+  units = "s"
+
+  CACHE_SIZE = 50000
+  KEYS = 60000
+  OPERATIONS_PER_THREAD = 20000
+
+  def _RunThreads(self, cache, num_threads):
+    """Runs a mix of gets and puts on the cache from num_threads threads."""
+
+    def Worker(offset):
+      for i in range(self.OPERATIONS_PER_THREAD):
+        key = "C.%016X" % ((offset + i * 7919) % self.KEYS)
+        try:
+          cache.Get(key)
+        except KeyError:
+          cache.Put(key, i)
+
+    threads = [
+        threading.Thread(target=Worker, args=(i * 1000,))
+        for i in range(num_threads)
+    ]
+
+    start = time.time()
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+
+    return time.time() - start
+
+  def testContention(self):
+    for num_threads in [1, 10, 50]:
+      operations = num_threads * self.OPERATIONS_PER_THREAD
+
+      fast_store = utils.FastStore(max_size=self.CACHE_SIZE)
+      self.AddResult("FastStore, %d threads" % num_threads,
+                     self._RunThreads(fast_store, num_threads), operations)
+
+      cache = sharded_cache.ShardedCache(max_size=self.CACHE_SIZE)
+      self.AddResult("ShardedCache, %d threads" % num_threads,
+                     self._RunThreads(cache, num_threads), operations)
+
+
+def main(argv):
+  test_lib.main(argv)
+
+
+if __name__ == "__main__":
+  flags.StartMain(main)
@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+"""Tests for the sharded cache."""
+
+import threading
+
+
+from builtins import range  # pylint: disable=redefined-builtin
+
+from grr_response_core.lib import flags
+from grr_response_core.lib import sharded_cache
+from grr_response_core.lib import stats
+from grr.test_lib import test_lib
+
+
+class ShardedCacheTest(test_lib.GRRBaseTest):
+  """Tests for ShardedCache."""
+
+  def testExpiresObjectsWhenFull(self):
+    cache = sharded_cache.ShardedCache(max_size=5, num_shards=1)
+    for i in range(100):
+      cache.Put(i, i)
+
+    self.assertEqual(len(cache), 5)
+    self.assertEqual(cache.Get(99), 99)
+    self.assertRaises(KeyError, cache.Get, 0)
+    self.assertEqual(cache.evictions, 95)
+
+  def testNeverExceedsMaxSize(self):
+    cache = sharded_cache.ShardedCache(max_size=37, num_shards=8)
+    for i in range(1000):
+      cache.Put("key%d" % i, i)
+
+    self.assertLessEqual(len(cache), 37)
+
+  def testGetRefreshesObjects(self):
+    cache = sharded_cache.ShardedCache(max_size=5, num_shards=1)
+    for i in range(5):
+      cache.Put(i, i)
+
+    # Key 0 is refreshed each time it is read so it is never evicted.
+    for i in range(5, 1000):
+      cache.Get(0)
+      cache.Put(i, i)
+
+    self.assertEqual(cache.Get(0), 0)
+
+  def testExpireObject(self):
+    cache = sharded_cache.ShardedCache(max_size=100)
+    cache.Put("test1", 1)
+    self.assertEqual(cache.Get("test1"), 1)
+    self.assertIn("test1", cache)
+
+    self.assertEqual(cache.ExpireObject("test1"), 1)
+    self.assertRaises(KeyError, cache.Get, "test1")
+    self.assertNotIn("test1", cache)
+
+  def testExpirePrefix(self):
+    cache = sharded_cache.ShardedCache(max_size=100)
+    for i in range(10):
+      cache.Put("foo%d" % i, i)
+      cache.Put("bar%d" % i, i)
+
+    cache.ExpirePrefix("foo")
+    self.assertEqual(sorted(key for key, _ in cache),
+                     ["bar%d" % i for i in range(10)])
+
+  def testKillObject(self):
+    results = []
+
+    class TestCache(sharded_cache.ShardedCache):
+
+      def KillObject(self, obj):
+        results.append(obj)
+
+    cache = TestCache(max_size=5, num_shards=1)
+    for i in range(10):
+      cache.Put(i, i)
+
+    # Only the first 5 objects have been evicted.
+    self.assertEqual(results, list(range(5)))
+
+    cache.Flush()
+    self.assertEqual(sorted(results), list(range(10)))
+    self.assertEqual(len(cache), 0)
+
+  def testMaxAge(self):
+    cache = sharded_cache.ShardedCache(max_size=10, max_age=50)
+    with test_lib.FakeTime(100):
+      cache.Put("key", "hello")
+
+    with test_lib.FakeTime(140):
+      # Reading does not extend the lifetime of the object.
+      self.assertEqual(cache.Get("key"), "hello")
+
+    with test_lib.FakeTime(160):
+      self.assertRaises(KeyError, cache.Get, "key")
+
+    self.assertEqual(len(cache), 0)
+
+  def testCounters(self):
+    cache = sharded_cache.ShardedCache(max_size=1, name="test_cache")
+    cache.Put("a", 1)
+    cache.Get("a")
+    cache.Put("b", 2)
+    self.assertRaises(KeyError, cache.Get, "a")
+
+    self.assertEqual(cache.hits, 1)
+    self.assertEqual(cache.misses, 1)
+    self.assertEqual(cache.evictions, 1)
+
+    for counter in ["hits", "misses", "evictions"]:
+      self.assertEqual(
+          stats.STATS.GetMetricValue(
+              "sharded_cache_" + counter, fields=["test_cache"]), 1)
+
+  def testConcurrentAccess(self):
+    cache = sharded_cache.ShardedCache(max_size=100, num_shards=4)
+
+    def Worker(offset):
+      for i in range(1000):
+        key = (offset + i) % 150
+        cache.Put(key, key)
+        try:
+          self.assertEqual(cache.Get(key), key)
+        except KeyError:
+          pass
+
+    threads = [threading.Thread(target=Worker, args=(i,)) for i in range(10)]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+
+    self.assertLessEqual(len(cache), 100)
+    for key, value in cache:
+      self.assertEqual(key, value)
+
+
+def main(argv):
+  test_lib.main(argv)
+
+
+if __name__ == "__main__":
+  flags.StartMain(main)
@@ -10,6 +10,7 @@ import copy
 import errno
 import functools
 import getpass
+import heapq
 import io
 import os
 import pipes
@@ -366,12 +367,21 @@ class FastStore(object):
 
 
 class TimeBasedCache(FastStore):
-  """A Cache which expires based on time."""
+  """A Cache which expires based on time.
+
+  Objects are put into expiry buckets of sweep_granularity seconds, and the
+  buckets are kept in a min-heap. The housekeeper thread only looks at the
+  buckets that are due, so the time it holds the cache lock is proportional
+  to the number of objects that expire rather than to the size of the cache.
+  Buckets only hold keys, each key is in at most one bucket. Objects that
+  were refreshed or removed in the meantime are detected when their bucket
+  comes up.
+  """
 
   active_caches = None
   house_keeper_thread = None
 
-  def __init__(self, max_size=10, max_age=600):
+  def __init__(self, max_size=10, max_age=600, sweep_granularity=1):
     """Constructor.
 
     This cache will refresh the age of the cached object as long as they are
@@ -381,9 +391,20 @@ class TimeBasedCache(FastStore):
     Args:
       max_size: The maximum number of objects held in cache.
       max_age: The maximum length of time an object is considered alive.
+      sweep_granularity: The width in seconds of the expiry buckets. Coarser
+        buckets mean fewer heap entries, but expired objects may stay in
+        memory up to this much longer.
     """
     super(TimeBasedCache, self).__init__(max_size)
     self.max_age = max_age
+    self.sweep_granularity = sweep_granularity
+
+    # Maps bucket numbers to the keys which expire in this bucket.
+    self._expiry_buckets = {}
+    # Keys which are in one of the _expiry_buckets.
+    self._scheduled_keys = set()
+    # A min-heap of the bucket numbers in _expiry_buckets.
+    self._expiry_heap = []
 
     def HouseKeeper():
       """A housekeeper thread which expunges old objects."""
@@ -394,21 +415,7 @@ class TimeBasedCache(FastStore):
       now = time.time()
 
       for cache in TimeBasedCache.active_caches:
-        # Only expunge while holding the lock on the data store.
-        with cache.lock:
-          # pylint: disable=protected-access
-          # We need to take a copy of the value list because we are changing
-          # this dict during the iteration.
-          for node in list(itervalues(cache._hash)):
-            timestamp, obj = node.data
-
-            # Expire the object if it is too old.
-            if timestamp + cache.max_age < now:
-              cache.KillObject(obj)
-
-              cache._age.Unlink(node)
-              cache._hash.pop(node.key, None)
-          # pylint: enable=protected-access
+        cache.ExpireOldObjects(now)
 
     if not TimeBasedCache.house_keeper_thread:
       TimeBasedCache.active_caches = weakref.WeakSet()
@@ -418,6 +425,50 @@ class TimeBasedCache(FastStore):
       TimeBasedCache.house_keeper_thread.start()
     TimeBasedCache.active_caches.add(self)
 
+  def _ScheduleExpiry(self, key, timestamp):
+    """Puts the key into the bucket of its expiry time."""
+    bucket = int((timestamp + self.max_age) // self.sweep_granularity) + 1
+    keys = self._expiry_buckets.get(bucket)
+    if keys is None:
+      keys = self._expiry_buckets[bucket] = []
+      heapq.heappush(self._expiry_heap, bucket)
+    keys.append(key)
+    self._scheduled_keys.add(key)
+
+  @Synchronized
+  def ExpireOldObjects(self, now):
+    """Expires all objects which are older than max_age.
+
+    Args:
+      now: The current time.
+
+    Returns:
+      The number of expired objects.
+    """
+    expired = 0
+    while (self._expiry_heap and
+           self._expiry_heap[0] * self.sweep_granularity <= now):
+      bucket = heapq.heappop(self._expiry_heap)
+      for key in self._expiry_buckets.pop(bucket):
+        self._scheduled_keys.discard(key)
+
+        # Skip objects which were removed in the meantime.
+        node = self._hash.get(key)
+        if node is None:
+          continue
+
+        timestamp, obj = node.data
+        if timestamp + self.max_age < now:
+          self.KillObject(obj)
+          self._age.Unlink(node)
+          self._hash.pop(key, None)
+          expired += 1
+        else:
+          # The object was refreshed or replaced since it was scheduled.
+          self._ScheduleExpiry(key, timestamp)
+
+    return expired
+
   @Synchronized
   def Get(self, key):
     now = time.time()
@@ -430,8 +481,21 @@ class TimeBasedCache(FastStore):
 
     return stored[1]
 
+  @Synchronized
   def Put(self, key, obj):
-    super(TimeBasedCache, self).Put(key, [time.time(), obj])
+    now = time.time()
+    super(TimeBasedCache, self).Put(key, [now, obj])
+
+    # A key which is already scheduled is rescheduled when its bucket is due.
+    if key in self._hash and key not in self._scheduled_keys:
+      self._ScheduleExpiry(key, now)
+
+  @Synchronized
+  def Flush(self):
+    super(TimeBasedCache, self).Flush()
+    self._expiry_buckets = {}
+    self._scheduled_keys = set()
+    self._expiry_heap = []
 
 
 class Memoize(object):
@@ -940,6 +1004,35 @@ class ArchiveAlreadyClosedError(Error):
   pass
 
 
+class DeflatedFileContent(object):
+  """Contents of a file deflated ahead of writing it into a zip archive.
+
+  Deflating doesn't depend on the state of the archive, so the contents of
+  different files can be compressed in parallel and written with
+  StreamingZipGenerator.WriteDeflatedFileContent afterwards.
+  """
+
+  def __init__(self, chunks):
+    cmpr = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+
+    self.chunks = []
+    self.file_size = 0
+    self.compress_size = 0
+    self.crc = 0
+    for chunk in chunks:
+      self.file_size += len(chunk)
+      # pytype: disable=module-attr
+      self.crc = zipfile.crc32(chunk, self.crc) & 0xffffffff
+      # pytype: enable=module-attr
+      self._Append(cmpr.compress(chunk))
+    self._Append(cmpr.flush())
+
+  def _Append(self, deflated):
+    if deflated:
+      self.chunks.append(deflated)
+      self.compress_size += len(deflated)
+
+
 # TODO(user):pytype: we use a lot of zipfile internals that type checker is
 # not aware of.
 # pytype: disable=attribute-error,wrong-arg-types
@@ -1113,6 +1206,28 @@ class StreamingZipGenerator(object):
     self._stream.write(chunk)
     return self._stream.GetValueAndReset()
 
+  def WriteDeflatedFileContent(self, content):
+    """Writes the whole contents of a file deflated with DeflatedFileContent."""
+
+    if not self._stream:
+      raise ArchiveAlreadyClosedError(
+          "Attempting to write to a ZIP archive that was already closed.")
+
+    if self.cur_zinfo.compress_type != zipfile.ZIP_DEFLATED:
+      raise ValueError("Deflated content requires ZIP_DEFLATED compression.")
+    if self.cur_file_size:
+      raise ValueError("Deflated content has to be the only file content.")
+
+    # The content is already deflated and flushed.
+    self.cur_cmpr = None
+    self.cur_file_size = content.file_size
+    self.cur_compress_size = content.compress_size
+    self.cur_crc = content.crc
+
+    for chunk in content.chunks:
+      self._stream.write(chunk)
+    return self._stream.GetValueAndReset()
+
   def WriteFileFooter(self):
     """Writes the file footer (finished the file)."""
 
@@ -1126,6 +1241,8 @@ class StreamingZipGenerator(object):
       self.cur_zinfo.compress_size = self.cur_compress_size
 
       self._stream.write(buf)
+    elif self.cur_zinfo.compress_type == zipfile.ZIP_DEFLATED:
+      self.cur_zinfo.compress_size = self.cur_compress_size
     else:
       self.cur_zinfo.compress_size = self.cur_file_size
 
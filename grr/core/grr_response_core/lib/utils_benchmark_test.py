@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+"""Benchmarks for the caches in utils."""
+
+import time
+
+
+from builtins import range  # pylint: disable=redefined-builtin
+import pytest
+
+from grr_response_core.lib import flags
+from grr_response_core.lib import utils
+from grr.test_lib import benchmark_test_lib
+from grr.test_lib import test_lib
+
+
+@pytest.mark.large
+class TimeBasedCacheBenchmark(benchmark_test_lib.MicroBenchmarks):
+  """Measures how long the housekeeper holds the cache lock."""
+
+  units = "ms"
+
+  # The number of objects expiring in each sweep.
+  EXPIRING = 100
+
+  def testSweepPauseTime(self):
+    for size in [1000, 10000, 100000]:
+      cache = utils.TimeBasedCache(max_size=size, max_age=60)
+
+      # Only the oldest objects are due when the housekeeper runs.
+      with test_lib.FakeTime(100):
+        for i in range(self.EXPIRING):
+          cache.Put(i, i)
+
+      with test_lib.FakeTime(1000):
+        for i in range(self.EXPIRING, size):
+          cache.Put(i, i)
+
+      start = time.time()
+      expired = cache.ExpireOldObjects(500)
+      self.AddResult("Sweep of %d objects" % size, time.time() - start,
+                     expired)
+      self.assertEqual(expired, self.EXPIRING)
+
+
+def main(argv):
+  test_lib.main(argv)
+
+
+if __name__ == "__main__":
+  flags.StartMain(main)
@@ -106,6 +106,45 @@ class StoreTests(test_lib.GRRBaseTest):
       # This should now be expired
       self.assertRaises(KeyError, tested_cache.Get, key)
 
+  def testTimeBasedCacheExpiresRefreshedObjectsLater(self):
+    tested_cache = utils.TimeBasedCache(max_age=50, sweep_granularity=10)
+    with test_lib.FakeTime(100):
+      tested_cache.Put("refreshed", 1)
+      tested_cache.Put("stale", 2)
+
+    with test_lib.FakeTime(140):
+      self.assertEqual(tested_cache.Get("refreshed"), 1)
+
+    # Nothing is due yet.
+    self.assertEqual(tested_cache.ExpireOldObjects(145), 0)
+
+    with test_lib.FakeTime(170):
+      self.assertEqual(tested_cache.ExpireOldObjects(170), 1)
+      self.assertEqual(tested_cache.Get("refreshed"), 1)
+      self.assertNotIn("stale", tested_cache)
+
+    self.assertEqual(tested_cache.ExpireOldObjects(221), 1)
+    self.assertEqual(len(tested_cache), 0)
+
+  def testTimeBasedCacheSkipsRemovedObjects(self):
+    results = []
+
+    class TestCache(utils.TimeBasedCache):
+
+      def KillObject(self, obj):
+        results.append(obj)
+
+    tested_cache = TestCache(max_size=2, max_age=50)
+    with test_lib.FakeTime(100):
+      for i in range(4):
+        tested_cache.Put(i, i)
+      tested_cache.ExpireObject(3)
+
+    # Evicted objects are killed with their timestamp, expired ones aren't.
+    self.assertEqual(results, [[100, 0], [100, 1], [100, 3]])
+    self.assertEqual(tested_cache.ExpireOldObjects(200), 1)
+    self.assertEqual(results, [[100, 0], [100, 1], [100, 3], 2])
+
   def testTimeBasedCacheSingleThread(self):
 
     utils.TimeBasedCache()
@@ -431,6 +470,33 @@ class StreamingZipWriterTest(test_lib.GRRBaseTest):
         link_contents = zip_fd.read("test2.txt.link")
         self.assertEqual(link_contents, "subdir/test2.txt")
 
+  def testZipFileWithDeflatedFileContent(self):
+    chunks = [b"this is a test string", b"", b"this is another test string"]
+    content = utils.DeflatedFileContent(chunks)
+    self.assertEqual(content.file_size, len(b"".join(chunks)))
+
+    generator = utils.StreamingZipGenerator(compression=zipfile.ZIP_DEFLATED)
+    data = [
+        generator.WriteFileHeader("test1.txt"),
+        generator.WriteDeflatedFileContent(content),
+        generator.WriteFileFooter(),
+        generator.WriteFileHeader("test2.txt"),
+        generator.WriteFileChunk(b"written directly"),
+        generator.WriteFileFooter(),
+        generator.Close()
+    ]
+
+    test_zip = zipfile.ZipFile(io.BytesIO(b"".join(data)), "r")
+    self.assertIsNone(test_zip.testzip())
+    self.assertEqual(test_zip.read("test1.txt"), b"".join(chunks))
+    self.assertEqual(test_zip.read("test2.txt"), b"written directly")
+
+  def testDeflatedFileContentRequiresDeflatedFile(self):
+    generator = utils.StreamingZipGenerator(compression=zipfile.ZIP_STORED)
+    generator.WriteFileHeader("test.txt")
+    with self.assertRaises(ValueError):
+      generator.WriteDeflatedFileContent(utils.DeflatedFileContent([b"test"]))
+
 
 class StreamingTarWriterTest(test_lib.GRRBaseTest):
   """Tests for StreamingTarWriter."""
@@ -25,6 +25,7 @@ from grr_response_core import config
 from grr_response_core.lib import lexer
 from grr_response_core.lib import rdfvalue
 from grr_response_core.lib import registry
+from grr_response_core.lib import sharded_cache
 from grr_response_core.lib import type_info
 from grr_response_core.lib import utils
 from grr_response_core.lib.rdfvalues import crypto as rdf_crypto
@@ -284,9 +285,10 @@ class Factory(object):
   intermediate_cache_age = 600
 
   def __init__(self):
-    self.intermediate_cache = utils.AgeBasedCache(
+    self.intermediate_cache = sharded_cache.ShardedCache(
         max_size=self.intermediate_cache_max_size,
-        max_age=self.intermediate_cache_age)
+        max_age=self.intermediate_cache_age,
+        name="aff4_intermediate_cache")
 
     # Create a token for system level actions. This token is used by other
     # classes such as HashFileStore and NSRLFilestore to create entries under
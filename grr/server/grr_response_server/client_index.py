@@ -8,9 +8,9 @@ An index of client machines, associating likely identifiers to client IDs.
 from builtins import map  # pylint: disable=redefined-builtin
 from builtins import range  # pylint: disable=redefined-builtin
 from future.utils import iteritems
-from future.utils import itervalues
 
 from grr_response_core.lib import rdfvalue
+from grr_response_core.lib import sharded_cache
 from grr_response_core.lib import utils
 from grr_response_core.lib.rdfvalues import client as rdf_client
 from grr_response_server import aff4
@@ -18,6 +18,16 @@ from grr_response_server import data_store
 from grr_response_server import keyword_index
 from grr_response_server.aff4_objects import aff4_grr
 
+# Paged client searches read this many client ids beyond the requested page and
+# keep them in a server side cursor for the next page.
+SEARCH_READ_AHEAD = 1000
+
+# Seconds for which search cursors are kept.
+SEARCH_CURSOR_MAX_AGE = 300
+
+_SEARCH_CURSORS = sharded_cache.ShardedCache(
+    max_size=1000, max_age=SEARCH_CURSOR_MAX_AGE)
+
 
 def CreateClientIndex(token=None):
   return aff4.FACTORY.Create(
@@ -325,6 +335,31 @@ def GetMostRecentClient(client_list, token=None):
   return client_urn
 
 
+class _SearchCursor(object):
+  """Client ids read ahead by a paged client search."""
+
+  def __init__(self, search, offset, client_ids, exhausted):
+    self.search = search
+    # The offset of the first read ahead client id in the search results.
+    self.offset = offset
+    self.client_ids = client_ids
+    # Whether client_ids are all the remaining search results.
+    self.exhausted = exhausted
+
+
+def _ParseSearchCursor(cursor):
+  """Returns the cursor id and the offset of the next page of a cursor."""
+  try:
+    cursor_id, offset = cursor.split(":")
+    offset = int(offset)
+  except ValueError:
+    raise ValueError("Invalid search cursor: %s" % cursor)
+
+  if offset < 0:
+    raise ValueError("Invalid search cursor: %s" % cursor)
+  return cursor_id, offset
+
+
 class ClientIndex(object):
   """An index of client machines."""
 
@@ -354,14 +389,25 @@ class ClientIndex(object):
 
     return start_time, filtered_keywords
 
-  def LookupClients(self, keywords):
-    """Returns a list of client URNs associated with keywords.
+  def LookupClients(self,
+                    keywords,
+                    offset=0,
+                    count=None,
+                    labels=None,
+                    label_owners=None):
+    """Returns a list of client ids associated with keywords.
 
     Args:
       keywords: The list of keywords to search by.
+      offset: The number of matching clients to skip.
+      count: If set, the maximum number of client ids to return.
+      labels: If set, only clients with at least one of these labels are
+        returned.
+      label_owners: If set along with labels, only labels owned by one of these
+        users are considered.
 
     Returns:
-      A list of client URNs.
+      A sorted list of client ids, starting at the given offset.
 
     Raises:
       ValueError: A string (single keyword) was passed instead of an iterable.
@@ -372,20 +418,84 @@ class ClientIndex(object):
 
     start_time, filtered_keywords = self._AnalyzeKeywords(keywords)
 
-    keyword_map = data_store.REL_DB.ListClientsForKeywords(
+    return data_store.REL_DB.ListClientsMatchingKeywords(
         list(map(self._NormalizeKeyword, filtered_keywords)),
-        start_time=start_time)
+        start_time=start_time,
+        offset=offset,
+        count=count,
+        labels=labels,
+        label_owners=label_owners)
+
+  def SearchClients(self,
+                    keywords,
+                    offset=0,
+                    count=None,
+                    labels=None,
+                    label_owners=None,
+                    cursor=None):
+    """Returns a page of client ids associated with keywords.
+
+    Client ids beyond the page are read ahead and kept in a short lived server
+    side cursor, so the next page can usually be returned without another
+    lookup.
 
-    results = itervalues(keyword_map)
-    relevant_set = set(next(results))
-
-    for hits in results:
-      relevant_set &= set(hits)
+    Args:
+      keywords: The list of keywords to search by.
+      offset: The number of matching clients to skip. Ignored if a cursor is
+        given.
+      count: If set, the maximum number of client ids to return.
+      labels: If set, only clients with at least one of these labels are
+        returned.
+      label_owners: If set along with labels, only labels owned by one of these
+        users are considered.
+      cursor: A cursor returned by a previous call with the same keywords and
+        labels. The page following the previous one is returned.
 
-      if not relevant_set:
-        return []
+    Returns:
+      A tuple of a sorted list of client ids and a cursor for the next page, or
+      None if there are no more clients.
 
-    return sorted(relevant_set)
+    Raises:
+      ValueError: The cursor is malformed.
+    """
+    search = (tuple(keywords), None if labels is None else
+              tuple(sorted(labels)), None if label_owners is None else
+              tuple(sorted(label_owners)))
+
+    client_ids = None
+    if cursor:
+      cursor_id, offset = _ParseSearchCursor(cursor)
+      try:
+        state = _SEARCH_CURSORS.Get(cursor_id)
+      except KeyError:
+        state = None
+
+      if (state is not None and state.search == search and
+          state.offset == offset and
+          (state.exhausted or
+           (count is not None and len(state.client_ids) >= count))):
+        client_ids = state.client_ids
+        exhausted = state.exhausted
+
+    if client_ids is None:
+      read_count = None if count is None else count + SEARCH_READ_AHEAD
+      client_ids = self.LookupClients(
+          keywords,
+          offset=offset,
+          count=read_count,
+          labels=labels,
+          label_owners=label_owners)
+      exhausted = read_count is None or len(client_ids) < read_count
+
+    page, rest = client_ids[:count], client_ids[count:]
+    if exhausted and not rest:
+      return page, None
+
+    next_offset = offset + len(page)
+    cursor_id = "%016x" % utils.PRNG.GetUInt64()
+    _SEARCH_CURSORS.Put(cursor_id,
+                        _SearchCursor(search, next_offset, rest, exhausted))
+    return page, "%s:%d" % (cursor_id, next_offset)
 
   def ReadClientPostingLists(self, keywords):
     """Looks up all clients associated with any of the given keywords.
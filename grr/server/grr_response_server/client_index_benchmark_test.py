@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+"""Benchmarks client searches in the relational client index."""
+
+import time
+
+
+from builtins import range  # pylint: disable=redefined-builtin
+from future.utils import itervalues
+import pytest
+
+from grr_response_core.lib import flags
+from grr_response_core.lib import rdfvalue
+from grr_response_server import client_index
+from grr_response_server import data_store
+from grr.test_lib import benchmark_test_lib
+from grr.test_lib import test_lib
+
+
+@pytest.mark.large
+class ClientIndexSearchBenchmark(benchmark_test_lib.MicroBenchmarks):
+  """Measures paged searches for common keywords in a large fleet."""
+
+  units = "ms"
+
+  CLIENTS = 50000
+  PAGE_SIZE = 50
+  REPETITIONS = 10
+
+  def _CreateFleet(self):
+    for i in range(self.CLIENTS):
+      client_id = u"C.%016x" % i
+      data_store.REL_DB.WriteClientMetadata(client_id, fleetspeak_enabled=False)
+
+      keywords = [".", "windows" if i % 2 else "linux", "host-%d" % i]
+      if i % 10 == 0:
+        keywords.append("label:investigation")
+      data_store.REL_DB.AddClientKeywords(client_id, keywords)
+
+  def _SearchAllPostings(self, keywords, offset):
+    """Searches the way the index did before paging moved into the db."""
+    start_time = rdfvalue.RDFDatetime.Now() - rdfvalue.Duration("180d")
+    keyword_map = data_store.REL_DB.ListClientsForKeywords(
+        keywords, start_time=start_time)
+
+    results = itervalues(keyword_map)
+    relevant_set = set(next(results))
+    for hits in results:
+      relevant_set &= set(hits)
+
+    return sorted(relevant_set)[offset:offset + self.PAGE_SIZE]
+
+  def _Time(self, name, search):
+    start = time.time()
+    for i in range(self.REPETITIONS):
+      search(i * self.PAGE_SIZE)
+    self.AddResult(name, (time.time() - start) / self.REPETITIONS,
+                   self.REPETITIONS)
+
+  def testSearch(self):
+    self._CreateFleet()
+    index = client_index.ClientIndex()
+
+    for keywords in [["."], ["windows"], ["windows", "label:investigation"]]:
+      query = " ".join(keywords)
+      self._Time(
+          "All postings: %s" % query,
+          lambda offset: self._SearchAllPostings(keywords, offset))  # pylint: disable=cell-var-from-loop
+      self._Time(
+          "Paged: %s" % query,
+          lambda offset: index.LookupClients(  # pylint: disable=g-long-lambda
+              keywords, offset=offset, count=self.PAGE_SIZE))  # pylint: disable=cell-var-from-loop
+
+
+def main(argv):
+  test_lib.main(argv)
+
+
+if __name__ == "__main__":
+  flags.StartMain(main)
@@ -8,6 +8,7 @@ import socket
 from builtins import range  # pylint: disable=redefined-builtin
 from future.utils import iteritems
 from future.utils import iterkeys
+import mock
 
 from grr_response_core.lib import flags
 from grr_response_core.lib import ipv6_utils
@@ -391,6 +392,96 @@ class ClientIndexTest(aff4_test_lib.AFF4ObjectTest):
     # Universal keyword should find everything.
     self.assertItemsEqual(index.LookupClients(["."]), list(clients))
 
+  def testLookupClientsPaged(self):
+    index = client_index.ClientIndex()
+
+    clients = self._SetupClients(5)
+    for client_id, client in iteritems(clients):
+      data_store.REL_DB.WriteClientMetadata(client_id, fleetspeak_enabled=False)
+      index.AddClient(client)
+
+    client_ids = sorted(clients)
+    self.assertEqual(index.LookupClients(["."], count=2), client_ids[:2])
+    self.assertEqual(
+        index.LookupClients(["."], offset=2, count=2), client_ids[2:4])
+    self.assertEqual(index.LookupClients(["."], offset=4), client_ids[4:])
+    self.assertEqual(index.LookupClients(["."], offset=5), [])
+    self.assertEqual(
+        index.LookupClients(["windows", "192.168.0"], offset=1, count=1),
+        client_ids[1:2])
+
+  def testSearchClientsWithCursor(self):
+    index = client_index.ClientIndex()
+
+    clients = self._SetupClients(5)
+    for client_id, client in iteritems(clients):
+      data_store.REL_DB.WriteClientMetadata(client_id, fleetspeak_enabled=False)
+      index.AddClient(client)
+
+    client_ids = sorted(clients)
+    with mock.patch.object(
+        index, "LookupClients", wraps=index.LookupClients) as lookup:
+      page, cursor = index.SearchClients(["."], count=2)
+      self.assertEqual(page, client_ids[:2])
+
+      page, cursor = index.SearchClients(["."], count=2, cursor=cursor)
+      self.assertEqual(page, client_ids[2:4])
+
+      page, cursor = index.SearchClients(["."], count=2, cursor=cursor)
+      self.assertEqual(page, client_ids[4:])
+      self.assertIsNone(cursor)
+
+      # All the pages were read ahead by the first search.
+      self.assertEqual(lookup.call_count, 1)
+
+  def testSearchClientsWithExpiredCursor(self):
+    index = client_index.ClientIndex()
+
+    clients = self._SetupClients(5)
+    for client_id, client in iteritems(clients):
+      data_store.REL_DB.WriteClientMetadata(client_id, fleetspeak_enabled=False)
+      index.AddClient(client)
+
+    client_ids = sorted(clients)
+    with utils.Stubber(client_index, "SEARCH_READ_AHEAD", 0):
+      page, cursor = index.SearchClients(["."], count=2)
+    self.assertEqual(page, client_ids[:2])
+
+    # The search is repeated starting at the offset of the cursor if the cursor
+    # isn't known anymore or was returned for another search.
+    page, _ = index.SearchClients(["."],
+                                  count=2,
+                                  cursor="0000000000000000:2")
+    self.assertEqual(page, client_ids[2:4])
+
+    page, _ = index.SearchClients(["windows"], count=2, cursor=cursor)
+    self.assertEqual(page, client_ids[2:4])
+
+    with self.assertRaises(ValueError):
+      index.SearchClients(["."], count=2, cursor="foo")
+
+  def testSearchClientsWithLabels(self):
+    index = client_index.ClientIndex()
+
+    clients = self._SetupClients(5)
+    for client_id, client in iteritems(clients):
+      data_store.REL_DB.WriteClientMetadata(client_id, fleetspeak_enabled=False)
+      index.AddClient(client)
+
+    client_ids = sorted(clients)
+    data_store.REL_DB.AddClientLabels(client_ids[1], u"david", [u"foo"])
+    data_store.REL_DB.AddClientLabels(client_ids[3], u"peter", [u"foo"])
+
+    page, cursor = index.SearchClients(["."],
+                                       count=10,
+                                       labels=[u"foo"],
+                                       label_owners=[u"david", u"peter"])
+    self.assertEqual(page, [client_ids[1], client_ids[3]])
+    self.assertIsNone(cursor)
+
+    page, _ = index.SearchClients(["."], labels=[u"foo"], label_owners=[u"x"])
+    self.assertEqual(page, [])
+
   def testAddTimestamp(self):
     index = client_index.ClientIndex()
 
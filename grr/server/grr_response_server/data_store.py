@@ -48,6 +48,7 @@ import time
 from builtins import zip  # pylint: disable=redefined-builtin
 from future.utils import iteritems
 from future.utils import iterkeys
+from future.utils import itervalues
 from future.utils import with_metaclass
 
 from grr_response_core import config
@@ -60,6 +61,7 @@ from grr_response_core.lib.rdfvalues import flows as rdf_flows
 from grr_response_server import access_control
 from grr_response_server import blob_store
 from grr_response_server import db
+from grr_response_server import notification_bus
 from grr_response_server import stats_values
 from grr_response_server.databases import registry_init
 from grr_response_server.rdfvalues import flow_runner as rdf_flow_runner
@@ -140,6 +142,45 @@ def GetDefaultToken(token):
   return token
 
 
+def LeaseQueueTasks(values, limit):
+  """Computes the leases for tasks read from a client queue.
+
+  Args:
+    values: A list of (predicate, serialized task, timestamp) tuples as stored
+      in the queue.
+    limit: The maximum number of tasks to lease.
+
+  Returns:
+    A tuple (tasks, to_set, to_delete). tasks is a list of the leased
+    GrrMessage() objects, to_set maps predicates to the serialized leased tasks
+    that have to be written back with the lease timestamp and to_delete is a
+    set of predicates of tasks whose ttl is exhausted.
+  """
+  tasks = []
+  to_delete = set()
+  to_set = {}
+  for predicate, task, timestamp in values:
+    task = rdf_flows.GrrMessage.FromSerializedString(task)
+    task.leased_until = timestamp
+    task.leased_by = utils.ProcessIdString()
+    # Decrement the ttl
+    task.task_ttl -= 1
+    if task.task_ttl <= 0:
+      # Remove the task if ttl is exhausted.
+      to_delete.add(predicate)
+      stats.STATS.IncrementCounter("grr_task_ttl_expired_count")
+    else:
+      if task.task_ttl != rdf_flows.GrrMessage.max_ttl - 1:
+        stats.STATS.IncrementCounter("grr_task_retransmission_count")
+
+      to_set.setdefault(predicate, []).append(task.SerializeToString())
+      tasks.append(task)
+      if len(tasks) >= limit:
+        break
+
+  return tasks, to_set, to_delete
+
+
 # This represents a record stored in a queue/collection. The attributes are:
 # queue_id:  Id of the queue this record is stored in.
 # timestamp: Timestamp this record was stored at.
@@ -170,6 +211,11 @@ class MutationPool(object):
     self.delete_attributes_requests = []
 
     self.new_notifications = []
+    # Maps collection ids to [count, min_timestamp] of items added in this
+    # pool.
+    self.collection_count_updates = {}
+    # Count markers of items added under a caller chosen key.
+    self.collection_count_records = []
 
   def DeleteSubjects(self, subjects):
     self.delete_subject_requests.extend(subjects)
@@ -194,6 +240,8 @@ class MutationPool(object):
 
   def Flush(self):
     """Flushing actually applies all the operations in the pool."""
+    self._FlushCollectionCounts()
+
     DB.DeleteSubjects(self.delete_subject_requests, sync=False)
 
     for req in self.delete_attributes_requests:
@@ -216,6 +264,8 @@ class MutationPool(object):
 
     for queue, notifications in self.new_notifications:
       DB.CreateNotifications(queue, notifications)
+    # Only wake up the workers once the notifications are in the data store.
+    notification_bus.Publish([queue for queue, _ in self.new_notifications])
     self.new_notifications = []
 
     self.delete_subject_requests = []
@@ -261,6 +311,95 @@ class MutationPool(object):
         timestamp=timestamp,
         replace=True)
 
+  def CollectionIncrementCount(self, collection_id, timestamp, count=1):
+    """Increments the item count of a collection when the pool is flushed.
+
+    Args:
+      collection_id: The collection the items were added to.
+      timestamp: The timestamp of the added items.
+      count: The number of added items.
+    """
+    update = self.collection_count_updates.get(collection_id)
+    if update is None:
+      self.collection_count_updates[collection_id] = [count, timestamp]
+    else:
+      update[0] += count
+      update[1] = min(update[1], timestamp)
+
+  def CollectionCountRecord(self, collection_id, timestamp, suffix):
+    """Counts an item that was added under a caller chosen key.
+
+    Adding an item under an existing key overwrites the item, so it must not
+    be counted again. Instead of a delta, such items get a marker named after
+    their key that is counted once no matter how often it is written.
+
+    Args:
+      collection_id: The collection the item was added to.
+      timestamp: The timestamp of the item.
+      suffix: The suffix of the item.
+    """
+    self.collection_count_records.append((collection_id, timestamp, suffix))
+
+  def _FlushCollectionCounts(self):
+    """Writes one count delta per collection updated in this pool."""
+    if not (self.collection_count_updates or self.collection_count_records):
+      return
+
+    count_requests = []
+    for collection_id, (count, min_timestamp) in iteritems(
+        self.collection_count_updates):
+      # Concurrent writers can't update a single counter without losing
+      # increments, so every flush writes a delta of its own. The delta is
+      # stored at the timestamp of the oldest counted item, which lets the
+      # index maintenance detect late writes.
+      attribute = "%s%016x.%06x" % (
+          DataStore.COLLECTION_COUNT_DELTA_PREFIX,
+          rdfvalue.RDFDatetime.Now().AsMicrosecondsSinceEpoch(),
+          random.randint(0, DataStore.COLLECTION_MAX_SUFFIX))
+      count_requests.append((collection_id, {
+          attribute: [count]
+      }, min_timestamp, True, None))
+
+    for collection_id, timestamp, suffix in self.collection_count_records:
+      # The marker is stored as new (1) until the next compaction sees it.
+      attribute = "%s%016x.%06x" % (DataStore.COLLECTION_COUNT_RECORD_PREFIX,
+                                    timestamp, suffix)
+      count_requests.append((collection_id, {
+          attribute: [1]
+      }, timestamp, True, None))
+
+    # The deltas are written before the items they count. This way every
+    # visible item has a visible delta.
+    self.set_requests = count_requests + self.set_requests
+    self.collection_count_updates = {}
+    self.collection_count_records = []
+
+  def CollectionSetCount(self,
+                         collection_id,
+                         count,
+                         compacted_deltas,
+                         seen_records=None):
+    """Folds count deltas into the stored count of a collection.
+
+    Args:
+      collection_id: The collection to update.
+      count: The new count, including the compacted deltas.
+      compacted_deltas: The attributes of the deltas included in count.
+      seen_records: (attribute, timestamp) tuples of the count markers that
+          are no longer new.
+    """
+    values = {DataStore.COLLECTION_COUNT_ATTRIBUTE: [count]}
+    for attribute, timestamp in seen_records or []:
+      values[attribute] = [(0, timestamp)]
+    self.MultiSet(
+        collection_id, values, timestamp=0, to_delete=compacted_deltas)
+
+  def CollectionDeleteIndexes(self, collection_id, indexes):
+    self.DeleteAttributes(collection_id, [
+        DataStore.COLLECTION_INDEX_ATTRIBUTE_PREFIX + "%08x" % index
+        for index in indexes
+    ])
+
   def CollectionAddStoredTypeIndex(self, collection_id, stored_type):
     self.Set(
         collection_id,
@@ -269,12 +408,35 @@ class MutationPool(object):
         timestamp=0)
 
   def CollectionDelete(self, collection_id):
+    # The count and the offset index are meaningless once the items are gone.
+    index_attributes = [
+        attribute for attribute, _, _ in DB.ResolvePrefix(
+            collection_id, DataStore.COLLECTION_INDEX_PREFIX)
+    ]
+    if index_attributes:
+      self.DeleteAttributes(collection_id, index_attributes)
+
     for subject, _, _ in DB.ScanAttribute(
         collection_id.Add("Results"), DataStore.COLLECTION_ATTRIBUTE):
       self.DeleteSubject(subject)
       if self.Size() > 50000:
         self.Flush()
 
+  def CollectionMultiReadItems(self, records):
+    """Reads items from many collections, see DataStore.
+
+    Mutations still pending in this pool are flushed first so items added
+    through the pool are found.
+
+    Args:
+      records: A list of Record objects.
+
+    Returns:
+      A dict mapping collection ids to lists of (value, timestamp) tuples.
+    """
+    self.Flush()
+    return DB.CollectionMultiReadItems(records)
+
   def QueueAddItem(self, queue_id, item, timestamp):
     result_subject, timestamp, _ = DataStore.CollectionMakeURN(
         queue_id, timestamp, suffix=None, subpath="Records")
@@ -409,55 +571,47 @@ class MutationPool(object):
       logging.warning("Datastore exception: %s", e)
       return []
 
+  def QueueMultiQueryAndOwn(self, queues, lease_seconds, limit_per_queue,
+                            timestamp):
+    """Leases tasks from a number of queues at once, see DataStore.
+
+    Args:
+      queues: A list of queues to query from.
+      lease_seconds: The tasks will be leased for this long.
+      limit_per_queue: Number of values to fetch from each queue.
+      timestamp: Range of times for consideration.
+    Returns:
+        A dict mapping each queue to a list of leased GrrMessage() objects.
+    """
+    return DB.QueueMultiQueryAndOwn(queues, lease_seconds, limit_per_queue,
+                                    timestamp)
+
   def _QueueQueryAndOwn(self,
                         subject,
                         lease_seconds=100,
                         limit=1,
                         timestamp=None):
     """Business logic helper for QueueQueryAndOwn()."""
-    tasks = []
-
-    lease = int(lease_seconds * 1e6)
-
     # Only grab attributes with timestamps in the past.
-    delete_attrs = set()
-    serialized_tasks_dict = {}
-    for predicate, task, timestamp in DB.ResolvePrefix(
+    values = DB.ResolvePrefix(
         subject,
         DataStore.QUEUE_TASK_PREDICATE_PREFIX,
-        timestamp=(0, timestamp or rdfvalue.RDFDatetime.Now())):
-      task = rdf_flows.GrrMessage.FromSerializedString(task)
-      task.leased_until = timestamp
-      task.leased_by = utils.ProcessIdString()
-      # Decrement the ttl
-      task.task_ttl -= 1
-      if task.task_ttl <= 0:
-        # Remove the task if ttl is exhausted.
-        delete_attrs.add(predicate)
-        stats.STATS.IncrementCounter("grr_task_ttl_expired_count")
-      else:
-        if task.task_ttl != rdf_flows.GrrMessage.max_ttl - 1:
-          stats.STATS.IncrementCounter("grr_task_retransmission_count")
+        timestamp=(0, timestamp or rdfvalue.RDFDatetime.Now()))
+    tasks, to_set, to_delete = LeaseQueueTasks(values, limit)
 
-        serialized_tasks_dict.setdefault(predicate,
-                                         []).append(task.SerializeToString())
-        tasks.append(task)
-        if len(tasks) >= limit:
-          break
-
-    if delete_attrs or serialized_tasks_dict:
+    if to_delete or to_set:
       # Update the timestamp on claimed tasks to be in the future and decrement
       # their TTLs, delete tasks with expired ttls.
       self.MultiSet(
           subject,
-          serialized_tasks_dict,
+          to_set,
           replace=True,
-          timestamp=int(time.time() * 1e6) + lease,
-          to_delete=delete_attrs)
+          timestamp=int(time.time() * 1e6) + int(lease_seconds * 1e6),
+          to_delete=to_delete)
 
-    if delete_attrs:
-      logging.info("TTL exceeded for %d messages on queue %s",
-                   len(delete_attrs), subject)
+    if to_delete:
+      logging.info("TTL exceeded for %d messages on queue %s", len(to_delete),
+                   subject)
     return tasks
 
   def StatsWriteMetrics(self, subject, metrics_metadata, timestamp=None):
@@ -1346,14 +1500,32 @@ class DataStore(with_metaclass(registry.MetaclassRegistry, object)):
   # The largest possible suffix - maximum value expressible by 6 hex digits.
   COLLECTION_MAX_SUFFIX = 0xffffff
 
+  # Number of collection items parsed together when scanning a collection.
+  COLLECTION_SCAN_BATCH_SIZE = 1000
+
   # The attribute (column) where we store value.
   COLLECTION_ATTRIBUTE = "aff4:sequential_value"
 
+  # The prefix of all index attributes of a collection.
+  COLLECTION_INDEX_PREFIX = "index:"
+
   # An attribute name of the form "index:sc_<i>" at timestamp <t> indicates that
   # the item with record number i was stored at timestamp t. The timestamp
   # suffix is stored as the value.
   COLLECTION_INDEX_ATTRIBUTE_PREFIX = "index:sc_"
 
+  # The number of items in a collection is the value of the count attribute
+  # plus the values of all the count delta attributes. Deltas are written by
+  # the mutation pools adding items and are stored at the timestamp of the
+  # oldest item they count.
+  COLLECTION_COUNT_ATTRIBUTE = "index:count"
+  COLLECTION_COUNT_DELTA_PREFIX = "index:count_delta_"
+
+  # Items added under a caller chosen key are counted by a marker named after
+  # the key instead, which makes adding the same item twice count once. The
+  # markers are never compacted, their value is 1 while they are new.
+  COLLECTION_COUNT_RECORD_PREFIX = "index:count_record_"
+
   # The attribute prefix to use when storing the index of stored types
   # for multi type collections.
   COLLECTION_VALUE_TYPE_PREFIX = "aff4:value_type_"
@@ -1395,16 +1567,27 @@ class DataStore(with_metaclass(registry.MetaclassRegistry, object)):
               after_timestamp,
               suffix=after_suffix or self.COLLECTION_MAX_SUFFIX)[0])
 
-    for subject, timestamp, serialized_rdf_value in self.ScanAttribute(
+    scan = self.ScanAttribute(
         collection_id.Add("Results"),
         self.COLLECTION_ATTRIBUTE,
         after_urn=after_urn,
-        max_records=limit):
-      item = rdf_type.FromSerializedString(serialized_rdf_value)
-      item.age = timestamp
-      # The urn is timestamp.suffix where suffix is 6 hex digits.
-      suffix = int(str(subject)[-6:], 16)
-      yield (item, timestamp, suffix)
+        max_records=limit)
+
+    # Structs can be parsed a page at a time which is a lot cheaper than
+    # parsing every item on its own.
+    parse_batch = getattr(rdf_type, "FromManySerializedStrings", None)
+    if parse_batch is None:
+
+      def parse_batch(values):  # pylint: disable=function-redefined
+        return [rdf_type.FromSerializedString(v) for v in values]
+
+    for batch in utils.Grouper(scan, self.COLLECTION_SCAN_BATCH_SIZE):
+      items = parse_batch([serialized for _, _, serialized in batch])
+      for item, (subject, timestamp, _) in zip(items, batch):
+        item.age = timestamp
+        # The urn is timestamp.suffix where suffix is 6 hex digits.
+        suffix = int(str(subject)[-6:], 16)
+        yield (item, timestamp, suffix)
 
   def CollectionReadIndex(self, collection_id):
     """Reads all index entries for the given collection.
@@ -1421,6 +1604,35 @@ class DataStore(with_metaclass(registry.MetaclassRegistry, object)):
       i = int(attr[len(self.COLLECTION_INDEX_ATTRIBUTE_PREFIX):], 16)
       yield (i, ts, int(value, 16))
 
+  def CollectionReadCount(self, collection_id):
+    """Reads the item count of the given collection.
+
+    Args:
+      collection_id: ID of the collection for which the count should be read.
+
+    Returns:
+      A tuple (count, deltas, records). count is the compacted count or None
+      if the count was never compacted. deltas is a list of (attribute, count,
+      min_timestamp) tuples for the count deltas not yet compacted. records
+      is a list of (attribute, is_new, timestamp) tuples for the count markers,
+      each of which counts one item.
+    """
+    count = None
+    deltas = []
+    records = []
+    for (attr, value, ts) in self.ResolvePrefix(
+        collection_id,
+        self.COLLECTION_COUNT_ATTRIBUTE,
+        timestamp=self.NEWEST_TIMESTAMP):
+      if attr == self.COLLECTION_COUNT_ATTRIBUTE:
+        count = int(value)
+      elif attr.startswith(self.COLLECTION_COUNT_DELTA_PREFIX):
+        deltas.append((attr, int(value), ts))
+      elif attr.startswith(self.COLLECTION_COUNT_RECORD_PREFIX):
+        records.append((attr, bool(int(value)), ts))
+
+    return count, deltas, records
+
   def CollectionReadStoredTypes(self, collection_id):
     for attribute, _, _ in self.ResolveRow(collection_id):
       if attribute.startswith(self.COLLECTION_VALUE_TYPE_PREFIX):
@@ -1435,6 +1647,39 @@ class DataStore(with_metaclass(registry.MetaclassRegistry, object)):
       _, value, timestamp = v[0]
       yield (value, timestamp)
 
+  def CollectionMultiReadItems(self, records):
+    """Reads the items of records that belong to any number of collections.
+
+    Args:
+      records: A list of Record objects, possibly from many different
+               collections.
+
+    Returns:
+      A dict mapping collection ids to lists of (value, timestamp) tuples in
+      the order of the given records. Records whose items do not exist are
+      skipped.
+    """
+    subjects = [
+        DataStore.CollectionMakeURN(record.queue_id, record.timestamp,
+                                    record.suffix, record.subpath)[0]
+        for record in records
+    ]
+
+    items = {}
+    for batch in utils.Grouper(subjects, self.COLLECTION_SCAN_BATCH_SIZE):
+      for subject, values in self.MultiResolvePrefix(
+          batch, DataStore.COLLECTION_ATTRIBUTE):
+        _, value, timestamp = values[0]
+        items[utils.SmartStr(subject)] = (value, timestamp)
+
+    result = {}
+    for record, subject in zip(records, subjects):
+      item = items.get(utils.SmartStr(subject))
+      if item is not None:
+        result.setdefault(record.queue_id, []).append(item)
+
+    return result
+
   def QueueQueryTasks(self, queue, limit=1):
     """Retrieves tasks from a queue without leasing them.
 
@@ -1458,6 +1703,62 @@ class DataStore(with_metaclass(registry.MetaclassRegistry, object)):
 
     return all_tasks[:limit]
 
+  def QueueMultiQueryAndOwn(self, queues, lease_seconds, limit_per_queue,
+                            timestamp):
+    """Leases tasks from a number of queues at once.
+
+    Queues that are currently locked by another process are skipped, they will
+    be picked up again on the next call. This implementation locks the queues
+    one by one but reads all of them with a single MultiResolvePrefix call.
+    Data stores that can lease tasks with fewer round trips should override it.
+
+    Args:
+      queues: A list of queues to query from.
+      lease_seconds: The tasks will be leased for this long.
+      limit_per_queue: Number of values to fetch from each queue.
+      timestamp: Range of times for consideration.
+    Returns:
+        A dict mapping each queue to a list of leased GrrMessage() objects.
+    """
+    result = {queue: [] for queue in queues}
+
+    locks = {}
+    try:
+      for queue in queues:
+        try:
+          lock = self.LockRetryWrapper(
+              queue, lease_time=lease_seconds, blocking=False)
+        except DBSubjectLockError:
+          continue
+        locks[lock.subject] = (queue, lock)
+
+      if not locks:
+        return result
+
+      lease_timestamp = int(time.time() * 1e6) + int(lease_seconds * 1e6)
+      for subject, values in self.MultiResolvePrefix(
+          list(locks),
+          DataStore.QUEUE_TASK_PREDICATE_PREFIX,
+          timestamp=(0, timestamp or rdfvalue.RDFDatetime.Now())):
+        queue, _ = locks[utils.SmartStr(subject)]
+        tasks, to_set, to_delete = LeaseQueueTasks(
+            sorted(values, key=lambda v: v[0]), limit_per_queue)
+        if to_set or to_delete:
+          self.MultiSet(
+              subject,
+              to_set,
+              replace=True,
+              timestamp=lease_timestamp,
+              to_delete=to_delete)
+        result[queue] = tasks
+    except Error as e:
+      logging.warning("Datastore exception: %s", e)
+    finally:
+      for _, lock in itervalues(locks):
+        lock.Release()
+
+    return result
+
   def StatsReadDataForProcesses(self,
                                 processes,
                                 metric_name,
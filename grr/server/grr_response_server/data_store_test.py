@@ -1328,6 +1328,8 @@ class DataStoreTestMixin(object):
         "BlobExists",
         "BlobsExist",
         "CheckRequestsForCompletion",
+        "CollectionMultiReadItems",
+        "CollectionReadCount",
         "CollectionReadIndex",
         "CollectionReadStoredTypes",
         "CollectionScanItems",
@@ -1351,6 +1353,7 @@ class DataStoreTestMixin(object):
         "MultiDestroyFlowStates",
         "MultiResolvePrefix",
         "MultiSet",
+        "QueueMultiQueryAndOwn",
         "ReadBlob",
         "ReadBlobs",
         "ReadCompletedRequests",
@@ -1372,6 +1375,11 @@ class DataStoreTestMixin(object):
         "CollectionAddIndex",
         "CollectionAddItem",
         "CollectionAddStoredTypeIndex",
+        "CollectionCountRecord",
+        "CollectionDeleteIndexes",
+        "CollectionIncrementCount",
+        "CollectionMultiReadItems",
+        "CollectionSetCount",
         "CreateNotifications",
         "DeleteAttributes",
         "DeleteSubject",
@@ -1486,6 +1494,41 @@ class DataStoreTestMixin(object):
     stored, _ = data_store.DB.Resolve(self.test_row, predicate)
     self.assertIsNone(stored)
 
+  def testQueueMultiQueryAndOwn(self):
+    queues = [
+        rdf_client.ClientURN("C.%016X" % i).Queue() for i in range(1, 5)
+    ]
+    tasks = []
+    for queue in queues[:3]:
+      for _ in range(3):
+        tasks.append(
+            rdf_flows.GrrMessage(
+                queue=queue, session_id="aff4:/Test", generate_task_id=True))
+    with data_store.DB.GetMutationPool() as pool:
+      pool.QueueScheduleTasks(tasks, rdfvalue.RDFDatetime.Now())
+
+    # Queues locked by someone else are skipped.
+    with data_store.DB.DBSubjectLock(queues[2], lease_time=100):
+      leased = data_store.DB.QueueMultiQueryAndOwn(
+          queues, 100, 2, rdfvalue.RDFDatetime.Now())
+
+    self.assertEqual(sorted(leased), sorted(queues))
+    for queue in queues[:2]:
+      self.assertEqual(len(leased[queue]), 2)
+      for task in leased[queue]:
+        self.assertEqual(task.queue, queue)
+        self.assertEqual(task.task_ttl, rdf_flows.GrrMessage.max_ttl - 1)
+    self.assertEqual(leased[queues[2]], [])
+    self.assertEqual(leased[queues[3]], [])
+
+    # Only the tasks that are not leased yet are returned.
+    leased = data_store.DB.QueueMultiQueryAndOwn(queues, 100, 10,
+                                                 rdfvalue.RDFDatetime.Now())
+    self.assertEqual(len(leased[queues[0]]), 1)
+    self.assertEqual(len(leased[queues[1]]), 1)
+    self.assertEqual(len(leased[queues[2]]), 3)
+    self.assertEqual(leased[queues[3]], [])
+
   def testQueueManager(self):
     session_id = rdfvalue.SessionID(flow_name="test")
     client_id = test_lib.TEST_CLIENT_ID
@@ -2164,10 +2207,15 @@ class DataStoreBenchmarks(benchmark_test_lib.MicroBenchmarks):
     self.AddResult("Seq. Coll. Add (size %d)" % self.RECORD_SIZE, elapsed_time,
                    self.RECORDS)
 
+    start_time = time.time()
+    indexed_collection.UpdateIndex()
+    elapsed_time = time.time() - start_time
+    self.AddResult("Seq. Coll. Update index", elapsed_time, 1)
+
     start_time = time.time()
     self.assertEqual(len(indexed_collection), self.RECORDS)
     elapsed_time = time.time() - start_time
-    self.AddResult("Seq. Coll. Read to end", elapsed_time, 1)
+    self.AddResult("Seq. Coll. Length", elapsed_time, 1)
 
     start_time = time.time()
     for _ in range(self.READ_COUNT):
@@ -343,6 +343,39 @@ class FakeDataStore(data_store.DataStore):
         result.append((attribute_name, data, ts))
     return result
 
+  @utils.Synchronized
+  def QueueMultiQueryAndOwn(self, queues, lease_seconds, limit_per_queue,
+                            timestamp):
+    """Leases tasks from many queues while holding the store lock once."""
+    now = time.time() * 1e6
+    lease_timestamp = int(now) + int(lease_seconds * 1e6)
+    end = timestamp or rdfvalue.RDFDatetime.Now()
+
+    result = {}
+    for queue in queues:
+      result[queue] = []
+
+      # No subject lock is needed since the store lock is held, but queues
+      # locked by someone else are left alone.
+      expires = self.transactions.get(utils.SmartStr(queue))
+      if expires and now < expires:
+        continue
+
+      values = self.ResolvePrefix(
+          queue, self.QUEUE_TASK_PREDICATE_PREFIX, timestamp=(0, end))
+      tasks, to_set, to_delete = data_store.LeaseQueueTasks(
+          values, limit_per_queue)
+      if to_set or to_delete:
+        self.MultiSet(
+            queue,
+            to_set,
+            replace=True,
+            timestamp=lease_timestamp,
+            to_delete=to_delete)
+      result[queue] = tasks
+
+    return result
+
   def Size(self):
     total_size = sys.getsizeof(self.subjects)
     for subject, record in iteritems(self.subjects):
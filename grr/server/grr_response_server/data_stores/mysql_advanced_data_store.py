@@ -390,6 +390,109 @@ class MySQLAdvancedDataStore(data_store.DataStore):
       if max_records and result_count >= max_records:
         return
 
+  def QueueMultiQueryAndOwn(self, queues, lease_seconds, limit_per_queue,
+                            timestamp):
+    """Leases tasks from many queues with a fixed number of queries.
+
+    For every batch of queues, one query locks all queues that are not locked
+    already, one query reads the tasks of the queues we got the lock for, one
+    transaction writes the leases and one query releases the locks.
+
+    Args:
+      queues: A list of queues to query from.
+      lease_seconds: The tasks will be leased for this long.
+      limit_per_queue: Number of values to fetch from each queue.
+      timestamp: Range of times for consideration.
+    Returns:
+        A dict mapping each queue to a list of leased GrrMessage() objects.
+    """
+    result = {queue: [] for queue in queues}
+    end = int(timestamp or rdfvalue.RDFDatetime.Now())
+
+    for batch in utils.Grouper(queues, self.max_values_per_query):
+      try:
+        result.update(
+            self._QueueMultiQueryAndOwn(batch, lease_seconds, limit_per_queue,
+                                        end))
+      except data_store.Error as e:
+        logging.warning("Datastore exception: %s", e)
+
+    return result
+
+  def _QueueMultiQueryAndOwn(self, queues, lease_seconds, limit_per_queue,
+                             end):
+    """Leases tasks from a batch of queues, see QueueMultiQueryAndOwn."""
+    subjects = {utils.SmartUnicode(queue): queue for queue in queues}
+    subject_hashes = ", ".join(["unhex(md5(%s))"] * len(subjects))
+
+    # Like MySQLDBSubjectLock, the owner and the expiration time identify our
+    # locks. Locks held by others are only replaced once they have expired.
+    lock_token = thread.get_ident()
+    now = int(time.time() * 1e6)
+    expires = now + int(lease_seconds * 1e6)
+    query = ("INSERT INTO locks (subject_hash, lock_owner, lock_expiration) "
+             "VALUES " + ", ".join(["(unhex(md5(%s)), %s, %s)"] * len(subjects))
+             + " ON DUPLICATE KEY UPDATE "
+             "lock_owner=IF(lock_expiration > %s, lock_owner, "
+             "VALUES(lock_owner)), "
+             "lock_expiration=IF(lock_expiration > %s, lock_expiration, "
+             "VALUES(lock_expiration))")
+    args = []
+    for subject in subjects:
+      args.extend([subject, lock_token, expires])
+    args.extend([now, now])
+    self.ExecuteQuery(query, args)
+
+    try:
+      query = ("SELECT subjects.subject, attributes.attribute, aff4.value, "
+               "aff4.timestamp FROM aff4 "
+               "JOIN locks ON aff4.subject_hash=locks.subject_hash "
+               "JOIN subjects ON aff4.subject_hash=subjects.hash "
+               "JOIN attributes ON aff4.attribute_hash=attributes.hash "
+               "WHERE aff4.subject_hash IN (" + subject_hashes + ") "
+               "AND locks.lock_owner=%s AND locks.lock_expiration=%s "
+               "AND attributes.attribute like %s "
+               "AND aff4.timestamp >= 0 AND aff4.timestamp <= %s "
+               "ORDER BY subjects.subject, attributes.attribute")
+      args = list(subjects) + [
+          lock_token, expires, self.QUEUE_TASK_PREDICATE_PREFIX + "%", end
+      ]
+      rows, _ = self.ExecuteQuery(query, args)
+
+      values = {}
+      for row in rows:
+        attribute = row["attribute"]
+        values.setdefault(utils.SmartUnicode(row["subject"]), []).append(
+            (attribute, self._Decode(attribute, row["value"]),
+             row["timestamp"]))
+
+      result = {}
+      transaction = []
+      to_replace = []
+      for subject, subject_values in iteritems(values):
+        tasks, to_set, to_delete = data_store.LeaseQueueTasks(
+            subject_values, limit_per_queue)
+        for attribute in to_delete:
+          transaction.append(self._BuildDelete(subject, attribute)[0])
+        for attribute, serialized_tasks in iteritems(to_set):
+          for serialized_task in serialized_tasks:
+            to_replace.append(
+                [subject, attribute,
+                 self._Encode(serialized_task), expires])
+        result[subjects[subject]] = tasks
+
+      if to_replace:
+        transaction.extend(self._BuildReplaces(to_replace))
+      if transaction:
+        self._ExecuteTransaction(transaction)
+
+      return result
+    finally:
+      query = ("UPDATE locks SET lock_expiration=0, lock_owner=0 "
+               "WHERE lock_expiration=%s AND lock_owner=%s "
+               "AND subject_hash IN (" + subject_hashes + ")")
+      self.ExecuteQuery(query, [expires, lock_token] + list(subjects))
+
   def MultiSet(self,
                subject,
                values,
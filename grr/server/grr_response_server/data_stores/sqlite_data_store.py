@@ -25,6 +25,7 @@ from past.builtins import long
 import sqlite3
 
 from grr_response_core import config
+from grr_response_core.lib import rdfvalue
 from grr_response_core.lib import utils
 from grr_response_server import aff4
 from grr_response_server import data_store
@@ -302,6 +303,28 @@ class SqliteConnection(object):
     self.Execute(query, args)
     self.dirty = True
 
+  @utils.Synchronized
+  def SetLockIfExpired(self, subject, expires, token, now):
+    """Locks a subject unless it holds a lock that has not expired yet.
+
+    Args:
+     subject: The subject.
+     expires: The expiration time of the new lock.
+     token: The token identifying the lock owner.
+     now: The current time, locks expiring before it are replaced.
+
+    Returns:
+     True if the lock was taken.
+    """
+    subject = utils.SmartStr(subject)
+    query = """INSERT OR REPLACE INTO lock
+               SELECT ?, ?, ? WHERE NOT EXISTS
+                 (SELECT 1 FROM lock WHERE subject = ? AND expires > ?)"""
+    args = (subject, expires, token, subject, now)
+    self.Execute(query, args)
+    self.dirty = True
+    return self.cursor.rowcount == 1
+
   @utils.Synchronized
   def RemoveLock(self, subject):
     """Removes the lock from a subject."""
@@ -900,6 +923,62 @@ class SqliteDataStore(data_store.DataStore):
 
     return results
 
+  def QueueMultiQueryAndOwn(self, queues, lease_seconds, limit_per_queue,
+                            timestamp):
+    """Leases tasks from many queues, committing once per queue.
+
+    The lock on a queue is taken, the tasks are leased and the lock is removed
+    again in a single transaction on the queue's database file. The lock never
+    becomes visible to others, it only makes the transaction hold the write
+    lock of the file from the start and lets queues locked through
+    DBSubjectLock be skipped.
+
+    Args:
+      queues: A list of queues to query from.
+      lease_seconds: The tasks will be leased for this long.
+      limit_per_queue: Number of values to fetch from each queue.
+      timestamp: Range of times for consideration.
+    Returns:
+        A dict mapping each queue to a list of leased GrrMessage() objects.
+    """
+    now = int(time.time() * 1e6)
+    lease = int(lease_seconds * 1e6)
+    end = int(timestamp or rdfvalue.RDFDatetime.Now())
+    lock_token = thread.get_ident()
+    prefix = self.QUEUE_TASK_PREDICATE_PREFIX
+
+    result = {}
+    for queue in queues:
+      result[queue] = []
+      try:
+        with self.cache.Get(queue) as sqlite_connection:
+          if not sqlite_connection.SetLockIfExpired(queue, now + lease,
+                                                    lock_token, now):
+            continue
+
+          values = [(attribute, self._Decode(attribute, value), ts)
+                    for attribute, value, ts in
+                    sqlite_connection.GetValuesFromPrefix(queue, prefix, 0, end)
+                   ]
+          tasks, to_set, to_delete = data_store.LeaseQueueTasks(
+              sorted(values, key=lambda v: v[0]), limit_per_queue)
+
+          for attribute in to_delete:
+            sqlite_connection.DeleteAttribute(queue, attribute)
+          for attribute, serialized_tasks in iteritems(to_set):
+            sqlite_connection.DeleteAttribute(queue, attribute)
+            for serialized_task in serialized_tasks:
+              sqlite_connection.SetAttribute(queue, attribute,
+                                             self._Encode(serialized_task),
+                                             now + lease)
+
+          sqlite_connection.RemoveLock(queue)
+          result[queue] = tasks
+      except sqlite3.Error as e:
+        logging.warning("Datastore exception: %s", e)
+
+    return result
+
   def DumpDatabase(self):
     for _, sql_connection in self.cache:
       sql_connection.PrettyPrint()
@@ -8,6 +8,7 @@ import threading
 from grr_response_core.lib import rdfvalue
 from grr_response_core.lib import utils
 from grr_response_server import db
+from grr_response_server import posting_lists
 from grr_response_server.databases import mem_blobs
 from grr_response_server.databases import mem_clients
 from grr_response_server.databases import mem_cronjobs
@@ -39,6 +40,7 @@ class InMemoryDB(mem_blobs.InMemoryDBBlobsMixin,
 
   def _Init(self):
     self.approvals_by_username = {}
+    self.audit_event_counts = {}
     self.clients = {}
     self.client_messages = {}
     self.client_message_leases = {}
@@ -47,7 +49,9 @@ class InMemoryDB(mem_blobs.InMemoryDBBlobsMixin,
     self.cronjobs = {}
     self.events = []
     self.foreman_rules = []
+    self.foreman_rules_version = 0
     self.keywords = {}
+    self.keyword_posting_lists = posting_lists.PostingLists()
     self.labels = {}
     self.message_handler_leases = {}
     self.message_handler_requests = {}
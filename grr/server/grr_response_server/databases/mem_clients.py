@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 """The in memory database methods for client handling."""
 
+import heapq
 
 from future.utils import iteritems
 from future.utils import iterkeys
@@ -179,6 +180,7 @@ class InMemoryDBClientMixin(object):
     for k in keywords:
       self.keywords.setdefault(k, {})
       self.keywords[k][client_id] = rdfvalue.RDFDatetime.Now()
+    self.keyword_posting_lists.Add(client_id, keywords)
 
   @utils.Synchronized
   def ListClientsForKeywords(self, keywords, start_time=None):
@@ -202,6 +204,43 @@ class InMemoryDBClientMixin(object):
     """Removes the association of a particular client to a keyword."""
     if keyword in self.keywords and client_id in self.keywords[keyword]:
       del self.keywords[keyword][client_id]
+      self.keyword_posting_lists.Remove(client_id, utils.SmartStr(keyword))
+
+  def _HasClientLabel(self, client_id, labels, owners):
+    for owner, owner_labels in iteritems(self.labels.get(client_id, {})):
+      if owners is not None and owner not in owners:
+        continue
+      if not labels.isdisjoint(owner_labels):
+        return True
+    return False
+
+  @utils.Synchronized
+  def ListClientsMatchingKeywords(self,
+                                  keywords,
+                                  start_time=None,
+                                  offset=0,
+                                  count=None,
+                                  labels=None,
+                                  label_owners=None):
+    """Lists the clients associated with all of the given keywords."""
+    keywords = set(utils.SmartStr(kw) for kw in keywords)
+    matches = self.keyword_posting_lists.Lookup(keywords)
+    client_ids = self.keyword_posting_lists.ItemIds(matches)
+
+    if start_time is not None:
+      client_ids = (
+          cid for cid in client_ids
+          if all(self.keywords[kw][cid] >= start_time for kw in keywords))
+
+    if labels is not None:
+      labels = set(utils.SmartUnicode(l) for l in labels)
+      client_ids = (
+          cid for cid in client_ids
+          if self._HasClientLabel(cid, labels, label_owners))
+
+    if count is None:
+      return sorted(client_ids)[offset:]
+    return heapq.nsmallest(offset + count, client_ids)[offset:]
 
   @utils.Synchronized
   def AddClientLabels(self, client_id, owner, labels):
@@ -1,8 +1,11 @@
 #!/usr/bin/env python
 """The in memory database methods for event handling."""
 
+from future.utils import iteritems
+
 from grr_response_core.lib import rdfvalue
 from grr_response_core.lib import utils
+from grr_response_server import db
 
 
 class InMemoryDBEventMixin(object):
@@ -12,8 +15,47 @@ class InMemoryDBEventMixin(object):
   def ReadAllAuditEvents(self):
     return sorted(self.events, key=lambda event: event.timestamp)
 
+  @utils.Synchronized
+  def ReadAuditEvents(self, timerange=None, actions=None, usernames=None):
+    """Reads audit events matching the given conditions."""
+    from_time, to_time = self._ParseTimeRange(timerange)
+
+    result = []
+    for event in self.events:
+      if not from_time <= event.timestamp <= to_time:
+        continue
+      if actions is not None and event.action not in actions:
+        continue
+      if usernames is not None and event.user not in usernames:
+        continue
+      result.append(event.Copy())
+
+    return sorted(result, key=lambda event: event.timestamp)
+
+  @utils.Synchronized
+  def ReadAuditEventCounts(self, timerange=None, actions=None):
+    """Reads the number of audit events written per user, action and flow."""
+    from_time, to_time = self._ParseTimeRange(timerange)
+
+    result = {}
+    for key, count in iteritems(self.audit_event_counts):
+      interval_start, username, action, flow_name = key
+      if not from_time <= interval_start <= to_time:
+        continue
+      if actions is not None and action not in actions:
+        continue
+
+      key = (username, action, flow_name)
+      result[key] = result.get(key, 0) + count
+
+    return result
+
   @utils.Synchronized
   def WriteAuditEvent(self, event):
     event = event.Copy()
     event.timestamp = rdfvalue.RDFDatetime.Now()
     self.events.append(event)
+
+    key = (event.timestamp.Floor(db.AUDIT_EVENT_COUNTS_INTERVAL), event.user,
+           int(event.action), event.flow_name)
+    self.audit_event_counts[key] = self.audit_event_counts.get(key, 0) + 1
@@ -1,21 +1,32 @@
 #!/usr/bin/env python
 """The in memory database methods for foreman rule handling."""
 
+import itertools
+
 from grr_response_core.lib import rdfvalue
 from grr_response_core.lib import utils
 
+# Versions are unique across all database instances, so that a version read
+# before the database was cleared is never mistaken for a current one.
+_FOREMAN_RULES_VERSIONS = itertools.count(1)
+
 
 class InMemoryDBForemanRulesMixin(object):
   """InMemoryDB mixin for foreman rules related functions."""
 
+  def _UpdateForemanRulesVersion(self):
+    self.foreman_rules_version = next(_FOREMAN_RULES_VERSIONS)
+
   @utils.Synchronized
   def WriteForemanRule(self, rule):
     self.RemoveForemanRule(rule.hunt_id)
     self.foreman_rules.append(rule)
+    self._UpdateForemanRulesVersion()
 
   @utils.Synchronized
   def RemoveForemanRule(self, hunt_id):
     self.foreman_rules = [r for r in self.foreman_rules if r.hunt_id != hunt_id]
+    self._UpdateForemanRulesVersion()
 
   @utils.Synchronized
   def ReadAllForemanRules(self):
@@ -27,3 +38,8 @@ class InMemoryDBForemanRulesMixin(object):
     self.foreman_rules = [
         r for r in self.foreman_rules if r.expiration_time >= now
     ]
+    self._UpdateForemanRulesVersion()
+
+  @utils.Synchronized
+  def ReadForemanRulesVersion(self):
+    return self.foreman_rules_version
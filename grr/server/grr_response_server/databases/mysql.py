@@ -6,7 +6,6 @@ See grr/server/db.py for interface.
 """
 import contextlib
 import logging
-import math
 import random
 import time
 import warnings
@@ -29,6 +28,18 @@ from grr_response_server.databases import mysql_users
 # Maximum retry count:
 _MAX_RETRY_COUNT = 5
 
+# Retries of failed transactions wait a random time of up to _RETRY_DELAY
+# seconds, doubled on every attempt but at most _MAX_RETRY_DELAY.
+_RETRY_DELAY = 0.5
+_MAX_RETRY_DELAY = 10.0
+
+# Pooled connections idle for longer than this many seconds are closed.
+_CONNECTION_MAX_IDLE_TIME = 300
+
+# Pooled connections idle for at least this many seconds are checked with a
+# ping before they are used, the server may have closed them in the meantime.
+_CONNECTION_VALIDATE_AFTER = 30
+
 # MySQL error codes:
 _RETRYABLE_ERRORS = {
     1205,  # ER_LOCK_WAIT_TIMEOUT
@@ -63,7 +74,15 @@ class MysqlDB(mysql_blobs.MySQLDBBlobsMixin,
   See server/db.py for a full description of the interface.
   """
 
-  def __init__(self, host=None, port=None, user=None, passwd=None, db=None):
+  def __init__(self,
+               host=None,
+               port=None,
+               user=None,
+               passwd=None,
+               db=None,
+               pool_min_size=0,
+               pool_max_size=10,
+               read_pool_max_size=0):
     """Creates a datastore implementation.
 
     Args:
@@ -72,6 +91,11 @@ class MysqlDB(mysql_blobs.MySQLDBBlobsMixin,
       user: Passed to MySQLdb.Connect when creating a new connection.
       passwd: Passed to MySQLdb.Connect when creating a new connection.
       db: Passed to MySQLdb.Connect when creating a new connection.
+      pool_min_size: The number of connections kept open while idle.
+      pool_max_size: The maximum number of simultaneous connections.
+      read_pool_max_size: If not 0, readonly transactions use a separate pool
+        of up to this many connections, so that bursts of reads can't keep
+        writers waiting for a connection.
     """
 
     # Turn all SQL warnings into exceptions.
@@ -88,7 +112,24 @@ class MysqlDB(mysql_blobs.MySQLDBBlobsMixin,
           use_unicode=True,
           charset="utf8")
 
-    self.pool = mysql_pool.Pool(Connect)
+    self.pool = mysql_pool.Pool(
+        Connect,
+        max_size=pool_max_size,
+        min_size=pool_min_size,
+        max_idle_time=_CONNECTION_MAX_IDLE_TIME,
+        validate_after=_CONNECTION_VALIDATE_AFTER,
+        name="mysql_pool")
+
+    self.read_pool = self.pool
+    if read_pool_max_size:
+      self.read_pool = mysql_pool.Pool(
+          Connect,
+          max_size=read_pool_max_size,
+          min_size=min(pool_min_size, read_pool_max_size),
+          max_idle_time=_CONNECTION_MAX_IDLE_TIME,
+          validate_after=_CONNECTION_VALIDATE_AFTER,
+          name="mysql_read_pool")
+
     with contextlib.closing(self.pool.get()) as connection:
       with contextlib.closing(connection.cursor()) as cursor:
         self._MariaDBCompatibility(cursor)
@@ -99,6 +140,8 @@ class MysqlDB(mysql_blobs.MySQLDBBlobsMixin,
 
   def Close(self):
     self.pool.close()
+    if self.read_pool is not self.pool:
+      self.read_pool.close()
 
   def _CheckForMariaDB(self, cursor):
     """Checks if we are running against MariaDB."""
@@ -163,11 +206,13 @@ class MysqlDB(mysql_blobs.MySQLDBBlobsMixin,
     Raises: Any exception raised by function.
     """
     start_query = "START TRANSACTION;"
+    pool = self.pool
     if readonly:
       start_query = "START TRANSACTION WITH CONSISTENT SNAPSHOT, READ ONLY;"
+      pool = self.read_pool
 
     for retry_count in range(_MAX_RETRY_COUNT):
-      with contextlib.closing(self.pool.get()) as connection:
+      with contextlib.closing(pool.get()) as connection:
         try:
           with contextlib.closing(connection.cursor()) as cursor:
             cursor.execute(start_query)
@@ -180,13 +225,14 @@ class MysqlDB(mysql_blobs.MySQLDBBlobsMixin,
         except MySQLdb.OperationalError as e:
           connection.rollback()
           # Re-raise if this was the last attempt.
-          if retry_count >= _MAX_RETRY_COUNT or not _IsRetryable(e):
+          if retry_count >= _MAX_RETRY_COUNT - 1 or not _IsRetryable(e):
             raise
-      # Simple delay, with jitter.
-      #
-      # TODO(user): Move to something more elegant, e.g. integrate a
-      # general retry or backoff library.
-      time.sleep(random.uniform(1.0, 2.0) * math.pow(1.5, retry_count))
+      # Exponential backoff with full jitter, so that transactions which
+      # deadlocked on each other don't retry in lockstep. The connection is
+      # back in the pool while we wait.
+      time.sleep(
+          random.uniform(0, min(_MAX_RETRY_DELAY,
+                                _RETRY_DELAY * 2**retry_count)))
     # Shouldn't happen, because we should have re-raised whatever caused the
     # last try to fail.
     raise Exception("Looped ended early - last exception swallowed.")  # pylint: disable=g-doc-exception
@@ -447,6 +447,54 @@ class MySQLDBClientMixin(object):
       result[keyword_mapping[kw]].append(mysql_utils.IntToClientID(cid))
     return result
 
+  @mysql_utils.WithTransaction(readonly=True)
+  def ListClientsMatchingKeywords(self,
+                                  keywords,
+                                  start_time=None,
+                                  offset=0,
+                                  count=None,
+                                  labels=None,
+                                  label_owners=None,
+                                  cursor=None):
+    """Lists the clients associated with all of the given keywords."""
+    keywords = set(utils.SmartUnicode(kw) for kw in keywords)
+    if ((labels is not None and not labels) or
+        (label_owners is not None and not label_owners)):
+      return []
+
+    # (client_id, keyword) is the primary key, so a client matches all
+    # keywords if it has as many rows as there are keywords. Sorting and
+    # paging happen in the database, only the requested page is returned.
+    query = ("SELECT client_id FROM client_keywords WHERE "
+             "keyword IN ({})".format(",".join(["%s"] * len(keywords))))
+    args = list(keywords)
+    if start_time:
+      query += " AND timestamp >= %s"
+      args.append(mysql_utils.RDFDatetimeToMysqlString(start_time))
+
+    if labels is not None:
+      labels = set(utils.SmartUnicode(l) for l in labels)
+      query += (" AND client_id IN (SELECT client_id FROM client_labels "
+                "WHERE label IN ({})".format(",".join(["%s"] * len(labels))))
+      args.extend(labels)
+      if label_owners is not None:
+        query += " AND owner IN ({})".format(
+            ",".join(["%s"] * len(label_owners)))
+        args.extend(label_owners)
+      query += ")"
+
+    query += " GROUP BY client_id HAVING COUNT(*) = %s ORDER BY client_id"
+    args.append(len(keywords))
+
+    if count is not None or offset:
+      # MySQL doesn't support OFFSET without LIMIT, the maximum value of an
+      # unsigned 64 bit int is the documented way to return all rows.
+      query += " LIMIT %s OFFSET %s"
+      args += [count if count is not None else 2**64 - 1, offset]
+
+    cursor.execute(query, args)
+    return [mysql_utils.IntToClientID(cid) for cid, in cursor.fetchall()]
+
   @mysql_utils.WithTransaction()
   def AddClientLabels(self, client_id, owner, labels, cursor=None):
     """Attaches a list of user labels to a client."""
@@ -99,6 +99,24 @@ CREATE TABLE IF NOT EXISTS audit_event(
     timestamp DATETIME(6),
     details MEDIUMBLOB
 )""", """
+ALTER TABLE audit_event ADD COLUMN IF NOT EXISTS action INT UNSIGNED
+""", """
+CREATE INDEX IF NOT EXISTS audit_event_timestamp_idx ON audit_event(timestamp)
+""", """
+CREATE INDEX IF NOT EXISTS audit_event_action_idx
+ON audit_event(action, timestamp)
+""", """
+CREATE INDEX IF NOT EXISTS audit_event_username_idx
+ON audit_event(username, timestamp)
+""", """
+CREATE TABLE IF NOT EXISTS audit_event_counts(
+    interval_start DATETIME(6),
+    username VARCHAR(128),
+    action INT UNSIGNED,
+    flow_name VARCHAR(128),
+    count BIGINT UNSIGNED,
+    PRIMARY KEY (interval_start, username, action, flow_name)
+)""", """
 CREATE TABLE IF NOT EXISTS message_handler_requests(
     handlername VARCHAR(128),
     timestamp DATETIME(6),
@@ -114,6 +132,11 @@ CREATE TABLE IF NOT EXISTS foreman_rules(
     rule MEDIUMBLOB,
     PRIMARY KEY (hunt_id)
 )""", """
+CREATE TABLE IF NOT EXISTS foreman_rules_version(
+    id TINYINT UNSIGNED,
+    version BIGINT UNSIGNED,
+    PRIMARY KEY (id)
+)""", """
 CREATE TABLE IF NOT EXISTS cron_jobs(
     job_id VARCHAR(128),
     job MEDIUMBLOB,
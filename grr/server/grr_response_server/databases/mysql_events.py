@@ -4,9 +4,38 @@
 from grr_response_core.lib import rdfvalue
 from grr_response_core.lib.rdfvalues import client as rdf_client
 from grr_response_core.lib.rdfvalues import events as rdf_events
+from grr_response_server import db
 from grr_response_server.databases import mysql_utils
 
 
+def _AuditEventFromRow(username, urn, client_id, timestamp, details):
+  event = rdf_events.AuditEvent.FromSerializedString(details)
+  event.user = username
+  if urn:
+    event.urn = rdfvalue.RDFURN(urn)
+  if client_id is not None:
+    event.client = rdf_client.ClientURN(mysql_utils.IntToClientID(client_id))
+  event.timestamp = mysql_utils.MysqlToRDFDatetime(timestamp)
+  return event
+
+
+def _TimeRangeConditions(column, timerange, args):
+  """Returns SQL conditions restricting a column to a timerange."""
+  conditions = []
+  if timerange:
+    time_from, time_to = timerange  # pylint: disable=unpacking-non-sequence
+
+    if time_from is not None:
+      conditions.append("%s >= %%s" % column)
+      args.append(mysql_utils.RDFDatetimeToMysqlString(time_from))
+
+    if time_to is not None:
+      conditions.append("%s <= %%s" % column)
+      args.append(mysql_utils.RDFDatetimeToMysqlString(time_to))
+
+  return conditions
+
+
 class MySQLDBEventMixin(object):
   """MySQLDB mixin for event handling."""
 
@@ -19,19 +48,60 @@ class MySQLDBEventMixin(object):
         ORDER BY timestamp
     """)
 
-    result = []
-    for username, urn, client_id, timestamp, details in cursor.fetchall():
-      event = rdf_events.AuditEvent.FromSerializedString(details)
-      event.user = username
-      if urn:
-        event.urn = rdfvalue.RDFURN(urn)
-      if client_id is not None:
-        event.client = rdf_client.ClientURN(
-            mysql_utils.IntToClientID(client_id))
-      event.timestamp = mysql_utils.MysqlToRDFDatetime(timestamp)
-      result.append(event)
+    return [_AuditEventFromRow(*row) for row in cursor.fetchall()]
+
+  @mysql_utils.WithTransaction(readonly=True)
+  def ReadAuditEvents(self,
+                      timerange=None,
+                      actions=None,
+                      usernames=None,
+                      cursor=None):
+    """Reads audit events matching the given conditions."""
+    if actions is not None and not actions:
+      return []
+    if usernames is not None and not usernames:
+      return []
+
+    args = []
+    conditions = _TimeRangeConditions("timestamp", timerange, args)
+    if actions is not None:
+      conditions.append("action IN (%s)" % ", ".join(["%s"] * len(actions)))
+      args.extend(actions)
+    if usernames is not None:
+      conditions.append(
+          "username IN (%s)" % ", ".join(["%s"] * len(usernames)))
+      args.extend(usernames)
+
+    query = ("SELECT username, urn, client_id, timestamp, details "
+             "FROM audit_event ")
+    if conditions:
+      query += "WHERE " + " AND ".join(conditions) + " "
+    query += "ORDER BY timestamp"
 
-    return result
+    cursor.execute(query, args)
+    return [_AuditEventFromRow(*row) for row in cursor.fetchall()]
+
+  @mysql_utils.WithTransaction(readonly=True)
+  def ReadAuditEventCounts(self, timerange=None, actions=None, cursor=None):
+    """Reads the number of audit events written per user, action and flow."""
+    if actions is not None and not actions:
+      return {}
+
+    args = []
+    conditions = _TimeRangeConditions("interval_start", timerange, args)
+    if actions is not None:
+      conditions.append("action IN (%s)" % ", ".join(["%s"] * len(actions)))
+      args.extend(actions)
+
+    query = ("SELECT username, action, flow_name, SUM(count) "
+             "FROM audit_event_counts ")
+    if conditions:
+      query += "WHERE " + " AND ".join(conditions) + " "
+    query += "GROUP BY username, action, flow_name"
+
+    cursor.execute(query, args)
+    return {(username, action, flow_name): int(count)
+            for username, action, flow_name, count in cursor.fetchall()}
 
   @mysql_utils.WithTransaction()
   def WriteAuditEvent(self, event, cursor=None):
@@ -57,18 +127,32 @@ class MySQLDBEventMixin(object):
       client_id = None
 
     if event.HasField("timestamp"):
-      timestamp = mysql_utils.RDFDatetimeToMysqlString(event.timestamp)
+      timestamp = event.timestamp
       event.timestamp = None
     else:
-      timestamp = mysql_utils.RDFDatetimeToMysqlString(
-          rdfvalue.RDFDatetime.Now())
+      timestamp = rdfvalue.RDFDatetime.Now()
 
     details = event.SerializeToString()
 
     query = """
-    INSERT INTO audit_event (username, urn, client_id, timestamp, details)
-    VALUES (%s, %s, %s, %s, %s)
+    INSERT INTO audit_event
+      (username, urn, client_id, timestamp, action, details)
+    VALUES (%s, %s, %s, %s, %s, %s)
+    """
+    values = (username, urn, client_id,
+              mysql_utils.RDFDatetimeToMysqlString(timestamp),
+              int(event.action), details)
+
+    cursor.execute(query, values)
+
+    interval_start = timestamp.Floor(db.AUDIT_EVENT_COUNTS_INTERVAL)
+    query = """
+    INSERT INTO audit_event_counts
+      (interval_start, username, action, flow_name, count)
+    VALUES (%s, %s, %s, %s, 1)
+    ON DUPLICATE KEY UPDATE count = count + 1
     """
-    values = (username, urn, client_id, timestamp, details)
+    values = (mysql_utils.RDFDatetimeToMysqlString(interval_start), username or
+              "", int(event.action), event.flow_name or "")
 
     cursor.execute(query, values)
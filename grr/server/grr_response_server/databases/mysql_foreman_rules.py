@@ -9,6 +9,12 @@ from grr_response_server.databases import mysql_utils
 class MySQLDBForemanRulesMixin(object):
   """MySQLDB mixin for foreman rules related functions."""
 
+  def _UpdateForemanRulesVersion(self, cursor):
+    # Every change of the rules bumps the version in the same transaction, so
+    # readers can tell that the rules changed from a single row.
+    cursor.execute("INSERT INTO foreman_rules_version (id, version) "
+                   "VALUES (0, 1) ON DUPLICATE KEY UPDATE version=version+1")
+
   @mysql_utils.WithTransaction()
   def WriteForemanRule(self, rule, cursor=None):
     query = ("INSERT INTO foreman_rules "
@@ -18,11 +24,14 @@ class MySQLDBForemanRulesMixin(object):
     exp_str = mysql_utils.RDFDatetimeToMysqlString(rule.expiration_time),
     rule_str = rule.SerializeToString()
     cursor.execute(query, [rule.hunt_id, exp_str, rule_str, exp_str, rule_str])
+    self._UpdateForemanRulesVersion(cursor)
 
   @mysql_utils.WithTransaction()
   def RemoveForemanRule(self, hunt_id, cursor=None):
     query = "DELETE FROM foreman_rules WHERE hunt_id=%s"
     cursor.execute(query, [hunt_id])
+    if cursor.rowcount:
+      self._UpdateForemanRulesVersion(cursor)
 
   @mysql_utils.WithTransaction(readonly=True)
   def ReadAllForemanRules(self, cursor=None):
@@ -37,3 +46,11 @@ class MySQLDBForemanRulesMixin(object):
     now = rdfvalue.RDFDatetime.Now()
     cursor.execute("DELETE FROM foreman_rules WHERE expiration_time < %s",
                    [mysql_utils.RDFDatetimeToMysqlString(now)])
+    if cursor.rowcount:
+      self._UpdateForemanRulesVersion(cursor)
+
+  @mysql_utils.WithTransaction(readonly=True)
+  def ReadForemanRulesVersion(self, cursor=None):
+    cursor.execute("SELECT version FROM foreman_rules_version WHERE id=0")
+    row = cursor.fetchone()
+    return int(row[0]) if row else 0
@@ -1,11 +1,15 @@
 #!/usr/bin/env python
 """Connection pooling for MySQLdb connections."""
 
+import collections
 import logging
 import threading
+import time
 
 import MySQLdb
 
+from grr_response_core.lib import stats
+
 
 class Error(Exception):
   pass
@@ -15,19 +19,35 @@ class PoolAlreadyClosedError(Error):
   pass
 
 
+# An idle connection and the time it was returned to the pool.
+_IdleConnection = collections.namedtuple("_IdleConnection", ["con", "since"])
+
+
 class Pool(object):
   """A Pool of database connections.
 
-  A simple pool, with a maximum number of simultaneous connections. Primary goal
-  is to do the right thing when using MySQLdb in obvious ways (our use case),
-  but we also try to stay loosely within the PEP-249 standard.
+  A pool with a maximum number of simultaneous connections. Primary goal is to
+  do the right thing when using MySQLdb in obvious ways (our use case), but we
+  also try to stay loosely within the PEP-249 standard.
 
   Intends to be thread safe in that multiple connections can be requested and
   used by multiple threads without synchronization, but operations on each
   connection (and its associated cursors) are assumed to be serial.
+
+  Threads waiting for a connection are served in the order they started
+  waiting. Connections idle for longer than max_idle_time are closed, unless
+  this would leave fewer than min_size connections open. A connection that has
+  been idle for validate_after seconds is pinged before it is handed out, so
+  that connections closed by the server while idle are not returned.
   """
 
-  def __init__(self, connect_func, max_size=10):
+  def __init__(self,
+               connect_func,
+               max_size=10,
+               min_size=0,
+               max_idle_time=None,
+               validate_after=None,
+               name=None):
     """Creates a ConnectionPool.
 
     Args:
@@ -35,12 +55,106 @@ class Pool(object):
        database, i.e. a MySQLdb.Connection. Should raise or block if the
        database is unavailable.
      max_size: The maximum number of simultaneous connections.
+     min_size: The number of connections that are kept open even when idle
+       for longer than max_idle_time.
+     max_idle_time: If set, connections idle for longer than this many seconds
+       are closed.
+     validate_after: If set, connections idle for at least this many seconds
+       are pinged when taken from the pool.
+     name: If set, the wait time and the number of connections in use and idle
+       are exported through stats.STATS using this name as a prefix.
     """
     self.connect_func = connect_func
-    self.limiter = threading.BoundedSemaphore(max_size)
-    self.idle_conns = []  # Atomic access only!!
+    self.max_size = max_size
+    self.min_size = min_size
+    self.max_idle_time = max_idle_time
+    self.validate_after = validate_after
+    self.name = name
+
+    self.lock = threading.Lock()
+    self.in_use = 0
+    # Events of the threads waiting for a connection, in the order they started
+    # waiting.
+    self.waiters = collections.deque()
+    # _IdleConnection tuples, the most recently used connection last.
+    self.idle_conns = []
     self.closed = False
 
+    if self.name:
+      stats.STATS.RegisterEventMetric(
+          self.name + "_wait_time",
+          bins=[0.001 * 2**x for x in range(15)])  # 1ms to ~16 seconds
+      stats.STATS.RegisterGaugeMetric(self.name + "_in_use", int)
+      stats.STATS.SetGaugeCallback(self.name + "_in_use",
+                                   lambda: self.in_use)
+      stats.STATS.RegisterGaugeMetric(self.name + "_idle", int)
+      stats.STATS.SetGaugeCallback(self.name + "_idle",
+                                   lambda: len(self.idle_conns))
+
+  def _Acquire(self, blocking):
+    """Reserves capacity for a connection, returns False if there is none."""
+    with self.lock:
+      if self.in_use < self.max_size and not self.waiters:
+        self.in_use += 1
+        return True
+
+      if not blocking:
+        return False
+
+      waiter = threading.Event()
+      self.waiters.append(waiter)
+
+    # The releasing thread hands its capacity over to us, in_use stays the same.
+    waiter.wait()
+    return True
+
+  def _Release(self):
+    """Releases capacity reserved by _Acquire."""
+    with self.lock:
+      if self.waiters:
+        self.waiters.popleft().set()
+      else:
+        self.in_use -= 1
+
+  def _ReapIdle(self, now):
+    """Closes connections that have been idle for too long."""
+    if self.max_idle_time is None:
+      return
+
+    to_close = []
+    with self.lock:
+      while (self.idle_conns and
+             now - self.idle_conns[0].since > self.max_idle_time and
+             self.in_use + len(self.idle_conns) > self.min_size):
+        to_close.append(self.idle_conns.pop(0).con)
+
+    for con in to_close:
+      _CloseQuietly(con)
+
+  def _PopIdle(self):
+    """Returns a usable idle connection or None if there is none."""
+    now = time.time()
+    while True:
+      with self.lock:
+        if not self.idle_conns:
+          return None
+        idle = self.idle_conns.pop()
+
+      if (self.validate_after is None or
+          now - idle.since < self.validate_after):
+        return idle.con
+
+      try:
+        idle.con.ping()
+        return idle.con
+      except Exception:  # pylint: disable=broad-except
+        logging.info("Closing pooled connection that failed validation.")
+        _CloseQuietly(idle.con)
+
+  def _PutIdle(self, con):
+    with self.lock:
+      self.idle_conns.append(_IdleConnection(con, time.time()))
+
   def get(self, blocking=True):
     """Gets a connection.
 
@@ -58,29 +172,41 @@ class Pool(object):
     if self.closed:
       raise PoolAlreadyClosedError("Connection pool is already closed.")
 
-    # NOTE: Once we acquire capacity from the semaphore, it is essential that we
-    # return it eventually. On success, this responsibility is delegated to
+    # NOTE: Once we acquire capacity, it is essential that we return it
+    # eventually. On success, this responsibility is delegated to
     # _ConnectionProxy.
-    if not self.limiter.acquire(blocking=blocking):
+    start_time = time.time()
+    self._ReapIdle(start_time)
+    if not self._Acquire(blocking):
       return None
-    c = None
-    # pop is atomic, but if we did a check first, it would not be atomic with
-    # the pop.
+    if self.name:
+      stats.STATS.RecordEvent(self.name + "_wait_time",
+                              time.time() - start_time)
+
     try:
-      c = self.idle_conns.pop()
-    except IndexError:
-      # Create a connection, release the pool allocation if it fails.
-      try:
+      c = self._PopIdle()
+      if c is None:
+        # Create a connection, release the pool allocation if it fails.
         c = self.connect_func()
-      except Exception:
-        self.limiter.release()
-        raise
+    except Exception:
+      self._Release()
+      raise
     return _ConnectionProxy(self, c)
 
   def close(self):
     self.closed = True
-    for conn in self.idle_conns:
-      conn.close()
+    with self.lock:
+      idle_conns = self.idle_conns
+      self.idle_conns = []
+    for idle in idle_conns:
+      idle.con.close()
+
+
+def _CloseQuietly(con):
+  try:
+    con.close()
+  except Exception:  # pylint: disable=broad-except
+    pass
 
 
 class _ConnectionProxy(object):
@@ -107,8 +233,7 @@ class _ConnectionProxy(object):
         if not self.errored and not self.pool.closed:
           try:
             self.con.rollback()
-            # append is atomic.
-            self.pool.idle_conns.append(self.con)
+            self.pool._PutIdle(self.con)  # pylint: disable=protected-access
           except Exception:
             # rollback raised and the connection didn't make it into the idle
             # list, so close it.
@@ -118,7 +243,7 @@ class _ConnectionProxy(object):
           self.con.close()
       finally:
         self.con = None
-        self.pool.limiter.release()
+        self.pool._Release()  # pylint: disable=protected-access
 
   def commit(self):
     self.con.commit()
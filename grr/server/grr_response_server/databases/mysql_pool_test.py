@@ -1,6 +1,9 @@
 #!/usr/bin/env python
 """Tests for mysql_pool.py."""
 
+import threading
+import time
+
 from builtins import range  # pylint: disable=redefined-builtin
 import mock
 import MySQLdb
@@ -9,6 +12,50 @@ import unittest
 from grr_response_server.databases import mysql_pool
 
 
+class FakeConnection(object):
+  """A stand-in for a MySQLdb connection."""
+
+  def __init__(self):
+    self.closed = False
+    self.pings = 0
+    self.ping_error = None
+
+  def ping(self):
+    self.pings += 1
+    if self.ping_error:
+      raise self.ping_error
+
+  def rollback(self):
+    pass
+
+  def commit(self):
+    pass
+
+  def cursor(self):
+    return mock.MagicMock()
+
+  def close(self):
+    self.closed = True
+
+
+class FakeConnectionFactory(object):
+  """Creates FakeConnections and keeps track of them."""
+
+  def __init__(self):
+    self.connections = []
+    self.lock = threading.Lock()
+
+  def __call__(self):
+    con = FakeConnection()
+    with self.lock:
+      self.connections.append(con)
+    return con
+
+  @property
+  def open_connections(self):
+    return [con for con in self.connections if not con.closed]
+
+
 class TestPool(unittest.TestCase):
 
   def testMaxSize(self):
@@ -134,5 +181,99 @@ class TestPool(unittest.TestCase):
         self.assertEqual(1, len(pool.idle_conns))
 
 
+  def testIdleConnectionsAreClosed(self):
+    factory = FakeConnectionFactory()
+    pool = mysql_pool.Pool(factory, max_size=5, min_size=2, max_idle_time=60)
+
+    with mock.patch.object(mysql_pool.time, 'time', return_value=1000):
+      proxies = [pool.get() for _ in range(3)]
+      for p in proxies:
+        p.close()
+    self.assertEqual(3, len(factory.open_connections))
+
+    with mock.patch.object(mysql_pool.time, 'time', return_value=1030):
+      pool.get().close()
+    self.assertEqual(3, len(factory.open_connections))
+
+    with mock.patch.object(mysql_pool.time, 'time', return_value=1061):
+      con = pool.get()
+    # The connection used at 1030 is still fresh, the others are closed as long
+    # as min_size connections stay open.
+    self.assertEqual(2, len(factory.open_connections))
+    self.assertEqual(1, len(pool.idle_conns))
+    con.close()
+
+  def testConnectionsAreValidatedAfterBeingIdle(self):
+    factory = FakeConnectionFactory()
+    pool = mysql_pool.Pool(factory, max_size=5, validate_after=10)
+
+    with mock.patch.object(mysql_pool.time, 'time', return_value=1000):
+      pool.get().close()
+      pool.get().close()
+    con = factory.connections[0]
+    self.assertEqual(0, con.pings)
+
+    with mock.patch.object(mysql_pool.time, 'time', return_value=1010):
+      pool.get().close()
+    self.assertEqual(1, con.pings)
+
+    con.ping_error = MySQLdb.OperationalError('MySQL server has gone away')
+    with mock.patch.object(mysql_pool.time, 'time', return_value=1020):
+      proxy = pool.get()
+    self.assertTrue(con.closed)
+    self.assertIsNot(con, proxy.con)
+    self.assertEqual(2, len(factory.connections))
+    proxy.close()
+
+  def testWaitingThreadsAreServedInOrder(self):
+    pool = mysql_pool.Pool(FakeConnectionFactory(), max_size=1)
+    con = pool.get()
+
+    served = []
+
+    def Waiter(i):
+      waiting_con = pool.get()
+      served.append(i)
+      waiting_con.close()
+
+    threads = []
+    for i in range(3):
+      thread = threading.Thread(target=Waiter, args=(i,))
+      thread.start()
+      threads.append(thread)
+      # Wait for every thread to queue up before starting the next one.
+      while len(pool.waiters) <= i:
+        time.sleep(0.01)
+
+    # Requests without blocking don't jump the queue.
+    self.assertIsNone(pool.get(blocking=False))
+
+    con.close()
+    for thread in threads:
+      thread.join()
+    self.assertEqual([0, 1, 2], served)
+    self.assertEqual(0, pool.in_use)
+
+  def testLoad(self):
+    factory = FakeConnectionFactory()
+    pool = mysql_pool.Pool(factory, max_size=4, validate_after=0)
+
+    def Worker():
+      for _ in range(100):
+        con = pool.get()
+        con.cursor().execute('SELECT 1')
+        con.close()
+
+    threads = [threading.Thread(target=Worker) for _ in range(20)]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+
+    self.assertLessEqual(len(factory.connections), 4)
+    self.assertEqual(0, pool.in_use)
+    self.assertEqual(len(factory.connections), len(pool.idle_conns))
+
+
 if __name__ == '__main__':
   unittest.main()
@@ -2,11 +2,13 @@
 """A registry of all available Databases."""
 
 from grr_response_server.databases import mem
+from grr_response_server.databases import sqlite
 
 # All available databases go into this registry.
 REGISTRY = {}
 
 REGISTRY["InMemoryDB"] = mem.InMemoryDB
+REGISTRY["SqliteDB"] = sqlite.SqliteDB
 
 # TODO(amoser): Import MySQL relational here.
 
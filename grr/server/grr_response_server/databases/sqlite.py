@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+"""SQLite implementation of the GRR relational database abstraction.
+
+See grr/server/db.py for interface.
+
+The database is kept in a single file in WAL mode, so readers never block the
+(single) writer. Every thread uses its own connection.
+"""
+import logging
+import math
+import os
+import random
+import sqlite3
+import threading
+import time
+
+from builtins import range  # pylint: disable=redefined-builtin
+
+from grr_response_core import config
+from grr_response_server import db as db_module
+from grr_response_server.databases import sqlite_blobs
+from grr_response_server.databases import sqlite_clients
+from grr_response_server.databases import sqlite_cronjobs
+from grr_response_server.databases import sqlite_ddl
+from grr_response_server.databases import sqlite_events
+from grr_response_server.databases import sqlite_flows
+from grr_response_server.databases import sqlite_foreman_rules
+from grr_response_server.databases import sqlite_paths
+from grr_response_server.databases import sqlite_users
+
+# Maximum retry count:
+_MAX_RETRY_COUNT = 5
+
+# Seconds a connection waits for a lock held by another connection before
+# raising "database is locked".
+_BUSY_TIMEOUT = 30.0
+
+
+def _IsRetryable(error):
+  """Returns whether error is likely to be retryable."""
+  if not isinstance(error, sqlite3.OperationalError):
+    return False
+  message = str(error)
+  return "locked" in message or "busy" in message
+
+
+# pyformat: disable
+class SqliteDB(sqlite_blobs.SqliteDBBlobsMixin,
+               sqlite_clients.SqliteDBClientMixin,
+               sqlite_cronjobs.SqliteDBCronJobMixin,
+               sqlite_events.SqliteDBEventMixin,
+               sqlite_flows.SqliteDBFlowMixin,
+               sqlite_foreman_rules.SqliteDBForemanRulesMixin,
+               sqlite_paths.SqliteDBPathMixin,
+               sqlite_users.SqliteDBUsersMixin,
+               db_module.Database):
+  """Implements db_module.Database using SQLite.
+  # pyformat: enable
+
+  See server/db.py for a full description of the interface.
+  """
+
+  def __init__(self, path=None):
+    """Creates a datastore implementation.
+
+    Args:
+      path: A path to the SQLite database file. Defaults to the `SqliteDB.path`
+        config option.
+    """
+    if path is None:
+      path = config.CONFIG["SqliteDB.path"]
+
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+      os.makedirs(directory)
+
+    self.path = path
+    self._local = threading.local()
+    self._connections = []
+    self._connections_lock = threading.Lock()
+
+    connection = self._GetConnection()
+    cursor = connection.cursor()
+    try:
+      cursor.execute("PRAGMA journal_mode = WAL")
+      self._InitializeSchema(cursor)
+    finally:
+      cursor.close()
+
+    self.handler_thread = None
+    self.handler_stop = True
+
+  def Close(self):
+    self.UnregisterMessageHandler()
+    with self._connections_lock:
+      for connection in self._connections:
+        connection.close()
+      self._connections = []
+    self._local = threading.local()
+
+  def _GetConnection(self):
+    """Returns the connection of the calling thread, creating it if needed."""
+    connection = getattr(self._local, "connection", None)
+    if connection is not None:
+      return connection
+
+    # Transactions are started and finished explicitly in _RunInTransaction.
+    connection = sqlite3.connect(
+        self.path,
+        timeout=_BUSY_TIMEOUT,
+        isolation_level=None,
+        check_same_thread=False)
+    connection.execute("PRAGMA foreign_keys = ON")
+    connection.execute("PRAGMA synchronous = NORMAL")
+
+    with self._connections_lock:
+      self._connections.append(connection)
+    self._local.connection = connection
+    return connection
+
+  def _InitializeSchema(self, cursor):
+    """Initialize the database's schema."""
+    for command in sqlite_ddl.SCHEMA_SETUP:
+      try:
+        cursor.execute(command)
+      except Exception:
+        logging.error("Failed to execute DDL: %s", command)
+        raise
+
+  def _RunInTransaction(self, function, readonly=False):
+    """Runs function within a transaction.
+
+    Begins a transaction on the connection of the calling thread and passes a
+    cursor to function.
+
+    If function finishes without raising, the transaction is committed.
+
+    If function raises, the transaction will be rolled back, if the database
+    was locked by another connection, the operation may be repeated.
+
+    Args:
+      function: A function to be run, must accept a single sqlite3.Cursor
+        parameter.
+      readonly: Indicates that only a readonly (snapshot) transaction is
+        required. Write transactions take the database write lock upfront so
+        that they can't deadlock with each other.
+
+    Returns:
+      The value returned by the last call to function.
+
+    Raises: Any exception raised by function.
+    """
+    start_query = "BEGIN" if readonly else "BEGIN IMMEDIATE"
+
+    connection = self._GetConnection()
+    for retry_count in range(_MAX_RETRY_COUNT):
+      cursor = connection.cursor()
+      try:
+        cursor.execute(start_query)
+        ret = function(cursor)
+        cursor.execute("COMMIT")
+        return ret
+      except sqlite3.OperationalError as e:
+        self._Rollback(cursor)
+        # Re-raise if this was the last attempt.
+        if retry_count + 1 >= _MAX_RETRY_COUNT or not _IsRetryable(e):
+          raise
+      except:
+        self._Rollback(cursor)
+        raise
+      finally:
+        cursor.close()
+
+      # Simple delay, with jitter.
+      time.sleep(random.uniform(0.1, 0.2) * math.pow(1.5, retry_count))
+    # Shouldn't happen, because we should have re-raised whatever caused the
+    # last try to fail.
+    raise Exception("Looped ended early - last exception swallowed.")  # pylint: disable=g-doc-exception
+
+  def _Rollback(self, cursor):
+    # The transaction might have never been started (e.g. if BEGIN failed).
+    try:
+      cursor.execute("ROLLBACK")
+    except sqlite3.OperationalError:
+      pass
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+"""Benchmarks the SQLite relational database against the in-memory one."""
+
+import os
+import shutil
+import tempfile
+import time
+
+
+from builtins import range  # pylint: disable=redefined-builtin
+import pytest
+
+from grr_response_core.lib import flags
+from grr_response_core.lib import rdfvalue
+from grr_response_core.lib.rdfvalues import flows as rdf_flows
+from grr_response_server.databases import mem
+from grr_response_server.databases import sqlite
+from grr_response_server.rdfvalues import objects as rdf_objects
+from grr.test_lib import benchmark_test_lib
+from grr.test_lib import test_lib
+
+
+@pytest.mark.large
+class SqliteDBBenchmark(benchmark_test_lib.MicroBenchmarks):
+  """Compares common database operations of SqliteDB and InMemoryDB."""
+
+  units = "ms"
+
+  CLIENT_ID = "C.0000000000000001"
+  DIRECTORIES = 50
+  FILES_PER_DIRECTORY = 40
+  MESSAGES = 2000
+
+  def setUp(self):
+    super(SqliteDBBenchmark, self).setUp()
+    self.temp_dir = tempfile.mkdtemp()
+
+  def tearDown(self):
+    super(SqliteDBBenchmark, self).tearDown()
+    shutil.rmtree(self.temp_dir)
+
+  def _Databases(self):
+    sqlite_db = sqlite.SqliteDB(os.path.join(self.temp_dir, "grr.sqlite"))
+    try:
+      for name, db in [("InMemoryDB", mem.InMemoryDB()), ("SqliteDB",
+                                                           sqlite_db)]:
+        db.WriteClientMetadata(self.CLIENT_ID, fleetspeak_enabled=False)
+        yield name, db
+    finally:
+      sqlite_db.Close()
+
+  def _Time(self, name, callback, repetitions=1):
+    start = time.time()
+    for _ in range(repetitions):
+      callback()
+    self.AddResult(name, (time.time() - start) / repetitions, repetitions)
+
+  def _PathInfos(self):
+    path_infos = []
+    for i in range(self.DIRECTORIES):
+      for j in range(self.FILES_PER_DIRECTORY):
+        path_info = rdf_objects.PathInfo.OS(
+            components=(u"usr", u"dir%d" % i, u"file%d" % j))
+        path_info.stat_entry.st_size = j
+        path_infos.append(path_info)
+    return path_infos
+
+  def testPaths(self):
+    """Writing a file tree and listing it."""
+    path_infos = self._PathInfos()
+    components_list = [tuple(p.components) for p in path_infos]
+    path_type = rdf_objects.PathInfo.PathType.OS
+
+    for name, db in self._Databases():
+      self._Time(
+          "%s MultiWritePathInfos" % name,
+          lambda: db.MultiWritePathInfos({self.CLIENT_ID: path_infos}))  # pylint: disable=cell-var-from-loop
+      self._Time(
+          "%s ReadPathInfos" % name,
+          lambda: db.ReadPathInfos(self.CLIENT_ID, path_type, components_list))  # pylint: disable=cell-var-from-loop
+      self._Time(
+          "%s ListChildPathInfos" % name,
+          lambda: db.ListChildPathInfos(self.CLIENT_ID, path_type,  # pylint: disable=cell-var-from-loop
+                                        (u"usr", u"dir0")),
+          repetitions=self.DIRECTORIES)
+      self._Time(
+          "%s ListDescendentPathInfos" % name,
+          lambda: db.ListDescendentPathInfos(self.CLIENT_ID, path_type, ()))  # pylint: disable=cell-var-from-loop
+
+  def testClientMessages(self):
+    """Writing and leasing client messages."""
+    lease_time = rdfvalue.Duration("10m")
+
+    for name, db in self._Databases():
+      messages = [
+          rdf_flows.GrrMessage(queue=self.CLIENT_ID, generate_task_id=True)
+          for _ in range(self.MESSAGES)
+      ]
+      self._Time("%s WriteClientMessages" % name,
+                 lambda: db.WriteClientMessages(messages))  # pylint: disable=cell-var-from-loop
+      self._Time(
+          "%s LeaseClientMessages" % name,
+          lambda: db.LeaseClientMessages(  # pylint: disable=cell-var-from-loop
+              self.CLIENT_ID, lease_time=lease_time, limit=100),
+          repetitions=self.MESSAGES // 100)
+      self._Time("%s DeleteClientMessages" % name,
+                 lambda: db.DeleteClientMessages(messages))  # pylint: disable=cell-var-from-loop
+
+
+def main(argv):
+  test_lib.main(argv)
+
+
+if __name__ == "__main__":
+  flags.StartMain(main)
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+"""The SQLite database methods for blobs handling."""
+
+import sqlite3
+
+from future.utils import iteritems
+from future.utils import iterkeys
+
+from grr_response_core.lib import utils
+from grr_response_server import db
+from grr_response_server.databases import sqlite_utils
+from grr_response_server.rdfvalues import objects as rdf_objects
+
+
+class SqliteDBBlobsMixin(object):
+  """SqliteDB mixin for blobs related functions."""
+
+  @sqlite_utils.WithTransaction()
+  def WriteClientPathBlobReferences(self,
+                                    references_by_client_path_id,
+                                    cursor=None):
+    """Writes blob references for given client path ids."""
+    args = []
+    for client_path_id, blob_refs in iteritems(references_by_client_path_id):
+      path_idx = (client_path_id.client_id, int(client_path_id.path_type),
+                  sqlite_utils.Blob(client_path_id.path_id.AsBytes()))
+      for blob_ref in blob_refs:
+        args.append(path_idx + (blob_ref.offset, blob_ref.size,
+                                sqlite_utils.Blob(blob_ref.blob_id.AsBytes())))
+
+    try:
+      cursor.executemany(
+          "INSERT OR REPLACE INTO client_path_blob_references "
+          "(client_id, path_type, path_id, offset, size, blob_id) "
+          "VALUES (?, ?, ?, ?, ?, ?)", args)
+    except sqlite3.IntegrityError as e:
+      raise db.AtLeastOneUnknownPathError(
+          list(iterkeys(references_by_client_path_id)), cause=e)
+
+  @sqlite_utils.WithTransaction(readonly=True)
+  def ReadClientPathBlobReferences(self, client_path_ids, cursor=None):
+    """Reads blob references of given client path ids."""
+    result = {}
+    for cpid in client_path_ids:
+      cursor.execute(
+          "SELECT offset, size, blob_id FROM client_path_blob_references "
+          "WHERE client_id = ? AND path_type = ? AND path_id = ? "
+          "ORDER BY offset", [
+              cpid.client_id,
+              int(cpid.path_type),
+              sqlite_utils.Blob(cpid.path_id.AsBytes())
+          ])
+      result[cpid] = [
+          rdf_objects.BlobReference(
+              offset=offset,
+              size=size,
+              blob_id=rdf_objects.BlobID.FromBytes(bytes(blob_id)))
+          for offset, size, blob_id in cursor.fetchall()
+      ]
+
+    return result
+
+  @sqlite_utils.WithTransaction()
+  def WriteBlobs(self, blob_id_data_pairs, cursor=None):
+    """Writes given blobs."""
+    cursor.executemany(
+        "INSERT OR REPLACE INTO blobs (blob_id, blob_data) VALUES (?, ?)",
+        [(sqlite_utils.Blob(blob_id.AsBytes()), sqlite_utils.Blob(blob_data))
+         for blob_id, blob_data in iteritems(blob_id_data_pairs)])
+
+  @sqlite_utils.WithTransaction(readonly=True)
+  def ReadBlobs(self, blob_ids, cursor=None):
+    """Reads given blobs."""
+    result = {blob_id: None for blob_id in blob_ids}
+    for batch in utils.Grouper(blob_ids, sqlite_utils.MAX_QUERY_VARIABLES):
+      cursor.execute(
+          "SELECT blob_id, blob_data FROM blobs WHERE blob_id IN (%s)" %
+          sqlite_utils.Placeholders(len(batch)),
+          [sqlite_utils.Blob(blob_id.AsBytes()) for blob_id in batch])
+      for blob_id, blob_data in cursor.fetchall():
+        result[rdf_objects.BlobID.FromBytes(bytes(blob_id))] = bytes(blob_data)
+
+    return result
+
+  @sqlite_utils.WithTransaction(readonly=True)
+  def CheckBlobsExist(self, blob_ids, cursor=None):
+    """Checks if given blobs exit."""
+    result = {blob_id: False for blob_id in blob_ids}
+    for batch in utils.Grouper(blob_ids, sqlite_utils.MAX_QUERY_VARIABLES):
+      cursor.execute(
+          "SELECT blob_id FROM blobs WHERE blob_id IN (%s)" %
+          sqlite_utils.Placeholders(len(batch)),
+          [sqlite_utils.Blob(blob_id.AsBytes()) for blob_id in batch])
+      for blob_id, in cursor.fetchall():
+        result[rdf_objects.BlobID.FromBytes(bytes(blob_id))] = True
+
+    return result
@@ -0,0 +1,591 @@
+#!/usr/bin/env python
+"""The SQLite database methods for client handling."""
+
+import sqlite3
+
+
+from future.utils import iterkeys
+from future.utils import itervalues
+
+from grr_response_core.lib import rdfvalue
+from grr_response_core.lib import utils
+from grr_response_core.lib.rdfvalues import client as rdf_client
+from grr_response_core.lib.rdfvalues import client_network as rdf_client_network
+from grr_response_server import db
+from grr_response_server.databases import sqlite_utils
+from grr_response_server.rdfvalues import objects as rdf_objects
+
+
+class SqliteDBClientMixin(object):
+  """SqliteDB mixin for client related functions."""
+
+  @sqlite_utils.WithTransaction()
+  def WriteClientMetadata(self,
+                          client_id,
+                          certificate=None,
+                          fleetspeak_enabled=None,
+                          first_seen=None,
+                          last_ping=None,
+                          last_clock=None,
+                          last_ip=None,
+                          last_foreman=None,
+                          cursor=None):
+    """Write metadata about the client."""
+
+    columns = []
+    values = []
+    if certificate:
+      columns.append("certificate")
+      values.append(sqlite_utils.Blob(certificate.SerializeToString()))
+    if fleetspeak_enabled is not None:
+      columns.append("fleetspeak_enabled")
+      values.append(int(fleetspeak_enabled))
+    if first_seen:
+      columns.append("first_seen")
+      values.append(sqlite_utils.RDFDatetimeToInt(first_seen))
+    if last_ping:
+      columns.append("last_ping")
+      values.append(sqlite_utils.RDFDatetimeToInt(last_ping))
+    if last_clock:
+      columns.append("last_clock")
+      values.append(sqlite_utils.RDFDatetimeToInt(last_clock))
+    if last_ip:
+      columns.append("last_ip")
+      values.append(sqlite_utils.Blob(last_ip.SerializeToString()))
+    if last_foreman:
+      columns.append("last_foreman")
+      values.append(sqlite_utils.RDFDatetimeToInt(last_foreman))
+
+    cursor.execute("INSERT OR IGNORE INTO clients (client_id) VALUES (?)",
+                   [client_id])
+    if not columns:
+      return
+
+    query = "UPDATE clients SET {updates} WHERE client_id = ?".format(
+        updates=", ".join("{} = ?".format(col) for col in columns))
+    cursor.execute(query, values + [client_id])
+
+  @sqlite_utils.WithTransaction(readonly=True)
+  def MultiReadClientMetadata(self, client_ids, cursor=None):
+    """Reads ClientMetadata records for a list of clients."""
+    ret = {}
+    for batch in utils.Grouper(client_ids, sqlite_utils.MAX_QUERY_VARIABLES):
+      query = ("SELECT client_id, fleetspeak_enabled, certificate, last_ping, "
+               "last_clock, last_ip, last_foreman, first_seen, "
+               "last_crash_timestamp, last_startup_timestamp FROM "
+               "clients WHERE client_id IN ({})").format(
+                   sqlite_utils.Placeholders(len(batch)))
+      cursor.execute(query, batch)
+      for row in cursor.fetchall():
+        cid, fs, crt, ping, clk, ip, foreman, first, lct, lst = row
+        ret[cid] = rdf_objects.ClientMetadata(
+            certificate=sqlite_utils.BlobToBytes(crt),
+            fleetspeak_enabled=fs,
+            first_seen=sqlite_utils.IntToRDFDatetime(first),
+            ping=sqlite_utils.IntToRDFDatetime(ping),
+            clock=sqlite_utils.IntToRDFDatetime(clk),
+            ip=sqlite_utils.BlobToRDFProto(rdf_client_network.NetworkAddress,
+                                           ip),
+            last_foreman_time=sqlite_utils.IntToRDFDatetime(foreman),
+            startup_info_timestamp=sqlite_utils.IntToRDFDatetime(lst),
+            last_crash_timestamp=sqlite_utils.IntToRDFDatetime(lct))
+    return ret
+
+  @sqlite_utils.WithTransaction()
+  def WriteClientSnapshot(self, client, cursor=None):
+    """Write new client snapshot."""
+    startup_info = client.startup_info
+    client.startup_info = None
+
+    insert_history_query = (
+        "INSERT OR REPLACE INTO client_snapshot_history(client_id, timestamp, "
+        "client_snapshot) VALUES (?, ?, ?)")
+    insert_startup_query = (
+        "INSERT OR REPLACE INTO client_startup_history(client_id, timestamp, "
+        "startup_info) VALUES(?, ?, ?)")
+    update_query = ("UPDATE clients SET last_client_timestamp=?, "
+                    "last_startup_timestamp=? "
+                    "WHERE client_id = ?")
+
+    client_id = client.client_id
+    timestamp = sqlite_utils.RDFDatetimeToInt(rdfvalue.RDFDatetime.Now())
+
+    try:
+      cursor.execute(
+          insert_history_query,
+          (client_id, timestamp, sqlite_utils.Blob(client.SerializeToString())))
+      cursor.execute(
+          insert_startup_query,
+          (client_id, timestamp,
+           sqlite_utils.Blob(startup_info.SerializeToString())))
+      cursor.execute(update_query, (timestamp, timestamp, client_id))
+    except sqlite3.IntegrityError as e:
+      raise db.UnknownClientError(client_id, cause=e)
+    finally:
+      client.startup_info = startup_info
+
+  @sqlite_utils.WithTransaction(readonly=True)
+  def MultiReadClientSnapshot(self, client_ids, cursor=None):
+    """Reads the latest client snapshots for a list of clients."""
+    ret = {cid: None for cid in client_ids}
+    for batch in utils.Grouper(client_ids, sqlite_utils.MAX_QUERY_VARIABLES):
+      query = (
+          "SELECT h.client_id, h.client_snapshot, h.timestamp, s.startup_info "
+          "FROM clients as c, client_snapshot_history as h, "
+          "client_startup_history as s "
+          "WHERE h.client_id = c.client_id "
+          "AND s.client_id = c.client_id "
+          "AND h.timestamp = c.last_client_timestamp "
+          "AND s.timestamp = c.last_startup_timestamp "
+          "AND c.client_id IN ({})").format(
+              sqlite_utils.Placeholders(len(batch)))
+      cursor.execute(query, batch)
+      for cid, snapshot, timestamp, startup_info in cursor.fetchall():
+        client_obj = sqlite_utils.BlobToRDFProto(rdf_objects.ClientSnapshot,
+                                                 snapshot)
+        client_obj.startup_info = sqlite_utils.BlobToRDFProto(
+            rdf_client.StartupInfo, startup_info)
+        client_obj.timestamp = sqlite_utils.IntToRDFDatetime(timestamp)
+        ret[cid] = client_obj
+    return ret
+
+  @sqlite_utils.WithTransaction(readonly=True)
+  def ReadClientSnapshotHistory(self, client_id, timerange=None, cursor=None):
+    """Reads the full history for a particular client."""
+
+    query = ("SELECT sn.client_snapshot, st.startup_info, sn.timestamp FROM "
+             "client_snapshot_history AS sn, "
+             "client_startup_history AS st WHERE "
+             "sn.client_id = st.client_id AND "
+             "sn.timestamp = st.timestamp AND "
+             "sn.client_id=? ")
+
+    args = [client_id]
+    if timerange:
+      time_from, time_to = timerange  # pylint: disable=unpacking-non-sequence
+
+      if time_from is not None:
+        query += "AND sn.timestamp >= ? "
+        args.append(sqlite_utils.RDFDatetimeToInt(time_from))
+
+      if time_to is not None:
+        query += "AND sn.timestamp <= ? "
+        args.append(sqlite_utils.RDFDatetimeToInt(time_to))
+
+    query += "ORDER BY sn.timestamp DESC"
+
+    ret = []
+    cursor.execute(query, args)
+    for snapshot, startup_info, timestamp in cursor.fetchall():
+      client = sqlite_utils.BlobToRDFProto(rdf_objects.ClientSnapshot, snapshot)
+      client.startup_info = sqlite_utils.BlobToRDFProto(rdf_client.StartupInfo,
+                                                        startup_info)
+      client.timestamp = sqlite_utils.IntToRDFDatetime(timestamp)
+
+      ret.append(client)
+    return ret
+
+  @sqlite_utils.WithTransaction()
+  def WriteClientSnapshotHistory(self, clients, cursor=None):
+    """Writes the full history for a particular client."""
+    client_id = clients[0].client_id
+    latest_timestamp = None
+
+    for client in clients:
+
+      startup_info = client.startup_info
+      client.startup_info = None
+      timestamp = sqlite_utils.RDFDatetimeToInt(client.timestamp)
+      latest_timestamp = max(latest_timestamp, timestamp)
+
+      try:
+        cursor.execute(
+            "INSERT INTO client_snapshot_history "
+            "(client_id, timestamp, client_snapshot) "
+            "VALUES (?, ?, ?)",
+            [client_id, timestamp,
+             sqlite_utils.Blob(client.SerializeToString())])
+        cursor.execute(
+            "INSERT INTO client_startup_history "
+            "(client_id, timestamp, startup_info) "
+            "VALUES (?, ?, ?)",
+            [client_id, timestamp,
+             sqlite_utils.Blob(startup_info.SerializeToString())])
+      except sqlite3.IntegrityError as e:
+        raise db.UnknownClientError(client_id, cause=e)
+      finally:
+        client.startup_info = startup_info
+
+    cursor.execute(
+        "UPDATE clients SET last_client_timestamp=? "
+        "WHERE client_id = ? AND "
+        "(last_client_timestamp IS NULL OR last_client_timestamp < ?)",
+        [latest_timestamp, client_id, latest_timestamp])
+    cursor.execute(
+        "UPDATE clients SET last_startup_timestamp=? "
+        "WHERE client_id = ? AND "
+        "(last_startup_timestamp IS NULL OR last_startup_timestamp < ?)",
+        [latest_timestamp, client_id, latest_timestamp])
+
+  @sqlite_utils.WithTransaction()
+  def WriteClientStartupInfo(self, client_id, startup_info, cursor=None):
+    """Writes a new client startup record."""
+    now = sqlite_utils.RDFDatetimeToInt(rdfvalue.RDFDatetime.Now())
+
+    try:
+      cursor.execute(
+          "INSERT OR REPLACE INTO client_startup_history "
+          "(client_id, timestamp, startup_info) "
+          "VALUES (?, ?, ?)",
+          [client_id, now,
+           sqlite_utils.Blob(startup_info.SerializeToString())])
+      cursor.execute(
+          "UPDATE clients SET last_startup_timestamp = ? WHERE client_id=?",
+          [now, client_id])
+    except sqlite3.IntegrityError as e:
+      raise db.UnknownClientError(client_id, cause=e)
+
+  @sqlite_utils.WithTransaction(readonly=True)
+  def ReadClientStartupInfo(self, client_id, cursor=None):
+    """Reads the latest client startup record for a single client."""
+    query = (
+        "SELECT startup_info, timestamp FROM clients, client_startup_history "
+        "WHERE clients.last_startup_timestamp=client_startup_history.timestamp "
+        "AND clients.client_id=client_startup_history.client_id "
+        "AND clients.client_id=?")
+    cursor.execute(query, [client_id])
+    row = cursor.fetchone()
+    if row is None:
+      return None
+
+    startup_info, timestamp = row
+    res = sqlite_utils.BlobToRDFProto(rdf_client.StartupInfo, startup_info)
+    res.timestamp = sqlite_utils.IntToRDFDatetime(timestamp)
+    return res
+
+  @sqlite_utils.WithTransaction(readonly=True)
+  def ReadClientStartupInfoHistory(self, client_id, timerange=None,
+                                   cursor=None):
+    """Reads the full startup history for a particular client."""
+
+    query = ("SELECT startup_info, timestamp FROM client_startup_history "
+             "WHERE client_id=? ")
+    args = [client_id]
+
+    if timerange:
+      time_from, time_to = timerange  # pylint: disable=unpacking-non-sequence
+
+      if time_from is not None:
+        query += "AND timestamp >= ? "
+        args.append(sqlite_utils.RDFDatetimeToInt(time_from))
+
+      if time_to is not None:
+        query += "AND timestamp <= ? "
+        args.append(sqlite_utils.RDFDatetimeToInt(time_to))
+
+    query += "ORDER BY timestamp DESC "
+
+    ret = []
+    cursor.execute(query, args)
+
+    for startup_info, timestamp in cursor.fetchall():
+      si = sqlite_utils.BlobToRDFProto(rdf_client.StartupInfo, startup_info)
+      si.timestamp = sqlite_utils.IntToRDFDatetime(timestamp)
+      ret.append(si)
+    return ret
+
+  def _ResponseToClientsFullInfo(self, response):
+    """Creates a ClientFullInfo object from a database response."""
+    c_full_info = None
+    prev_cid = None
+    for row in response:
+      (cid, fs, crt, ping, clk, ip, foreman, first, last_client_ts,
+       last_crash_ts, last_startup_ts, client_obj, client_startup_obj,
+       last_startup_obj, label_owner, label_name) = row
+
+      if cid != prev_cid:
+        if c_full_info:
+          yield prev_cid, c_full_info
+
+        metadata = rdf_objects.ClientMetadata(
+            certificate=sqlite_utils.BlobToBytes(crt),
+            fleetspeak_enabled=fs,
+            first_seen=sqlite_utils.IntToRDFDatetime(first),
+            ping=sqlite_utils.IntToRDFDatetime(ping),
+            clock=sqlite_utils.IntToRDFDatetime(clk),
+            ip=sqlite_utils.BlobToRDFProto(rdf_client_network.NetworkAddress,
+                                           ip),
+            last_foreman_time=sqlite_utils.IntToRDFDatetime(foreman),
+            startup_info_timestamp=sqlite_utils.IntToRDFDatetime(
+                last_startup_ts),
+            last_crash_timestamp=sqlite_utils.IntToRDFDatetime(last_crash_ts))
+
+        if client_obj is not None:
+          l_snapshot = sqlite_utils.BlobToRDFProto(rdf_objects.ClientSnapshot,
+                                                   client_obj)
+          l_snapshot.timestamp = sqlite_utils.IntToRDFDatetime(last_client_ts)
+          l_snapshot.startup_info = sqlite_utils.BlobToRDFProto(
+              rdf_client.StartupInfo, client_startup_obj)
+          l_snapshot.startup_info.timestamp = l_snapshot.timestamp
+        else:
+          l_snapshot = rdf_objects.ClientSnapshot(client_id=cid)
+
+        if last_startup_obj is not None:
+          startup_info = sqlite_utils.BlobToRDFProto(rdf_client.StartupInfo,
+                                                     last_startup_obj)
+          startup_info.timestamp = sqlite_utils.IntToRDFDatetime(
+              last_startup_ts)
+        else:
+          startup_info = None
+
+        prev_cid = cid
+        c_full_info = rdf_objects.ClientFullInfo(
+            metadata=metadata,
+            labels=[],
+            last_snapshot=l_snapshot,
+            last_startup_info=startup_info)
+
+      if label_owner and label_name:
+        c_full_info.labels.append(
+            rdf_objects.ClientLabel(name=label_name, owner=label_owner))
+
+    if c_full_info:
+      yield prev_cid, c_full_info
+
+  @sqlite_utils.WithTransaction(readonly=True)
+  def MultiReadClientFullInfo(self, client_ids, min_last_ping=None,
+                              cursor=None):
+    """Reads full client information for a list of clients."""
+    ret = {}
+    for batch in utils.Grouper(client_ids, sqlite_utils.MAX_QUERY_VARIABLES):
+      query = (
+          "SELECT "
+          "c.client_id, c.fleetspeak_enabled, c.certificate, c.last_ping, "
+          "c.last_clock, c.last_ip, c.last_foreman, c.first_seen, "
+          "c.last_client_timestamp, c.last_crash_timestamp, "
+          "c.last_startup_timestamp, h.client_snapshot, s.startup_info, "
+          "s_last.startup_info, l.owner, l.label "
+          "FROM clients as c "
+          "LEFT JOIN client_snapshot_history as h ON ( "
+          "c.client_id = h.client_id "
+          "AND h.timestamp = c.last_client_timestamp) "
+          "LEFT JOIN client_startup_history as s ON ( "
+          "c.client_id = s.client_id "
+          "AND s.timestamp = c.last_client_timestamp) "
+          "LEFT JOIN client_startup_history as s_last ON ( "
+          "c.client_id = s_last.client_id "
+          "AND s_last.timestamp = c.last_startup_timestamp) "
+          "LEFT JOIN client_labels AS l ON (c.client_id = l.client_id) ")
+
+      query += "WHERE c.client_id IN (%s) " % sqlite_utils.Placeholders(
+          len(batch))
+
+      values = list(batch)
+      if min_last_ping is not None:
+        query += "AND c.last_ping >= ? "
+        values.append(sqlite_utils.RDFDatetimeToInt(min_last_ping))
+
+      query += "ORDER BY c.client_id"
+
+      cursor.execute(query, values)
+      for c_id, c_info in self._ResponseToClientsFullInfo(cursor.fetchall()):
+        ret[c_id] = c_info
+
+    return ret
+
+  @sqlite_utils.WithTransaction(readonly=True)
+  def ReadAllClientIDs(self, cursor=None):
+    """Reads client ids for all clients in the database."""
+    cursor.execute("SELECT client_id FROM clients")
+    return [res[0] for res in cursor.fetchall()]
+
+  @sqlite_utils.WithTransaction()
+  def AddClientKeywords(self, client_id, keywords, cursor=None):
+    """Associates the provided keywords with the client."""
+    now = sqlite_utils.RDFDatetimeToInt(rdfvalue.RDFDatetime.Now())
+
+    try:
+      cursor.executemany(
+          "INSERT OR REPLACE INTO client_keywords "
+          "(client_id, keyword, timestamp) VALUES (?, ?, ?)",
+          [(client_id, utils.SmartUnicode(kw), now) for kw in keywords])
+    except sqlite3.IntegrityError as e:
+      raise db.UnknownClientError(client_id, cause=e)
+
+  @sqlite_utils.WithTransaction()
+  def RemoveClientKeyword(self, client_id, keyword, cursor=None):
+    """Removes the association of a particular client to a keyword."""
+    cursor.execute(
+        "DELETE FROM client_keywords WHERE client_id=? AND keyword=?",
+        [client_id, utils.SmartUnicode(keyword)])
+
+  @sqlite_utils.WithTransaction(readonly=True)
+  def ListClientsForKeywords(self, keywords, start_time=None, cursor=None):
+    """Lists the clients associated with keywords."""
+    keywords = set(keywords)
+    keyword_mapping = {utils.SmartUnicode(kw): kw for kw in keywords}
+
+    result = {}
+    for kw in itervalues(keyword_mapping):
+      result[kw] = []
+
+    for batch in utils.Grouper(
+        iterkeys(keyword_mapping), sqlite_utils.MAX_QUERY_VARIABLES):
+      query = ("SELECT DISTINCT keyword, client_id FROM client_keywords WHERE "
+               "keyword IN ({})".format(sqlite_utils.Placeholders(len(batch))))
+      args = list(batch)
+      if start_time:
+        query += " AND timestamp >= ?"
+        args.append(sqlite_utils.RDFDatetimeToInt(start_time))
+
+      cursor.execute(query, args)
+      for kw, cid in cursor.fetchall():
+        result[keyword_mapping[kw]].append(cid)
+    return result
+
+  @sqlite_utils.WithTransaction(readonly=True)
+  def ListClientsMatchingKeywords(self,
+                                  keywords,
+                                  start_time=None,
+                                  offset=0,
+                                  count=None,
+                                  labels=None,
+                                  label_owners=None,
+                                  cursor=None):
+    """Lists the clients associated with all of the given keywords."""
+    keywords = set(utils.SmartUnicode(kw) for kw in keywords)
+    labels = None if labels is None else set(
+        utils.SmartUnicode(l) for l in labels)
+    if ((labels is not None and not labels) or
+        (label_owners is not None and not label_owners)):
+      return []
+
+    num_variables = len(keywords) + len(labels or []) + len(label_owners or [])
+    if num_variables >= sqlite_utils.MAX_QUERY_VARIABLES:
+      raise ValueError("Too many keywords and labels: %d." % num_variables)
+
+    # (client_id, keyword) is the primary key, so a client matches all
+    # keywords if it has as many rows as there are keywords.
+    query = ("SELECT client_id FROM client_keywords WHERE "
+             "keyword IN ({})".format(sqlite_utils.Placeholders(len(keywords))))
+    args = list(keywords)
+    if start_time:
+      query += " AND timestamp >= ?"
+      args.append(sqlite_utils.RDFDatetimeToInt(start_time))
+
+    if labels is not None:
+      query += (" AND client_id IN (SELECT client_id FROM client_labels "
+                "WHERE label IN ({})".format(
+                    sqlite_utils.Placeholders(len(labels))))
+      args.extend(labels)
+      if label_owners is not None:
+        query += " AND owner IN ({})".format(
+            sqlite_utils.Placeholders(len(label_owners)))
+        args.extend(label_owners)
+      query += ")"
+
+    # A negative LIMIT returns all rows.
+    query += (" GROUP BY client_id HAVING COUNT(*) = ? ORDER BY client_id "
+              "LIMIT ? OFFSET ?")
+    args += [len(keywords), count if count is not None else -1, offset]
+
+    cursor.execute(query, args)
+    return [cid for cid, in cursor.fetchall()]
+
+  @sqlite_utils.WithTransaction()
+  def AddClientLabels(self, client_id, owner, labels, cursor=None):
+    """Attaches a list of user labels to a client."""
+    try:
+      cursor.executemany(
+          "INSERT OR IGNORE INTO client_labels (client_id, owner, label) "
+          "VALUES (?, ?, ?)",
+          [(client_id, owner, utils.SmartUnicode(label)) for label in labels])
+    except sqlite3.IntegrityError as e:
+      raise db.UnknownClientError(client_id, cause=e)
+
+  @sqlite_utils.WithTransaction(readonly=True)
+  def MultiReadClientLabels(self, client_ids, cursor=None):
+    """Reads the user labels for a list of clients."""
+    ret = {client_id: [] for client_id in client_ids}
+    for batch in utils.Grouper(client_ids, sqlite_utils.MAX_QUERY_VARIABLES):
+      query = ("SELECT client_id, owner, label "
+               "FROM client_labels "
+               "WHERE client_id IN ({})").format(
+                   sqlite_utils.Placeholders(len(batch)))
+
+      cursor.execute(query, batch)
+      for client_id, owner, label in cursor.fetchall():
+        ret[client_id].append(rdf_objects.ClientLabel(name=label, owner=owner))
+
+    for r in itervalues(ret):
+      r.sort(key=lambda label: (label.owner, label.name))
+    return ret
+
+  @sqlite_utils.WithTransaction()
+  def RemoveClientLabels(self, client_id, owner, labels, cursor=None):
+    """Removes a list of user labels from a given client."""
+    cursor.executemany(
+        "DELETE FROM client_labels "
+        "WHERE client_id=? AND owner=? AND label=?",
+        [(client_id, owner, utils.SmartUnicode(l)) for l in labels])
+
+  @sqlite_utils.WithTransaction(readonly=True)
+  def ReadAllClientLabels(self, cursor=None):
+    """Reads the user labels for a list of clients."""
+
+    cursor.execute("SELECT DISTINCT owner, label FROM client_labels")
+
+    result = []
+    for owner, label in cursor.fetchall():
+      result.append(rdf_objects.ClientLabel(name=label, owner=owner))
+
+    result.sort(key=lambda label: (label.owner, label.name))
+    return result
+
+  @sqlite_utils.WithTransaction()
+  def WriteClientCrashInfo(self, client_id, crash_info, cursor=None):
+    """Writes a new client crash record."""
+    now = sqlite_utils.RDFDatetimeToInt(rdfvalue.RDFDatetime.Now())
+    try:
+      cursor.execute(
+          "INSERT OR REPLACE INTO client_crash_history "
+          "(client_id, timestamp, crash_info) VALUES (?, ?, ?)",
+          [client_id, now,
+           sqlite_utils.Blob(crash_info.SerializeToString())])
+      cursor.execute(
+          "UPDATE clients SET last_crash_timestamp = ? WHERE client_id=?",
+          [now, client_id])
+
+    except sqlite3.IntegrityError as e:
+      raise db.UnknownClientError(client_id, cause=e)
+
+  @sqlite_utils.WithTransaction(readonly=True)
+  def ReadClientCrashInfo(self, client_id, cursor=None):
+    """Reads the latest client crash record for a single client."""
+    cursor.execute(
+        "SELECT timestamp, crash_info FROM clients, client_crash_history WHERE "
+        "clients.client_id = client_crash_history.client_id AND "
+        "clients.last_crash_timestamp = client_crash_history.timestamp AND "
+        "clients.client_id = ?", [client_id])
+    row = cursor.fetchone()
+    if not row:
+      return None
+
+    timestamp, crash_info = row
+    res = sqlite_utils.BlobToRDFProto(rdf_client.ClientCrash, crash_info)
+    res.timestamp = sqlite_utils.IntToRDFDatetime(timestamp)
+    return res
+
+  @sqlite_utils.WithTransaction(readonly=True)
+  def ReadClientCrashInfoHistory(self, client_id, cursor=None):
+    """Reads the full crash history for a particular client."""
+    cursor.execute(
+        "SELECT timestamp, crash_info FROM client_crash_history WHERE "
+        "client_crash_history.client_id = ? "
+        "ORDER BY timestamp DESC", [client_id])
+    ret = []
+    for timestamp, crash_info in cursor.fetchall():
+      ci = sqlite_utils.BlobToRDFProto(rdf_client.ClientCrash, crash_info)
+      ci.timestamp = sqlite_utils.IntToRDFDatetime(timestamp)
+      ret.append(ci)
+    return ret
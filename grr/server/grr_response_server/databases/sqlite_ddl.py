@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+"""A collection of DDL for use by the SQLite database implementation.
+
+All timestamps are stored as integer microseconds since epoch, serialized
+protobufs and hash ids are stored as BLOBs.
+"""
+
+SCHEMA_SETUP = [
+    """
+CREATE TABLE IF NOT EXISTS clients(
+    client_id TEXT PRIMARY KEY,
+    last_client_timestamp INTEGER,
+    last_startup_timestamp INTEGER,
+    last_crash_timestamp INTEGER,
+    fleetspeak_enabled BOOLEAN,
+    certificate BLOB,
+    last_ping INTEGER,
+    last_clock INTEGER,
+    last_ip BLOB,
+    last_foreman INTEGER,
+    first_seen INTEGER
+)""", """
+CREATE TABLE IF NOT EXISTS client_labels(
+    client_id TEXT,
+    owner TEXT,
+    label TEXT,
+    PRIMARY KEY (client_id, owner, label),
+    FOREIGN KEY (client_id) REFERENCES clients(client_id)
+)""", """
+CREATE INDEX IF NOT EXISTS owner_label_idx ON client_labels(owner, label)
+""", """
+CREATE TABLE IF NOT EXISTS client_snapshot_history(
+    client_id TEXT,
+    timestamp INTEGER,
+    client_snapshot BLOB,
+    PRIMARY KEY (client_id, timestamp),
+    FOREIGN KEY (client_id) REFERENCES clients(client_id)
+)""", """
+CREATE TABLE IF NOT EXISTS client_startup_history(
+    client_id TEXT,
+    timestamp INTEGER,
+    startup_info BLOB,
+    PRIMARY KEY (client_id, timestamp),
+    FOREIGN KEY (client_id) REFERENCES clients(client_id)
+)""", """
+CREATE TABLE IF NOT EXISTS client_crash_history(
+    client_id TEXT,
+    timestamp INTEGER,
+    crash_info BLOB,
+    PRIMARY KEY (client_id, timestamp),
+    FOREIGN KEY (client_id) REFERENCES clients(client_id)
+)""", """
+CREATE TABLE IF NOT EXISTS client_keywords(
+    client_id TEXT,
+    keyword TEXT,
+    timestamp INTEGER,
+    PRIMARY KEY (client_id, keyword),
+    FOREIGN KEY (client_id) REFERENCES clients(client_id)
+)""", """
+CREATE INDEX IF NOT EXISTS keyword_client_idx
+ON client_keywords(keyword, timestamp)
+""", """
+CREATE TABLE IF NOT EXISTS grr_users(
+    username TEXT PRIMARY KEY,
+    password BLOB,
+    ui_mode INTEGER,
+    canary_mode BOOLEAN,
+    user_type INTEGER
+)""", """
+CREATE TABLE IF NOT EXISTS approval_request(
+    username TEXT,
+    approval_type INTEGER,
+    subject_id TEXT,
+    approval_id TEXT,
+    timestamp INTEGER,
+    expiration_time INTEGER,
+    approval_request BLOB,
+    PRIMARY KEY (username, approval_id),
+    FOREIGN KEY (username) REFERENCES grr_users (username)
+)""", """
+CREATE INDEX IF NOT EXISTS by_username_type_subject
+ON approval_request(username, approval_type, subject_id)
+""", """
+CREATE TABLE IF NOT EXISTS approval_grant(
+    username TEXT,
+    approval_id TEXT,
+    grantor_username TEXT,
+    timestamp INTEGER,
+    PRIMARY KEY (username, approval_id, grantor_username, timestamp),
+    FOREIGN KEY (username) REFERENCES grr_users (username)
+)""", """
+CREATE TABLE IF NOT EXISTS user_notification(
+    username TEXT,
+    timestamp INTEGER,
+    notification_state INTEGER,
+    notification BLOB,
+    PRIMARY KEY (username, timestamp),
+    FOREIGN KEY (username) REFERENCES grr_users (username)
+)""", """
+CREATE TABLE IF NOT EXISTS audit_event(
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    username TEXT,
+    urn TEXT,
+    client_id TEXT,
+    timestamp INTEGER,
+    action INTEGER,
+    details BLOB
+)""", """
+CREATE INDEX IF NOT EXISTS audit_event_timestamp_idx
+ON audit_event(timestamp)
+""", """
+CREATE INDEX IF NOT EXISTS audit_event_action_idx
+ON audit_event(action, timestamp)
+""", """
+CREATE INDEX IF NOT EXISTS audit_event_username_idx
+ON audit_event(username, timestamp)
+""", """
+CREATE TABLE IF NOT EXISTS audit_event_counts(
+    interval_start INTEGER,
+    username TEXT,
+    action INTEGER,
+    flow_name TEXT,
+    count INTEGER,
+    PRIMARY KEY (interval_start, username, action, flow_name)
+)""", """
+CREATE TABLE IF NOT EXISTS message_handler_requests(
+    handlername TEXT,
+    timestamp INTEGER,
+    request_id INTEGER,
+    request BLOB,
+    leased_until INTEGER,
+    leased_by TEXT,
+    PRIMARY KEY (handlername, request_id)
+)""", """
+CREATE TABLE IF NOT EXISTS foreman_rules(
+    hunt_id TEXT PRIMARY KEY,
+    expiration_time INTEGER,
+    rule BLOB
+)""", """
+CREATE TABLE IF NOT EXISTS foreman_rules_version(
+    id INTEGER PRIMARY KEY,
+    version INTEGER
+)""", """
+CREATE TABLE IF NOT EXISTS cron_jobs(
+    job_id TEXT PRIMARY KEY,
+    job BLOB,
+    create_time INTEGER,
+    current_run_id TEXT,
+    enabled BOOLEAN,
+    forced_run_requested BOOLEAN,
+    last_run_time INTEGER,
+    last_run_status INTEGER,
+    state BLOB,
+    leased_until INTEGER,
+    leased_by TEXT
+)""", """
+CREATE TABLE IF NOT EXISTS cron_job_runs(
+    job_id TEXT,
+    run_id TEXT,
+    write_time INTEGER,
+    run BLOB,
+    PRIMARY KEY (job_id, run_id),
+    FOREIGN KEY (job_id) REFERENCES cron_jobs (job_id) ON DELETE CASCADE
+)""", """
+CREATE TABLE IF NOT EXISTS client_messages(
+    client_id TEXT,
+    message_id INTEGER,
+    timestamp INTEGER,
+    message BLOB,
+    leased_until INTEGER,
+    leased_by TEXT,
+    PRIMARY KEY (client_id, message_id),
+    FOREIGN KEY (client_id) REFERENCES clients(client_id)
+)""", """
+CREATE TABLE IF NOT EXISTS client_paths(
+    client_id TEXT,
+    path_type INTEGER,
+    path_id BLOB,
+    components TEXT,
+    depth INTEGER,
+    directory BOOLEAN,
+    timestamp INTEGER,
+    PRIMARY KEY (client_id, path_type, path_id),
+    FOREIGN KEY (client_id) REFERENCES clients(client_id)
+)""", """
+CREATE TABLE IF NOT EXISTS client_path_closure(
+    client_id TEXT,
+    path_type INTEGER,
+    ancestor_id BLOB,
+    depth INTEGER,
+    descendant_id BLOB,
+    PRIMARY KEY (client_id, path_type, ancestor_id, depth, descendant_id)
+)""", """
+CREATE TABLE IF NOT EXISTS client_path_stat_entries(
+    client_id TEXT,
+    path_type INTEGER,
+    path_id BLOB,
+    timestamp INTEGER,
+    stat_entry BLOB,
+    PRIMARY KEY (client_id, path_type, path_id, timestamp),
+    FOREIGN KEY (client_id, path_type, path_id)
+    REFERENCES client_paths(client_id, path_type, path_id)
+)""", """
+CREATE TABLE IF NOT EXISTS client_path_hash_entries(
+    client_id TEXT,
+    path_type INTEGER,
+    path_id BLOB,
+    timestamp INTEGER,
+    hash_entry BLOB,
+    PRIMARY KEY (client_id, path_type, path_id, timestamp),
+    FOREIGN KEY (client_id, path_type, path_id)
+    REFERENCES client_paths(client_id, path_type, path_id)
+)""", """
+CREATE TABLE IF NOT EXISTS client_path_blob_references(
+    client_id TEXT,
+    path_type INTEGER,
+    path_id BLOB,
+    offset INTEGER,
+    size INTEGER,
+    blob_id BLOB,
+    PRIMARY KEY (client_id, path_type, path_id, offset),
+    FOREIGN KEY (client_id, path_type, path_id)
+    REFERENCES client_paths(client_id, path_type, path_id)
+)""", """
+CREATE TABLE IF NOT EXISTS blobs(
+    blob_id BLOB PRIMARY KEY,
+    blob_data BLOB
+)"""
+]
@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+"""The SQLite database methods for event handling."""
+
+from grr_response_core.lib import rdfvalue
+from grr_response_core.lib.rdfvalues import client as rdf_client
+from grr_response_core.lib.rdfvalues import events as rdf_events
+from grr_response_server import db
+from grr_response_server.databases import sqlite_utils
+
+
+def _AuditEventFromRow(username, urn, client_id, timestamp, details):
+  event = sqlite_utils.BlobToRDFProto(rdf_events.AuditEvent, details)
+  event.user = username
+  if urn:
+    event.urn = rdfvalue.RDFURN(urn)
+  if client_id is not None:
+    event.client = rdf_client.ClientURN(client_id)
+  event.timestamp = sqlite_utils.IntToRDFDatetime(timestamp)
+  return event
+
+
+def _TimeRangeConditions(column, timerange, args):
+  """Returns SQL conditions restricting a column to a timerange."""
+  conditions = []
+  if timerange:
+    time_from, time_to = timerange  # pylint: disable=unpacking-non-sequence
+
+    if time_from is not None:
+      conditions.append("%s >= ?" % column)
+      args.append(sqlite_utils.RDFDatetimeToInt(time_from))
+
+    if time_to is not None:
+      conditions.append("%s <= ?" % column)
+      args.append(sqlite_utils.RDFDatetimeToInt(time_to))
+
+  return conditions
+
+
+class SqliteDBEventMixin(object):
+  """SqliteDB mixin for event handling."""
+
+  @sqlite_utils.WithTransaction(readonly=True)
+  def ReadAllAuditEvents(self, cursor=None):
+    """Reads all audit events stored in the database."""
+    cursor.execute("""
+        SELECT username, urn, client_id, timestamp, details
+        FROM audit_event
+        ORDER BY timestamp, id
+    """)
+
+    return [_AuditEventFromRow(*row) for row in cursor.fetchall()]
+
+  @sqlite_utils.WithTransaction(readonly=True)
+  def ReadAuditEvents(self,
+                      timerange=None,
+                      actions=None,
+                      usernames=None,
+                      cursor=None):
+    """Reads audit events matching the given conditions."""
+    if actions is not None and not actions:
+      return []
+    if usernames is not None and not usernames:
+      return []
+
+    num_variables = len(actions or []) + len(usernames or [])
+    if num_variables >= sqlite_utils.MAX_QUERY_VARIABLES:
+      raise ValueError("Too many actions and usernames: %d." % num_variables)
+
+    args = []
+    conditions = _TimeRangeConditions("timestamp", timerange, args)
+    if actions is not None:
+      conditions.append(
+          "action IN (%s)" % sqlite_utils.Placeholders(len(actions)))
+      args.extend(actions)
+    if usernames is not None:
+      conditions.append(
+          "username IN (%s)" % sqlite_utils.Placeholders(len(usernames)))
+      args.extend(usernames)
+
+    query = ("SELECT username, urn, client_id, timestamp, details "
+             "FROM audit_event ")
+    if conditions:
+      query += "WHERE " + " AND ".join(conditions) + " "
+    query += "ORDER BY timestamp, id"
+
+    cursor.execute(query, args)
+    return [_AuditEventFromRow(*row) for row in cursor.fetchall()]
+
+  @sqlite_utils.WithTransaction(readonly=True)
+  def ReadAuditEventCounts(self, timerange=None, actions=None, cursor=None):
+    """Reads the number of audit events written per user, action and flow."""
+    if actions is not None and not actions:
+      return {}
+
+    args = []
+    conditions = _TimeRangeConditions("interval_start", timerange, args)
+    if actions is not None:
+      conditions.append(
+          "action IN (%s)" % sqlite_utils.Placeholders(len(actions)))
+      args.extend(actions)
+
+    query = ("SELECT username, action, flow_name, SUM(count) "
+             "FROM audit_event_counts ")
+    if conditions:
+      query += "WHERE " + " AND ".join(conditions) + " "
+    query += "GROUP BY username, action, flow_name"
+
+    cursor.execute(query, args)
+    return {(username, action, flow_name): count
+            for username, action, flow_name, count in cursor.fetchall()}
+
+  @sqlite_utils.WithTransaction()
+  def WriteAuditEvent(self, event, cursor=None):
+    """Writes an audit event to the database."""
+    event = event.Copy()
+
+    if event.HasField("user"):
+      username = event.user
+      event.user = None
+    else:
+      username = None
+
+    if event.HasField("urn"):
+      urn = unicode(event.urn)
+      event.urn = None
+    else:
+      urn = None
+
+    if event.HasField("client"):
+      client_id = event.client.Basename()
+      event.client = None
+    else:
+      client_id = None
+
+    if event.HasField("timestamp"):
+      timestamp = event.timestamp
+      event.timestamp = None
+    else:
+      timestamp = rdfvalue.RDFDatetime.Now()
+
+    details = sqlite_utils.Blob(event.SerializeToString())
+
+    query = """
+    INSERT INTO audit_event
+      (username, urn, client_id, timestamp, action, details)
+    VALUES (?, ?, ?, ?, ?, ?)
+    """
+    values = (username, urn, client_id,
+              sqlite_utils.RDFDatetimeToInt(timestamp), int(event.action),
+              details)
+
+    cursor.execute(query, values)
+
+    key = (sqlite_utils.RDFDatetimeToInt(
+        timestamp.Floor(db.AUDIT_EVENT_COUNTS_INTERVAL)), username or u"",
+           int(event.action), event.flow_name or u"")
+    cursor.execute(
+        "INSERT OR IGNORE INTO audit_event_counts "
+        "(interval_start, username, action, flow_name, count) "
+        "VALUES (?, ?, ?, ?, 0)", key)
+    cursor.execute(
+        "UPDATE audit_event_counts SET count = count + 1 "
+        "WHERE interval_start = ? AND username = ? AND action = ? "
+        "AND flow_name = ?", key)
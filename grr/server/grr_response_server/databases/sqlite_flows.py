@@ -0,0 +1,235 @@
+#!/usr/bin/env python
+"""The SQLite database methods for flow handling."""
+
+import logging
+import sqlite3
+import threading
+import time
+
+from grr_response_core.lib import rdfvalue
+from grr_response_core.lib import utils
+from grr_response_core.lib.rdfvalues import flows as rdf_flows
+from grr_response_server import db
+from grr_response_server import db_utils
+from grr_response_server.databases import sqlite_utils
+from grr_response_server.rdfvalues import objects as rdf_objects
+
+
+def _SqliteLimit(limit):
+  # A negative LIMIT means that there is no upper bound in SQLite.
+  return -1 if limit is None else limit
+
+
+class SqliteDBFlowMixin(object):
+  """SqliteDB mixin for flow handling."""
+
+  @sqlite_utils.WithTransaction()
+  def WriteMessageHandlerRequests(self, requests, cursor=None):
+    """Writes a list of message handler requests to the database."""
+    now = sqlite_utils.RDFDatetimeToInt(rdfvalue.RDFDatetime.Now())
+    cursor.executemany(
+        "INSERT OR IGNORE INTO message_handler_requests "
+        "(handlername, timestamp, request_id, request) VALUES (?, ?, ?, ?)",
+        [(r.handler_name, now, sqlite_utils.UInt64ToInt(r.request_id),
+          sqlite_utils.Blob(r.SerializeToString())) for r in requests])
+
+  @sqlite_utils.WithTransaction(readonly=True)
+  def ReadMessageHandlerRequests(self, cursor=None):
+    """Reads all message handler requests from the database."""
+
+    query = ("SELECT timestamp, request, leased_until, leased_by "
+             "FROM message_handler_requests "
+             "ORDER BY timestamp DESC")
+
+    cursor.execute(query)
+
+    res = []
+    for timestamp, request, leased_until, leased_by in cursor.fetchall():
+      req = sqlite_utils.BlobToRDFProto(rdf_objects.MessageHandlerRequest,
+                                        request)
+      req.timestamp = sqlite_utils.IntToRDFDatetime(timestamp)
+      req.leased_by = leased_by
+      req.leased_until = sqlite_utils.IntToRDFDatetime(leased_until)
+      res.append(req)
+    return res
+
+  @sqlite_utils.WithTransaction()
+  def DeleteMessageHandlerRequests(self, requests, cursor=None):
+    """Deletes a list of message handler requests from the database."""
+    request_ids = set(
+        [sqlite_utils.UInt64ToInt(r.request_id) for r in requests])
+    cursor.executemany(
+        "DELETE FROM message_handler_requests WHERE request_id = ?",
+        [(request_id,) for request_id in request_ids])
+
+  def RegisterMessageHandler(self, handler, lease_time, limit=1000):
+    """Leases a number of message handler requests up to the indicated limit."""
+    self.UnregisterMessageHandler()
+
+    if handler:
+      self.handler_stop = False
+      self.handler_thread = threading.Thread(
+          name="message_handler",
+          target=self._MessageHandlerLoop,
+          args=(handler, lease_time, limit))
+      self.handler_thread.daemon = True
+      self.handler_thread.start()
+
+  def UnregisterMessageHandler(self):
+    """Unregisters any registered message handler."""
+    if self.handler_thread:
+      self.handler_stop = True
+      self.handler_thread.join()
+      self.handler_thread = None
+
+  def _MessageHandlerLoop(self, handler, lease_time, limit):
+    while not self.handler_stop:
+      try:
+        msgs = self._LeaseMessageHandlerRequests(lease_time, limit)
+        if msgs:
+          handler(msgs)
+        else:
+          time.sleep(5)
+      except Exception as e:  # pylint: disable=broad-except
+        logging.exception("_LeaseMessageHandlerRequests raised %s.", e)
+
+  @sqlite_utils.WithTransaction()
+  def _LeaseMessageHandlerRequests(self, lease_time, limit, cursor=None):
+    """Leases a number of message handler requests up to the indicated limit."""
+
+    now = rdfvalue.RDFDatetime.Now()
+    expiry = now + lease_time
+    expiry_int = sqlite_utils.RDFDatetimeToInt(expiry)
+    id_str = utils.ProcessIdString()
+
+    # The write transaction holds the database lock, so the requests selected
+    # here can't be leased by anybody else before they are updated.
+    cursor.execute(
+        "SELECT handlername, request_id, timestamp, request "
+        "FROM message_handler_requests "
+        "WHERE leased_until IS NULL OR leased_until < ? "
+        "LIMIT ?", [sqlite_utils.RDFDatetimeToInt(now),
+                    _SqliteLimit(limit)])
+    rows = cursor.fetchall()
+    if not rows:
+      return []
+
+    cursor.executemany(
+        "UPDATE message_handler_requests SET leased_until=?, leased_by=? "
+        "WHERE handlername=? AND request_id=?",
+        [(expiry_int, id_str, handlername, request_id)
+         for handlername, request_id, _, _ in rows])
+
+    res = []
+    for _, _, timestamp, request in rows:
+      req = sqlite_utils.BlobToRDFProto(rdf_objects.MessageHandlerRequest,
+                                        request)
+      req.timestamp = sqlite_utils.IntToRDFDatetime(timestamp)
+      req.leased_until = expiry
+      req.leased_by = id_str
+      res.append(req)
+
+    return res
+
+  @sqlite_utils.WithTransaction(readonly=True)
+  def ReadClientMessages(self, client_id, cursor=None):
+    """Reads all client messages available for a given client_id."""
+
+    query = ("SELECT message, leased_until, leased_by FROM client_messages "
+             "WHERE client_id = ? ORDER BY message_id")
+
+    cursor.execute(query, [client_id])
+
+    ret = []
+    for msg, leased_until, leased_by in cursor.fetchall():
+      message = sqlite_utils.BlobToRDFProto(rdf_flows.GrrMessage, msg)
+      if leased_until:
+        message.leased_by = leased_by
+        message.leased_until = sqlite_utils.IntToRDFDatetime(leased_until)
+      ret.append(message)
+
+    return ret
+
+  @sqlite_utils.WithTransaction()
+  def DeleteClientMessages(self, messages, cursor=None):
+    """Deletes a list of client messages from the db."""
+    if not messages:
+      return
+
+    to_delete = []
+    for m in messages:
+      client_id = db_utils.ClientIdFromGrrMessage(m)
+      to_delete.append((client_id, sqlite_utils.UInt64ToInt(m.task_id)))
+
+    if len(set(to_delete)) != len(to_delete):
+      raise ValueError(
+          "Received multiple copies of the same message to delete.")
+
+    cursor.executemany(
+        "DELETE FROM client_messages WHERE client_id=? AND message_id=?",
+        to_delete)
+
+  @sqlite_utils.WithTransaction()
+  def LeaseClientMessages(self,
+                          client_id,
+                          lease_time=None,
+                          limit=None,
+                          cursor=None):
+    """Leases available client messages for the client with the given id."""
+
+    now = rdfvalue.RDFDatetime.Now()
+    expiry = now + lease_time
+    expiry_int = sqlite_utils.RDFDatetimeToInt(expiry)
+    proc_id_str = utils.ProcessIdString()
+
+    # The write transaction holds the database lock, so the messages selected
+    # here can't be leased by anybody else before they are updated.
+    cursor.execute(
+        "SELECT message_id, message FROM client_messages "
+        "WHERE client_id=? AND (leased_until IS NULL OR leased_until < ?) "
+        "ORDER BY message_id LIMIT ?",
+        [client_id, sqlite_utils.RDFDatetimeToInt(now), _SqliteLimit(limit)])
+    rows = cursor.fetchall()
+    if not rows:
+      return []
+
+    cursor.executemany(
+        "UPDATE client_messages SET leased_until=?, leased_by=? "
+        "WHERE client_id=? AND message_id=?",
+        [(expiry_int, proc_id_str, client_id, message_id)
+         for message_id, _ in rows])
+
+    ret = []
+    for _, msg in rows:
+      message = sqlite_utils.BlobToRDFProto(rdf_flows.GrrMessage, msg)
+      message.leased_by = proc_id_str
+      message.leased_until = expiry
+      ret.append(message)
+    return ret
+
+  @sqlite_utils.WithTransaction()
+  def WriteClientMessages(self, messages, cursor=None):
+    """Writes messages that should go to the client to the db."""
+    now = sqlite_utils.RDFDatetimeToInt(rdfvalue.RDFDatetime.Now())
+
+    args = []
+    for m in messages:
+      client_id = db_utils.ClientIdFromGrrMessage(m)
+      args.append((client_id, sqlite_utils.UInt64ToInt(m.task_id), now,
+                   sqlite_utils.Blob(m.SerializeToString())))
+
+    # Existing messages keep their lease, only the content is updated.
+    try:
+      cursor.executemany(
+          "INSERT OR IGNORE INTO client_messages "
+          "(client_id, message_id, timestamp, message) VALUES (?, ?, ?, ?)",
+          args)
+    except sqlite3.IntegrityError as e:
+      raise db.UnknownClientError(
+          ", ".join(sorted(set(a[0] for a in args))), cause=e)
+
+    cursor.executemany(
+        "UPDATE client_messages SET timestamp=?, message=? "
+        "WHERE client_id=? AND message_id=?",
+        [(timestamp, message, client_id, message_id)
+         for client_id, message_id, timestamp, message in args])
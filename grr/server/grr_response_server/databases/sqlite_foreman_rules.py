@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+"""The SQLite database methods for foreman rule handling."""
+
+from grr_response_core.lib import rdfvalue
+from grr_response_server import foreman_rules
+from grr_response_server.databases import sqlite_utils
+
+
+class SqliteDBForemanRulesMixin(object):
+  """SqliteDB mixin for foreman rules related functions."""
+
+  def _UpdateForemanRulesVersion(self, cursor):
+    # Every change of the rules bumps the version in the same transaction, so
+    # readers can tell that the rules changed from a single row.
+    cursor.execute("INSERT OR IGNORE INTO foreman_rules_version (id, version) "
+                   "VALUES (0, 0)")
+    cursor.execute(
+        "UPDATE foreman_rules_version SET version=version+1 WHERE id=0")
+
+  @sqlite_utils.WithTransaction()
+  def WriteForemanRule(self, rule, cursor=None):
+    query = ("INSERT OR REPLACE INTO foreman_rules "
+             "(hunt_id, expiration_time, rule) VALUES (?, ?, ?)")
+    cursor.execute(query, [
+        rule.hunt_id,
+        sqlite_utils.RDFDatetimeToInt(rule.expiration_time),
+        sqlite_utils.Blob(rule.SerializeToString())
+    ])
+    self._UpdateForemanRulesVersion(cursor)
+
+  @sqlite_utils.WithTransaction()
+  def RemoveForemanRule(self, hunt_id, cursor=None):
+    query = "DELETE FROM foreman_rules WHERE hunt_id=?"
+    cursor.execute(query, [hunt_id])
+    if cursor.rowcount:
+      self._UpdateForemanRulesVersion(cursor)
+
+  @sqlite_utils.WithTransaction(readonly=True)
+  def ReadAllForemanRules(self, cursor=None):
+    cursor.execute("SELECT rule FROM foreman_rules")
+    res = []
+    for rule, in cursor.fetchall():
+      res.append(
+          sqlite_utils.BlobToRDFProto(foreman_rules.ForemanCondition, rule))
+    return res
+
+  @sqlite_utils.WithTransaction()
+  def RemoveExpiredForemanRules(self, cursor=None):
+    now = rdfvalue.RDFDatetime.Now()
+    cursor.execute("DELETE FROM foreman_rules WHERE expiration_time < ?",
+                   [sqlite_utils.RDFDatetimeToInt(now)])
+    if cursor.rowcount:
+      self._UpdateForemanRulesVersion(cursor)
+
+  @sqlite_utils.WithTransaction(readonly=True)
+  def ReadForemanRulesVersion(self, cursor=None):
+    cursor.execute("SELECT version FROM foreman_rules_version WHERE id=0")
+    row = cursor.fetchone()
+    return row[0] if row else 0
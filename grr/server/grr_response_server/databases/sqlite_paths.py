@@ -0,0 +1,389 @@
+#!/usr/bin/env python
+"""The SQLite database methods for path handling.
+
+Besides the path records themselves, a closure table with a row for every
+(ancestor, descendant) pair is maintained. This makes listing descendants of a
+path (up to a given depth) a single indexed range scan instead of a scan over
+all the paths of a client.
+"""
+
+import json
+import sqlite3
+
+from builtins import range  # pylint: disable=redefined-builtin
+from future.utils import iteritems
+
+from grr_response_core.lib import rdfvalue
+from grr_response_core.lib import utils
+from grr_response_core.lib.rdfvalues import client_fs as rdf_client_fs
+from grr_response_core.lib.rdfvalues import crypto as rdf_crypto
+from grr_response_server import db
+from grr_response_server.databases import sqlite_utils
+from grr_response_server.rdfvalues import objects as rdf_objects
+
+# Selects path records together with their latest stat and hash entries that
+# are not newer than a given timestamp. The timestamp has to be passed twice.
+_PATH_INFO_QUERY = """
+SELECT p.components, p.directory, p.timestamp,
+       s.stat_entry, s.timestamp, h.hash_entry, h.timestamp
+FROM {source}
+LEFT JOIN client_path_stat_entries AS s ON (
+    s.client_id = p.client_id AND
+    s.path_type = p.path_type AND
+    s.path_id = p.path_id AND
+    s.timestamp = (SELECT MAX(timestamp) FROM client_path_stat_entries
+                   WHERE client_id = p.client_id AND
+                         path_type = p.path_type AND
+                         path_id = p.path_id AND
+                         timestamp <= ?))
+LEFT JOIN client_path_hash_entries AS h ON (
+    h.client_id = p.client_id AND
+    h.path_type = p.path_type AND
+    h.path_id = p.path_id AND
+    h.timestamp = (SELECT MAX(timestamp) FROM client_path_hash_entries
+                   WHERE client_id = p.client_id AND
+                         path_type = p.path_type AND
+                         path_id = p.path_id AND
+                         timestamp <= ?))
+"""
+
+
+def _PathIDBlob(components):
+  return sqlite_utils.Blob(rdf_objects.PathID.FromComponents(components)
+                           .AsBytes())
+
+
+def _ComponentsToText(components):
+  return json.dumps(list(components))
+
+
+def _TextToComponents(text):
+  return tuple(json.loads(text))
+
+
+def _PathInfoFromRow(path_type, row):
+  """Creates a path info object from a `_PATH_INFO_QUERY` result row."""
+  (components, directory, timestamp, stat_entry, stat_entry_timestamp,
+   hash_entry, hash_entry_timestamp) = row
+
+  result = rdf_objects.PathInfo(
+      path_type=path_type,
+      components=_TextToComponents(components),
+      directory=bool(directory),
+      timestamp=sqlite_utils.IntToRDFDatetime(timestamp))
+
+  if stat_entry is not None:
+    result.stat_entry = sqlite_utils.BlobToRDFProto(rdf_client_fs.StatEntry,
+                                                    stat_entry)
+    result.last_stat_entry_timestamp = sqlite_utils.IntToRDFDatetime(
+        stat_entry_timestamp)
+  if hash_entry is not None:
+    result.hash_entry = sqlite_utils.BlobToRDFProto(rdf_crypto.Hash,
+                                                    hash_entry)
+    result.last_hash_entry_timestamp = sqlite_utils.IntToRDFDatetime(
+        hash_entry_timestamp)
+
+  return result
+
+
+class SqliteDBPathMixin(object):
+  """SqliteDB mixin for path related functions."""
+
+  @sqlite_utils.WithTransaction(readonly=True)
+  def ReadPathInfo(self,
+                   client_id,
+                   path_type,
+                   components,
+                   timestamp=None,
+                   cursor=None):
+    """Retrieves a path info record for a given path."""
+    if timestamp is None:
+      timestamp = rdfvalue.RDFDatetime.Now()
+    timestamp = sqlite_utils.RDFDatetimeToInt(timestamp)
+
+    query = _PATH_INFO_QUERY.format(source="client_paths AS p")
+    query += "WHERE p.client_id = ? AND p.path_type = ? AND p.path_id = ?"
+    cursor.execute(query, [
+        timestamp, timestamp, client_id,
+        int(path_type),
+        _PathIDBlob(components)
+    ])
+
+    row = cursor.fetchone()
+    if row is None:
+      raise db.UnknownPathError(
+          client_id=client_id, path_type=path_type, components=components)
+
+    return _PathInfoFromRow(path_type, row)
+
+  @sqlite_utils.WithTransaction(readonly=True)
+  def ReadPathInfos(self, client_id, path_type, components_list, cursor=None):
+    """Retrieves path info records for given paths."""
+    result = {components: None for components in components_list}
+
+    timestamp = sqlite_utils.RDFDatetimeToInt(rdfvalue.RDFDatetime.Now())
+    for batch in utils.Grouper(components_list,
+                               sqlite_utils.MAX_QUERY_VARIABLES):
+      query = _PATH_INFO_QUERY.format(source="client_paths AS p")
+      query += ("WHERE p.client_id = ? AND p.path_type = ? "
+                "AND p.path_id IN ({})").format(
+                    sqlite_utils.Placeholders(len(batch)))
+
+      args = [timestamp, timestamp, client_id, int(path_type)]
+      args.extend(_PathIDBlob(components) for components in batch)
+      cursor.execute(query, args)
+
+      for row in cursor.fetchall():
+        path_info = _PathInfoFromRow(path_type, row)
+        result[tuple(path_info.components)] = path_info
+
+    return result
+
+  @sqlite_utils.WithTransaction(readonly=True)
+  def ListDescendentPathInfos(self,
+                              client_id,
+                              path_type,
+                              components,
+                              max_depth=None,
+                              cursor=None):
+    """Lists path info records that correspond to descendants of given path."""
+    timestamp = sqlite_utils.RDFDatetimeToInt(rdfvalue.RDFDatetime.Now())
+
+    query = _PATH_INFO_QUERY.format(
+        source="client_path_closure AS c "
+        "JOIN client_paths AS p ON ("
+        "p.client_id = c.client_id AND "
+        "p.path_type = c.path_type AND "
+        "p.path_id = c.descendant_id)")
+    query += "WHERE c.client_id = ? AND c.path_type = ? AND c.ancestor_id = ? "
+    args = [
+        timestamp, timestamp, client_id,
+        int(path_type),
+        _PathIDBlob(components)
+    ]
+
+    if max_depth is not None:
+      query += "AND c.depth <= ?"
+      args.append(max_depth)
+
+    cursor.execute(query, args)
+    result = [_PathInfoFromRow(path_type, row) for row in cursor.fetchall()]
+    result.sort(key=lambda _: tuple(_.components))
+    return result
+
+  def WritePathInfos(self, client_id, path_infos):
+    """Writes a collection of path_info records for a client."""
+    self.MultiWritePathInfos({client_id: path_infos})
+
+  @sqlite_utils.WithTransaction()
+  def MultiWritePathInfos(self, path_infos, cursor=None):
+    """Writes a collection of path info records for specified clients."""
+    now = sqlite_utils.RDFDatetimeToInt(rdfvalue.RDFDatetime.Now())
+    for client_id, client_path_infos in iteritems(path_infos):
+      try:
+        self._WritePathInfos(client_id, client_path_infos, now, cursor)
+      except sqlite3.IntegrityError as e:
+        raise db.UnknownClientError(client_id, cause=e)
+
+  def _WritePathInfos(self, client_id, path_infos, timestamp, cursor):
+    """Writes path info records of a single client using the given cursor."""
+    # Maps (path_type, path_id) to [components, directory] of every path that
+    # has to exist after the write, i.e. written paths and their ancestors.
+    records = {}
+    stat_entries = []
+    hash_entries = []
+
+    def AddRecord(path_info):
+      path_idx = (int(path_info.path_type), path_info.GetPathID().AsBytes())
+      record = records.setdefault(path_idx,
+                                  [tuple(path_info.components), False])
+      record[1] |= bool(path_info.directory)
+      return path_idx
+
+    for path_info in path_infos:
+      path_type, path_id = AddRecord(path_info)
+      if path_info.HasField("stat_entry"):
+        stat_entries.append(
+            (client_id, path_type, sqlite_utils.Blob(path_id), timestamp,
+             sqlite_utils.Blob(path_info.stat_entry.SerializeToString())))
+      if path_info.HasField("hash_entry"):
+        hash_entries.append(
+            (client_id, path_type, sqlite_utils.Blob(path_id), timestamp,
+             sqlite_utils.Blob(path_info.hash_entry.SerializeToString())))
+
+      for ancestor_path_info in path_info.GetAncestors():
+        AddRecord(ancestor_path_info)
+
+    if not records:
+      return
+
+    existing = self._ExistingPathIDs(client_id, records, cursor)
+
+    new_paths = []
+    updates = []
+    closure = []
+    for path_idx, (components, directory) in iteritems(records):
+      path_type, path_id = path_idx
+      if path_idx in existing:
+        updates.append((timestamp, directory, client_id, path_type,
+                        sqlite_utils.Blob(path_id)))
+        continue
+
+      new_paths.append((client_id, path_type, sqlite_utils.Blob(path_id),
+                        _ComponentsToText(components), len(components),
+                        directory, timestamp))
+
+      # The closure table has a row for every proper ancestor of a path.
+      for depth in range(1, len(components) + 1):
+        ancestor_components = components[:len(components) - depth]
+        closure.append((client_id, path_type, _PathIDBlob(ancestor_components),
+                        depth, sqlite_utils.Blob(path_id)))
+
+    cursor.executemany(
+        "INSERT INTO client_paths "
+        "(client_id, path_type, path_id, components, depth, directory, "
+        "timestamp) VALUES (?, ?, ?, ?, ?, ?, ?)", new_paths)
+    cursor.executemany(
+        "UPDATE client_paths SET timestamp = ?, directory = directory OR ? "
+        "WHERE client_id = ? AND path_type = ? AND path_id = ?", updates)
+    cursor.executemany(
+        "INSERT OR IGNORE INTO client_path_closure "
+        "(client_id, path_type, ancestor_id, depth, descendant_id) "
+        "VALUES (?, ?, ?, ?, ?)", closure)
+    cursor.executemany(
+        "INSERT OR REPLACE INTO client_path_stat_entries "
+        "(client_id, path_type, path_id, timestamp, stat_entry) "
+        "VALUES (?, ?, ?, ?, ?)", stat_entries)
+    cursor.executemany(
+        "INSERT OR REPLACE INTO client_path_hash_entries "
+        "(client_id, path_type, path_id, timestamp, hash_entry) "
+        "VALUES (?, ?, ?, ?, ?)", hash_entries)
+
+  def _ExistingPathIDs(self, client_id, path_idxs, cursor):
+    """Returns the subset of given (path_type, path_id) pairs that exist."""
+    by_path_type = {}
+    for path_type, path_id in path_idxs:
+      by_path_type.setdefault(path_type, []).append(path_id)
+
+    result = set()
+    for path_type, path_ids in iteritems(by_path_type):
+      for batch in utils.Grouper(path_ids, sqlite_utils.MAX_QUERY_VARIABLES):
+        cursor.execute(
+            "SELECT path_id FROM client_paths "
+            "WHERE client_id = ? AND path_type = ? AND path_id IN ({})".format(
+                sqlite_utils.Placeholders(len(batch))),
+            [client_id, path_type] + [sqlite_utils.Blob(i) for i in batch])
+        for path_id, in cursor.fetchall():
+          result.add((path_type, bytes(path_id)))
+
+    return result
+
+  def ClearPathHistory(self, client_id, path_infos):
+    """Clears path history for specified paths of given client."""
+    self.MultiClearPathHistory({client_id: path_infos})
+
+  @sqlite_utils.WithTransaction()
+  def MultiClearPathHistory(self, path_infos, cursor=None):
+    """Clears path history for specified paths of given clients."""
+    args = []
+    for client_id, client_path_infos in iteritems(path_infos):
+      for path_info in client_path_infos:
+        args.append((client_id, int(path_info.path_type),
+                     sqlite_utils.Blob(path_info.GetPathID().AsBytes())))
+
+    for table in ["client_path_stat_entries", "client_path_hash_entries"]:
+      cursor.executemany(
+          "DELETE FROM {} "
+          "WHERE client_id = ? AND path_type = ? AND path_id = ?".format(table),
+          args)
+
+  @sqlite_utils.WithTransaction()
+  def MultiWritePathHistory(self, client_path_histories, cursor=None):
+    """Writes a collection of hash and stat entries observed for given paths."""
+    stat_entries = []
+    hash_entries = []
+    for client_path, client_path_history in iteritems(client_path_histories):
+      client_id = client_path.client_id
+      path_type = int(client_path.path_type)
+      path_id = _PathIDBlob(client_path.components)
+
+      cursor.execute("SELECT 1 FROM clients WHERE client_id = ?", [client_id])
+      if cursor.fetchone() is None:
+        raise db.UnknownClientError(client_id)
+
+      for timestamp, stat_entry in iteritems(client_path_history.stat_entries):
+        stat_entries.append((client_id, path_type, path_id,
+                             sqlite_utils.RDFDatetimeToInt(timestamp),
+                             sqlite_utils.Blob(stat_entry.SerializeToString())))
+
+      for timestamp, hash_entry in iteritems(client_path_history.hash_entries):
+        hash_entries.append((client_id, path_type, path_id,
+                             sqlite_utils.RDFDatetimeToInt(timestamp),
+                             sqlite_utils.Blob(hash_entry.SerializeToString())))
+
+    for client_id, path_type, path_id, _, _ in stat_entries + hash_entries:
+      cursor.execute(
+          "SELECT 1 FROM client_paths "
+          "WHERE client_id = ? AND path_type = ? AND path_id = ?",
+          [client_id, path_type, path_id])
+      if cursor.fetchone() is None:
+        raise db.AtLeastOneUnknownPathError(list(client_path_histories))
+
+    try:
+      cursor.executemany(
+          "INSERT INTO client_path_stat_entries "
+          "(client_id, path_type, path_id, timestamp, stat_entry) "
+          "VALUES (?, ?, ?, ?, ?)", stat_entries)
+      cursor.executemany(
+          "INSERT INTO client_path_hash_entries "
+          "(client_id, path_type, path_id, timestamp, hash_entry) "
+          "VALUES (?, ?, ?, ?, ?)", hash_entries)
+    except sqlite3.IntegrityError as e:
+      raise db.Error("Duplicated path history entry: %s" % e)
+
+  @sqlite_utils.WithTransaction(readonly=True)
+  def ReadPathInfosHistories(self,
+                             client_id,
+                             path_type,
+                             components_list,
+                             cursor=None):
+    """Reads a collection of hash and stat entries for given paths."""
+    results = {}
+
+    for components in components_list:
+      args = [client_id, int(path_type), _PathIDBlob(components)]
+
+      entries_by_ts = {}
+
+      cursor.execute(
+          "SELECT timestamp, stat_entry FROM client_path_stat_entries "
+          "WHERE client_id = ? AND path_type = ? AND path_id = ?", args)
+      for timestamp, stat_entry in cursor.fetchall():
+        entries_by_ts[timestamp] = rdf_objects.PathInfo(
+            path_type=path_type,
+            components=components,
+            timestamp=sqlite_utils.IntToRDFDatetime(timestamp),
+            stat_entry=sqlite_utils.BlobToRDFProto(rdf_client_fs.StatEntry,
+                                                   stat_entry))
+
+      cursor.execute(
+          "SELECT timestamp, hash_entry FROM client_path_hash_entries "
+          "WHERE client_id = ? AND path_type = ? AND path_id = ?", args)
+      for timestamp, hash_entry in cursor.fetchall():
+        try:
+          path_info = entries_by_ts[timestamp]
+        except KeyError:
+          path_info = rdf_objects.PathInfo(
+              path_type=path_type,
+              components=components,
+              timestamp=sqlite_utils.IntToRDFDatetime(timestamp))
+          entries_by_ts[timestamp] = path_info
+
+        path_info.hash_entry = sqlite_utils.BlobToRDFProto(
+            rdf_crypto.Hash, hash_entry)
+
+      results[components] = [
+          entries_by_ts[timestamp] for timestamp in sorted(entries_by_ts)
+      ]
+
+    return results
@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+import os
+import shutil
+import tempfile
+import unittest
+
+from grr_response_core.lib import flags
+from grr_response_server import db_test_mixin
+from grr_response_server.databases import sqlite
+from grr.test_lib import test_lib
+
+FLAGS = flags.FLAGS
+
+
+class SqliteDBTest(db_test_mixin.DatabaseTestMixin, unittest.TestCase):
+
+  def CreateDatabase(self):
+    temp_dir = tempfile.mkdtemp()
+    conn = sqlite.SqliteDB(os.path.join(temp_dir, "grr.sqlite"))
+
+    def Fin():
+      conn.Close()
+      shutil.rmtree(temp_dir)
+
+    return conn, Fin
+
+  def testIsRetryable(self):
+    self.assertFalse(sqlite._IsRetryable(Exception("database is locked")))
+    self.assertFalse(
+        sqlite._IsRetryable(sqlite.sqlite3.OperationalError("no such table")))
+    self.assertTrue(
+        sqlite._IsRetryable(
+            sqlite.sqlite3.OperationalError("database is locked")))
+
+  def testRunInTransactionRollsBackOnError(self):
+
+    def Failing(cursor):
+      cursor.execute("INSERT INTO grr_users (username) VALUES ('foo')")
+      raise ValueError()
+
+    with self.assertRaises(ValueError):
+      self.db.delegate._RunInTransaction(Failing)
+
+    self.assertEqual(list(self.db.ReadAllGRRUsers()), [])
+
+
+def main(args):
+  test_lib.main(args)
+
+
+if __name__ == "__main__":
+  flags.StartMain(main)
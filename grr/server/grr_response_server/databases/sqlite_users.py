@@ -0,0 +1,298 @@
+#!/usr/bin/env python
+"""The SQLite database methods for GRR users and approval handling."""
+
+import sqlite3
+
+from grr_response_core.lib import rdfvalue
+from grr_response_core.lib import utils
+from grr_response_server import db
+from grr_response_server.databases import sqlite_utils
+from grr_response_server.rdfvalues import objects as rdf_objects
+
+
+def _NewApprovalID():
+  return u"%016x" % utils.PRNG.GetUInt64()
+
+
+def _ResponseToApprovalsWithGrants(response):
+  """Converts a generator with approval rows into ApprovalRequest objects."""
+  prev_approval_id = None
+  cur_approval_request = None
+  for (approval_id, approval_timestamp, approval_request_bytes,
+       grantor_username, grant_timestamp) in response:
+
+    if approval_id != prev_approval_id:
+      prev_approval_id = approval_id
+
+      if cur_approval_request:
+        yield cur_approval_request
+
+      cur_approval_request = sqlite_utils.BlobToRDFProto(
+          rdf_objects.ApprovalRequest, approval_request_bytes)
+      cur_approval_request.approval_id = approval_id
+      cur_approval_request.timestamp = sqlite_utils.IntToRDFDatetime(
+          approval_timestamp)
+
+    if grantor_username and grant_timestamp:
+      cur_approval_request.grants.append(
+          rdf_objects.ApprovalGrant(
+              grantor_username=grantor_username,
+              timestamp=sqlite_utils.IntToRDFDatetime(grant_timestamp)))
+
+  if cur_approval_request:
+    yield cur_approval_request
+
+
+class SqliteDBUsersMixin(object):
+  """SqliteDB mixin for GRR users and approval related functions."""
+
+  @sqlite_utils.WithTransaction()
+  def WriteGRRUser(self,
+                   username,
+                   password=None,
+                   ui_mode=None,
+                   canary_mode=None,
+                   user_type=None,
+                   cursor=None):
+    """Writes user object for a user with a given name."""
+
+    columns = []
+    values = []
+
+    if password is not None:
+      columns.append("password")
+      values.append(sqlite_utils.Blob(password.SerializeToString()))
+    if ui_mode is not None:
+      columns.append("ui_mode")
+      values.append(int(ui_mode))
+    if canary_mode is not None:
+      columns.append("canary_mode")
+      values.append(bool(canary_mode))
+    if user_type is not None:
+      columns.append("user_type")
+      values.append(int(user_type))
+
+    cursor.execute("INSERT OR IGNORE INTO grr_users (username) VALUES (?)",
+                   [username])
+    if not columns:
+      return
+
+    query = "UPDATE grr_users SET {updates} WHERE username = ?".format(
+        updates=", ".join("{} = ?".format(col) for col in columns))
+    cursor.execute(query, values + [username])
+
+  def _RowToGRRUser(self, row):
+    """Creates a GRR user object from a database result row."""
+    username, password, ui_mode, canary_mode, user_type = row
+    result = rdf_objects.GRRUser(
+        username=username,
+        ui_mode=ui_mode,
+        canary_mode=canary_mode,
+        user_type=user_type)
+
+    if password:
+      result.password.ParseFromString(bytes(password))
+
+    return result
+
+  @sqlite_utils.WithTransaction(readonly=True)
+  def ReadGRRUser(self, username, cursor=None):
+    """Reads a user object corresponding to a given name."""
+    cursor.execute(
+        "SELECT username, password, ui_mode, canary_mode, user_type "
+        "FROM grr_users WHERE username=?", [username])
+
+    row = cursor.fetchone()
+    if row is None:
+      raise db.UnknownGRRUserError("User '%s' not found." % username)
+
+    return self._RowToGRRUser(row)
+
+  @sqlite_utils.WithTransaction(readonly=True)
+  def ReadAllGRRUsers(self, cursor=None):
+    cursor.execute("SELECT username, password, ui_mode, canary_mode, user_type "
+                   "FROM grr_users")
+    res = []
+    for row in cursor.fetchall():
+      res.append(self._RowToGRRUser(row))
+    return res
+
+  @sqlite_utils.WithTransaction()
+  def WriteApprovalRequest(self, approval_request, cursor=None):
+    """Writes an approval request object."""
+    # Copy the approval_request to ensure we don't modify the source object.
+    approval_request = approval_request.Copy()
+    approval_id = _NewApprovalID()
+    now = sqlite_utils.RDFDatetimeToInt(rdfvalue.RDFDatetime.Now())
+
+    grants = approval_request.grants
+    approval_request.grants = None
+
+    query = ("INSERT INTO approval_request (username, approval_type, "
+             "subject_id, approval_id, timestamp, expiration_time, "
+             "approval_request) VALUES (?, ?, ?, ?, ?, ?, ?)")
+
+    args = [
+        approval_request.requestor_username,
+        int(approval_request.approval_type), approval_request.subject_id,
+        approval_id, now,
+        sqlite_utils.RDFDatetimeToInt(approval_request.expiration_time),
+        sqlite_utils.Blob(approval_request.SerializeToString())
+    ]
+    cursor.execute(query, args)
+
+    cursor.executemany(
+        "INSERT OR IGNORE INTO approval_grant (username, approval_id, "
+        "grantor_username, timestamp) VALUES (?, ?, ?, ?)",
+        [(approval_request.requestor_username, approval_id,
+          grant.grantor_username, now) for grant in grants])
+
+    return approval_id
+
+  @sqlite_utils.WithTransaction()
+  def GrantApproval(self,
+                    requestor_username,
+                    approval_id,
+                    grantor_username,
+                    cursor=None):
+    """Grants approval for a given request using given username."""
+    cursor.execute(
+        "SELECT 1 FROM approval_request WHERE username=? AND approval_id=?",
+        [requestor_username, approval_id])
+    if cursor.fetchone() is None:
+      raise db.UnknownApprovalRequestError(
+          "Approval '%s' not found." % approval_id)
+
+    now = sqlite_utils.RDFDatetimeToInt(rdfvalue.RDFDatetime.Now())
+    cursor.execute(
+        "INSERT OR IGNORE INTO approval_grant (username, approval_id, "
+        "grantor_username, timestamp) VALUES (?, ?, ?, ?)",
+        [requestor_username, approval_id, grantor_username, now])
+
+  @sqlite_utils.WithTransaction(readonly=True)
+  def ReadApprovalRequest(self, requestor_username, approval_id, cursor=None):
+    """Reads an approval request object with a given id."""
+
+    query = ("SELECT ar.approval_id, ar.timestamp, ar.approval_request, "
+             "ag.grantor_username, ag.timestamp "
+             "FROM approval_request AS ar "
+             "LEFT JOIN approval_grant AS ag USING (username, approval_id) "
+             "WHERE ar.approval_id=? AND ar.username=? "
+             "ORDER BY ag.timestamp")
+
+    cursor.execute(query, [approval_id, requestor_username])
+    res = list(_ResponseToApprovalsWithGrants(cursor.fetchall()))
+    if not res:
+      raise db.UnknownApprovalRequestError(
+          "Approval '%s' not found." % approval_id)
+
+    return res[0]
+
+  @sqlite_utils.WithTransaction(readonly=True)
+  def ReadApprovalRequests(self,
+                           requestor_username,
+                           approval_type,
+                           subject_id=None,
+                           include_expired=False,
+                           cursor=None):
+    """Reads approval requests of a given type for a given user."""
+
+    query = ("SELECT ar.approval_id, ar.timestamp, ar.approval_request, "
+             "ag.grantor_username, ag.timestamp "
+             "FROM approval_request AS ar "
+             "LEFT JOIN approval_grant AS ag USING (username, approval_id) "
+             "WHERE ar.username=? AND ar.approval_type=?")
+
+    args = [requestor_username, int(approval_type)]
+
+    if subject_id:
+      query += " AND ar.subject_id = ?"
+      args.append(subject_id)
+
+    if not include_expired:
+      query += " AND ar.expiration_time >= ?"
+      args.append(sqlite_utils.RDFDatetimeToInt(rdfvalue.RDFDatetime.Now()))
+
+    query += " ORDER BY ar.approval_id, ag.timestamp"
+
+    cursor.execute(query, args)
+    return list(_ResponseToApprovalsWithGrants(cursor.fetchall()))
+
+  @sqlite_utils.WithTransaction()
+  def WriteUserNotification(self, notification, cursor=None):
+    """Writes a notification for a given user."""
+    # Copy the notification to ensure we don't modify the source object.
+    notification = notification.Copy()
+
+    if not notification.timestamp:
+      notification.timestamp = rdfvalue.RDFDatetime.Now()
+
+    query = ("INSERT INTO user_notification (username, timestamp, "
+             "notification_state, notification) "
+             "VALUES (?, ?, ?, ?)")
+
+    args = [
+        notification.username,
+        sqlite_utils.RDFDatetimeToInt(notification.timestamp),
+        int(notification.state),
+        sqlite_utils.Blob(notification.SerializeToString())
+    ]
+    try:
+      cursor.execute(query, args)
+    except sqlite3.IntegrityError:
+      raise db.UnknownGRRUserError("User %s not found!" % notification.username)
+
+  @sqlite_utils.WithTransaction(readonly=True)
+  def ReadUserNotifications(self,
+                            username,
+                            state=None,
+                            timerange=None,
+                            cursor=None):
+    """Reads notifications scheduled for a user within a given timerange."""
+
+    query = ("SELECT timestamp, notification_state, notification "
+             "FROM user_notification "
+             "WHERE username=? ")
+    args = [username]
+
+    if state is not None:
+      query += "AND notification_state = ? "
+      args.append(int(state))
+
+    if timerange is not None:
+      time_from, time_to = timerange  # pylint: disable=unpacking-non-sequence
+
+      if time_from is not None:
+        query += "AND timestamp >= ? "
+        args.append(sqlite_utils.RDFDatetimeToInt(time_from))
+
+      if time_to is not None:
+        query += "AND timestamp <= ? "
+        args.append(sqlite_utils.RDFDatetimeToInt(time_to))
+
+    query += "ORDER BY timestamp DESC "
+
+    ret = []
+    cursor.execute(query, args)
+
+    for timestamp, state, notification_ser in cursor.fetchall():
+      n = sqlite_utils.BlobToRDFProto(rdf_objects.UserNotification,
+                                      notification_ser)
+      n.timestamp = sqlite_utils.IntToRDFDatetime(timestamp)
+      n.state = state
+      ret.append(n)
+
+    return ret
+
+  @sqlite_utils.WithTransaction()
+  def UpdateUserNotifications(self,
+                              username,
+                              timestamps,
+                              state=None,
+                              cursor=None):
+    """Updates existing user notification objects."""
+    cursor.executemany(
+        "UPDATE user_notification SET notification_state = ? "
+        "WHERE username = ? AND timestamp = ?",
+        [(int(state), username, sqlite_utils.RDFDatetimeToInt(t))
+         for t in timestamps])
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+"""Utilities used by the SQLite database."""
+from __future__ import unicode_literals
+
+import functools
+import inspect
+import sqlite3
+
+from grr_response_core.lib import rdfvalue
+from grr_response_server import db_utils
+
+# SQLite limits the number of host parameters in a single statement to 999 by
+# default, queries with a variable number of arguments are split into batches
+# of this size.
+MAX_QUERY_VARIABLES = 500
+
+
+def Blob(value):
+  """Wraps serialized data so that it is stored as a BLOB."""
+  return value if value is None else sqlite3.Binary(value)
+
+
+def BlobToBytes(value):
+  return value if value is None else bytes(value)
+
+
+def BlobToRDFProto(proto_type, value):
+  if value is None:
+    return None
+  return proto_type.FromSerializedString(bytes(value))
+
+
+# Timestamps are stored as integer microseconds since epoch.
+def RDFDatetimeToInt(rdf):
+  if rdf is None:
+    return None
+  if not isinstance(rdf, rdfvalue.RDFDatetime):
+    raise ValueError(
+        "time value must be rdfvalue.RDFDatetime, got: %s" % type(rdf))
+  return rdf.AsMicrosecondsSinceEpoch()
+
+
+def IntToRDFDatetime(value):
+  return value if value is None else rdfvalue.RDFDatetime(value)
+
+
+# SQLite integers are signed 64 bit values. Unsigned 64 bit ids are shifted
+# into that range, which keeps them ordered the same way.
+def UInt64ToInt(value):
+  return value - 2**63
+
+
+def Placeholders(count):
+  return ", ".join(["?"] * count)
+
+
+class WithTransaction(object):
+  """Decorator that provides a cursor with transaction management.
+
+  Every function decorated @WithTransaction will receive a named 'cursor'
+  argument.
+
+  If the caller provides a cursor, it will be passed through without change.
+
+  Otherwise, the calling thread's connection is used to start a transaction and
+  the decorated function is called with a cursor on it. Afterwards the
+  transaction is committed. If the database is locked by another writer, the
+  decorated function may be called again after a short delay.
+  """
+
+  def __init__(self, readonly=False):
+    """Constructs a decorator.
+
+    Args:
+      readonly: Whether the decorated function only requires a readonly
+        transaction. Has no effect when a cursor is provided.
+    """
+    self.readonly = readonly
+
+  def __call__(self, func):
+    readonly = self.readonly
+
+    if "cursor" not in inspect.getargspec(func).args:
+      raise TypeError(
+          "@sqlite_utils.WithTransaction requires a function to take a "
+          "'cursor' argument.")
+
+    @functools.wraps(func)
+    def Decorated(self, *args, **kw):
+      """A function decorated by WithTransaction to receive a cursor."""
+      cursor = kw.get("cursor", None)
+      if cursor:
+        return func(self, *args, **kw)
+
+      def Closure(cursor):
+        new_kw = kw.copy()
+        new_kw["cursor"] = cursor
+        return func(self, *args, **new_kw)
+
+      return self._RunInTransaction(Closure, readonly)
+
+    return db_utils.CallLoggedAndAccounted(Decorated)
@@ -27,6 +27,9 @@ from grr_response_server import foreman_rules
 from grr_response_server.rdfvalues import cronjobs as rdf_cronjobs
 from grr_response_server.rdfvalues import objects as rdf_objects
 
+# Written audit events are counted per interval of this length.
+AUDIT_EVENT_COUNTS_INTERVAL = rdfvalue.Duration("1d")
+
 
 class Error(Exception):
 
@@ -454,6 +457,31 @@ class Database(with_metaclass(abc.ABCMeta, object)):
         ids.
     """
 
+  @abc.abstractmethod
+  def ListClientsMatchingKeywords(self,
+                                  keywords,
+                                  start_time=None,
+                                  offset=0,
+                                  count=None,
+                                  labels=None,
+                                  label_owners=None):
+    """Lists the clients associated with all of the given keywords.
+
+    Args:
+      keywords: An iterable container of keyword strings to look for.
+      start_time: If set, should be an rdfvalue.RDFDatime and the function will
+        only consider keywords associated after this time.
+      offset: The number of matching clients to skip.
+      count: If set, the maximum number of client ids to return.
+      labels: If set, an iterable of label names. Only clients with at least
+        one of these labels are listed.
+      label_owners: If set along with labels, an iterable of usernames. Only
+        labels owned by one of these users are considered.
+    Returns:
+      A sorted list of the ids of the clients associated with every keyword,
+      starting at the given offset.
+    """
+
   @abc.abstractmethod
   def RemoveClientKeyword(self, client_id, keyword):
     """Removes the association of a particular client to a keyword.
@@ -547,6 +575,18 @@ class Database(with_metaclass(abc.ABCMeta, object)):
   def RemoveExpiredForemanRules(self):
     """Removes all expired foreman rules from the database."""
 
+  @abc.abstractmethod
+  def ReadForemanRulesVersion(self):
+    """Reads a stamp identifying the current set of foreman rules.
+
+    Reading the stamp is much cheaper than reading the rules, so that callers
+    can cache the rules and only read them again when the stamp changes.
+
+    Returns:
+      An opaque value that changes whenever foreman rules are written or
+      removed.
+    """
+
   @abc.abstractmethod
   def WriteGRRUser(self,
                    username,
@@ -931,6 +971,44 @@ class Database(with_metaclass(abc.ABCMeta, object)):
       List of `rdf_events.AuditEvent` instances.
     """
 
+  @abc.abstractmethod
+  def ReadAuditEvents(self, timerange=None, actions=None, usernames=None):
+    """Reads audit events matching the given conditions.
+
+    Events are indexed by action and by username, so only matching events are
+    read.
+
+    Args:
+      timerange: Should be either a tuple of (from, to) or None. "from" and
+                 "to" should be rdfvalue.RDFDatetime or None values and are
+                 inclusive.
+      actions: If set, only events with one of these
+               `rdf_events.AuditEvent.Action` values are read.
+      usernames: If set, only events of one of these users are read.
+
+    Returns:
+      List of `rdf_events.AuditEvent` instances, oldest first.
+    """
+
+  @abc.abstractmethod
+  def ReadAuditEventCounts(self, timerange=None, actions=None):
+    """Reads the number of audit events written per user, action and flow.
+
+    Counts are maintained for every AUDIT_EVENT_COUNTS_INTERVAL when the events
+    are written, so reading them doesn't depend on the number of events.
+
+    Args:
+      timerange: Should be either a tuple of (from, to) or None. Only counts of
+                 intervals starting between "from" and "to" (inclusive) are
+                 read.
+      actions: If set, only events with one of these
+               `rdf_events.AuditEvent.Action` values are counted.
+
+    Returns:
+      A dict mapping (username, action, flow_name) tuples to the number of
+      events. Missing usernames and flow names are empty strings.
+    """
+
   @abc.abstractmethod
   def WriteAuditEvent(self, event):
     """Writes an audit event to the database.
@@ -1381,6 +1459,44 @@ class DatabaseValidationWrapper(Database):
 
     return self.delegate.ListClientsForKeywords(keywords, start_time=start_time)
 
+  def ListClientsMatchingKeywords(self,
+                                  keywords,
+                                  start_time=None,
+                                  offset=0,
+                                  count=None,
+                                  labels=None,
+                                  label_owners=None):
+    keywords = set(keywords)
+    if not keywords:
+      raise ValueError("At least one keyword is required.")
+
+    if start_time:
+      _ValidateTimestamp(start_time)
+
+    if offset < 0:
+      raise ValueError("offset must be non-negative, got %d." % offset)
+
+    if count is not None and count < 0:
+      raise ValueError("count must be non-negative, got %d." % count)
+
+    if labels is not None:
+      labels = set(labels)
+      for label in labels:
+        _ValidateLabel(label)
+
+    if label_owners is not None:
+      label_owners = set(label_owners)
+      for owner in label_owners:
+        _ValidateUsername(owner)
+
+    return self.delegate.ListClientsMatchingKeywords(
+        keywords,
+        start_time=start_time,
+        offset=offset,
+        count=count,
+        labels=labels,
+        label_owners=label_owners)
+
   def RemoveClientKeyword(self, client_id, keyword):
     _ValidateClientId(client_id)
 
@@ -1426,6 +1542,9 @@ class DatabaseValidationWrapper(Database):
   def RemoveExpiredForemanRules(self):
     return self.delegate.RemoveExpiredForemanRules()
 
+  def ReadForemanRulesVersion(self):
+    return self.delegate.ReadForemanRulesVersion()
+
   def WriteGRRUser(self,
                    username,
                    password=None,
@@ -1632,6 +1751,28 @@ class DatabaseValidationWrapper(Database):
   def ReadAllAuditEvents(self):
     return self.delegate.ReadAllAuditEvents()
 
+  def ReadAuditEvents(self, timerange=None, actions=None, usernames=None):
+    if timerange is not None:
+      _ValidateTimeRange(timerange)
+    if actions is not None:
+      actions = set(int(action) for action in actions)
+    if usernames is not None:
+      usernames = set(usernames)
+      for username in usernames:
+        _ValidateUsername(username)
+
+    return self.delegate.ReadAuditEvents(
+        timerange=timerange, actions=actions, usernames=usernames)
+
+  def ReadAuditEventCounts(self, timerange=None, actions=None):
+    if timerange is not None:
+      _ValidateTimeRange(timerange)
+    if actions is not None:
+      actions = set(int(action) for action in actions)
+
+    return self.delegate.ReadAuditEventCounts(
+        timerange=timerange, actions=actions)
+
   def WriteAuditEvent(self, event):
     utils.AssertType(event, rdf_events.AuditEvent)
     return self.delegate.WriteAuditEvent(event)
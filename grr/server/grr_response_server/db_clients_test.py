@@ -604,6 +604,77 @@ class DatabaseTestClientsMixin(object):
     self.assertEqual(res["hostname1"], [])
     self.assertEqual(res["hostname2"], [client_id])
 
+  def testListClientsMatchingKeywords(self):
+    d = self.db
+    client_ids = sorted(self.InitializeClient() for _ in range(5))
+
+    for i, client_id in enumerate(client_ids):
+      keywords = [".", "machine"]
+      if i % 2 == 0:
+        keywords.append("even")
+      d.AddClientKeywords(client_id, keywords)
+
+    self.assertEqual(d.ListClientsMatchingKeywords(["."]), client_ids)
+    self.assertEqual(
+        d.ListClientsMatchingKeywords([".", "even"]), client_ids[::2])
+    self.assertEqual(
+        d.ListClientsMatchingKeywords(["even", "machine"], offset=1, count=1),
+        [client_ids[2]])
+    self.assertEqual(
+        d.ListClientsMatchingKeywords(["machine"], offset=3), client_ids[3:])
+    self.assertEqual(
+        d.ListClientsMatchingKeywords(["machine"], count=0), [])
+    self.assertEqual(d.ListClientsMatchingKeywords(["even", "missing"]), [])
+
+    d.RemoveClientKeyword(client_ids[0], "even")
+    self.assertEqual(d.ListClientsMatchingKeywords(["even"]), client_ids[2::2])
+
+  def testListClientsMatchingKeywordsTimeRanges(self):
+    d = self.db
+    client_id_1 = self.InitializeClient()
+    client_id_2 = self.InitializeClient()
+
+    d.AddClientKeywords(client_id_1, ["hostname", "machine"])
+    d.AddClientKeywords(client_id_2, ["hostname"])
+    change_time = rdfvalue.RDFDatetime.Now()
+    d.AddClientKeywords(client_id_2, ["machine"])
+
+    self.assertEqual(
+        d.ListClientsMatchingKeywords(["machine"], start_time=change_time),
+        [client_id_2])
+    self.assertEqual(
+        d.ListClientsMatchingKeywords(["hostname", "machine"],
+                                      start_time=change_time), [])
+
+  def testListClientsMatchingKeywordsLabels(self):
+    d = self.db
+    client_ids = sorted(self.InitializeClient() for _ in range(4))
+    for client_id in client_ids:
+      d.AddClientKeywords(client_id, [".", "machine"])
+
+    d.AddClientLabels(client_ids[0], "david", ["foo"])
+    d.AddClientLabels(client_ids[1], "david", ["not-foo"])
+    d.AddClientLabels(client_ids[2], "peter", ["bar"])
+    d.AddClientLabels(client_ids[3], "peter", ["bar", "foo"])
+
+    self.assertEqual(
+        d.ListClientsMatchingKeywords(["."], labels=["foo", "bar"]),
+        [client_ids[0], client_ids[2], client_ids[3]])
+    self.assertEqual(
+        d.ListClientsMatchingKeywords(["machine"],
+                                      labels=["foo", "bar"],
+                                      label_owners=["david"]), [client_ids[0]])
+    self.assertEqual(
+        d.ListClientsMatchingKeywords(["."],
+                                      labels=["foo"],
+                                      label_owners=["david", "peter"],
+                                      offset=1,
+                                      count=1), [client_ids[3]])
+    self.assertEqual(
+        d.ListClientsMatchingKeywords(["."], labels=["foo"], label_owners=[]),
+        [])
+    self.assertEqual(d.ListClientsMatchingKeywords(["."], labels=[]), [])
+
   def testRemoveClientKeyword(self):
     d = self.db
     client_id = self.InitializeClient()
@@ -2,6 +2,7 @@
 from grr_response_core.lib import rdfvalue
 from grr_response_core.lib.rdfvalues import client as rdf_client
 from grr_response_core.lib.rdfvalues import events as rdf_events
+from grr.test_lib import test_lib
 
 
 class DatabaseEventsTestMixin(object):
@@ -45,3 +46,96 @@ class DatabaseEventsTestMixin(object):
     self.assertGreater(log[0].timestamp, timestamp)
     self.assertGreater(log[1].timestamp, timestamp)
     self.assertGreater(log[2].timestamp, timestamp)
+
+  def _WriteEvents(self):
+    with test_lib.FakeTime(
+        rdfvalue.RDFDatetime.FromHumanReadable("2018-01-01")):
+      self.db.WriteAuditEvent(
+          rdf_events.AuditEvent(
+              action=rdf_events.AuditEvent.Action.RUN_FLOW,
+              user="foo",
+              flow_name="Flow1"))
+
+    with test_lib.FakeTime(
+        rdfvalue.RDFDatetime.FromHumanReadable("2018-01-02 10:00")):
+      self.db.WriteAuditEvent(
+          rdf_events.AuditEvent(
+              action=rdf_events.AuditEvent.Action.RUN_FLOW,
+              user="bar",
+              flow_name="Flow1"))
+      self.db.WriteAuditEvent(
+          rdf_events.AuditEvent(
+              action=rdf_events.AuditEvent.Action.HUNT_CREATED, user="foo"))
+
+    with test_lib.FakeTime(
+        rdfvalue.RDFDatetime.FromHumanReadable("2018-01-02 12:00")):
+      self.db.WriteAuditEvent(
+          rdf_events.AuditEvent(
+              action=rdf_events.AuditEvent.Action.RUN_FLOW,
+              user="foo",
+              flow_name="Flow2"))
+
+  def testReadAuditEventsFiltersByTimeActionAndUser(self):
+    self._WriteEvents()
+
+    def Read(**kwargs):
+      return [(int(e.action), e.user, e.flow_name)
+              for e in self.db.ReadAuditEvents(**kwargs)]
+
+    run_flow = int(rdf_events.AuditEvent.Action.RUN_FLOW)
+    hunt_created = int(rdf_events.AuditEvent.Action.HUNT_CREATED)
+
+    self.assertEqual(
+        Read(), [(run_flow, "foo", "Flow1"), (run_flow, "bar", "Flow1"),
+                 (hunt_created, "foo", ""), (run_flow, "foo", "Flow2")])
+    self.assertEqual(
+        Read(actions=[rdf_events.AuditEvent.Action.HUNT_CREATED]),
+        [(hunt_created, "foo", "")])
+    self.assertEqual(
+        Read(usernames=[u"foo"]), [(run_flow, "foo", "Flow1"),
+                                  (hunt_created, "foo", ""),
+                                  (run_flow, "foo", "Flow2")])
+    self.assertEqual(
+        Read(
+            timerange=(rdfvalue.RDFDatetime.FromHumanReadable("2018-01-02"),
+                       rdfvalue.RDFDatetime.FromHumanReadable(
+                           "2018-01-02 11:00")),
+            actions=[rdf_events.AuditEvent.Action.RUN_FLOW],
+            usernames=[u"foo", u"bar"]), [(run_flow, "bar", "Flow1")])
+    self.assertEqual(Read(actions=[]), [])
+
+  def testReadAuditEventCounts(self):
+    self._WriteEvents()
+
+    run_flow = int(rdf_events.AuditEvent.Action.RUN_FLOW)
+    hunt_created = int(rdf_events.AuditEvent.Action.HUNT_CREATED)
+
+    self.assertEqual(
+        self.db.ReadAuditEventCounts(), {
+            ("foo", run_flow, "Flow1"): 1,
+            ("bar", run_flow, "Flow1"): 1,
+            ("foo", run_flow, "Flow2"): 1,
+            ("foo", hunt_created, ""): 1,
+        })
+
+    second_day = rdfvalue.RDFDatetime.FromHumanReadable("2018-01-02")
+    self.assertEqual(
+        self.db.ReadAuditEventCounts(
+            timerange=(second_day, second_day),
+            actions=[rdf_events.AuditEvent.Action.RUN_FLOW]), {
+                ("bar", run_flow, "Flow1"): 1,
+                ("foo", run_flow, "Flow2"): 1,
+            })
+
+  def testReadAuditEventCountsSumsEventsOfAllIntervals(self):
+    for day in ["2018-01-01", "2018-01-02", "2018-01-02 23:59"]:
+      with test_lib.FakeTime(rdfvalue.RDFDatetime.FromHumanReadable(day)):
+        self.db.WriteAuditEvent(
+            rdf_events.AuditEvent(
+                action=rdf_events.AuditEvent.Action.RUN_FLOW,
+                user="foo",
+                flow_name="Flow1"))
+
+    self.assertEqual(
+        self.db.ReadAuditEventCounts(),
+        {("foo", int(rdf_events.AuditEvent.Action.RUN_FLOW), "Flow1"): 3})
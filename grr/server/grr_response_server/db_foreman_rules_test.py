@@ -82,3 +82,23 @@ class DatabaseTestForemanRulesMixin(object):
     with test_lib.FakeTime(590):
       self.db.RemoveExpiredForemanRules()
       self.assertEqual(len(self.db.ReadAllForemanRules()), 1)
+
+  def testForemanRulesVersionChangesWithRules(self):
+    versions = [self.db.ReadForemanRulesVersion()]
+
+    self.db.WriteForemanRule(self._GetTestRule("H:123456"))
+    versions.append(self.db.ReadForemanRulesVersion())
+    self.assertEqual(self.db.ReadForemanRulesVersion(), versions[-1])
+
+    self.db.WriteForemanRule(self._GetTestRule("H:654321"))
+    versions.append(self.db.ReadForemanRulesVersion())
+
+    rule = self._GetTestRule("H:654321")
+    rule.description = "Updated test rule"
+    self.db.WriteForemanRule(rule)
+    versions.append(self.db.ReadForemanRulesVersion())
+
+    self.db.RemoveForemanRule("H:123456")
+    versions.append(self.db.ReadForemanRulesVersion())
+
+    self.assertEqual(len(set(versions)), len(versions))
@@ -6,10 +6,14 @@ Exporters defined here convert various complex RDFValues to simple RDFValues
 easily be written to a relational database or just to a set of files.
 """
 
+import collections
+import functools
 import hashlib
+import itertools
 import json
 import logging
 import re
+import threading
 import time
 
 
@@ -20,6 +24,7 @@ from future.utils import with_metaclass
 
 from grr_response_core.lib import rdfvalue
 from grr_response_core.lib import registry
+from grr_response_core.lib import sharded_cache
 from grr_response_core.lib import utils
 from grr_response_core.lib.rdfvalues import client as rdf_client
 from grr_response_core.lib.rdfvalues import client_fs as rdf_client_fs
@@ -29,7 +34,9 @@ from grr_response_core.lib.rdfvalues import protodict as rdf_protodict
 from grr_response_core.lib.rdfvalues import structs as rdf_structs
 from grr_response_proto import export_pb2
 from grr_response_server import aff4
+from grr_response_server import data_store
 from grr_response_server import data_store_utils
+from grr_response_server import threadpool
 from grr_response_server.aff4_objects import filestore
 from grr_response_server.flows.general import collectors as flow_collectors
 
@@ -41,6 +48,32 @@ try:
 except ImportError:
   pass
 
+# Metadata of recently exported clients. Exports of large hunts convert results
+# of the same clients over and over again, the cache is shared by all the
+# converters and output plugins in the process.
+CLIENT_METADATA_CACHE_MAX_SIZE = 100000
+
+# Seconds for which client metadata is cached.
+CLIENT_METADATA_CACHE_MAX_AGE = 600
+
+CLIENT_METADATA_CACHE = sharded_cache.ShardedCache(
+    max_size=CLIENT_METADATA_CACHE_MAX_SIZE,
+    max_age=CLIENT_METADATA_CACHE_MAX_AGE,
+    name="export_client_metadata")
+
+# Values of the same type are converted in chunks of this size. Chunks are
+# converted in parallel on a thread pool.
+CONVERSION_CHUNK_SIZE = 1000
+
+# The number of chunks converted at the same time. Converted chunks are kept in
+# memory until all the chunks before them are yielded, so this also bounds the
+# memory used by a conversion.
+CONVERSION_THREADS = 4
+
+# Marks the threads converting a chunk. Conversions started by converters
+# themselves run in the converting thread instead of starting more threads.
+_conversion_thread = threading.local()
+
 
 class Error(Exception):
   """Errors generated by export converters."""
@@ -1054,10 +1087,6 @@ class GrrMessageConverter(ExportConverter):
 
   input_rdf_type = "GrrMessage"
 
-  def __init__(self, *args, **kw):
-    super(GrrMessageConverter, self).__init__(*args, **kw)
-    self.cached_metadata = {}
-
   def Convert(self, metadata, grr_message, token=None):
     """Converts GrrMessage into a set of RDFValues.
 
@@ -1091,26 +1120,7 @@ class GrrMessageConverter(ExportConverter):
     for metadata, msg in metadata_value_pairs:
       msg_dict.setdefault(msg.source, []).append((metadata, msg))
 
-    metadata_objects = []
-    metadata_to_fetch = []
-
-    # Open the clients we don't have metadata for and fetch metadata.
-    for client_urn in msg_dict:
-      try:
-        metadata_objects.append(self.cached_metadata[client_urn])
-      except KeyError:
-        metadata_to_fetch.append(client_urn)
-
-    if metadata_to_fetch:
-      client_fds = aff4.FACTORY.MultiOpen(
-          metadata_to_fetch, mode="r", token=token)
-
-      fetched_metadata = [
-          GetMetadata(client_fd, token=token) for client_fd in client_fds
-      ]
-      for metadata in fetched_metadata:
-        self.cached_metadata[metadata.client_urn] = metadata
-      metadata_objects.extend(fetched_metadata)
+    metadata_objects = itervalues(MultiGetMetadata(msg_dict, token=token))
 
     data_by_type = {}
     for metadata in metadata_objects:
@@ -1932,6 +1942,30 @@ class RekallResponseToExportedRekallKernelObjectConverter(
       pass
 
 
+def _LabelsMetadata(metadata, labels):
+  """Fills in the label fields of ExportedMetadata."""
+  system_labels = set()
+  user_labels = set()
+  for l in labels:
+    if l.owner == "GRR":
+      system_labels.add(l.name)
+    else:
+      user_labels.add(l.name)
+
+  metadata.labels = u",".join(sorted(system_labels | user_labels))
+
+  metadata.system_labels = u",".join(sorted(system_labels))
+
+  metadata.user_labels = u",".join(sorted(user_labels))
+
+
+def _UsernamesMetadata(kb):
+  usernames = u""
+  if kb:
+    usernames = [user.username for user in kb.users] or u""
+  return utils.SmartUnicode(usernames)
+
+
 def GetMetadata(client, token=None):
   """Builds ExportedMetadata object for a given client id.
 
@@ -1966,39 +2000,151 @@ def GetMetadata(client, token=None):
   metadata.os_version = utils.SmartUnicode(
       client_fd.Get(client_fd.Schema.OS_VERSION, u""))
 
-  kb = client_fd.Get(client_fd.Schema.KNOWLEDGE_BASE)
-  usernames = u""
-  if kb:
-    usernames = [user.username for user in kb.users] or u""
-  metadata.usernames = utils.SmartUnicode(usernames)
+  metadata.usernames = _UsernamesMetadata(
+      client_fd.Get(client_fd.Schema.KNOWLEDGE_BASE))
 
   metadata.mac_address = utils.SmartUnicode(
       client_fd.Get(client_fd.Schema.MAC_ADDRESS, u""))
 
-  system_labels = set()
-  user_labels = set()
-  for l in client_fd.GetLabels():
-    if l.owner == "GRR":
-      system_labels.add(l.name)
-    else:
-      user_labels.add(l.name)
+  _LabelsMetadata(metadata, client_fd.GetLabels())
 
-  metadata.labels = u",".join(sorted(system_labels | user_labels))
+  metadata.hardware_info = client_fd.Get(client_fd.Schema.HARDWARE_INFO)
 
-  metadata.system_labels = u",".join(sorted(system_labels))
+  metadata.kernel_version = client_fd.Get(client_fd.Schema.KERNEL)
 
-  metadata.user_labels = u",".join(sorted(user_labels))
+  return metadata
 
-  metadata.hardware_info = client_fd.Get(client_fd.Schema.HARDWARE_INFO)
 
-  metadata.kernel_version = client_fd.Get(client_fd.Schema.KERNEL)
+def GetMetadataFromClientInfo(client_id, client_info):
+  """Builds ExportedMetadata object from a relational db ClientFullInfo.
+
+  Args:
+    client_id: Id of the client.
+    client_info: rdf_objects.ClientFullInfo of the client.
+
+  Returns:
+    ExportedMetadata object with metadata of the client.
+  """
+  metadata = ExportedMetadata()
+
+  metadata.client_urn = rdf_client.ClientURN(client_id)
+
+  snapshot = client_info.last_snapshot
+  if snapshot:
+    kb = snapshot.knowledge_base
+
+    metadata.client_age = snapshot.timestamp
+
+    metadata.hostname = utils.SmartUnicode(kb.fqdn or u"")
+
+    metadata.os = utils.SmartUnicode(kb.os or u"")
+
+    metadata.uname = utils.SmartUnicode(snapshot.Uname())
+
+    metadata.os_release = utils.SmartUnicode(snapshot.os_release or u"")
+
+    metadata.os_version = utils.SmartUnicode(snapshot.os_version or u"")
+
+    metadata.usernames = _UsernamesMetadata(kb)
+
+    metadata.mac_address = u"\n".join(snapshot.GetMacAddresses())
+
+    if snapshot.HasField("hardware_info"):
+      metadata.hardware_info = snapshot.hardware_info
+
+    if snapshot.kernel:
+      metadata.kernel_version = snapshot.kernel
+
+  _LabelsMetadata(metadata, client_info.labels)
 
   return metadata
 
 
+def MultiGetMetadata(client_urns, token=None):
+  """Builds ExportedMetadata objects for a number of clients.
+
+  Metadata is served from CLIENT_METADATA_CACHE where possible, all the other
+  clients are read from the data store at once.
+
+  Args:
+    client_urns: Iterable with client ids or ClientURNs.
+    token: Security token.
+
+  Returns:
+    A dict mapping ClientURNs to ExportedMetadata objects. Clients that don't
+    exist are missing from the result. Every call returns new ExportedMetadata
+    objects, so they can be modified by the caller.
+  """
+  result = {}
+  urns_to_fetch = {}
+
+  for urn in client_urns:
+    urn = rdf_client.ClientURN(urn)
+    client_id = urn.Basename()
+    try:
+      result[urn] = ExportedMetadata(CLIENT_METADATA_CACHE.Get(client_id))
+    except KeyError:
+      urns_to_fetch[client_id] = urn
+
+  if not urns_to_fetch:
+    return result
+
+  if data_store.RelationalDBReadEnabled():
+    client_infos = data_store.REL_DB.MultiReadClientFullInfo(
+        list(urns_to_fetch))
+    fetched_metadata = [
+        GetMetadataFromClientInfo(client_id, client_info)
+        for client_id, client_info in iteritems(client_infos)
+        if client_info.metadata
+    ]
+  else:
+    client_fds = aff4.FACTORY.MultiOpen(
+        itervalues(urns_to_fetch), mode="r", token=token)
+    fetched_metadata = [
+        GetMetadata(client_fd, token=token) for client_fd in client_fds
+    ]
+
+  for metadata in fetched_metadata:
+    client_id = metadata.client_urn.Basename()
+    CLIENT_METADATA_CACHE.Put(client_id, metadata)
+    result[urns_to_fetch[client_id]] = ExportedMetadata(metadata)
+
+  return result
+
+
+def _ConvertChunk(converter, metadata_value_pairs, token=None):
+  """Converts a chunk of values, marking the thread as converting."""
+  _conversion_thread.converting = True
+  try:
+    return list(converter.BatchConvert(metadata_value_pairs, token=token))
+  finally:
+    _conversion_thread.converting = False
+
+
+def _ConvertChunks(chunks, token=None):
+  """Converts (converter, metadata_value_pairs) chunks on a thread pool."""
+  with threadpool.ReadAhead(
+      CONVERSION_THREADS, name="ExportConversion") as read_ahead:
+    for converter, chunk in chunks:
+      for results in read_ahead.Add(
+          functools.partial(_ConvertChunk, converter, chunk, token=token)):
+        for result in results:
+          yield result
+
+    for results in read_ahead.Drain():
+      for result in results:
+        yield result
+
+
 def ConvertValuesWithMetadata(metadata_value_pairs, token=None, options=None):
   """Converts a set of RDFValues into a set of export-friendly RDFValues.
 
+  Values are grouped by type and every group is split into chunks of
+  CONVERSION_CHUNK_SIZE values which are converted in parallel. Converted
+  values are yielded in a deterministic order: types in the order they are
+  first seen, converters in the order they are registered and chunks in the
+  order of the values.
+
   Args:
     metadata_value_pairs: Tuples of (metadata, rdf_value), where metadata is
                           an instance of ExportedMetadata and rdf_value is
@@ -2018,10 +2164,14 @@ def ConvertValuesWithMetadata(metadata_value_pairs, token=None, options=None):
                       converters, only the last one will be specified in the
                       exception message.
   """
+  metadata_values_groups = collections.OrderedDict()
+  for metadata, value in metadata_value_pairs:
+    metadata_values_groups.setdefault(value.__class__.__name__, []).append(
+        (metadata, value))
+
   no_converter_found_error = None
-  for metadata_values_group in itervalues(
-      utils.GroupBy(metadata_value_pairs,
-                    lambda pair: pair[1].__class__.__name__)):
+  chunks = []
+  for metadata_values_group in itervalues(metadata_values_groups):
 
     _, first_value = metadata_values_group[0]
     converters_classes = ExportConverter.GetConvertersByValue(first_value)
@@ -2030,10 +2180,20 @@ def ConvertValuesWithMetadata(metadata_value_pairs, token=None, options=None):
           first_value)
       continue
 
-    converters = [cls(options) for cls in converters_classes]
-    for converter in converters:
-      for result in converter.BatchConvert(metadata_values_group, token=token):
-        yield result
+    # Every chunk gets its own converter, converters are not thread safe.
+    for cls in converters_classes:
+      for chunk in utils.Grouper(metadata_values_group, CONVERSION_CHUNK_SIZE):
+        chunks.append((cls(options), chunk))
+
+  if len(chunks) > 1 and not getattr(_conversion_thread, "converting", False):
+    results = _ConvertChunks(chunks, token=token)
+  else:
+    results = itertools.chain.from_iterable(
+        converter.BatchConvert(chunk, token=token)
+        for converter, chunk in chunks)
+
+  for result in results:
+    yield result
 
   if no_converter_found_error is not None:
     raise NoConverterFound(no_converter_found_error)
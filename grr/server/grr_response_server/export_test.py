@@ -5,10 +5,13 @@ import json
 import os
 import socket
 
+import mock
+
 from grr_response_client.components.rekall_support import grr_rekall
 from grr_response_core.lib import flags
 from grr_response_core.lib import queues
 from grr_response_core.lib import rdfvalue
+from grr_response_core.lib import utils
 from grr_response_core.lib.rdfvalues import anomaly as rdf_anomaly
 from grr_response_core.lib.rdfvalues import client as rdf_client
 from grr_response_core.lib.rdfvalues import client_fs as rdf_client_fs
@@ -159,6 +162,23 @@ class ExportTest(ExportTestBase):
                     (result[0] == DummyRDFValue2("someB") and
                      result[1] == DummyRDFValue("someA")))
 
+  def testConvertsChunksInParallelInOrder(self):
+    values = [DummyRDFValue("value%d" % i) for i in range(10)]
+    values.extend(DummyRDFValue3("other%d" % i) for i in range(5))
+
+    with utils.Stubber(export, "CONVERSION_CHUNK_SIZE", 3):
+      result = list(export.ConvertValues(self.metadata, values))
+
+    self.assertEqual(result[:10],
+                     [rdfvalue.RDFString("value%d" % i) for i in range(10)])
+
+    # Both DummyRDFValue3 converters keep the order of the values.
+    self.assertEqual(len(result), 20)
+    self.assertEqual([r for r in result if isinstance(r, DummyRDFValue)],
+                     [DummyRDFValue("other%dA" % i) for i in range(5)])
+    self.assertEqual([r for r in result if isinstance(r, DummyRDFValue2)],
+                     [DummyRDFValue2("other%dB" % i) for i in range(5)])
+
   def _ConvertsCollectionWithValuesWithSingleConverter(self, coll_type):
     with data_store.DB.GetMutationPool() as pool:
       fd = coll_type(rdfvalue.RDFURN("aff4:/testcoll"))
@@ -670,6 +690,43 @@ class ExportTest(ExportTestBase):
     metadata = export.GetMetadata(client_id, token=self.token)
     self.assertFalse(metadata.usernames)
 
+  def testMultiGetMetadata(self):
+    client_ids = self.SetupClients(2)
+    missing_client_id = rdf_client.ClientURN("C.4815162342108108")
+
+    result = export.MultiGetMetadata(
+        client_ids + [missing_client_id], token=self.token)
+
+    self.assertItemsEqual(result, client_ids)
+    for i, client_id in enumerate(client_ids):
+      metadata = result[client_id]
+      self.assertEqual(metadata.client_urn, client_id)
+      self.assertEqual(metadata.os, u"Linux")
+      self.assertEqual(metadata.kernel_version, u"4.0.0")
+      self.assertEqual(metadata.mac_address,
+                       u"aabbccddee%02x\nbbccddeeff%02x" % (i, i))
+      self.assertEqual(metadata.hardware_info.bios_version,
+                       u"Bios-Version-%x" % i)
+      self.assertIn(u"user1", metadata.usernames)
+
+  def testMultiGetMetadataIsCached(self):
+    client_id = self.SetupClient(1)
+
+    metadata = export.MultiGetMetadata([client_id], token=self.token)[client_id]
+    metadata.source_urn = rdfvalue.RDFURN("aff4:/hunts/H:123456/Results")
+
+    with mock.patch.object(
+        aff4.FACTORY, "MultiOpen",
+        side_effect=AssertionError("Unexpected read.")), mock.patch.object(
+            data_store.REL_DB,
+            "MultiReadClientFullInfo",
+            side_effect=AssertionError("Unexpected read.")):
+      cached = export.MultiGetMetadata([client_id], token=self.token)
+
+    self.assertEqual(cached[client_id].os, u"Linux")
+    # Changes made by callers don't end up in the cache.
+    self.assertFalse(cached[client_id].source_urn)
+
   def testClientSummaryToExportedClientConverter(self):
     client_summary = rdf_client.ClientSummary()
     metadata = export.ExportedMetadata(hostname="ahostname")
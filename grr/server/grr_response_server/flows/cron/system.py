@@ -2,6 +2,7 @@
 """These flows are system-specific GRR cron flows."""
 
 import bisect
+import functools
 import logging
 import time
 
@@ -10,9 +11,11 @@ from builtins import zip  # pylint: disable=redefined-builtin
 from future.utils import iteritems
 from future.utils import itervalues
 from future.utils import viewkeys
+from future.utils import with_metaclass
 
 from fleetspeak.src.server.proto.fleetspeak_server import admin_pb2
 from grr_response_core.lib import rdfvalue
+from grr_response_core.lib import registry
 from grr_response_core.lib import utils
 from grr_response_core.lib.rdfvalues import stats as rdf_stats
 from grr_response_server import aff4
@@ -21,6 +24,7 @@ from grr_response_server import data_store
 from grr_response_server import export_utils
 from grr_response_server import fleetspeak_connector
 from grr_response_server import fleetspeak_utils
+from grr_response_server import threadpool
 from grr_response_server.aff4_objects import aff4_grr
 from grr_response_server.aff4_objects import cronjobs as aff4_cronjobs
 from grr_response_server.aff4_objects import stats as aff4_stats
@@ -50,7 +54,7 @@ class _ActiveCounter(object):
     self.attribute = attribute
     self.categories = dict([(x, {}) for x in self.active_days])
 
-  def Add(self, category, label, age):
+  def Add(self, category, label, age, now=None):
     """Adds another instance of this category into the active_days counter.
 
     We automatically count the event towards all relevant active_days. For
@@ -62,8 +66,10 @@ class _ActiveCounter(object):
       category: The category name to account this instance against.
       label: Client label to which this should be applied.
       age: When this instance occurred.
+      now: The current time, if not given RDFDatetime.Now() is used.
     """
-    now = rdfvalue.RDFDatetime.Now()
+    if now is None:
+      now = rdfvalue.RDFDatetime.Now()
     category = utils.SmartUnicode(category)
 
     for active_time in self.active_days:
@@ -72,8 +78,13 @@ class _ActiveCounter(object):
         self.categories[active_time][label][
             category] = self.categories[active_time][label].get(category, 0) + 1
 
-  def Save(self, cron_flow):
-    """Generate a histogram object and store in the specified attribute."""
+  def Save(self, stats_for_label):
+    """Generate a histogram object and store in the specified attribute.
+
+    Args:
+      stats_for_label: A function returning the ClientFleetStats object the
+        histogram of a given label is added to.
+    """
     histograms = {}
     for active_time in self.active_days:
       for label in self.categories[active_time]:
@@ -88,9 +99,7 @@ class _ActiveCounter(object):
     for label, histogram in iteritems(histograms):
       # Add an additional instance of this histogram (without removing previous
       # instances).
-      # pylint: disable=protected-access
-      cron_flow._StatsForLabel(label).AddAttribute(histogram)
-      # pylint: enable=protected-access
+      stats_for_label(label).AddAttribute(histogram)
 
 
 def _GetLastContactFromFleetspeak(client_ids):
@@ -122,23 +131,62 @@ def _GetLastContactFromFleetspeak(client_ids):
   return last_contact_times
 
 
-CLIENT_READ_BATCH_SIZE = 50000
+CLIENT_READ_BATCH_SIZE = 10000
+
+# The number of client batches _IterateAllClients reads in parallel.
+CLIENT_READ_THREADS = 4
+
+
+def _ReadClientBatch(client_ids):
+  """Reads full info objects for a batch of clients from the relational db."""
+  client_map = data_store.REL_DB.MultiReadClientFullInfo(client_ids)
+  fs_client_ids = [
+      cid for (cid, client) in iteritems(client_map)
+      if client.metadata.fleetspeak_enabled
+  ]
+  last_contact_times = _GetLastContactFromFleetspeak(fs_client_ids)
+  for cid, last_contact in iteritems(last_contact_times):
+    client_map[cid].metadata.ping = last_contact
+  return list(itervalues(client_map))
 
 
-def _IterateAllClients():
-  """Fetches client data from the relational db."""
+def _IterateAllClients(batch_size=None, num_threads=None):
+  """Fetches client data from the relational db.
+
+  Batches of clients are read on a thread pool while the caller is processing
+  the previous ones. At most num_threads batches are read ahead, so the memory
+  used doesn't grow with the size of the fleet.
+
+  Args:
+    batch_size: The number of clients read with a single db call, defaults to
+      CLIENT_READ_BATCH_SIZE.
+    num_threads: The number of batches read in parallel, defaults to
+      CLIENT_READ_THREADS.
+
+  Yields:
+    rdf_objects.ClientFullInfo objects.
+  """
+  batch_size = batch_size or CLIENT_READ_BATCH_SIZE
+  num_threads = num_threads or CLIENT_READ_THREADS
+
   all_client_ids = data_store.REL_DB.ReadAllClientIDs()
-  for batch in utils.Grouper(all_client_ids, CLIENT_READ_BATCH_SIZE):
-    client_map = data_store.REL_DB.MultiReadClientFullInfo(batch)
-    fs_client_ids = [
-        cid for (cid, client) in iteritems(client_map)
-        if client.metadata.fleetspeak_enabled
-    ]
-    last_contact_times = _GetLastContactFromFleetspeak(fs_client_ids)
-    for cid, last_contact in iteritems(last_contact_times):
-      client_map[cid].metadata.ping = last_contact
-    for client in itervalues(client_map):
-      yield client
+  batches = list(utils.Grouper(all_client_ids, batch_size))
+
+  if num_threads <= 1 or len(batches) <= 1:
+    for batch in batches:
+      for client in _ReadClientBatch(batch):
+        yield client
+    return
+
+  with threadpool.ReadAhead(num_threads, name="ClientFleetScan") as read_ahead:
+    for batch in batches:
+      for clients in read_ahead.Add(functools.partial(_ReadClientBatch, batch)):
+        for client in clients:
+          yield client
+
+    for clients in read_ahead.Drain():
+      for client in clients:
+        yield client
 
 
 def _IterateAllLegacyClients(token):
@@ -163,77 +211,61 @@ def _IterateAllLegacyClients(token):
       yield last_contact, client
 
 
-class AbstractClientStatsCronJob(cronjobs.SystemCronJobBase):
-  """Base class for all stats processing cron jobs."""
+class ClientFleetStatsAggregator(
+    with_metaclass(registry.MetaclassRegistry, object)):
+  """Base class for the breakdowns computed from a scan of the client fleet.
 
-  CLIENT_STATS_URN = rdfvalue.RDFURN("aff4:/stats/ClientFleetStats")
-
-  def BeginProcessing(self):
-    pass
-
-  def ProcessClientFullInfo(self, client_full_info):
-    raise NotImplementedError()
-
-  def FinishProcessing(self):
-    pass
-
-  def _GetClientLabelsList(self, client):
-    """Get set of labels applied to this client."""
-    return set(["All"] + list(client.GetLabelsNames(owner="GRR")))
+  The clients are read once per scan and every aggregator run by the scan gets
+  to see each of them, so registering another aggregator doesn't cost an extra
+  pass over the client table. Sites can add their own breakdowns by
+  subclassing this class.
+  """
 
-  def _StatsForLabel(self, label):
-    if label not in self.stats:
-      self.stats[label] = aff4.FACTORY.Create(
-          self.CLIENT_STATS_URN.Add(label),
-          aff4_stats.ClientFleetStats,
-          mode="w",
-          token=self.token)
-    return self.stats[label]
+  __abstract = True  # pylint: disable=g-bad-name
 
-  def Run(self):
-    """Retrieve all the clients for the AbstractClientStatsCollectors."""
-    try:
+  # How often ClientFleetStatsCronJob records the stats of this aggregator.
+  frequency = rdfvalue.Duration("1d")
 
-      self.stats = {}
+  def __init__(self, now):
+    """Constructor.
 
-      self.BeginProcessing()
+    Args:
+      now: The time of the scan, used to compute the age of clients.
+    """
+    self.now = now
 
-      processed_count = 0
-      for client in _IterateAllClients():
-        self.ProcessClientFullInfo(client)
-        processed_count += 1
+  def ProcessClientFullInfo(self, client_full_info, labels):
+    """Accounts for a single client.
 
-        # This flow is not dead: we don't want to run out of lease time.
-        self.HeartBeat()
+    Args:
+      client_full_info: The rdf_objects.ClientFullInfo of the client.
+      labels: The set of labels the client's stats are recorded for.
+    """
+    raise NotImplementedError()
 
-      self.FinishProcessing()
-      for fd in itervalues(self.stats):
-        fd.Close()
+  def Save(self, stats_for_label):
+    """Adds the computed stats to the ClientFleetStats objects.
 
-      logging.info("%s: processed %d clients.", self.__class__.__name__,
-                   processed_count)
-    except Exception as e:  # pylint: disable=broad-except
-      logging.exception("Error while calculating stats: %s", e)
-      raise
+    Args:
+      stats_for_label: A function returning the ClientFleetStats object the
+        stats of a given label are added to.
+    """
+    raise NotImplementedError()
 
 
-class GRRVersionBreakDownCronJob(AbstractClientStatsCronJob):
+class GRRVersionBreakDownAggregator(ClientFleetStatsAggregator):
   """Records relative ratios of GRR versions in 7 day actives."""
 
   frequency = rdfvalue.Duration("4h")
-  lifetime = rdfvalue.Duration("4h")
 
-  def BeginProcessing(self):
+  def __init__(self, now):
+    super(GRRVersionBreakDownAggregator, self).__init__(now)
     self.counter = _ActiveCounter(
         aff4_stats.ClientFleetStats.SchemaCls.GRRVERSION_HISTOGRAM)
 
-  def FinishProcessing(self):
-    self.counter.Save(self)
-
-  def ProcessClientFullInfo(self, client_full_info):
+  def ProcessClientFullInfo(self, client_full_info, labels):
     c_info = client_full_info.last_startup_info.client_info
     ping = client_full_info.metadata.ping
-    labels = self._GetClientLabelsList(client_full_info)
 
     if not (c_info and ping):
       return
@@ -244,64 +276,75 @@ class GRRVersionBreakDownCronJob(AbstractClientStatsCronJob):
     ])
 
     for label in labels:
-      self.counter.Add(category, label, ping)
+      self.counter.Add(category, label, ping, now=self.now)
 
+  def Save(self, stats_for_label):
+    self.counter.Save(stats_for_label)
 
-class OSBreakDownCronJob(AbstractClientStatsCronJob):
-  """Records relative ratios of OS versions in 7 day actives."""
 
-  frequency = rdfvalue.Duration("1d")
-  lifetime = rdfvalue.Duration("20h")
+class OSBreakDownAggregator(ClientFleetStatsAggregator):
+  """Records relative ratios of OS versions in 7 day actives."""
 
-  def BeginProcessing(self):
+  def __init__(self, now):
+    super(OSBreakDownAggregator, self).__init__(now)
     self.counters = [
         _ActiveCounter(aff4_stats.ClientFleetStats.SchemaCls.OS_HISTOGRAM),
         _ActiveCounter(aff4_stats.ClientFleetStats.SchemaCls.RELEASE_HISTOGRAM),
     ]
 
-  def FinishProcessing(self):
-    # Write all the counter attributes.
-    for counter in self.counters:
-      counter.Save(self)
-
-  def ProcessClientFullInfo(self, client_full_info):
-    labels = self._GetClientLabelsList(client_full_info)
+  def ProcessClientFullInfo(self, client_full_info, labels):
     ping = client_full_info.metadata.ping
-    system = client_full_info.last_snapshot.knowledge_base.os
-    uname = client_full_info.last_snapshot.Uname()
-
     if not ping:
       return
 
+    system = client_full_info.last_snapshot.knowledge_base.os
+    uname = client_full_info.last_snapshot.Uname()
+
     for label in labels:
       # Windows, Linux, Darwin
-      self.counters[0].Add(system, label, ping)
+      self.counters[0].Add(system, label, ping, now=self.now)
 
       # Windows-2008ServerR2-6.1.7601SP1, Linux-Ubuntu-12.04,
       # Darwin-OSX-10.9.3
-      self.counters[1].Add(uname, label, ping)
+      self.counters[1].Add(uname, label, ping, now=self.now)
 
+  def Save(self, stats_for_label):
+    # Write all the counter attributes.
+    for counter in self.counters:
+      counter.Save(stats_for_label)
 
-class LastAccessStatsCronJob(AbstractClientStatsCronJob):
-  """Calculates a histogram statistics of clients last contacted times."""
 
-  frequency = rdfvalue.Duration("1d")
-  lifetime = rdfvalue.Duration("20h")
+class LastAccessStatsAggregator(ClientFleetStatsAggregator):
+  """Calculates a histogram statistics of clients last contacted times."""
 
   # The number of clients fall into these bins (number of days ago)
   _bins = [1, 2, 3, 7, 14, 30, 60]
 
+  def __init__(self, now):
+    super(LastAccessStatsAggregator, self).__init__(now)
+    self._bins = [long(x * 1e6 * 24 * 60 * 60) for x in self._bins]
+    self.values = {}
+
   def _ValuesForLabel(self, label):
     if label not in self.values:
       self.values[label] = [0] * len(self._bins)
     return self.values[label]
 
-  def BeginProcessing(self):
-    self._bins = [long(x * 1e6 * 24 * 60 * 60) for x in self._bins]
+  def ProcessClientFullInfo(self, client_full_info, labels):
+    ping = client_full_info.metadata.ping
+    if not ping:
+      return
 
-    self.values = {}
+    time_ago = self.now - ping
+    pos = bisect.bisect(self._bins, time_ago.microseconds)
 
-  def FinishProcessing(self):
+    for label in labels:
+      values = self._ValuesForLabel(label)
+      # If clients are older than the last bin forget them.
+      if pos < len(values):
+        values[pos] += 1
+
+  def Save(self, stats_for_label):
     # Build and store the graph now. Day actives are cumulative.
     for label in self.values:
       cumulative_count = 0
@@ -310,25 +353,143 @@ class LastAccessStatsCronJob(AbstractClientStatsCronJob):
         cumulative_count += y
         graph.Append(x_value=x, y_value=cumulative_count)
 
-      self._StatsForLabel(label).AddAttribute(graph)
+      stats_for_label(label).AddAttribute(graph)
 
-  def ProcessClientFullInfo(self, client_full_info):
-    labels = self._GetClientLabelsList(client_full_info)
-    ping = client_full_info.metadata.ping
 
-    if not ping:
-      return
+class AbstractClientStatsCronJob(cronjobs.SystemCronJobBase):
+  """Base class for all stats processing cron jobs.
 
-    now = rdfvalue.RDFDatetime.Now()
-    for label in labels:
-      time_ago = now - ping
-      pos = bisect.bisect(self._bins, time_ago.microseconds)
+  The fleet is read once per run and every client is fed to all the
+  aggregators the run computes stats for.
+  """
 
-      # If clients are older than the last bin forget them.
-      try:
-        self._ValuesForLabel(label)[pos] += 1
-      except IndexError:
-        pass
+  CLIENT_STATS_URN = rdfvalue.RDFURN("aff4:/stats/ClientFleetStats")
+
+  # The ClientFleetStatsAggregator classes run by this job.
+  aggregators = []
+
+  def GetAggregators(self, now):
+    """Returns the aggregator classes that should be run now."""
+    del now  # Unused.
+    return list(self.aggregators)
+
+  def FinishProcessing(self, aggregators, now):
+    """Called once the stats of the given aggregator classes were written."""
+
+  def _GetClientLabelsList(self, client):
+    """Get set of labels applied to this client."""
+    return set(["All"] + list(client.GetLabelsNames(owner="GRR")))
+
+  def _StatsForLabel(self, label):
+    if label not in self.stats:
+      self.stats[label] = aff4.FACTORY.Create(
+          self.CLIENT_STATS_URN.Add(label),
+          aff4_stats.ClientFleetStats,
+          mode="w",
+          token=self.token)
+    return self.stats[label]
+
+  def Run(self):
+    """Retrieve all the clients for the ClientFleetStatsAggregators."""
+    try:
+
+      self.stats = {}
+
+      now = rdfvalue.RDFDatetime.Now()
+      aggregator_classes = self.GetAggregators(now)
+      if not aggregator_classes:
+        logging.info("%s: no stats due.", self.__class__.__name__)
+        return
+
+      aggregators = [cls(now) for cls in aggregator_classes]
+
+      processed_count = 0
+      for client in _IterateAllClients():
+        labels = self._GetClientLabelsList(client)
+        for aggregator in aggregators:
+          aggregator.ProcessClientFullInfo(client, labels)
+        processed_count += 1
+
+        # This flow is not dead: we don't want to run out of lease time.
+        self.HeartBeat()
+
+      for aggregator in aggregators:
+        aggregator.Save(self._StatsForLabel)
+      for fd in itervalues(self.stats):
+        fd.Close()
+
+      self.FinishProcessing(aggregator_classes, now)
+
+      logging.info("%s: processed %d clients for %d aggregators.",
+                   self.__class__.__name__, processed_count, len(aggregators))
+    except Exception as e:  # pylint: disable=broad-except
+      logging.exception("Error while calculating stats: %s", e)
+      raise
+
+
+class ClientFleetStatsCronJob(AbstractClientStatsCronJob):
+  """Computes the stats of all registered aggregators in one fleet scan.
+
+  Each aggregator is run whenever its frequency has passed since its stats
+  were last recorded, so aggregators that are due together share a scan.
+  """
+
+  frequency = rdfvalue.Duration("4h")
+  lifetime = rdfvalue.Duration("4h")
+
+  def GetAggregators(self, now):
+    state = self.ReadCronState()
+    result = []
+    for name, cls in sorted(iteritems(ClientFleetStatsAggregator.classes)):
+      last_run = state.get(name)
+      if last_run is None or last_run + cls.frequency <= now:
+        result.append(cls)
+    return result
+
+  def FinishProcessing(self, aggregators, now):
+    state = self.ReadCronState()
+    for cls in aggregators:
+      state[cls.__name__] = now
+    self.WriteCronState(state)
+
+
+class GRRVersionBreakDownCronJob(AbstractClientStatsCronJob):
+  """Records relative ratios of GRR versions in 7 day actives.
+
+  Disabled by default, ClientFleetStatsCronJob records these stats.
+  """
+
+  frequency = rdfvalue.Duration("4h")
+  lifetime = rdfvalue.Duration("4h")
+  enabled = False
+
+  aggregators = [GRRVersionBreakDownAggregator]
+
+
+class OSBreakDownCronJob(AbstractClientStatsCronJob):
+  """Records relative ratios of OS versions in 7 day actives.
+
+  Disabled by default, ClientFleetStatsCronJob records these stats.
+  """
+
+  frequency = rdfvalue.Duration("1d")
+  lifetime = rdfvalue.Duration("20h")
+  enabled = False
+
+  aggregators = [OSBreakDownAggregator]
+
+
+class LastAccessStatsCronJob(AbstractClientStatsCronJob):
+  """Calculates a histogram statistics of clients last contacted times.
+
+  Disabled by default, ClientFleetStatsCronJob records these stats.
+  """
+
+  frequency = rdfvalue.Duration("1d")
+  lifetime = rdfvalue.Duration("20h")
+  enabled = False
+
+  aggregators = [LastAccessStatsAggregator]
 
 
 class AbstractClientStatsCronFlow(aff4_cronjobs.SystemCronFlow):
@@ -407,7 +568,7 @@ class GRRVersionBreakDown(AbstractClientStatsCronFlow):
         aff4_stats.ClientFleetStats.SchemaCls.GRRVERSION_HISTOGRAM)
 
   def FinishProcessing(self):
-    self.counter.Save(self)
+    self.counter.Save(self._StatsForLabel)
 
   def _Process(self, labels, c_info, ping):
     if not (c_info and ping):
@@ -447,7 +608,7 @@ class OSBreakDown(AbstractClientStatsCronFlow):
   def FinishProcessing(self):
     # Write all the counter attributes.
     for counter in self.counters:
-      counter.Save(self)
+      counter.Save(self._StatsForLabel)
 
   def _Process(self, labels, ping, system, uname):
     if not ping:
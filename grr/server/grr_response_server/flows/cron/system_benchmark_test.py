@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+"""Benchmarks the client fleet stats cron jobs on a large fleet."""
+
+import time
+
+
+from builtins import range  # pylint: disable=redefined-builtin
+import pytest
+
+from grr_response_core.lib import flags
+from grr_response_core.lib import rdfvalue
+from grr_response_core.lib.rdfvalues import client as rdf_client
+from grr_response_server import cronjobs
+from grr_response_server import data_store
+from grr_response_server.flows.cron import system
+from grr_response_server.rdfvalues import cronjobs as rdf_cronjobs
+from grr_response_server.rdfvalues import objects as rdf_objects
+from grr.test_lib import benchmark_test_lib
+from grr.test_lib import test_lib
+
+
+@pytest.mark.large
+class ClientFleetStatsBenchmark(benchmark_test_lib.MicroBenchmarks):
+  """Compares the per breakdown cron jobs to a single fleet scan."""
+
+  units = "s"
+
+  CLIENTS = 100000
+
+  _SYSTEMS = [u"Windows", u"Linux", u"Darwin"]
+
+  def _CreateFleet(self):
+    """Writes a synthetic fleet of clients to the relational db."""
+    now = rdfvalue.RDFDatetime.Now()
+    for i in range(self.CLIENTS):
+      client_id = u"C.%016x" % i
+      data_store.REL_DB.WriteClientMetadata(
+          client_id,
+          fleetspeak_enabled=False,
+          last_ping=now - rdfvalue.Duration("%dh" % (i % 1000)))
+
+      snapshot = rdf_objects.ClientSnapshot(client_id=client_id)
+      snapshot.knowledge_base.os = self._SYSTEMS[i % len(self._SYSTEMS)]
+      snapshot.os_release = u"Release %d" % (i % 10)
+      snapshot.os_version = u"%d.0" % (i % 7)
+      data_store.REL_DB.WriteClientSnapshot(snapshot)
+
+      data_store.REL_DB.WriteClientStartupInfo(
+          client_id,
+          rdf_client.StartupInfo(
+              client_info=rdf_client.ClientInformation(
+                  client_name=u"GRR", client_version=3200 + i % 5)))
+
+      if i % 10 == 0:
+        data_store.REL_DB.AddClientLabels(client_id, u"GRR",
+                                          [u"label%d" % (i // 10 % 20)])
+
+  def _RunJob(self, cls):
+    cronjobs.ScheduleSystemCronJobs(names=[cls.__name__])
+    job = rdf_cronjobs.CronJob(cron_job_id=cls.__name__)
+    cls(rdf_cronjobs.CronJobRun(), job).Run()
+
+  def testFleetScan(self):
+    self._CreateFleet()
+
+    start = time.time()
+    for cls in [
+        system.GRRVersionBreakDownCronJob, system.OSBreakDownCronJob,
+        system.LastAccessStatsCronJob
+    ]:
+      self._RunJob(cls)
+    self.AddResult("Per breakdown cron jobs", time.time() - start,
+                   self.CLIENTS)
+
+    start = time.time()
+    self._RunJob(system.ClientFleetStatsCronJob)
+    self.AddResult("ClientFleetStatsCronJob", time.time() - start,
+                   self.CLIENTS)
+
+
+def main(argv):
+  test_lib.main(argv)
+
+
+if __name__ == "__main__":
+  flags.StartMain(main)
@@ -13,6 +13,7 @@ from grr_response_core.lib import flags
 from grr_response_core.lib import rdfvalue
 from grr_response_core.lib.rdfvalues import client_stats as rdf_client_stats
 from grr_response_server import aff4
+from grr_response_server import cronjobs
 from grr_response_server import data_store
 from grr_response_server import fleetspeak_connector
 from grr_response_server import fleetspeak_utils
@@ -293,6 +294,61 @@ class SystemCronJobTest(SystemCronTestMixin, test_lib.GRRBaseTest):
 
     self._CheckLastAccessStats()
 
+  def _RunClientFleetStats(self):
+    job_id = unicode(system.ClientFleetStatsCronJob.__name__)
+    run = rdf_cronjobs.CronJobRun()
+    job = rdf_cronjobs.CronJob(
+        cron_job_id=job_id, state=data_store.REL_DB.ReadCronJob(job_id).state)
+    system.ClientFleetStatsCronJob(run, job).Run()
+
+  def testClientFleetStats(self):
+    cronjobs.ScheduleSystemCronJobs(
+        names=[system.ClientFleetStatsCronJob.__name__])
+    self._RunClientFleetStats()
+
+    self._CheckGRRVersionBreakDown()
+    self._CheckOSBreakdown()
+    self._CheckLastAccessStats()
+
+  def testClientFleetStatsRunsOnlyDueAggregators(self):
+    cronjobs.ScheduleSystemCronJobs(
+        names=[system.ClientFleetStatsCronJob.__name__])
+
+    aggregators = []
+
+    def GetAggregators(job, now):
+      result = original_get_aggregators(job, now)
+      aggregators.append(result)
+      return result
+
+    original_get_aggregators = system.ClientFleetStatsCronJob.GetAggregators
+    with mock.patch.object(system.ClientFleetStatsCronJob, "GetAggregators",
+                           GetAggregators):
+      self._RunClientFleetStats()
+      self.assertIn(system.OSBreakDownAggregator, aggregators[-1])
+      self.assertIn(system.GRRVersionBreakDownAggregator, aggregators[-1])
+
+      with test_lib.FakeTime(rdfvalue.RDFDatetime.Now() +
+                             rdfvalue.Duration("5h")):
+        self._RunClientFleetStats()
+      self.assertEqual(aggregators[-1], [system.GRRVersionBreakDownAggregator])
+
+      with test_lib.FakeTime(rdfvalue.RDFDatetime.Now() +
+                             rdfvalue.Duration("25h")):
+        self._RunClientFleetStats()
+      self.assertIn(system.OSBreakDownAggregator, aggregators[-1])
+      self.assertIn(system.LastAccessStatsAggregator, aggregators[-1])
+
+  def testIterateAllClientsReadsBatchesInParallel(self):
+    self._fs_conn.outgoing.ListClients.return_value = (
+        admin_pb2.ListClientsResponse())
+
+    client_ids = [
+        c.last_snapshot.client_id
+        for c in system._IterateAllClients(batch_size=3, num_threads=2)
+    ]
+    self.assertItemsEqual(client_ids, data_store.REL_DB.ReadAllClientIDs())
+
   def _RunPurgeClientStats(self):
     run = rdf_cronjobs.CronJobRun()
     job = rdf_cronjobs.CronJob()
@@ -58,3 +58,7 @@ class AuditEventListener(events.EventListener):
     with data_store.DB.GetMutationPool() as pool:
       for msg in msgs:
         AuditEventCollection.StaticAdd(log_urn, msg, mutation_pool=pool)
+
+    if data_store.RelationalDBWriteEnabled():
+      for msg in msgs:
+        data_store.REL_DB.WriteAuditEvent(msg)
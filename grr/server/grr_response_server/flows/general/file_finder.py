@@ -3,8 +3,12 @@
 
 import stat
 
+from future.utils import iteritems
+from future.utils import itervalues
+
 from grr_response_core.lib import artifact_utils
 from grr_response_core.lib import rdfvalue
+from grr_response_core.lib.rdfvalues import client as rdf_client
 from grr_response_core.lib.rdfvalues import client_fs as rdf_client_fs
 from grr_response_core.lib.rdfvalues import file_finder as rdf_file_finder
 from grr_response_core.lib.rdfvalues import paths as rdf_paths
@@ -343,6 +347,13 @@ class ClientFileFinder(flow.GRRFlow):
 
     self.args.paths = list(self._InterpolatePaths(self.args.paths))
 
+    if (self.args.action.action_type ==
+        rdf_file_finder.FileFinderAction.Action.DOWNLOAD):
+      # Chunks the client doesn't upload again are checked in StoreResults.
+      self.args.action.download.skip_uploaded_chunks = True
+
+    self.state.pending_results = {}
+
     self.CallClient(
         server_stubs.FileFinderOS, request=self.args, next_state="StoreResults")
 
@@ -360,6 +371,98 @@ class ClientFileFinder(flow.GRRFlow):
       raise flow.FlowError(responses.status)
 
     self.state.files_found = len(responses)
+
+    responses = list(responses)
+    missing_chunks = self._FindMissingChunks(responses)
+
+    complete_responses = []
+    for index, response in enumerate(responses):
+      if index not in missing_chunks:
+        complete_responses.append(response)
+        continue
+
+      # The client skipped chunks it uploaded before but the blob store doesn't
+      # have them anymore. The result is stored once they are fetched again.
+      chunks = missing_chunks[index]
+      self.state.pending_results[index] = dict(
+          response=response, missing=len(chunks), failed=False)
+      for chunk in chunks:
+        self.CallClient(
+            server_stubs.TransferBuffer,
+            rdf_client.BufferReference(
+                pathspec=response.stat_entry.pathspec,
+                offset=chunk.offset,
+                length=chunk.length),
+            next_state="ReceiveMissingChunk",
+            request_data=dict(index=index, digest=chunk.digest.encode("hex")))
+
+    self._StoreResponses(complete_responses)
+
+  def _FindMissingChunks(self, responses):
+    """Finds the transferred chunks missing in the blob store.
+
+    Args:
+      responses: A list of `FileFinderResult` objects.
+
+    Returns:
+      A dict mapping indices of responses to lists of their missing
+      `BlobImageChunkDescriptor` objects.
+    """
+    transferred_files = {
+        index: response.transferred_file
+        for index, response in enumerate(responses)
+        if response.HasField("transferred_file")
+    }
+
+    blob_hashes = set()
+    for transferred_file in itervalues(transferred_files):
+      for chunk in transferred_file.chunks:
+        blob_hashes.add(chunk.digest.encode("hex"))
+
+    if not blob_hashes:
+      return {}
+
+    existing_blobs = data_store.DB.BlobsExist(
+        list(blob_hashes), token=self.token)
+
+    missing_chunks = {}
+    for index, transferred_file in iteritems(transferred_files):
+      chunks = [
+          chunk for chunk in transferred_file.chunks
+          if not existing_blobs[chunk.digest.encode("hex")]
+      ]
+      if chunks:
+        missing_chunks[index] = chunks
+
+    return missing_chunks
+
+  def ReceiveMissingChunk(self, responses):
+    """Stores a result once all its missing chunks were fetched again."""
+    index = responses.request_data["index"]
+    pending_result = self.state.pending_results[index]
+    path = pending_result["response"].stat_entry.pathspec.path
+
+    if not responses.success:
+      self.Log("Failed to fetch a chunk of %s: %s", path, responses.status)
+      pending_result["failed"] = True
+    elif responses.First().data.encode("hex") != responses.request_data[
+        "digest"]:
+      self.Log("%s changed while its chunks were fetched.", path)
+      pending_result["failed"] = True
+
+    pending_result["missing"] -= 1
+    if pending_result["missing"] == 0:
+      del self.state.pending_results[index]
+
+      # The image would reference blobs we don't have, so only the stat entry
+      # of the file is stored.
+      response = pending_result["response"]
+      if pending_result["failed"]:
+        response.transferred_file = None
+      self._StoreResponses([response])
+
+  def _StoreResponses(self, responses):
+    """Writes results to the data store and sends them as replies."""
     files_to_publish = []
     with data_store.DB.GetMutationPool() as pool:
       for response in responses:
@@ -7,10 +7,12 @@ import glob
 import hashlib
 import os
 
+from builtins import range  # pylint: disable=redefined-builtin
 from builtins import zip  # pylint: disable=redefined-builtin
 from future.utils import itervalues
 
 from grr_response_client import vfs
+from grr_response_client.client_actions.file_finder_utils import uploading
 from grr_response_core.lib import flags
 from grr_response_core.lib import rdfvalue
 from grr_response_core.lib import utils
@@ -875,6 +877,62 @@ class TestClientFileFinderFlow(flow_test_lib.FlowTestsBaseclass):
     ]
     self.assertItemsEqual(relpaths, [u"厨房/卫浴洁.txt"])
 
+  def _RunCFFWithUploadedFirstChunk(self, path, data):
+    chunk_size = uploading.TransferStoreUploader.DEFAULT_CHUNK_SIZE
+    cache_path = os.path.join(self.temp_dir, "uploaded_chunks.cache")
+
+    with test_lib.ConfigOverrider({
+        "Client.uploaded_chunk_cache_path": cache_path,
+        "Client.uploaded_chunk_cache_size": 10
+    }):
+      # The client believes it uploaded the first chunk before, but the
+      # server doesn't have it.
+      chunk_cache = uploading.GetUploadedChunkCache(cache_path, 10)
+      chunk_cache.Add(hashlib.sha256(data[:chunk_size]).digest())
+
+      action = rdf_file_finder.FileFinderAction.Action.DOWNLOAD
+      return self._RunCFF([path], action)
+
+  def testClientFileFinderFetchesChunksSkippedByTheClient(self):
+    chunk_size = uploading.TransferStoreUploader.DEFAULT_CHUNK_SIZE
+    data = "".join(chr(i % 256) for i in range(chunk_size + 1000))
+
+    with test_lib.AutoTempFilePath() as temp_filepath:
+      with open(temp_filepath, "wb") as fd:
+        fd.write(data)
+
+      results = self._RunCFFWithUploadedFirstChunk(temp_filepath, data)
+
+      self.assertEqual(len(results), 1)
+      urn = results[0].stat_entry.pathspec.AFF4Path(self.client_id)
+      fd = aff4.FACTORY.Open(urn, token=self.token)
+      self.assertEqual(fd.read(), data)
+
+  def testClientFileFinderDropsFilesChangedWhileFetchingChunks(self):
+    chunk_size = uploading.TransferStoreUploader.DEFAULT_CHUNK_SIZE
+    data = "".join(chr(i % 256) for i in range(chunk_size + 1000))
+
+    def ReadVFS(pathspec, offset, length, progress_callback=None):
+      del pathspec, offset, progress_callback  # Unused.
+      return "x" * length
+
+    with test_lib.AutoTempFilePath() as temp_filepath:
+      with open(temp_filepath, "wb") as fd:
+        fd.write(data)
+
+      # The re-fetched chunk doesn't match the digest the client reported.
+      with utils.Stubber(vfs, "ReadVFS", ReadVFS):
+        results = self._RunCFFWithUploadedFirstChunk(temp_filepath, data)
+
+      # Only the stat entry is stored, no image pointing at a missing blob.
+      self.assertEqual(len(results), 1)
+      self.assertFalse(results[0].HasField("transferred_file"))
+      self.assertEqual(results[0].stat_entry.pathspec.path, temp_filepath)
+
+      urn = results[0].stat_entry.pathspec.AFF4Path(self.client_id)
+      fd = aff4.FACTORY.Open(urn, token=self.token)
+      self.assertNotIsInstance(fd, aff4_grr.VFSBlobImage)
+
   def testPathInterpolation(self):
     self.client_id = self.SetupClient(0)
 
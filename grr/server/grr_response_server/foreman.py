@@ -1,12 +1,15 @@
 #!/usr/bin/env python
 """The GRR Foreman."""
 
+import collections
 import logging
+import threading
 
 from grr_response_core.lib import rdfvalue
 from grr_response_core.lib import registry
 from grr_response_server import aff4
 from grr_response_server import data_store
+from grr_response_server import foreman_rules
 from grr_response_server import message_handlers
 
 
@@ -17,6 +20,39 @@ def GetForeman(token=None):
     return aff4.FACTORY.Open("aff4:/foreman", mode="rw", token=token)
 
 
+class ForemanRulesCache(object):
+  """Caches the compiled foreman rules of the relational db.
+
+  The rules are only read and compiled again when the rules version stamp in
+  the db changes.
+  """
+
+  def __init__(self):
+    self._lock = threading.Lock()
+    self._db = None
+    self._version = None
+    self._plan = None
+
+  def Get(self):
+    """Returns a ForemanConditionsPlan with the current foreman rules."""
+    db = data_store.REL_DB
+    # The version is read before the rules, so a concurrent change of the rules
+    # at worst makes the next call read them again.
+    version = db.ReadForemanRulesVersion()
+
+    with self._lock:
+      if self._plan is None or self._db is not db or self._version != version:
+        self._plan = foreman_rules.ForemanConditionsPlan(
+            db.ReadAllForemanRules())
+        self._db = db
+        self._version = version
+
+      return self._plan
+
+
+RULES_CACHE = ForemanRulesCache()
+
+
 # TODO(amoser): Now that Foreman rules are directly stored in the db,
 # consider removing this class altogether once the AFF4 Foreman has
 # been removed.
@@ -66,10 +102,6 @@ class Foreman(object):
 
     return actions_count
 
-  def _GetLastForemanRunTime(self, client_id):
-    md = data_store.REL_DB.ReadClientMetadata(client_id)
-    return md.last_foreman_time or rdfvalue.RDFDatetime(0)
-
   def _SetLastForemanRunTime(self, client_id, latest_rule):
     data_store.REL_DB.WriteClientMetadata(client_id, last_foreman=latest_rule)
 
@@ -82,42 +114,66 @@ class Foreman(object):
     Returns:
       Number of assigned tasks.
     """
-    rules = data_store.REL_DB.ReadAllForemanRules()
-    if not rules:
-      return 0
+    return self.AssignTasksToClients([client_id])
 
-    last_foreman_run = self._GetLastForemanRunTime(client_id)
+  def AssignTasksToClients(self, client_ids):
+    """Examines our rules and starts up flows based on many clients.
 
-    latest_rule_creation_time = max(rule.creation_time for rule in rules)
+    All the rules not yet checked by any of the clients are evaluated in one
+    pass, reading the data of all clients at once.
 
-    if latest_rule_creation_time <= last_foreman_run:
-      return 0
+    Args:
+      client_ids: Client ids of the clients for tasks to be assigned.
 
-    # Update the latest checked rule on the client.
-    self._SetLastForemanRunTime(client_id, latest_rule_creation_time)
+    Returns:
+      Number of assigned tasks.
+    """
+    plan = RULES_CACHE.Get()
+    if not plan.conditions:
+      return 0
 
-    relevant_rules = []
-    expired_rules = False
+    latest_rule_creation_time = max(
+        rule.creation_time for rule in plan.conditions)
 
     now = rdfvalue.RDFDatetime.Now()
-
-    for rule in rules:
-      if rule.expiration_time < now:
-        expired_rules = True
+    expired_rules = any(rule.expiration_time < now for rule in plan.conditions)
+    active_rules = [
+        rule for rule in plan.conditions if rule.expiration_time >= now
+    ]
+
+    client_ids = list(collections.OrderedDict.fromkeys(client_ids))
+    metadatas = data_store.REL_DB.MultiReadClientMetadata(client_ids)
+
+    relevant_rules_by_client = collections.OrderedDict()
+    for client_id in client_ids:
+      md = metadatas.get(client_id)
+      if md is None:
         continue
-      if rule.creation_time <= last_foreman_run:
+
+      last_foreman_run = md.last_foreman_time or rdfvalue.RDFDatetime(0)
+      if latest_rule_creation_time <= last_foreman_run:
         continue
 
-      relevant_rules.append(rule)
+      # Update the latest checked rule on the client.
+      self._SetLastForemanRunTime(client_id, latest_rule_creation_time)
+
+      relevant_rules = [
+          rule for rule in active_rules if rule.creation_time > last_foreman_run
+      ]
+      if relevant_rules:
+        relevant_rules_by_client[client_id] = relevant_rules
 
     actions_count = 0
-    if relevant_rules:
-      client_data = data_store.REL_DB.ReadClientFullInfo(client_id)
-      if client_data is None:
-        return
+    if relevant_rules_by_client:
+      clients_data = data_store.REL_DB.MultiReadClientFullInfo(
+          list(relevant_rules_by_client))
 
-      for rule in relevant_rules:
-        if rule.Evaluate(client_data):
+      for client_id, relevant_rules in relevant_rules_by_client.items():
+        client_data = clients_data.get(client_id)
+        if client_data is None:
+          continue
+
+        for rule in plan.Evaluate(client_data, relevant_rules):
           actions_count += self._RunAction(rule, client_id)
 
     if expired_rules:
@@ -132,10 +188,5 @@ class ForemanMessageHandler(message_handlers.MessageHandler):
   handler_name = "ForemanHandler"
 
   def ProcessMessages(self, msgs):
-    # TODO(amoser): The foreman reads the rules from the database for each
-    # client. In the old implementation we used to have a cache. If this is a
-    # performance hit, lets consider putting the cache back.
-
     foreman_obj = Foreman()
-    for msg in msgs:
-      foreman_obj.AssignTasksToClient(msg.client_id)
+    foreman_obj.AssignTasksToClients([msg.client_id for msg in msgs])
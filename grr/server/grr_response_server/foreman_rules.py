@@ -2,6 +2,7 @@
 """Foreman rules RDFValue classes."""
 
 import itertools
+import operator
 
 from grr_response_core import config
 from grr_response_core.lib import rdfvalue
@@ -35,6 +36,54 @@ class ForemanClientRuleBase(rdf_structs.RDFProtoStruct):
   def Validate(self):
     raise NotImplementedError
 
+  def Compile(self):
+    """Compiles the rule for evaluation against many clients.
+
+    Compiled rules only support clients read from the relational db.
+
+    Returns:
+      A function taking a `ClientFields` instance and returning a bool value of
+      the evaluation.
+    """
+    raise NotImplementedError
+
+
+class ClientFields(object):
+  """Fields of a `db.ClientFullInfo` resolved for evaluating compiled rules.
+
+  Every field is resolved only once, no matter how many rules refer to it.
+  """
+
+  def __init__(self, client_info):
+    self.client_info = client_info
+    self._values = {}
+
+  def Get(self, key, resolve):
+    """Returns the field identified by key, resolving it if needed.
+
+    Args:
+      key: A hashable key identifying the field.
+      resolve: A function taking a `db.ClientFullInfo` and returning the field.
+
+    Returns:
+      The value of the field.
+    """
+    try:
+      return self._values[key]
+    except KeyError:
+      value = self._values[key] = resolve(self.client_info)
+      return value
+
+
+def _ResolveOs(client_info):
+  if not client_info.HasField("last_snapshot"):
+    return ""
+  return utils.SmartStr(client_info.last_snapshot.knowledge_base.os or "")
+
+
+def _ResolveLabelNames(client_info):
+  return set(label.name for label in client_info.labels)
+
 
 class ForemanOsClientRule(ForemanClientRuleBase):
   """This rule will fire if the client OS is marked as true in the proto."""
@@ -58,23 +107,41 @@ class ForemanOsClientRule(ForemanClientRuleBase):
   def Validate(self):
     pass
 
+  def Compile(self):
+    prefixes = []
+    if self.os_windows:
+      prefixes.append("Windows")
+    if self.os_linux:
+      prefixes.append("Linux")
+    if self.os_darwin:
+      prefixes.append("Darwin")
+    prefixes = tuple(prefixes)
+
+    def Evaluate(fields):
+      return fields.Get("os", _ResolveOs).startswith(prefixes)
+
+    return Evaluate
+
 
 class ForemanLabelClientRule(ForemanClientRuleBase):
   """This rule will fire if the client has the selected label."""
   protobuf = jobs_pb2.ForemanLabelClientRule
 
-  def Evaluate(self, client_obj):
+  def _GetQuantifier(self):
     if self.match_mode == ForemanLabelClientRule.MatchMode.MATCH_ALL:
-      quantifier = all
+      return all
     elif self.match_mode == ForemanLabelClientRule.MatchMode.MATCH_ANY:
-      quantifier = any
+      return any
     elif self.match_mode == ForemanLabelClientRule.MatchMode.DOES_NOT_MATCH_ALL:
-      quantifier = lambda iterable: not all(iterable)
+      return lambda iterable: not all(iterable)
     elif self.match_mode == ForemanLabelClientRule.MatchMode.DOES_NOT_MATCH_ANY:
-      quantifier = lambda iterable: not any(iterable)
+      return lambda iterable: not any(iterable)
     else:
       raise ValueError("Unexpected match mode value: %s" % self.match_mode)
 
+  def Evaluate(self, client_obj):
+    quantifier = self._GetQuantifier()
+
     if RelationalDBReadEnabled():
       client_label_names = [label.name for label in client_obj.labels]
     else:
@@ -85,6 +152,16 @@ class ForemanLabelClientRule(ForemanClientRuleBase):
   def Validate(self):
     pass
 
+  def Compile(self):
+    quantifier = self._GetQuantifier()
+    label_names = list(self.label_names)
+
+    def Evaluate(fields):
+      client_label_names = fields.Get("labels", _ResolveLabelNames)
+      return quantifier((name in client_label_names) for name in label_names)
+
+    return Evaluate
+
 
 class ForemanRegexClientRule(ForemanClientRuleBase):
   """The Foreman schedules flows based on these rules firing."""
@@ -148,6 +225,17 @@ class ForemanRegexClientRule(ForemanClientRuleBase):
     if field == fsf.UNSET:
       raise ValueError(
           "Received regex rule without a valid field specification.")
+
+    # Clients that never sent a snapshot can still be matched on the fields
+    # that don't come from it, all other fields are empty.
+    res = None
+    if not client_info.HasField("last_snapshot"):
+      if field == fsf.CLIENT_NAME:
+        res = startup_info and startup_info.client_info.client_name
+      elif field == fsf.CLIENT_DESCRIPTION:
+        res = startup_info and startup_info.client_info.client_description
+      elif field == fsf.CLIENT_LABELS:
+        res = " ".join(l.name for l in client_info.labels)
     elif field == fsf.USERNAMES:
       res = " ".join(user.username for user in client_obj.knowledge_base.users)
     elif field == fsf.UNAME:
@@ -191,6 +279,22 @@ class ForemanRegexClientRule(ForemanClientRuleBase):
     if self.field == ForemanRegexClientRule.ForemanStringField.UNSET:
       raise ValueError("ForemanRegexClientRule rule invalid - field not set.")
 
+  def Compile(self):
+    field = self.field
+    if field == ForemanRegexClientRule.ForemanStringField.UNSET:
+      raise ValueError(
+          "Received regex rule without a valid field specification.")
+
+    # The regex is compiled once here, instead of every time the rule is read.
+    regex = self.attribute_regex
+    key = (ForemanRegexClientRule, int(field))
+    resolve = lambda client_info: self._ResolveField(field, client_info)
+
+    def Evaluate(fields):
+      return bool(regex.Search(fields.Get(key, resolve)))
+
+    return Evaluate
+
 
 class ForemanIntegerClientRule(ForemanClientRuleBase):
   """This rule will fire if the expression operator(attribute, value) is true.
@@ -228,12 +332,17 @@ class ForemanIntegerClientRule(ForemanClientRuleBase):
     startup_info = client_info.last_startup_info
     md = client_info.metadata
     client_obj = client_info.last_snapshot
+    # Clients that never sent a snapshot have no install or boot time.
+    has_snapshot = client_info.HasField("last_snapshot")
+    res = None
     if field == ForemanIntegerClientRule.ForemanIntegerField.CLIENT_VERSION:
       return startup_info.client_info.client_version
     elif field == ForemanIntegerClientRule.ForemanIntegerField.INSTALL_TIME:
-      res = client_obj.install_time
+      if has_snapshot:
+        res = client_obj.install_time
     elif field == ForemanIntegerClientRule.ForemanIntegerField.LAST_BOOT_TIME:
-      res = client_obj.startup_info.boot_time
+      if has_snapshot:
+        res = client_obj.startup_info.boot_time
     elif field == ForemanIntegerClientRule.ForemanIntegerField.CLIENT_CLOCK:
       res = md.clock
 
@@ -265,6 +374,33 @@ class ForemanIntegerClientRule(ForemanClientRuleBase):
     if self.field == ForemanIntegerClientRule.ForemanIntegerField.UNSET:
       raise ValueError("ForemanIntegerClientRule rule invalid - field not set.")
 
+  def Compile(self):
+    field = self.field
+    if field == ForemanIntegerClientRule.ForemanIntegerField.UNSET:
+      raise ValueError(
+          "Received integer rule without a valid field specification.")
+
+    op = self.operator
+    if op == ForemanIntegerClientRule.Operator.LESS_THAN:
+      compare = operator.lt
+    elif op == ForemanIntegerClientRule.Operator.GREATER_THAN:
+      compare = operator.gt
+    elif op == ForemanIntegerClientRule.Operator.EQUAL:
+      compare = operator.eq
+    else:
+      # Unknown operator.
+      raise ValueError("Unknown operator: %d" % op)
+
+    rule_value = self.value
+    key = (ForemanIntegerClientRule, int(field))
+    resolve = lambda client_info: self._ResolveField(field, client_info)
+
+    def Evaluate(fields):
+      value = fields.Get(key, resolve)
+      return value is not None and compare(value, rule_value)
+
+    return Evaluate
+
 
 class ForemanRuleAction(rdf_structs.RDFProtoStruct):
   protobuf = jobs_pb2.ForemanRuleAction
@@ -290,6 +426,9 @@ class ForemanClientRule(ForemanClientRuleBase):
   def Validate(self):
     self.UnionCast().Validate()
 
+  def Compile(self):
+    return self.UnionCast().Compile()
+
 
 class ForemanClientRuleSet(rdf_structs.RDFProtoStruct):
   """This proto holds rules and the strategy used to evaluate them."""
@@ -312,18 +451,38 @@ class ForemanClientRuleSet(rdf_structs.RDFProtoStruct):
     Raises:
       ValueError: The match mode is of unknown value.
     """
+    quantifier = self._GetQuantifier()
+    return quantifier(rule.Evaluate(client_obj) for rule in self.rules)
+
+  def Validate(self):
+    for rule in self.rules:
+      rule.Validate()
+
+  def _GetQuantifier(self):
     if self.match_mode == ForemanClientRuleSet.MatchMode.MATCH_ALL:
-      quantifier = all
+      return all
     elif self.match_mode == ForemanClientRuleSet.MatchMode.MATCH_ANY:
-      quantifier = any
+      return any
     else:
       raise ValueError("Unexpected match mode value: %s" % self.match_mode)
 
-    return quantifier(rule.Evaluate(client_obj) for rule in self.rules)
+  def Compile(self):
+    """Compiles the rule set for evaluation against many clients.
 
-  def Validate(self):
-    for rule in self.rules:
-      rule.Validate()
+    Returns:
+      A function taking a `ClientFields` instance and returning a bool value of
+      the evaluation.
+
+    Raises:
+      ValueError: The match mode is of unknown value.
+    """
+    quantifier = self._GetQuantifier()
+    compiled_rules = [rule.Compile() for rule in self.rules]
+
+    def Evaluate(fields):
+      return quantifier(evaluate(fields) for evaluate in compiled_rules)
+
+    return Evaluate
 
 
 class ForemanRule(rdf_structs.RDFProtoStruct):
@@ -371,6 +530,46 @@ class ForemanCondition(rdf_structs.RDFProtoStruct):
     return self.expiration_time - self.creation_time
 
 
+class ForemanConditionsPlan(object):
+  """Foreman conditions compiled for evaluation against many clients.
+
+  The rule sets of all the conditions are compiled once, and every client field
+  they refer to is only resolved once per client.
+  """
+
+  def __init__(self, conditions):
+    """Constructor.
+
+    Args:
+      conditions: A list of ForemanCondition objects with unique hunt ids.
+    """
+    self.conditions = list(conditions)
+    self._compiled = {
+        condition.hunt_id: condition.client_rule_set.Compile()
+        for condition in self.conditions
+    }
+
+  def Evaluate(self, client_info, conditions=None):
+    """Evaluates conditions against a client.
+
+    Args:
+      client_info: A `db.ClientFullInfo` instance.
+      conditions: A list of the plan's conditions to evaluate. Defaults to all
+        of them.
+
+    Returns:
+      A list of the conditions matching the client.
+    """
+    if conditions is None:
+      conditions = self.conditions
+
+    fields = ClientFields(client_info)
+    return [
+        condition for condition in conditions
+        if self._compiled[condition.hunt_id](fields)
+    ]
+
+
 class ForemanRules(rdf_protodict.RDFValueArray):
   """A list of rules that the foreman will apply."""
   rdf_type = ForemanRule
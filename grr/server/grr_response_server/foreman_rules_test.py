@@ -6,6 +6,7 @@ from builtins import range  # pylint: disable=redefined-builtin
 
 from grr_response_core.lib import flags
 from grr_response_core.lib import rdfvalue
+from grr_response_core.lib import utils
 from grr_response_core.lib.rdfvalues import test_base as rdf_test_base
 from grr_response_server import aff4
 from grr_response_server import data_store
@@ -615,6 +616,114 @@ class ForemanIntegerClientRuleTestRelational(
       r.Evaluate(info)
 
 
+class ForemanConditionsPlanTest(db_test_lib.RelationalDBEnabledMixin,
+                                test_lib.GRRBaseTest):
+
+  def _Condition(self, hunt_id, rules, match_mode=None):
+    rule_set = foreman_rules.ForemanClientRuleSet(rules=rules)
+    if match_mode is not None:
+      rule_set.match_mode = match_mode
+    return foreman_rules.ForemanCondition(
+        hunt_id=hunt_id, client_rule_set=rule_set)
+
+  def _RegexRule(self, field, regex):
+    return foreman_rules.ForemanClientRule(
+        rule_type=foreman_rules.ForemanClientRule.Type.REGEX,
+        regex=foreman_rules.ForemanRegexClientRule(
+            field=field, attribute_regex=regex))
+
+  def _Conditions(self, boot_time):
+    return [
+        self._Condition("H:000001", [
+            foreman_rules.ForemanClientRule(
+                rule_type=foreman_rules.ForemanClientRule.Type.OS,
+                os=foreman_rules.ForemanOsClientRule(os_linux=True))
+        ]),
+        self._Condition("H:000002", [
+            foreman_rules.ForemanClientRule(
+                rule_type=foreman_rules.ForemanClientRule.Type.LABEL,
+                label=foreman_rules.ForemanLabelClientRule(
+                    label_names=["hello", "foo"],
+                    match_mode=foreman_rules.ForemanLabelClientRule.MatchMode.
+                    MATCH_ANY))
+        ]),
+        self._Condition("H:000003", [
+            self._RegexRule("SYSTEM", "^Lin"),
+            foreman_rules.ForemanClientRule(
+                rule_type=foreman_rules.ForemanClientRule.Type.INTEGER,
+                integer=foreman_rules.ForemanIntegerClientRule(
+                    field="LAST_BOOT_TIME",
+                    operator=foreman_rules.ForemanIntegerClientRule.Operator.
+                    EQUAL,
+                    value=boot_time.AsSecondsSinceEpoch()))
+        ]),
+        self._Condition(
+            "H:000004",
+            [self._RegexRule("SYSTEM", "Windows"),
+             self._RegexRule("FQDN", ".")],
+            match_mode=foreman_rules.ForemanClientRuleSet.MatchMode.MATCH_ANY),
+        self._Condition("H:000005", [self._RegexRule("SYSTEM", "Windows")]),
+    ]
+
+  def testEvaluatesLikeTheRules(self):
+    boot_time = rdfvalue.RDFDatetime.FromSecondsSinceEpoch(1336300000)
+    conditions = self._Conditions(boot_time)
+    plan = foreman_rules.ForemanConditionsPlan(conditions)
+
+    for i, system in enumerate(["Linux", "Windows", "Darwin"]):
+      client = self.SetupTestClientObject(
+          i,
+          system=system,
+          last_boot_time=boot_time,
+          labels=[u"hello"] if i % 2 else None)
+      info = data_store.REL_DB.ReadClientFullInfo(client.client_id)
+
+      expected = [c for c in conditions if c.Evaluate(info)]
+      self.assertEqual(plan.Evaluate(info), expected)
+
+  def testEvaluatesGivenConditionsOnly(self):
+    conditions = self._Conditions(rdfvalue.RDFDatetime.Now())
+    plan = foreman_rules.ForemanConditionsPlan(conditions)
+
+    client = self.SetupTestClientObject(0, system="Linux")
+    info = data_store.REL_DB.ReadClientFullInfo(client.client_id)
+
+    self.assertEqual(plan.Evaluate(info), conditions[:1] + conditions[3:4])
+    self.assertEqual(plan.Evaluate(info, conditions[1:]), conditions[3:4])
+
+  def testResolvesEveryFieldOncePerClient(self):
+    conditions = [
+        self._Condition("H:00000%d" % i, [self._RegexRule("SYSTEM", "L")])
+        for i in range(5)
+    ]
+    plan = foreman_rules.ForemanConditionsPlan(conditions)
+
+    client = self.SetupTestClientObject(0, system="Linux")
+    info = data_store.REL_DB.ReadClientFullInfo(client.client_id)
+
+    resolve = foreman_rules.ForemanRegexClientRule._ResolveField  # pylint: disable=protected-access
+    calls = []
+
+    def ResolveField(rule, field, client_info):
+      calls.append(field)
+      return resolve(rule, field, client_info)
+
+    with utils.Stubber(foreman_rules.ForemanRegexClientRule, "_ResolveField",
+                       ResolveField):
+      self.assertEqual(plan.Evaluate(info), conditions)
+
+    self.assertEqual(calls, ["SYSTEM"])
+
+  def testUnsetFieldRaises(self):
+    condition = self._Condition("H:000001", [
+        foreman_rules.ForemanClientRule(
+            rule_type=foreman_rules.ForemanClientRule.Type.REGEX,
+            regex=foreman_rules.ForemanRegexClientRule(attribute_regex="foo"))
+    ])
+    with self.assertRaises(ValueError):
+      foreman_rules.ForemanConditionsPlan([condition])
+
+
 def main(argv):
   # Run the full test suite
   test_lib.main(argv)
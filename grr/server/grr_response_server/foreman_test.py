@@ -1,6 +1,9 @@
 #!/usr/bin/env python
 """Tests for the GRR Foreman."""
 
+from builtins import range  # pylint: disable=redefined-builtin
+import mock
+
 from grr_response_core.lib import flags
 from grr_response_core.lib import rdfvalue
 from grr_response_core.lib import utils
@@ -486,6 +489,122 @@ class RelationalForemanTests(db_test_lib.RelationalDBEnabledMixin,
         rules = data_store.REL_DB.ReadAllForemanRules()
         self.assertEqual(len(rules), num_rules)
 
+  def _WriteOsRule(self, hunt_id, creation_time=None, **kwargs):
+    creation_time = creation_time or rdfvalue.RDFDatetime.Now()
+    rule = foreman_rules.ForemanCondition(
+        creation_time=creation_time,
+        expiration_time=creation_time + rdfvalue.Duration("1h"),
+        description="Test rule",
+        hunt_name=standard.GenericHunt.__name__,
+        hunt_id=hunt_id)
+    rule.client_rule_set = foreman_rules.ForemanClientRuleSet(rules=[
+        foreman_rules.ForemanClientRule(
+            rule_type=foreman_rules.ForemanClientRule.Type.OS,
+            os=foreman_rules.ForemanOsClientRule(**kwargs))
+    ])
+    data_store.REL_DB.WriteForemanRule(rule)
+
+  def testAssignTasksToClients(self):
+    self.SetupTestClientObject(1, system="Windows XP")
+    self.SetupTestClientObject(2, system="Linux")
+    self.SetupTestClientObject(3, system="Windows 7")
+
+    with utils.Stubber(implementation.GRRHunt, "StartClients",
+                       self.StartClients):
+      self._WriteOsRule("H:111111", os_windows=True)
+      self._WriteOsRule("H:222222", os_linux=True)
+
+      self.clients_started = []
+      foreman_obj = foreman.GetForeman()
+      client_ids = [
+          u"C.1000000000000001", u"C.1000000000000002", u"C.1000000000000001",
+          u"C.1000000000000003", u"C.1000000000000004"
+      ]
+      self.assertEqual(foreman_obj.AssignTasksToClients(client_ids), 3)
+
+      started = [(hunt_urn.Basename(), client_id)
+                 for hunt_urn, client_id in self.clients_started]
+      self.assertEqual(started, [("H:111111", u"C.1000000000000001"),
+                                 ("H:222222", u"C.1000000000000002"),
+                                 ("H:111111", u"C.1000000000000003")])
+
+      # The rules were checked by all the clients, so nothing fires again.
+      self.clients_started = []
+      self.assertEqual(foreman_obj.AssignTasksToClients(client_ids), 0)
+      self.assertEqual(self.clients_started, [])
+
+      # Only the new rule is evaluated for the clients.
+      self._WriteOsRule(
+          "H:333333",
+          creation_time=rdfvalue.RDFDatetime.Now() + rdfvalue.Duration("1s"),
+          os_windows=True,
+          os_linux=True)
+      self.assertEqual(foreman_obj.AssignTasksToClients(client_ids), 3)
+      started = [(hunt_urn.Basename(), client_id)
+                 for hunt_urn, client_id in self.clients_started]
+      self.assertEqual(started, [("H:333333", u"C.1000000000000001"),
+                                 ("H:333333", u"C.1000000000000002"),
+                                 ("H:333333", u"C.1000000000000003")])
+
+  def testAssignTasksToClientsWithoutSnapshot(self):
+    self.SetupTestClientObject(1, system="Windows XP")
+    # This client is known but never sent a snapshot.
+    data_store.REL_DB.WriteClientMetadata(
+        u"C.1000000000000002", fleetspeak_enabled=False)
+    data_store.REL_DB.AddClientLabels(u"C.1000000000000002", u"GRR",
+                                      [u"foo"])
+
+    with utils.Stubber(implementation.GRRHunt, "StartClients",
+                       self.StartClients):
+      self._WriteOsRule("H:111111", os_windows=True)
+
+      # Label rules don't need a snapshot.
+      rule = foreman_rules.ForemanCondition(
+          creation_time=rdfvalue.RDFDatetime.Now(),
+          expiration_time=rdfvalue.RDFDatetime.Now() + rdfvalue.Duration("1h"),
+          description="Test rule",
+          hunt_name=standard.GenericHunt.__name__,
+          hunt_id="H:222222")
+      rule.client_rule_set = foreman_rules.ForemanClientRuleSet(rules=[
+          foreman_rules.ForemanClientRule(
+              rule_type=foreman_rules.ForemanClientRule.Type.LABEL,
+              label=foreman_rules.ForemanLabelClientRule(label_names=["foo"]))
+      ])
+      data_store.REL_DB.WriteForemanRule(rule)
+
+      self.clients_started = []
+      foreman_obj = foreman.GetForeman()
+      client_ids = [u"C.1000000000000002", u"C.1000000000000001"]
+      self.assertEqual(foreman_obj.AssignTasksToClients(client_ids), 2)
+
+      started = [(hunt_urn.Basename(), client_id)
+                 for hunt_urn, client_id in self.clients_started]
+      self.assertEqual(
+          sorted(started), [("H:111111", u"C.1000000000000001"),
+                            ("H:222222", u"C.1000000000000002")])
+
+  def testRulesAreOnlyReadWhenChanged(self):
+    self.SetupTestClientObject(1, system="Linux")
+    foreman_obj = foreman.GetForeman()
+
+    with mock.patch.object(
+        data_store.REL_DB,
+        "ReadAllForemanRules",
+        wraps=data_store.REL_DB.ReadAllForemanRules) as read_rules:
+      self._WriteOsRule("H:111111", os_windows=True)
+      for _ in range(3):
+        foreman_obj.AssignTasksToClient(u"C.1000000000000001")
+      self.assertEqual(read_rules.call_count, 1)
+
+      self._WriteOsRule("H:222222", os_windows=True)
+      for _ in range(3):
+        foreman_obj.AssignTasksToClient(u"C.1000000000000001")
+      self.assertEqual(read_rules.call_count, 2)
+
+      data_store.REL_DB.RemoveForemanRule(u"H:222222")
+      foreman_obj.AssignTasksToClient(u"C.1000000000000001")
+      self.assertEqual(read_rules.call_count, 3)
+
 
 def main(argv):
   # Run the full test suite
@@ -3,16 +3,19 @@
 
 import logging
 import operator
+import threading
 import time
 
 
 from future.utils import iteritems
+from future.utils import itervalues
 
 from grr_response_core import config
 from grr_response_core.lib import communicator
 from grr_response_core.lib import queues
 from grr_response_core.lib import rdfvalue
 from grr_response_core.lib import registry
+from grr_response_core.lib import sharded_cache
 from grr_response_core.lib import stats
 from grr_response_core.lib import utils
 from grr_response_core.lib.rdfvalues import client as rdf_client
@@ -32,15 +35,34 @@ from grr_response_server import threadpool
 from grr_response_server.aff4_objects import aff4_grr
 
 
+def _CommunicatorArgs():
+  """Returns the server communicator settings from the config."""
+  return dict(
+      session_cipher_cache_size=config.CONFIG[
+          "Frontend.session_cipher_cache_size"],
+      session_cipher_max_age=config.CONFIG[
+          "Frontend.session_cipher_max_age"].seconds,
+      session_cipher_max_packets=config.CONFIG[
+          "Frontend.session_cipher_max_packets"] or None,
+      compression=communicator.MessageListCompression(
+          level=config.CONFIG["Frontend.message_compression_level"],
+          min_size=config.CONFIG["Frontend.message_compression_min_size"],
+          direction="server_to_client"))
+
+
 class ServerCommunicator(communicator.Communicator):
   """A communicator which stores certificates using AFF4."""
 
   def __init__(self, certificate, private_key, token=None):
-    self.client_cache = utils.FastStore(1000)
+    self.client_cache = sharded_cache.ShardedCache(
+        max_size=1000, name="frontend_client_cache")
     self.token = token
     super(ServerCommunicator, self).__init__(
-        certificate=certificate, private_key=private_key)
-    self.pub_key_cache = utils.FastStore(max_size=50000)
+        certificate=certificate,
+        private_key=private_key,
+        **_CommunicatorArgs())
+    self.pub_key_cache = sharded_cache.ShardedCache(
+        max_size=50000, name="frontend_pub_key_cache")
     # Our common name as an RDFURN.
     self.common_name = rdfvalue.RDFURN(self.certificate.GetCN())
 
@@ -73,7 +95,7 @@ class ServerCommunicator(communicator.Communicator):
                               len(self.client_cache))
 
     pub_key = cert.GetPublicKey()
-    self.pub_key_cache.Put(common_name, pub_key)
+    self.pub_key_cache.Put(str(common_name), pub_key)
     return pub_key
 
   def VerifyMessageSignature(self, response_comms, packed_message_list, cipher,
@@ -187,8 +209,11 @@ class RelationalServerCommunicator(communicator.Communicator):
 
   def __init__(self, certificate, private_key):
     super(RelationalServerCommunicator, self).__init__(
-        certificate=certificate, private_key=private_key)
-    self.pub_key_cache = utils.FastStore(max_size=50000)
+        certificate=certificate,
+        private_key=private_key,
+        **_CommunicatorArgs())
+    self.pub_key_cache = sharded_cache.ShardedCache(
+        max_size=50000, name="frontend_relational_pub_key_cache")
     self.common_name = self.certificate.GetCN()
 
   def _GetRemotePublicKey(self, common_name):
@@ -212,7 +237,7 @@ class RelationalServerCommunicator(communicator.Communicator):
       raise communicator.UnknownClientCert("Stored cert mismatch")
 
     pub_key = cert.GetPublicKey()
-    self.pub_key_cache.Put(common_name, pub_key)
+    self.pub_key_cache.Put(remote_client_id, pub_key)
     return pub_key
 
   def VerifyMessageSignature(self, response_comms, packed_message_list, cipher,
@@ -296,6 +321,98 @@ class RelationalServerCommunicator(communicator.Communicator):
     return rdf_flows.GrrMessage.AuthorizationState.AUTHENTICATED
 
 
+class _PendingPoll(object):
+  """A client poll waiting to be processed as part of a batch."""
+
+  def __init__(self, source, messages, max_count):
+    self.source = source
+    self.messages = messages
+    self.max_count = max_count
+    self.tasks = []
+    self.error = None
+    self.done = threading.Event()
+
+
+class MessageBatcher(object):
+  """Groups concurrent client polls into batches that are processed together.
+
+  The first poll that arrives while no batch is being collected becomes the
+  batch leader. It waits for at most batch_window seconds (or until
+  max_batch_size polls have arrived) and then processes all collected polls
+  on behalf of the other waiting threads. Each poll still gets its own result.
+  """
+
+  def __init__(self, process_batch, batch_window, max_batch_size):
+    """Constructor.
+
+    Args:
+      process_batch: A callable that receives a list of _PendingPoll objects
+        and fills in their tasks.
+      batch_window: Maximum time in seconds a batch is collected for.
+      max_batch_size: Maximum number of polls in a batch.
+    """
+    self._process_batch = process_batch
+    self.batch_window = batch_window
+    self.max_batch_size = max_batch_size
+
+    self._lock = threading.Lock()
+    self._batch_full = threading.Condition(self._lock)
+    self._pending = []
+
+  def Process(self, source, messages, max_count):
+    """Processes a single poll as part of a batch.
+
+    Args:
+      source: The client which sent the messages.
+      messages: A list of GrrMessage RDFValues received from the client.
+      max_count: The maximum number of messages to send back to the client.
+
+    Returns:
+      The tasks leased for the client.
+    """
+    poll = _PendingPoll(source, messages, max_count)
+    start_time = time.time()
+
+    with self._lock:
+      self._pending.append(poll)
+      is_leader = len(self._pending) == 1
+      if is_leader:
+        if len(self._pending) < self.max_batch_size:
+          self._batch_full.wait(self.batch_window)
+        batch = self._pending
+        self._pending = []
+      elif len(self._pending) >= self.max_batch_size:
+        self._batch_full.notify()
+
+    if is_leader:
+      self._ProcessBatch(batch)
+    else:
+      poll.done.wait()
+
+    stats.STATS.RecordEvent("grr_frontendserver_batch_wait_time",
+                            time.time() - start_time)
+    if poll.error is not None:
+      raise poll.error  # pylint: disable=raising-bad-type
+
+    return poll.tasks
+
+  def _ProcessBatch(self, batch):
+    start_time = time.time()
+    try:
+      self._process_batch(batch)
+    except Exception as e:  # pylint: disable=broad-except
+      logging.exception("Error processing batch of %d polls: %s", len(batch), e)
+      for poll in batch:
+        poll.error = e
+    finally:
+      for poll in batch:
+        poll.done.set()
+
+    stats.STATS.RecordEvent("grr_frontendserver_batch_size", len(batch))
+    stats.STATS.RecordEvent("grr_frontendserver_batch_latency",
+                            time.time() - start_time)
+
+
 class FrontEndServer(object):
   """This is the front end server.
 
@@ -316,7 +433,9 @@ class FrontEndServer(object):
                max_queue_size=50,
                message_expiry_time=120,
                max_retransmission_time=10,
-               threadpool_prefix="grr_threadpool"):
+               threadpool_prefix="grr_threadpool",
+               message_batch_window=None,
+               message_batch_max_size=None):
     # Identify ourselves as the server.
     self.token = access_control.ACLToken(
         username="GRRFrontEnd", reason="Implied.")
@@ -338,6 +457,17 @@ class FrontEndServer(object):
         max_threads=config.CONFIG["Threadpool.size"])
     self.thread_pool.Start()
 
+    if message_batch_window is None:
+      message_batch_window = config.CONFIG["Frontend.message_batch_window"]
+    if message_batch_max_size is None:
+      message_batch_max_size = config.CONFIG["Frontend.message_batch_max_size"]
+
+    if message_batch_window > 0:
+      self.message_batcher = MessageBatcher(
+          self.ProcessPollBatch, message_batch_window, message_batch_max_size)
+    else:
+      self.message_batcher = None
+
     # There is only a single session id that we accept unauthenticated
     # messages for, the one to enroll new clients.
     self.unauth_allowed_session_id = rdfvalue.SessionID(
@@ -381,21 +511,24 @@ class FrontEndServer(object):
     messages, source, timestamp = self._communicator.DecodeMessages(
         request_comms)
 
-    now = time.time()
-    if messages:
-      # Receive messages in line.
-      self.ReceiveMessages(source, messages)
-
     # We send the client a maximum of self.max_queue_size messages
     required_count = max(0, self.max_queue_size - request_comms.queue_size)
-    tasks = []
 
     message_list = rdf_flows.MessageList()
-    # Only give the client messages if we are able to receive them in a
-    # reasonable time.
-    if time.time() - now < 10:
-      tasks = self.DrainTaskSchedulerQueueForClient(source, required_count)
-      message_list.job = tasks
+    if self.message_batcher:
+      message_list.job = self.message_batcher.Process(source, messages,
+                                                      required_count)
+    else:
+      now = time.time()
+      if messages:
+        # Receive messages in line.
+        self.ReceiveMessages(source, messages)
+
+      # Only give the client messages if we are able to receive them in a
+      # reasonable time.
+      if time.time() - now < 10:
+        message_list.job = self.DrainTaskSchedulerQueueForClient(
+            source, required_count)
 
     # Encode the message_list in the response_comms using the same API version
     # the client used.
@@ -408,6 +541,54 @@ class FrontEndServer(object):
 
     return source, len(messages)
 
+  def ProcessPollBatch(self, polls):
+    """Receives messages and leases tasks for a batch of client polls.
+
+    All messages received in the batch are written with a single queue manager
+    flush and the client queues are drained together.
+
+    Args:
+      polls: A list of _PendingPoll objects. Their tasks attribute is set to the
+        messages that should be sent back to the client.
+    """
+    now = time.time()
+    with queue_manager.QueueManager(token=self.token) as manager:
+      for poll in polls:
+        if not poll.messages:
+          continue
+
+        # A client sending bad messages only fails its own poll: its messages
+        # are queued separately and only written if all of them were handled.
+        poll_manager = manager.Copy()
+        try:
+          self._ReceiveMessages(poll_manager, poll.source, poll.messages)
+        except Exception as e:  # pylint: disable=broad-except
+          logging.exception("Error receiving messages from %s: %s",
+                            poll.source, e)
+          poll.error = e
+          continue
+
+        manager.Merge(poll_manager)
+
+    # Only give the clients messages if we are able to receive them in a
+    # reasonable time.
+    if time.time() - now >= 10:
+      return
+
+    max_counts = {}
+    for poll in polls:
+      if poll.error is None:
+        max_counts[poll.source] = max(
+            max_counts.get(poll.source, 0), poll.max_count)
+
+    tasks_by_client = self.MultiDrainTaskSchedulerQueueForClients(max_counts)
+
+    # If a client polled more than once in this batch, all the tasks go to the
+    # first poll.
+    for poll in polls:
+      if poll.error is None:
+        poll.tasks = tasks_by_client.pop(poll.source, [])
+
   def DrainTaskSchedulerQueueForClient(self, client, max_count=None):
     """Drains the client's Task Scheduler queue.
 
@@ -442,33 +623,90 @@ class FrontEndServer(object):
         limit=max_count,
         lease_seconds=self.message_expiry_time)
 
+    result = self._DropCompletedTasks({client: new_tasks})[client]
+
+    stats.STATS.IncrementCounter("grr_messages_sent", len(result))
+    if result:
+      logging.debug("Drained %d messages for %s in %s seconds.", len(result),
+                    client,
+                    time.time() - start_time)
+
+    return result
+
+  def MultiDrainTaskSchedulerQueueForClients(self, max_counts):
+    """Drains the Task Scheduler queues of many clients at once.
+
+    Args:
+       max_counts: A dict mapping client ids to the maximum number of messages
+                   we will issue for each client.
+
+    Returns:
+       A dict mapping client ids to the tasks representing the messages
+       returned.
+    """
+    start_time = time.time()
+
+    manager = queue_manager.QueueManager(token=self.token)
+    new_tasks = {}
+    for max_count, items in iteritems(
+        utils.GroupBy(iteritems(max_counts), operator.itemgetter(1))):
+      if max_count <= 0:
+        continue
+
+      clients_by_queue = {
+          rdf_client.ClientURN(client).Queue(): client for client, _ in items
+      }
+      leased = manager.MultiQueryAndOwn(
+          list(clients_by_queue),
+          limit_per_queue=max_count,
+          lease_seconds=self.message_expiry_time)
+      for queue, tasks in iteritems(leased):
+        new_tasks[clients_by_queue[queue]] = tasks
+
+    result = self._DropCompletedTasks(new_tasks)
+
+    num_sent = sum(len(tasks) for tasks in itervalues(result))
+    stats.STATS.IncrementCounter("grr_messages_sent", num_sent)
+    if num_sent:
+      logging.debug("Drained %d messages for %d clients in %s seconds.",
+                    num_sent, len(result),
+                    time.time() - start_time)
+
+    return result
+
+  def _DropCompletedTasks(self, tasks_by_client):
+    """Removes leased tasks that already have a status from the client.
+
+    Args:
+      tasks_by_client: A dict mapping client ids to lists of leased tasks.
+
+    Returns:
+      A dict mapping client ids to the tasks that should be sent.
+    """
     initial_ttl = rdf_flows.GrrMessage().task_ttl
     check_before_sending = []
-    result = []
-    for task in new_tasks:
-      if task.task_ttl < initial_ttl - 1:
-        # This message has been leased before.
-        check_before_sending.append(task)
-      else:
-        result.append(task)
+    result = {}
+    for client, tasks in iteritems(tasks_by_client):
+      result[client] = []
+      for task in tasks:
+        if task.task_ttl < initial_ttl - 1:
+          # This message has been leased before.
+          check_before_sending.append((client, task))
+        else:
+          result[client].append(task)
 
     if check_before_sending:
       with queue_manager.QueueManager(token=self.token) as manager:
-        status_found = manager.MultiCheckStatus(check_before_sending)
+        status_found = manager.MultiCheckStatus(
+            [task for _, task in check_before_sending])
 
         # All messages that don't have a status yet should be sent again.
-        for task in check_before_sending:
+        for client, task in check_before_sending:
           if task not in status_found:
-            result.append(task)
+            result[client].append(task)
           else:
             manager.DeQueueClientRequest(task)
 
-    stats.STATS.IncrementCounter("grr_messages_sent", len(result))
-    if result:
-      logging.debug("Drained %d messages for %s in %s seconds.", len(result),
-                    client,
-                    time.time() - start_time)
-
     return result
 
   def EnrolFleetspeakClient(self, client_id):
@@ -523,63 +761,67 @@ class FrontEndServer(object):
     """
     now = time.time()
     with queue_manager.QueueManager(token=self.token) as manager:
-      for session_id, msgs in iteritems(
-          utils.GroupBy(messages, operator.attrgetter("session_id"))):
+      self._ReceiveMessages(manager, client_id, messages)
 
-        # Remove and handle messages to WellKnownFlows
-        leftover_msgs = self.HandleWellKnownFlows(msgs)
+    logging.debug("Received %s messages from %s in %s sec", len(messages),
+                  client_id,
+                  time.time() - now)
 
-        unprocessed_msgs = []
-        for msg in leftover_msgs:
-          if (msg.auth_state == msg.AuthorizationState.AUTHENTICATED or
-              msg.session_id == self.unauth_allowed_session_id):
-            unprocessed_msgs.append(msg)
+  def _ReceiveMessages(self, manager, client_id, messages):
+    """Queues the messages from the source on the given queue manager."""
+    for session_id, msgs in iteritems(
+        utils.GroupBy(messages, operator.attrgetter("session_id"))):
 
-        if len(unprocessed_msgs) < len(leftover_msgs):
-          logging.info("Dropped %d unauthenticated messages for %s",
-                       len(leftover_msgs) - len(unprocessed_msgs), client_id)
+      # Remove and handle messages to WellKnownFlows
+      leftover_msgs = self.HandleWellKnownFlows(msgs)
 
-        if not unprocessed_msgs:
-          continue
+      unprocessed_msgs = []
+      for msg in leftover_msgs:
+        if (msg.auth_state == msg.AuthorizationState.AUTHENTICATED or
+            msg.session_id == self.unauth_allowed_session_id):
+          unprocessed_msgs.append(msg)
 
-        for msg in unprocessed_msgs:
-          manager.QueueResponse(msg)
-
-        for msg in unprocessed_msgs:
-          # Messages for well known flows should notify even though they don't
-          # have a status.
-          if msg.request_id == 0:
-            manager.QueueNotification(session_id=msg.session_id)
-            # Those messages are all the same, one notification is enough.
-            break
-          elif msg.type == rdf_flows.GrrMessage.Type.STATUS:
-            # If we receive a status message from the client it means the client
-            # has finished processing this request. We therefore can de-queue it
-            # from the client queue. msg.task_id will raise if the task id is
-            # not set (message originated at the client, there was no request on
-            # the server), so we have to check .HasTaskID() first.
-            if msg.HasTaskID():
-              manager.DeQueueClientRequest(msg)
-
-            manager.QueueNotification(
-                session_id=msg.session_id, last_status=msg.request_id)
-
-            stat = rdf_flows.GrrStatus(msg.payload)
-            if stat.status == rdf_flows.GrrStatus.ReturnedStatus.CLIENT_KILLED:
-              # A client crashed while performing an action, fire an event.
-              crash_details = rdf_client.ClientCrash(
-                  client_id=client_id,
-                  session_id=session_id,
-                  backtrace=stat.backtrace,
-                  crash_message=stat.error_message,
-                  nanny_status=stat.nanny_status,
-                  timestamp=rdfvalue.RDFDatetime.Now())
-              events.Events.PublishEvent(
-                  "ClientCrash", crash_details, token=self.token)
+      if len(unprocessed_msgs) < len(leftover_msgs):
+        logging.info("Dropped %d unauthenticated messages for %s",
+                     len(leftover_msgs) - len(unprocessed_msgs), client_id)
 
-    logging.debug("Received %s messages from %s in %s sec", len(messages),
-                  client_id,
-                  time.time() - now)
+      if not unprocessed_msgs:
+        continue
+
+      for msg in unprocessed_msgs:
+        manager.QueueResponse(msg)
+
+      for msg in unprocessed_msgs:
+        # Messages for well known flows should notify even though they don't
+        # have a status.
+        if msg.request_id == 0:
+          manager.QueueNotification(session_id=msg.session_id)
+          # Those messages are all the same, one notification is enough.
+          break
+        elif msg.type == rdf_flows.GrrMessage.Type.STATUS:
+          # If we receive a status message from the client it means the client
+          # has finished processing this request. We therefore can de-queue it
+          # from the client queue. msg.task_id will raise if the task id is
+          # not set (message originated at the client, there was no request on
+          # the server), so we have to check .HasTaskID() first.
+          if msg.HasTaskID():
+            manager.DeQueueClientRequest(msg)
+
+          manager.QueueNotification(
+              session_id=msg.session_id, last_status=msg.request_id)
+
+          stat = rdf_flows.GrrStatus(msg.payload)
+          if stat.status == rdf_flows.GrrStatus.ReturnedStatus.CLIENT_KILLED:
+            # A client crashed while performing an action, fire an event.
+            crash_details = rdf_client.ClientCrash(
+                client_id=client_id,
+                session_id=session_id,
+                backtrace=stat.backtrace,
+                crash_message=stat.error_message,
+                nanny_status=stat.nanny_status,
+                timestamp=rdfvalue.RDFDatetime.Now())
+            events.Events.PublishEvent(
+                "ClientCrash", crash_details, token=self.token)
 
   def HandleWellKnownFlows(self, messages):
     """Hands off messages to well known flows."""
@@ -675,6 +917,11 @@ class FrontendInit(registry.InitHook):
     stats.STATS.RegisterCounterMetric("grr_frontendserver_handle_num")
     stats.STATS.RegisterGaugeMetric("grr_frontendserver_client_cache_size", int)
     stats.STATS.RegisterCounterMetric("grr_messages_sent")
+    stats.STATS.RegisterEventMetric(
+        "grr_frontendserver_batch_size",
+        bins=[1, 2, 5, 10, 20, 50, 100, 200, 500, 1000])
+    stats.STATS.RegisterEventMetric("grr_frontendserver_batch_latency")
+    stats.STATS.RegisterEventMetric("grr_frontendserver_batch_wait_time")
 
     stats.STATS.RegisterCounterMetric(
         "grr_pub_key_cache", fields=[("type", str)])
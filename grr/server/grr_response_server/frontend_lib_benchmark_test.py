@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+"""Benchmarks encoding of messages sent by the frontend to clients."""
+
+import time
+
+
+from builtins import range  # pylint: disable=redefined-builtin
+import pytest
+
+from grr_response_core import config
+from grr_response_core.lib import flags
+from grr_response_core.lib.rdfvalues import flows as rdf_flows
+from grr_response_server import aff4
+from grr_response_server import frontend_lib
+from grr_response_server.aff4_objects import aff4_grr
+from grr.test_lib import benchmark_test_lib
+from grr.test_lib import test_lib
+
+
+@pytest.mark.large
+class ServerCommunicatorBenchmark(benchmark_test_lib.MicroBenchmarks):
+  """Compares polls per second with and without session cipher caching."""
+
+  units = "s"
+
+  POLLS = 1000
+
+  def setUp(self):
+    super(ServerCommunicatorBenchmark, self).setUp(["Polls/s"], ["<20"])
+
+  def _EncodePolls(self, name, client_id):
+    server_communicator = frontend_lib.ServerCommunicator(
+        certificate=config.CONFIG["Frontend.certificate"],
+        private_key=config.CONFIG["PrivateKeys.server_key"],
+        token=self.token)
+
+    message_list = rdf_flows.MessageList()
+    message_list.job.Append(session_id="W:Poll")
+
+    # Everything runs in this thread, so this is the rate for a single core.
+    start = time.time()
+    for _ in range(self.POLLS):
+      server_communicator.EncodeMessages(
+          message_list,
+          rdf_flows.ClientCommunication(),
+          destination=client_id)
+    time_taken = time.time() - start
+
+    self.AddResult(name, time_taken, self.POLLS,
+                   "%.1f" % (self.POLLS / time_taken))
+
+  def testEncodeMessages(self):
+    client_cert = self.ClientCertFromPrivateKey(
+        config.CONFIG["Client.private_key"])
+    client_id = client_cert.GetCN()
+    with aff4.FACTORY.Create(
+        client_id, aff4_grr.VFSGRRClient, token=self.token) as client:
+      client.Set(client.Schema.CERT, client_cert)
+
+    with test_lib.ConfigOverrider({"Frontend.session_cipher_cache_size": 0}):
+      self._EncodePolls("New cipher per poll", client_id)
+
+    self._EncodePolls("Cached session ciphers", client_id)
+
+
+def main(argv):
+  test_lib.main(argv)
+
+
+if __name__ == "__main__":
+  flags.StartMain(main)
@@ -4,8 +4,11 @@ from __future__ import division
 
 import array
 import logging
+import os
 import pdb
+import threading
 import time
+import zlib
 
 from builtins import chr  # pylint: disable=redefined-builtin
 from builtins import map  # pylint: disable=redefined-builtin
@@ -348,6 +351,135 @@ class GRRFEServerTest(frontend_test_lib.FrontEndServerTest):
       self.assertEqual(response.job[i].session_id, session_id)
       self.assertEqual(response.job[i].name, "Test")
 
+  def testMultiDrainTaskSchedulerQueueForClients(self):
+    client_ids = self.SetupClients(3)
+    for client_id in client_ids[:2]:
+      self.FlowSetup("SendingTestFlow", client_id=client_id)
+
+    result = self.server.MultiDrainTaskSchedulerQueueForClients(
+        {client_id: 5 for client_id in client_ids})
+
+    self.assertEqual(len(result[client_ids[0]]), 5)
+    self.assertEqual(len(result[client_ids[1]]), 5)
+    self.assertEqual(result[client_ids[2]], [])
+    for client_id in client_ids[:2]:
+      for task in result[client_id]:
+        self.assertEqual(task.queue, client_id.Queue())
+        self.assertEqual(task.name, "Test")
+
+  def testProcessPollBatch(self):
+    client_ids = self.SetupClients(2)
+    flow_obj = self.FlowSetup(
+        flow_test_lib.FlowOrderTest.__name__, client_id=client_ids[0])
+    self.FlowSetup("SendingTestFlow", client_id=client_ids[1])
+
+    messages = [
+        rdf_flows.GrrMessage(
+            request_id=1,
+            response_id=i,
+            session_id=flow_obj.session_id,
+            auth_state="AUTHENTICATED",
+            payload=rdfvalue.RDFInteger(i)) for i in range(1, 10)
+    ]
+    polls = [
+        frontend_lib._PendingPoll(client_ids[0], messages, 100),
+        frontend_lib._PendingPoll(client_ids[1], [], 100),
+    ]
+    self.server.ProcessPollBatch(polls)
+
+    # The responses of the first client were stored.
+    stored_messages = data_store.DB.ReadResponsesForRequestId(
+        flow_obj.session_id, 1)
+    self.assertEqual(len(stored_messages), len(messages))
+
+    # Both clients get their tasks.
+    self.assertEqual(len(polls[0].tasks), 1)
+    self.assertEqual(len(polls[1].tasks), 10)
+
+  def testProcessPollBatchIsolatesClientErrors(self):
+    client_ids = self.SetupClients(2)
+    flow_objs = [
+        self.FlowSetup(
+            flow_test_lib.FlowOrderTest.__name__, client_id=client_id)
+        for client_id in client_ids
+    ]
+    self.FlowSetup("SendingTestFlow", client_id=client_ids[1])
+
+    polls = []
+    for client_id, flow_obj in zip(client_ids, flow_objs):
+      messages = [
+          rdf_flows.GrrMessage(
+              request_id=1,
+              response_id=i,
+              session_id=flow_obj.session_id,
+              auth_state="AUTHENTICATED",
+              payload=rdfvalue.RDFInteger(i)) for i in range(1, 5)
+      ]
+      polls.append(frontend_lib._PendingPoll(client_id, messages, 100))
+
+    receive_messages = self.server._ReceiveMessages
+
+    def ReceiveMessages(manager, source, messages):
+      # The first client fails after its messages were queued.
+      receive_messages(manager, source, messages)
+      if source == client_ids[0]:
+        raise RuntimeError("Bad messages")
+
+    with utils.Stubber(self.server, "_ReceiveMessages", ReceiveMessages):
+      self.server.ProcessPollBatch(polls)
+
+    # Only the failing client's poll failed and none of its messages were
+    # written.
+    self.assertIsInstance(polls[0].error, RuntimeError)
+    self.assertEqual(polls[0].tasks, [])
+    self.assertFalse(
+        data_store.DB.ReadResponsesForRequestId(flow_objs[0].session_id, 1))
+
+    self.assertIsNone(polls[1].error)
+    self.assertEqual(
+        len(
+            data_store.DB.ReadResponsesForRequestId(flow_objs[1].session_id,
+                                                    1)), 4)
+    # The FlowOrderTest request and the 10 SendingTestFlow requests.
+    self.assertEqual(len(polls[1].tasks), 11)
+
+  def testMessageBatcher(self):
+    batches = []
+
+    def ProcessBatch(polls):
+      batches.append(len(polls))
+      for poll in polls:
+        poll.tasks = [poll.source]
+
+    batcher = frontend_lib.MessageBatcher(
+        ProcessBatch, batch_window=10, max_batch_size=5)
+
+    results = {}
+
+    def Poll(i):
+      results[i] = batcher.Process(i, [], 10)
+
+    threads = [threading.Thread(target=Poll, args=(i,)) for i in range(5)]
+    for t in threads:
+      t.start()
+    for t in threads:
+      t.join()
+
+    # The batch was processed as soon as it was full, without waiting for the
+    # whole batch window.
+    self.assertEqual(sum(batches), 5)
+    self.assertEqual(results, {i: [i] for i in range(5)})
+
+  def testMessageBatcherPropagatesErrors(self):
+
+    def ProcessBatch(unused_polls):
+      raise RuntimeError("Something went wrong.")
+
+    batcher = frontend_lib.MessageBatcher(
+        ProcessBatch, batch_window=0, max_batch_size=5)
+    with self.assertRaises(RuntimeError):
+      batcher.Process("C.1000000000000000", [], 10)
+
   def _ScheduleResponseAndStatus(self, client_id, flow_id):
     with queue_manager.QueueManager(token=self.token) as flow_manager:
       # Schedule a response.
@@ -659,6 +791,81 @@ class ClientCommsTest(test_lib.GRRBaseTest):
     self.assertEqual(decoded_messages[0].auth_state,
                      rdf_flows.GrrMessage.AuthorizationState.DESYNCHRONIZED)
 
+  def testServerReusesSessionCiphers(self):
+    self._MakeClientRecord()
+    self.server_communicator.session_cipher_max_packets = 2
+
+    # The client only accepts messages answering a request it sent.
+    self.ClientServerCommunicate()
+
+    encrypted_ciphers = []
+    for i in range(3):
+      message_list = rdf_flows.MessageList()
+      message_list.job.Append(session_id=str(i))
+
+      result = rdf_flows.ClientCommunication()
+      self.server_communicator.EncodeMessages(
+          message_list, result, destination=rdfvalue.RDFURN(self.client_id))
+      encrypted_ciphers.append(result.encrypted_cipher)
+
+      # The client doesn't need to know about the reuse.
+      decoded, _, _ = self.client_communicator.DecryptMessage(
+          result.SerializeToString())
+      self.assertEqual(len(decoded), 1)
+      self.assertEqual(decoded[0].session_id, message_list.job[0].session_id)
+
+    self.assertEqual(encrypted_ciphers[0], encrypted_ciphers[1])
+    # The cipher is replaced once it was used for session_cipher_max_packets.
+    self.assertNotEqual(encrypted_ciphers[1], encrypted_ciphers[2])
+
+  def _EncodeMessageList(self, message_list, compression):
+    packed_message_list = rdf_flows.PackedMessageList()
+    communicator.Communicator.EncodeMessageList(
+        message_list, packed_message_list, compression=compression)
+    return packed_message_list
+
+  def testMessageListCompression(self):
+    message_list = rdf_flows.MessageList()
+    for i in range(10):
+      message_list.job.Append(
+          session_id="aff4:/flows/W:%d" % i, name="OMG it's a string")
+    size = len(message_list.SerializeToString())
+
+    compression_types = rdf_flows.PackedMessageList.CompressionType
+    for compression, expected in [
+        (communicator.MessageListCompression(), compression_types.ZCOMPRESSION),
+        (communicator.MessageListCompression(level=1),
+         compression_types.ZCOMPRESSION),
+        (communicator.MessageListCompression(level=0),
+         compression_types.UNCOMPRESSED),
+        (communicator.MessageListCompression(min_size=size + 1),
+         compression_types.UNCOMPRESSED),
+    ]:
+      packed_message_list = self._EncodeMessageList(message_list, compression)
+      self.assertEqual(packed_message_list.compression, expected)
+
+      decoded = communicator.Communicator.DecompressMessageList(
+          packed_message_list)
+      self.assertEqual(decoded, message_list)
+
+  def testMessageListCompressionSkipsCompressedBlobs(self):
+    # Random data doesn't compress, so compressing it again would be wasted.
+    blob = rdf_protodict.DataBlob(
+        data=zlib.compress(os.urandom(10000)),
+        compression=rdf_protodict.DataBlob.CompressionType.ZCOMPRESSION)
+
+    message_list = rdf_flows.MessageList()
+    message_list.job.Append(session_id="aff4:/flows/W:1", payload=blob)
+
+    packed_message_list = self._EncodeMessageList(
+        message_list, communicator.MessageListCompression())
+    self.assertEqual(packed_message_list.compression,
+                     rdf_flows.PackedMessageList.CompressionType.UNCOMPRESSED)
+
+    decoded = communicator.Communicator.DecompressMessageList(
+        packed_message_list)
+    self.assertEqual(decoded.job[0].payload.data, blob.data)
+
   def testX509Verify(self):
     """X509 Verify can have several failure paths."""
 
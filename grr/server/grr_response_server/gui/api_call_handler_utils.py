@@ -2,6 +2,7 @@
 """This file contains utility functions used in ApiCallHandler classes."""
 
 
+import collections
 import io
 import itertools
 import logging
@@ -20,10 +21,43 @@ from grr_response_core.lib.rdfvalues import client as rdf_client
 from grr_response_core.lib.rdfvalues import structs as rdf_structs
 from grr_response_proto import api_utils_pb2
 from grr_response_server import aff4
+from grr_response_server import threadpool
 from grr_response_server.aff4_objects import aff4_grr
 from grr_response_server.flows.general import export as flow_export
 
 
+class _FileGroupRead(object):
+  """A read of the contents of a group of files."""
+
+  def __init__(self, fds, deflate=False):
+    self.fds = fds
+    self.deflate = deflate
+    # Maps fds to their contents, either a list of chunks or, when deflating,
+    # a utils.DeflatedFileContent.
+    self.contents = {}
+    # Maps fds that couldn't be read to the exceptions raised.
+    self.errors = {}
+
+  def Run(self):
+    """Reads the files and returns itself."""
+    chunks = collections.OrderedDict((fd, []) for fd in self.fds)
+    for fd, chunk, exception in aff4.AFF4Stream.MultiStream(self.fds):
+      if exception:
+        self.errors[fd] = exception
+      else:
+        chunks[fd].append(chunk)
+
+    for fd, fd_chunks in iteritems(chunks):
+      if fd in self.errors:
+        continue
+      if self.deflate:
+        self.contents[fd] = utils.DeflatedFileContent(fd_chunks)
+      else:
+        self.contents[fd] = fd_chunks
+
+    return self
+
+
 class CollectionArchiveGenerator(object):
   """Class that generates downloaded files archive from a collection."""
 
@@ -37,12 +71,22 @@ class CollectionArchiveGenerator(object):
 
   BATCH_SIZE = 1000
 
+  # Contents of the files are read ahead (and compressed for zip archives) on a
+  # thread pool in groups of at most this many files and bytes. Files larger
+  # than a group are streamed directly into the archive.
+  PREFETCH_GROUP_FILES = 100
+  PREFETCH_GROUP_SIZE = 32 * 1024 * 1024
+  # The number of groups read in parallel.
+  PREFETCH_THREADS = 4
+
   def __init__(self,
                archive_format=ZIP,
                prefix=None,
                description=None,
                predicate=None,
-               client_id=None):
+               client_id=None,
+               files_per_part=None,
+               part=0):
     """CollectionArchiveGenerator constructor.
 
     Args:
@@ -56,8 +100,14 @@ class CollectionArchiveGenerator(object):
       predicate: If not None, only the files matching the predicate will be
           archived, all others will be skipped.
       client_id: The client_id to use when exporting a flow results collection.
+      files_per_part: If set, the archive is split into parts, each one
+          referencing this many files of the collection. Every part is a
+          complete archive, so a large download can be restarted from the part
+          that failed.
+      part: The zero based index of the part to generate. Only used when
+          files_per_part is set.
     Raises:
-      ValueError: if prefix is None.
+      ValueError: if prefix is None or the part is out of range.
     """
     super(CollectionArchiveGenerator, self).__init__()
 
@@ -68,21 +118,36 @@ class CollectionArchiveGenerator(object):
       self.archive_generator = utils.StreamingTarGenerator()
     else:
       raise ValueError("Unknown archive format: %s" % archive_format)
+    # Zip archives compress every file separately, so files are deflated
+    # while they are read ahead. Tar archives are compressed as a whole.
+    self._deflate = archive_format == self.ZIP
 
     if not prefix:
       raise ValueError("Prefix can't be None.")
     self.prefix = prefix
 
+    if files_per_part is not None and files_per_part <= 0:
+      raise ValueError("files_per_part has to be positive: %d" % files_per_part)
+    if part < 0:
+      raise ValueError("part can't be negative: %d" % part)
+    self.files_per_part = files_per_part
+    self.part = part
+    self.last_part = True
+
     self.description = description or "Files archive collection"
 
     self.total_files = 0
     self.archived_files = 0
+    self.deduplicated_files = 0
     self.ignored_files = []
     self.failed_files = []
 
     self.predicate = predicate or (lambda _: True)
     self.client_id = client_id
 
+    # Maps sha256 hashes of the archived contents to their path in the archive.
+    self._archived_contents = {}
+
   @property
   def output_size(self):
     return self.archive_generator.output_size
@@ -95,6 +160,22 @@ class CollectionArchiveGenerator(object):
       except flow_export.ItemNotExportableError:
         pass
 
+  def _PartUrns(self, items):
+    """Yields the urns of the files in the generated part of the collection."""
+    urns = self._ItemsToUrns(items)
+    if self.files_per_part is None:
+      for urn in urns:
+        yield urn
+      return
+
+    start = self.part * self.files_per_part
+    stop = start + self.files_per_part
+    for urn in itertools.islice(urns, start, stop):
+      yield urn
+
+    # There are more parts if the collection has files past this one.
+    self.last_part = next(urns, None) is None
+
   def _GenerateDescription(self):
     """Generates description into a MANIFEST file in the archive."""
 
@@ -105,10 +186,16 @@ class CollectionArchiveGenerator(object):
         "ignored_files": len(self.ignored_files),
         "failed_files": len(self.failed_files)
     }
+    if self.deduplicated_files:
+      manifest["deduplicated_files"] = self.deduplicated_files
     if self.ignored_files:
       manifest["ignored_files_list"] = self.ignored_files
     if self.failed_files:
       manifest["failed_files_list"] = self.failed_files
+    if self.files_per_part is not None:
+      manifest["part"] = self.part
+      manifest["files_per_part"] = self.files_per_part
+      manifest["last_part"] = self.last_part
 
     # TODO(hanuszczak): Manifest is a YAML file which is supposed to be
     # unicode-encoded format. However due to PyYAML incompetence we are given
@@ -138,11 +225,175 @@ class CollectionArchiveGenerator(object):
     yield self.archive_generator.WriteFileChunk(summary)
     yield self.archive_generator.WriteFileFooter()
 
+  def _ContentHash(self, fd):
+    hash_obj = fd.Get(fd.Schema.HASH)
+    if hash_obj is None or not hash_obj.sha256:
+      return None
+    return hash_obj.sha256
+
+  def _FileFailed(self, fd, exception, fds_to_write, duplicates):
+    """Records a file that couldn't be read.
+
+    Its duplicates have the same contents but are stored separately, so the
+    first of them is read instead and the others become its duplicates.
+
+    Args:
+      fd: The file that couldn't be read.
+      exception: The exception raised while reading the file.
+      fds_to_write: The dict of files to write, the fallback is added to it.
+      duplicates: The dict mapping files to their duplicates.
+
+    Returns:
+      The duplicate to read instead or None if there is none.
+    """
+    logging.exception(exception)
+
+    self.archived_files -= 1
+    self.failed_files.append(utils.SmartUnicode(fd.urn))
+
+    fd_duplicates = duplicates.pop(fd, None)
+    if not fd_duplicates:
+      return None
+
+    fallback_fd, fallback_path = fd_duplicates[0]
+    duplicates[fallback_fd] = fd_duplicates[1:]
+    st = os.stat_result((0o644, 0, 0, 0, 0, 0, fallback_fd.size, 0, 0, 0))
+    fds_to_write[fallback_fd] = (fallback_path, st)
+    return fallback_fd
+
+  def _FileArchived(self, fd, content_path, duplicates):
+    """Records an archived file and links its duplicates to it."""
+    content_hash = self._ContentHash(fd)
+    if content_hash is not None:
+      self._archived_contents[content_hash] = content_path
+
+    for _, dup_path in duplicates.get(fd, []):
+      yield self._WriteDuplicate(content_path, dup_path)
+
+  def _WriteDuplicate(self, content_path, dup_path):
+    self.deduplicated_files += 1
+    # Links are relative, so that they are valid wherever the archive is
+    # extracted.
+    target = os.path.relpath(content_path, os.path.dirname(dup_path))
+    return self.archive_generator.WriteSymlink(target, dup_path)
+
+  def _GroupFiles(self, fds):
+    """Splits files into groups that are read ahead together."""
+    group = []
+    group_size = 0
+    for fd in fds:
+      if fd.size > self.PREFETCH_GROUP_SIZE:
+        yield [fd]
+        continue
+
+      if (len(group) >= self.PREFETCH_GROUP_FILES or
+          group_size + fd.size > self.PREFETCH_GROUP_SIZE):
+        yield group
+        group = []
+        group_size = 0
+
+      group.append(fd)
+      group_size += fd.size
+
+    if group:
+      yield group
+
+  def _StreamFiles(self, fds, fds_to_write, duplicates):
+    """Streams the contents of the files directly into the archive."""
+    fallbacks = []
+    prev_fd = None
+    for fd, chunk, exception in aff4.AFF4Stream.MultiStream(fds):
+      if exception:
+        fallback_fd = self._FileFailed(fd, exception, fds_to_write, duplicates)
+        if fallback_fd is not None:
+          fallbacks.append(fallback_fd)
+        continue
+
+      if prev_fd != fd:
+        if prev_fd:
+          yield self.archive_generator.WriteFileFooter()
+          for link in self._FileArchived(prev_fd, fds_to_write[prev_fd][0],
+                                         duplicates):
+            yield link
+        prev_fd = fd
+
+        content_path, st = fds_to_write[fd]
+        yield self.archive_generator.WriteFileHeader(content_path, st=st)
+
+      yield self.archive_generator.WriteFileChunk(chunk)
+
+    if self.archive_generator.is_file_write_in_progress:
+      yield self.archive_generator.WriteFileFooter()
+      for link in self._FileArchived(prev_fd, fds_to_write[prev_fd][0],
+                                     duplicates):
+        yield link
+
+    if fallbacks:
+      for chunk in self._StreamFiles(fallbacks, fds_to_write, duplicates):
+        yield chunk
+
+  def _WriteFileGroup(self, read, fds_to_write, duplicates):
+    """Writes the files of a finished _FileGroupRead into the archive."""
+    fallbacks = []
+    for fd in read.fds:
+      if fd in read.errors:
+        fallback_fd = self._FileFailed(fd, read.errors[fd], fds_to_write,
+                                       duplicates)
+        if fallback_fd is not None:
+          fallbacks.append(fallback_fd)
+        continue
+
+      content_path, st = fds_to_write[fd]
+      content = read.contents[fd]
+      yield self.archive_generator.WriteFileHeader(content_path, st=st)
+      if read.deflate:
+        yield self.archive_generator.WriteDeflatedFileContent(content)
+      else:
+        for chunk in content:
+          yield self.archive_generator.WriteFileChunk(chunk)
+      yield self.archive_generator.WriteFileFooter()
+
+      for link in self._FileArchived(fd, content_path, duplicates):
+        yield link
+
+    # Duplicates of files that couldn't be read are rare, they are read
+    # straight away instead of ahead.
+    if fallbacks:
+      for chunk in self._StreamFiles(fallbacks, fds_to_write, duplicates):
+        yield chunk
+
+  def _WriteFiles(self, fds_to_write, duplicates):
+    """Writes the contents of the files, reading them ahead on a pool."""
+    with threadpool.ReadAhead(
+        self.PREFETCH_THREADS, name="ArchiveFilesRead") as read_ahead:
+      # Duplicates of files that fail are added to fds_to_write while it is
+      # being written.
+      for group in self._GroupFiles(list(fds_to_write)):
+        if group[0].size > self.PREFETCH_GROUP_SIZE:
+          for read in read_ahead.Drain():
+            for chunk in self._WriteFileGroup(read, fds_to_write, duplicates):
+              yield chunk
+
+          for chunk in self._StreamFiles(group, fds_to_write, duplicates):
+            yield chunk
+          continue
+
+        read = _FileGroupRead(group, deflate=self._deflate)
+        for done_read in read_ahead.Add(read.Run):
+          for chunk in self._WriteFileGroup(done_read, fds_to_write,
+                                            duplicates):
+            yield chunk
+
+      for read in read_ahead.Drain():
+        for chunk in self._WriteFileGroup(read, fds_to_write, duplicates):
+          yield chunk
+
   def Generate(self, collection, token=None):
     """Generates archive from a given collection.
 
     Iterates the collection and generates an archive by yielding contents
-    of every referenced AFF4Stream.
+    of every referenced AFF4Stream. Files with the same contents as an already
+    archived file are stored as links to it.
 
     Args:
       collection: Iterable with items that point to aff4 paths.
@@ -153,10 +404,20 @@ class CollectionArchiveGenerator(object):
     """
     clients = set()
     for fd_urn_batch in utils.Grouper(
-        self._ItemsToUrns(collection), self.BATCH_SIZE):
-
-      fds_to_write = {}
-      for fd in aff4.FACTORY.MultiOpen(fd_urn_batch, token=token):
+        self._PartUrns(collection), self.BATCH_SIZE):
+
+      fds_to_write = collections.OrderedDict()
+      # Maps files to the files with the same contents in this batch, which
+      # are only written once the original is.
+      duplicates = {}
+      batch_contents = {}
+      # Files are processed in the collection order, so that the first copy of
+      # duplicate contents is always the one archived.
+      batch_order = {urn: i for i, urn in enumerate(fd_urn_batch)}
+      fds = sorted(
+          aff4.FACTORY.MultiOpen(fd_urn_batch, token=token),
+          key=lambda fd: batch_order.get(fd.urn, len(batch_order)))  # pylint: disable=cell-var-from-loop
+      for fd in fds:
         self.total_files += 1
 
         if not self.predicate(fd):
@@ -171,33 +432,26 @@ class CollectionArchiveGenerator(object):
           content_path = os.path.join(self.prefix, *urn_components)
           self.archived_files += 1
 
+          content_hash = self._ContentHash(fd)
+          if content_hash in self._archived_contents:
+            yield self._WriteDuplicate(self._archived_contents[content_hash],
+                                       content_path)
+            continue
+          if content_hash in batch_contents:
+            duplicates.setdefault(batch_contents[content_hash], []).append(
+                (fd, content_path))
+            continue
+          if content_hash is not None:
+            batch_contents[content_hash] = fd
+
           # Make sure size of the original file is passed. It's required
           # when output_writer is StreamingTarWriter.
           st = os.stat_result((0o644, 0, 0, 0, 0, 0, fd.size, 0, 0, 0))
           fds_to_write[fd] = (content_path, st)
 
       if fds_to_write:
-        prev_fd = None
-        for fd, chunk, exception in aff4.AFF4Stream.MultiStream(fds_to_write):
-          if exception:
-            logging.exception(exception)
-
-            self.archived_files -= 1
-            self.failed_files.append(utils.SmartUnicode(fd.urn))
-            continue
-
-          if prev_fd != fd:
-            if prev_fd:
-              yield self.archive_generator.WriteFileFooter()
-            prev_fd = fd
-
-            content_path, st = fds_to_write[fd]
-            yield self.archive_generator.WriteFileHeader(content_path, st=st)
-
-          yield self.archive_generator.WriteFileChunk(chunk)
-
-        if self.archive_generator.is_file_write_in_progress:
-          yield self.archive_generator.WriteFileFooter()
+        for chunk in self._WriteFiles(fds_to_write, duplicates):
+          yield chunk
 
     if clients:
       for client_urn_batch in utils.Grouper(clients, self.BATCH_SIZE):
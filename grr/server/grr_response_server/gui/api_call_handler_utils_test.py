@@ -35,9 +35,12 @@ class CollectionArchiveGeneratorTest(test_lib.GRRBaseTest):
     super(CollectionArchiveGeneratorTest, self).setUp()
     self.client_id = self.SetupClient(0)
 
-  def _CreateFile(self, path, content, hashing=False):
-    with aff4.FACTORY.Create(
-        path, aff4.AFF4MemoryStream, token=self.token) as fd:
+  def _CreateFile(self,
+                  path,
+                  content,
+                  hashing=False,
+                  aff4_type=aff4.AFF4MemoryStream):
+    with aff4.FACTORY.Create(path, aff4_type, token=self.token) as fd:
       fd.Write(content)
 
       if hashing:
@@ -79,7 +82,8 @@ class CollectionArchiveGeneratorTest(test_lib.GRRBaseTest):
       self,
       collection,
       archive_format=api_call_handler_utils.CollectionArchiveGenerator.ZIP,
-      predicate=None):
+      predicate=None,
+      **kwargs):
 
     fd_path = os.path.join(self.temp_dir, "archive")
     archive_generator = api_call_handler_utils.CollectionArchiveGenerator(
@@ -87,7 +91,8 @@ class CollectionArchiveGeneratorTest(test_lib.GRRBaseTest):
         predicate=predicate,
         prefix="test_prefix",
         description="Test description",
-        client_id=self.client_id)
+        client_id=self.client_id,
+        **kwargs)
     with open(fd_path, "wb") as out_fd:
       for chunk in archive_generator.Generate(collection, token=self.token):
         out_fd.write(chunk)
@@ -264,6 +269,142 @@ class CollectionArchiveGeneratorTest(test_lib.GRRBaseTest):
             ]
         })
 
+  def _InitializeDuplicateFiles(self):
+    self._InitializeFiles(hashing=True)
+
+    path3 = self.client_id.Add("fs/os/foo/hello3.txt")
+    self._CreateFile(path=path3, content="hello1", hashing=True)
+    self.stat_entries.append(
+        rdf_client_fs.StatEntry(
+            pathspec=rdf_paths.PathSpec(
+                path="foo/hello3.txt",
+                pathtype=rdf_paths.PathSpec.PathType.OS)))
+
+  def testLinksDuplicateFilesInZip(self):
+    self._InitializeDuplicateFiles()
+
+    fd_path = self._GenerateArchive(
+        self.stat_entries,
+        archive_format=api_call_handler_utils.CollectionArchiveGenerator.ZIP)
+
+    zip_fd = zipfile.ZipFile(fd_path)
+    link_name = "test_prefix/%s/fs/os/foo/hello3.txt" % self.client_id.Basename()
+    link_info = zip_fd.getinfo(link_name)
+    self.assertEqual(link_info.external_attr, (0o644 | 0o120000) << 16)
+    self.assertEqual(zip_fd.read(link_name), "bar/hello1.txt")
+    self.assertEqual(zip_fd.read(self.archive_paths[0]), "hello1")
+
+    manifest = yaml.safe_load(zip_fd.read("test_prefix/MANIFEST"))
+    self.assertEqual(manifest["archived_files"], 3)
+    self.assertEqual(manifest["deduplicated_files"], 1)
+
+  def testLinksDuplicateFilesInTar(self):
+    self._InitializeDuplicateFiles()
+
+    fd_path = self._GenerateArchive(
+        self.stat_entries,
+        archive_format=api_call_handler_utils.CollectionArchiveGenerator.TAR_GZ)
+
+    with tarfile.open(fd_path) as tar_fd:
+      link_info = tar_fd.getmember(
+          "test_prefix/%s/fs/os/foo/hello3.txt" % self.client_id.Basename())
+      self.assertTrue(link_info.issym())
+      self.assertEqual(link_info.linkname, "bar/hello1.txt")
+
+  def testArchivesDuplicateOfFailedFile(self):
+    path1 = self.client_id.Add("fs/os/foo/bar/hello1.txt")
+    self._CreateFile(
+        path=path1, content="hello1", hashing=True, aff4_type=aff4.AFF4Image)
+    # The original can't be read, its duplicate has to be archived instead.
+    aff4.FACTORY.Delete(path1.Add("0000000000"), token=self.token)
+
+    path2 = self.client_id.Add("fs/os/foo/hello2.txt")
+    self._CreateFile(path=path2, content="hello1", hashing=True)
+
+    stat_entries = [
+        rdf_client_fs.StatEntry(
+            pathspec=rdf_paths.PathSpec(
+                path=path, pathtype=rdf_paths.PathSpec.PathType.OS))
+        for path in ["foo/bar/hello1.txt", "foo/hello2.txt"]
+    ]
+    fd_path = self._GenerateArchive(
+        stat_entries,
+        archive_format=api_call_handler_utils.CollectionArchiveGenerator.ZIP)
+
+    zip_fd = zipfile.ZipFile(fd_path)
+    names = zip_fd.namelist()
+    self.assertNotIn(
+        "test_prefix/%s/fs/os/foo/bar/hello1.txt" % self.client_id.Basename(),
+        names)
+    self.assertEqual(
+        zip_fd.read(
+            "test_prefix/%s/fs/os/foo/hello2.txt" % self.client_id.Basename()),
+        "hello1")
+
+    manifest = yaml.safe_load(zip_fd.read("test_prefix/MANIFEST"))
+    self.assertEqual(manifest["archived_files"], 1)
+    self.assertEqual(manifest["failed_files_list"], [utils.SmartUnicode(path1)])
+    self.assertNotIn("deduplicated_files", manifest)
+
+  def testReadsFilesAheadInSmallGroups(self):
+    self._InitializeFiles(hashing=False)
+
+    with utils.MultiStubber(
+        (api_call_handler_utils.CollectionArchiveGenerator,
+         "PREFETCH_GROUP_FILES", 1),
+        (api_call_handler_utils.CollectionArchiveGenerator, "PREFETCH_THREADS",
+         1)):
+      fd_path = self._GenerateArchive(
+          self.stat_entries,
+          archive_format=api_call_handler_utils.CollectionArchiveGenerator.ZIP)
+
+    zip_fd = zipfile.ZipFile(fd_path)
+    self.assertEqual(zip_fd.read(self.archive_paths[0]), "hello1")
+    self.assertEqual(zip_fd.read(self.archive_paths[1]), "hello2")
+
+  def testStreamsFilesLargerThanPrefetchGroup(self):
+    self._InitializeFiles(hashing=False)
+
+    with utils.Stubber(api_call_handler_utils.CollectionArchiveGenerator,
+                       "PREFETCH_GROUP_SIZE", 1):
+      fd_path = self._GenerateArchive(
+          self.stat_entries,
+          archive_format=api_call_handler_utils.CollectionArchiveGenerator.ZIP)
+
+    zip_fd = zipfile.ZipFile(fd_path)
+    self.assertEqual(zip_fd.read(self.archive_paths[0]), "hello1")
+    self.assertEqual(zip_fd.read(self.archive_paths[1]), "hello2")
+
+  def testGeneratesArchiveParts(self):
+    self._InitializeFiles(hashing=True)
+
+    names = set()
+    for part in range(2):
+      fd_path = self._GenerateArchive(
+          self.stat_entries, files_per_part=1, part=part)
+
+      zip_fd = zipfile.ZipFile(fd_path)
+      names.update(utils.SmartUnicode(n) for n in zip_fd.namelist())
+
+      manifest = yaml.safe_load(zip_fd.read("test_prefix/MANIFEST"))
+      self.assertEqual(manifest["processed_files"], 1)
+      self.assertEqual(manifest["archived_files"], 1)
+      self.assertEqual(manifest["part"], part)
+      self.assertEqual(manifest["files_per_part"], 1)
+      self.assertEqual(manifest["last_part"], part == 1)
+
+    for p in self.archive_paths:
+      self.assertIn(p, names)
+
+  def testRaisesOnInvalidParts(self):
+    with self.assertRaises(ValueError):
+      api_call_handler_utils.CollectionArchiveGenerator(
+          prefix="test_prefix", files_per_part=0)
+
+    with self.assertRaises(ValueError):
+      api_call_handler_utils.CollectionArchiveGenerator(
+          prefix="test_prefix", files_per_part=1, part=-1)
+
 
 class FilterCollectionTest(test_lib.GRRBaseTest):
   """Test for FilterCollection."""
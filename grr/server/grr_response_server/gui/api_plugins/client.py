@@ -7,9 +7,7 @@ import sys
 
 
 from future.moves.urllib import parse as urlparse
-from future.utils import iteritems
 from future.utils import iterkeys
-from future.utils import itervalues
 import ipaddr
 
 from fleetspeak.src.server.proto.fleetspeak_server import admin_pb2
@@ -289,6 +287,23 @@ class ApiSearchClientsResult(rdf_structs.RDFProtoStruct):
   ]
 
 
+def _ReadApiClients(client_ids):
+  """Reads ApiClients for a sorted list of client ids from the relational db."""
+  client_infos = data_store.REL_DB.MultiReadClientFullInfo(client_ids)
+  return [
+      ApiClient().InitFromClientInfo(client_infos[client_id])
+      for client_id in client_ids
+      if client_id in client_infos
+  ]
+
+
+def _SearchClientsResult(api_clients, next_cursor):
+  result = ApiSearchClientsResult(items=api_clients)
+  if next_cursor:
+    result.next_cursor = next_cursor
+  return result
+
+
 class ApiSearchClientsHandler(api_call_handler_base.ApiCallHandler):
   """Renders results of a client search."""
 
@@ -301,16 +316,18 @@ class ApiSearchClientsHandler(api_call_handler_base.ApiCallHandler):
     keywords = shlex.split(args.query)
 
     api_clients = []
+    next_cursor = None
 
     if data_store.RelationalDBReadEnabled():
       index = client_index.ClientIndex()
 
-      clients = sorted(
-          index.LookupClients(keywords))[args.offset:args.offset + end]
+      client_ids, next_cursor = index.SearchClients(
+          keywords,
+          offset=args.offset,
+          count=args.count or None,
+          cursor=args.cursor or None)
 
-      client_infos = data_store.REL_DB.MultiReadClientFullInfo(clients)
-      for client_info in itervalues(client_infos):
-        api_clients.append(ApiClient().InitFromClientInfo(client_info))
+      api_clients = _ReadApiClients(client_ids)
 
     else:
       index = client_index.CreateClientIndex(token=token)
@@ -324,7 +341,7 @@ class ApiSearchClientsHandler(api_call_handler_base.ApiCallHandler):
         api_clients.append(ApiClient().InitFromAff4Object(child))
 
     UpdateClientsFromFleetspeak(api_clients)
-    return ApiSearchClientsResult(items=api_clients)
+    return _SearchClientsResult(api_clients, next_cursor)
 
 
 class ApiLabelsRestrictedSearchClientsHandler(
@@ -348,50 +365,32 @@ class ApiLabelsRestrictedSearchClientsHandler(
 
     return False
 
-  def _VerifyLabels(self, labels):
-    for label in labels:
-      if (label.name in self.labels_whitelist and
-          label.owner in self.labels_owners_whitelist):
-        return True
-    return False
-
   def Handle(self, args, token=None):
     if args.count:
       end = args.offset + args.count
-      # Read <count> clients ahead in case some of them fail to open / verify.
-      batch_size = end + args.count
     else:
       end = sys.maxsize
-      batch_size = end
 
     keywords = shlex.split(args.query)
     api_clients = []
+    next_cursor = None
 
     if data_store.RelationalDBReadEnabled():
-      index = client_index.ClientIndex()
+      if not self.labels_whitelist or not self.labels_owners_whitelist:
+        return ApiSearchClientsResult()
 
-      # TODO(amoser): We could move the label verification into the
-      # database making this method more efficient. Label restrictions
-      # should be on small subsets though so this might not be worth
-      # it.
-      all_client_ids = set()
-      for label in self.labels_whitelist:
-        label_filter = ["label:" + label] + keywords
-        all_client_ids.update(index.LookupClients(label_filter))
+      # The label restrictions are checked by the database, so only the clients
+      # on the requested page are read.
+      index = client_index.ClientIndex()
+      client_ids, next_cursor = index.SearchClients(
+          keywords,
+          offset=args.offset,
+          count=args.count or None,
+          labels=self.labels_whitelist,
+          label_owners=self.labels_owners_whitelist,
+          cursor=args.cursor or None)
 
-      index = 0
-      for cid_batch in utils.Grouper(sorted(all_client_ids), batch_size):
-        client_infos = data_store.REL_DB.MultiReadClientFullInfo(cid_batch)
-
-        for _, client_info in sorted(iteritems(client_infos)):
-          if not self._VerifyLabels(client_info.labels):
-            continue
-          if index >= args.offset and index < end:
-            api_clients.append(ApiClient().InitFromClientInfo(client_info))
-          index += 1
-          if index >= end:
-            UpdateClientsFromFleetspeak(api_clients)
-            return ApiSearchClientsResult(items=api_clients)
+      api_clients = _ReadApiClients(client_ids)
 
     else:
       index = client_index.CreateClientIndex(token=token)
@@ -415,7 +414,7 @@ class ApiLabelsRestrictedSearchClientsHandler(
           break
 
     UpdateClientsFromFleetspeak(api_clients)
-    return ApiSearchClientsResult(items=api_clients)
+    return _SearchClientsResult(api_clients, next_cursor)
 
 
 class ApiGetClientArgs(rdf_structs.RDFProtoStruct):
@@ -403,6 +403,29 @@ class ApiLabelsRestrictedSearchClientsHandlerTestRelational(
       data_store.REL_DB.AddClientLabels(client_id, u"david", [u"foo"])
       index.AddClientLabels(client_id, [u"foo"])
 
+  def testSearchWithCursor(self):
+    self._Setup100Clients()
+
+    result = []
+    cursor = None
+    for count in [10, 40, 25, 500]:
+      args = client_plugin.ApiSearchClientsArgs(query="label:foo", count=count)
+      if cursor:
+        args.cursor = cursor
+      page = self.handler.Handle(args, token=self.token)
+      result.extend(page.items)
+      cursor = page.next_cursor
+
+    self.assertEqual([str(res.client_id) for res in result], self.client_ids)
+    self.assertFalse(cursor)
+
+  def testSearchWithoutWhitelistedOwnersReturnsNothing(self):
+    handler = client_plugin.ApiLabelsRestrictedSearchClientsHandler(
+        labels_whitelist=[u"foo", u"bar"])
+    result = handler.Handle(
+        client_plugin.ApiSearchClientsArgs(), token=self.token)
+    self.assertFalse(result.items)
+
 
 class ApiInterrogateClientHandlerTest(api_test_lib.ApiCallHandlerTest):
   """Test for ApiInterrogateClientHandler."""
@@ -98,6 +98,8 @@ def _SetupAndRunVersionBreakDownCronjob(token=None):
     if data_store.RelationalDBReadEnabled():
       cron_job_name = unicode(cron_system.GRRVersionBreakDownCronJob.__name__)
       cronjobs.ScheduleSystemCronJobs(names=[cron_job_name])
+      # The per breakdown jobs are disabled by default.
+      manager.EnableJob(cron_job_name)
       manager.RunOnce()
       manager._GetThreadPool().Join()
     else:
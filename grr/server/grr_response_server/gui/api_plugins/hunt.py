@@ -956,10 +956,18 @@ class ApiGetHuntFilesArchiveHandler(api_call_handler_base.ApiCallHandler):
     else:
       raise ValueError("Unknown archive format: %s" % args.archive_format)
 
+    if args.files_per_part:
+      files_per_part = args.files_per_part
+      file_extension = "_part%d%s" % (args.part, file_extension)
+    else:
+      files_per_part = None
+
     generator = api_call_handler_utils.CollectionArchiveGenerator(
         prefix=target_file_prefix,
         description=description,
-        archive_format=archive_format)
+        archive_format=archive_format,
+        files_per_part=files_per_part,
+        part=args.part)
     content_generator = self._WrapContentGenerator(
         generator, collection, args, token=token)
     return api_call_handler_base.ApiBinaryStream(
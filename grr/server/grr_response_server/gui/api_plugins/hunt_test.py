@@ -315,6 +315,30 @@ class ApiGetHuntFilesArchiveHandlerTest(api_test_lib.ApiCallHandlerTest,
         self.assertEqual(manifest["processed_files"], 10)
         self.assertEqual(manifest["ignored_files"], 0)
 
+  def testGeneratesArchiveParts(self):
+    manifests = []
+    for part in range(3):
+      result = self.handler.Handle(
+          hunt_plugin.ApiGetHuntFilesArchiveArgs(
+              hunt_id=self.hunt.urn.Basename(),
+              archive_format="ZIP",
+              files_per_part=4,
+              part=part),
+          token=self.token)
+      self.assertTrue(result.filename.endswith("_part%d.zip" % part))
+
+      out_fd = io.BytesIO()
+      for chunk in result.GenerateContent():
+        out_fd.write(chunk)
+
+      zip_fd = zipfile.ZipFile(out_fd, "r")
+      for name in zip_fd.namelist():
+        if name.endswith("MANIFEST"):
+          manifests.append(yaml.safe_load(zip_fd.read(name)))
+
+    self.assertEqual([m["archived_files"] for m in manifests], [4, 4, 2])
+    self.assertEqual([m["last_part"] for m in manifests], [False, False, True])
+
 
 class ApiGetHuntFileHandlerTest(api_test_lib.ApiCallHandlerTest,
                                 hunt_test_lib.StandardHuntTestMixin):
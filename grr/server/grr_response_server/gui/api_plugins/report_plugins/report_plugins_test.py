@@ -6,12 +6,14 @@ import math
 import os
 
 from builtins import range  # pylint: disable=redefined-builtin
+import mock
 
 from grr_response_core import config
 from grr_response_core.lib import flags
 from grr_response_core.lib import rdfvalue
 from grr_response_core.lib.rdfvalues import events as rdf_events
 from grr_response_core.lib.rdfvalues import paths as rdf_paths
+from grr_response_server import data_store
 from grr_response_server import events
 from grr_response_server.aff4_objects import filestore_test_lib
 from grr_response_server.flows.cron import filestore_stats
@@ -24,7 +26,9 @@ from grr_response_server.gui.api_plugins.report_plugins import filestore_report_
 from grr_response_server.gui.api_plugins.report_plugins import rdf_report_plugins
 from grr_response_server.gui.api_plugins.report_plugins import report_plugins
 from grr_response_server.gui.api_plugins.report_plugins import report_plugins_test_mocks
+from grr_response_server.gui.api_plugins.report_plugins import report_utils
 from grr_response_server.gui.api_plugins.report_plugins import server_report_plugins
+from grr.test_lib import db_test_lib
 from grr.test_lib import flow_test_lib
 from grr.test_lib import test_lib
 
@@ -94,6 +98,74 @@ class ReportUtilsTest(test_lib.GRRBaseTest):
     self.assertNotIn("Fake outdated audit log.", audit_events)
 
 
+class ReportUtilsRelationalTest(db_test_lib.RelationalDBEnabledMixin,
+                                test_lib.GRRBaseTest):
+
+  def _AddFlowRuns(self, times):
+    for time in times:
+      with test_lib.FakeTime(rdfvalue.RDFDatetime.FromHumanReadable(time)):
+        AddFakeAuditLog(
+            action=rdf_events.AuditEvent.Action.RUN_FLOW,
+            user="User123",
+            flow_name="Flow123",
+            token=self.token)
+
+  def testGetAuditEventCountsReadsOnlyPartialDays(self):
+    self._AddFlowRuns([
+        "2012/12/01 12:00", "2012/12/02 06:00", "2012/12/05 12:00",
+        "2012/12/07 12:00", "2012/12/08 06:00", "2012/12/08 18:00"
+    ])
+
+    now = rdfvalue.RDFDatetime.FromHumanReadable("2012/12/08 12:00")
+    with mock.patch.object(
+        data_store.REL_DB,
+        "ReadAuditEvents",
+        wraps=data_store.REL_DB.ReadAuditEvents) as read_events:
+      counts = report_utils.GetAuditEventCounts(
+          rdfvalue.Duration("7d"), now, self.token)
+
+    # Events from 2012/12/01 12:00 to 2012/12/08 06:00.
+    self.assertEqual(
+        counts,
+        {("User123", int(rdf_events.AuditEvent.Action.RUN_FLOW), "Flow123"): 5})
+
+    # Only the first and the last day are partial.
+    self.assertEqual(read_events.call_count, 2)
+    for call in read_events.call_args_list:
+      start, end = call[1]["timerange"]
+      self.assertLess(end - start, rdfvalue.Duration("1d"))
+
+  def testGetAuditEventCountsWithinOneDay(self):
+    self._AddFlowRuns(["2012/12/01 06:00", "2012/12/01 12:00"])
+
+    now = rdfvalue.RDFDatetime.FromHumanReadable("2012/12/01 12:00")
+    counts = report_utils.GetAuditEventCounts(
+        rdfvalue.Duration("12h"), now, self.token)
+
+    # Events created exactly at now are not counted.
+    self.assertEqual(
+        counts,
+        {("User123", int(rdf_events.AuditEvent.Action.RUN_FLOW), "Flow123"): 1})
+
+  def testGetAuditLogEntriesFiltersByAction(self):
+    self._AddFlowRuns(["2012/12/01 06:00"])
+    with test_lib.FakeTime(
+        rdfvalue.RDFDatetime.FromHumanReadable("2012/12/01 07:00")):
+      AddFakeAuditLog(
+          action=rdf_events.AuditEvent.Action.HUNT_CREATED,
+          user="User123",
+          token=self.token)
+
+    entries = list(
+        report_utils.GetAuditLogEntries(
+            rdfvalue.Duration("1d"),
+            rdfvalue.RDFDatetime.FromHumanReadable("2012/12/02"),
+            self.token,
+            actions=[rdf_events.AuditEvent.Action.HUNT_CREATED]))
+    self.assertEqual([e.action for e in entries],
+                     [rdf_events.AuditEvent.Action.HUNT_CREATED])
+
+
 class ClientReportPluginsTest(test_lib.GRRBaseTest):
 
   def MockClients(self):
@@ -369,6 +441,7 @@ class FileStoreReportPluginsTest(test_lib.GRRBaseTest):
       self.assertEqual([p.y for p in series.points], [0])
 
 
+@db_test_lib.DualDBTest
 class ServerReportPluginsTest(test_lib.GRRBaseTest):
 
   def testClientApprovalsReportPlugin(self):
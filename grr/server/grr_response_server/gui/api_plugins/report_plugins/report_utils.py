@@ -1,22 +1,43 @@
 #!/usr/bin/env python
 """UI report handling helper utils."""
 
+from grr_response_core.lib import rdfvalue
 from grr_response_server import aff4
+from grr_response_server import data_store
+from grr_response_server import db
 from grr_response_server.flows.general import audit
 
 
-def GetAuditLogEntries(offset, now, token):
+def _JustBefore(timestamp):
+  return rdfvalue.RDFDatetime(timestamp.AsMicrosecondsSinceEpoch() - 1)
+
+
+def _JustAfter(timestamp):
+  return rdfvalue.RDFDatetime(timestamp.AsMicrosecondsSinceEpoch() + 1)
+
+
+def GetAuditLogEntries(offset, now, token, actions=None):
   """Return all audit log entries between now-offset and now.
 
   Args:
     offset: rdfvalue.Duration how far back to look in time
     now: rdfvalue.RDFDatetime for current time
     token: GRR access token
+    actions: If set, only entries with one of these AuditEvent.Action values
+      are returned.
   Raises:
     ValueError: No logs were found.
   Yields:
     AuditEvents created during the time range
   """
+  if data_store.RelationalDBReadEnabled():
+    # The relational db range is inclusive, the range here isn't.
+    for event in data_store.REL_DB.ReadAuditEvents(
+        timerange=(_JustAfter(now - offset), _JustBefore(now)),
+        actions=actions):
+      yield event
+    return
+
   start_time = now - offset - aff4.AUDIT_ROLLOVER_TIME
 
   logs_found = False
@@ -24,8 +45,71 @@ def GetAuditLogEntries(offset, now, token):
     logs_found = True
     for event in fd.GenerateItems():
       if now - offset < event.timestamp < now:
-        yield event
+        if actions is None or event.action in actions:
+          yield event
 
   if not logs_found:
     raise ValueError("Couldn't find any logs in aff4:/audit/logs "
                      "between %s and %s" % (start_time, now))
+
+
+def _CountEvents(events, counts):
+  for event in events:
+    key = (event.user, int(event.action), event.flow_name)
+    counts[key] = counts.get(key, 0) + 1
+
+
+def GetAuditEventCounts(offset, now, token, actions=None):
+  """Counts the audit log entries between now-offset and now.
+
+  The relational db maintains counts per db.AUDIT_EVENT_COUNTS_INTERVAL, so
+  only the entries of the partial intervals at the ends of the time range are
+  read. Entries created exactly at now are not counted, so adjacent time ranges
+  don't count them twice.
+
+  Args:
+    offset: rdfvalue.Duration how far back to look in time
+    now: rdfvalue.RDFDatetime for current time
+    token: GRR access token
+    actions: If set, only entries with one of these AuditEvent.Action values
+      are counted.
+  Raises:
+    ValueError: No logs were found.
+  Returns:
+    A dict mapping (user, action, flow_name) tuples to the number of entries.
+  """
+  counts = {}
+  if not data_store.RelationalDBReadEnabled():
+    _CountEvents(GetAuditLogEntries(offset, now, token, actions=actions), counts)
+    return counts
+
+  interval = db.AUDIT_EVENT_COUNTS_INTERVAL
+  start_time = now - offset
+  first_interval = start_time.Floor(interval)
+  if first_interval < start_time:
+    first_interval += interval
+  last_interval = now.Floor(interval) - interval
+
+  if first_interval > last_interval:
+    _CountEvents(
+        data_store.REL_DB.ReadAuditEvents(
+            timerange=(start_time, _JustBefore(now)), actions=actions), counts)
+    return counts
+
+  counts.update(
+      data_store.REL_DB.ReadAuditEventCounts(
+          timerange=(first_interval, last_interval), actions=actions))
+
+  # Entries of the partial intervals at both ends of the time range.
+  if start_time < first_interval:
+    _CountEvents(
+        data_store.REL_DB.ReadAuditEvents(
+            timerange=(start_time, _JustBefore(first_interval)),
+            actions=actions), counts)
+  if last_interval + interval < now:
+    _CountEvents(
+        data_store.REL_DB.ReadAuditEvents(
+            timerange=(last_interval + interval, _JustBefore(now)),
+            actions=actions), counts)
+
+  return counts
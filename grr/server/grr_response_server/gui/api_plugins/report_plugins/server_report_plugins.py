@@ -9,10 +9,8 @@ from future.utils import iteritems
 
 from grr_response_core.lib import rdfvalue
 from grr_response_core.lib.rdfvalues import events as rdf_events
-from grr_response_server import aff4
 
 from grr_response_server.aff4_objects import users as aff4_users
-from grr_response_server.flows.general import audit
 from grr_response_server.gui.api_plugins.report_plugins import rdf_report_plugins
 from grr_response_server.gui.api_plugins.report_plugins import report_plugin_base
 from grr_response_server.gui.api_plugins.report_plugins import report_utils
@@ -49,10 +47,12 @@ class ClientApprovalsReportPlugin(report_plugin_base.ReportPluginBase):
 
       rows = []
       try:
-        for event in report_utils.GetAuditLogEntries(timerange_offset,
-                                                     timerange_end, token):
-          if event.action in self.__class__.TYPES:
-            rows.append(event)
+        rows.extend(
+            report_utils.GetAuditLogEntries(
+                timerange_offset,
+                timerange_end,
+                token,
+                actions=self.__class__.TYPES))
 
       except ValueError:  # Couldn't find any logs..
         pass
@@ -94,10 +94,12 @@ class CronApprovalsReportPlugin(report_plugin_base.ReportPluginBase):
 
       rows = []
       try:
-        for event in report_utils.GetAuditLogEntries(timerange_offset,
-                                                     timerange_end, token):
-          if event.action in self.__class__.TYPES:
-            rows.append(event)
+        rows.extend(
+            report_utils.GetAuditLogEntries(
+                timerange_offset,
+                timerange_end,
+                token,
+                actions=self.__class__.TYPES))
 
       except ValueError:  # Couldn't find any logs..
         pass
@@ -144,10 +146,12 @@ class HuntActionsReportPlugin(report_plugin_base.ReportPluginBase):
 
       rows = []
       try:
-        for event in report_utils.GetAuditLogEntries(timerange_offset,
-                                                     timerange_end, token):
-          if event.action in self.__class__.TYPES:
-            rows.append(event)
+        rows.extend(
+            report_utils.GetAuditLogEntries(
+                timerange_offset,
+                timerange_end,
+                token,
+                actions=self.__class__.TYPES))
 
       except ValueError:  # Couldn't find any logs..
         pass
@@ -189,10 +193,12 @@ class HuntApprovalsReportPlugin(report_plugin_base.ReportPluginBase):
 
       rows = []
       try:
-        for event in report_utils.GetAuditLogEntries(timerange_offset,
-                                                     timerange_end, token):
-          if event.action in self.__class__.TYPES:
-            rows.append(event)
+        rows.extend(
+            report_utils.GetAuditLogEntries(
+                timerange_offset,
+                timerange_end,
+                token,
+                actions=self.__class__.TYPES))
 
       except ValueError:  # Couldn't find any logs..
         pass
@@ -226,10 +232,11 @@ class MostActiveUsersReportPlugin(report_plugin_base.ReportPluginBase):
 
       counts = {}
       try:
-        for event in report_utils.GetAuditLogEntries(timerange_offset,
-                                                     timerange_end, token):
-          counts.setdefault(event.user, 0)
-          counts[event.user] += 1
+        event_counts = report_utils.GetAuditEventCounts(
+            timerange_offset, timerange_end, token)
+        for (user, _, _), count in iteritems(event_counts):
+          counts.setdefault(user, 0)
+          counts[user] += count
       except ValueError:  # Couldn't find any logs..
         pass
 
@@ -272,14 +279,17 @@ class SystemFlowsReportPlugin(report_plugin_base.ReportPluginBase):
       # Store run count total and per-user
       counts = {}
       try:
-        for event in report_utils.GetAuditLogEntries(timerange_offset,
-                                                     timerange_end, token):
-          if (event.action == rdf_events.AuditEvent.Action.RUN_FLOW and
-              self.UserFilter(event.user)):
-            counts.setdefault(event.flow_name, {"total": 0, event.user: 0})
-            counts[event.flow_name]["total"] += 1
-            counts[event.flow_name].setdefault(event.user, 0)
-            counts[event.flow_name][event.user] += 1
+        event_counts = report_utils.GetAuditEventCounts(
+            timerange_offset,
+            timerange_end,
+            token,
+            actions=[rdf_events.AuditEvent.Action.RUN_FLOW])
+        for (user, _, flow_name), count in iteritems(event_counts):
+          if self.UserFilter(user):
+            counts.setdefault(flow_name, {"total": 0, user: 0})
+            counts[flow_name]["total"] += count
+            counts[flow_name].setdefault(user, 0)
+            counts[flow_name][user] += count
       except ValueError:  # Couldn't find any logs..
         pass
 
@@ -325,21 +335,18 @@ class UserActivityReportPlugin(report_plugin_base.ReportPluginBase):
     try:
       user_activity = {}
       week_duration = rdfvalue.Duration("7d")
-      offset = rdfvalue.Duration("%dw" % self.WEEKS)
       now = rdfvalue.RDFDatetime.Now()
-      start_time = now - offset - aff4.AUDIT_ROLLOVER_TIME
-      try:
-        for fd in audit.AuditLogsForTimespan(start_time, now, token):
-          for event in fd.GenerateItems():
-            for week in range(self.__class__.WEEKS):
-              start = now - week * week_duration
-              if start < event.timestamp < (start + week_duration):
-                weekly_activity = user_activity.setdefault(
-                    event.user,
-                    [[x, 0] for x in range(-self.__class__.WEEKS, 0, 1)])
-                weekly_activity[-week][1] += 1
-      except ValueError:  # Couldn't find any logs..
-        pass
+      for week in range(1, self.__class__.WEEKS + 1):
+        try:
+          event_counts = report_utils.GetAuditEventCounts(
+              week_duration, now - (week - 1) * week_duration, token)
+        except ValueError:  # Couldn't find any logs..
+          continue
+
+        for (user, _, _), count in iteritems(event_counts):
+          weekly_activity = user_activity.setdefault(
+              user, [[x, 0] for x in range(-self.__class__.WEEKS, 0, 1)])
+          weekly_activity[-week][1] += count
 
       ret.stack_chart.data = sorted(
           (rdf_report_plugins.ApiReportDataSeries2D(
@@ -383,14 +390,17 @@ class UserFlowsReportPlugin(report_plugin_base.ReportPluginBase):
       # Store run count total and per-user
       counts = {}
       try:
-        for event in report_utils.GetAuditLogEntries(timerange_offset,
-                                                     timerange_end, token):
-          if (event.action == rdf_events.AuditEvent.Action.RUN_FLOW and
-              self.UserFilter(event.user)):
-            counts.setdefault(event.flow_name, {"total": 0, event.user: 0})
-            counts[event.flow_name]["total"] += 1
-            counts[event.flow_name].setdefault(event.user, 0)
-            counts[event.flow_name][event.user] += 1
+        event_counts = report_utils.GetAuditEventCounts(
+            timerange_offset,
+            timerange_end,
+            token,
+            actions=[rdf_events.AuditEvent.Action.RUN_FLOW])
+        for (user, _, flow_name), count in iteritems(event_counts):
+          if self.UserFilter(user):
+            counts.setdefault(flow_name, {"total": 0, user: 0})
+            counts[flow_name]["total"] += count
+            counts[flow_name].setdefault(user, 0)
+            counts[flow_name][user] += count
       except ValueError:  # Couldn't find any logs..
         pass
 
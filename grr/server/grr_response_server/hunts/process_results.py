@@ -3,6 +3,7 @@
 """
 
 import logging
+import threading
 
 
 from future.utils import iteritems
@@ -14,6 +15,7 @@ from grr_response_core.lib import utils
 from grr_response_server import aff4
 from grr_response_server import data_store
 from grr_response_server import output_plugin
+from grr_response_server import threadpool
 from grr_response_server.aff4_objects import cronjobs
 from grr_response_server.hunts import implementation
 from grr_response_server.hunts import results as hunts_results
@@ -51,8 +53,13 @@ class ProcessHuntResultCollectionsCronFlow(cronjobs.SystemCronFlow):
   lifetime = rdfvalue.Duration("40m")
   allow_overruns = True
 
+  # The maximum number of results read and processed at once. Results of
+  # different hunts are read together.
   BATCH_SIZE = 5000
 
+  # The number of threads running the output plugins of a hunt.
+  PLUGIN_THREADS = 10
+
   def CheckIfRunningTooLong(self):
     if self.max_running_time:
       elapsed = rdfvalue.RDFDatetime.Now() - self.start_time
@@ -76,100 +83,251 @@ class ProcessHuntResultCollectionsCronFlow(cronjobs.SystemCronFlow):
       used_plugins.append((plugin_def, plugin_def.GetPluginForState(state)))
     return output_plugins, used_plugins
 
+  def _GetThreadPool(self):
+    pool = threadpool.ThreadPool.Factory(
+        "HuntResultsPluginPool", min_threads=self.PLUGIN_THREADS)
+    pool.Start()
+    return pool
+
+  def _RunPlugin(self, hunt_urn, plugin_def, plugin, results):
+    """Runs a single output plugin on a batch of results.
+
+    Args:
+      hunt_urn: The urn of the hunt the results belong to.
+      plugin_def: The OutputPluginDescriptor of the plugin.
+      plugin: The OutputPlugin object.
+      results: A list of hunt results.
+
+    Returns:
+      A tuple (status, exception) where status is the
+      OutputPluginBatchProcessingStatus of the run and exception is the
+      exception raised by the plugin or None.
+    """
+    try:
+      plugin.ProcessResponses(results)
+      plugin.Flush()
+
+      plugin_status = output_plugin.OutputPluginBatchProcessingStatus(
+          plugin_descriptor=plugin_def,
+          status="SUCCESS",
+          batch_size=len(results))
+      stats.STATS.IncrementCounter(
+          "hunt_results_ran_through_plugin",
+          delta=len(results),
+          fields=[plugin_def.plugin_name])
+      return plugin_status, None
+
+    except Exception as e:  # pylint: disable=broad-except
+      logging.exception(
+          "Error processing hunt results: hunt %s, "
+          "plugin %s", hunt_urn, utils.SmartStr(plugin))
+      self.Log("Error processing hunt results (hunt %s, "
+               "plugin %s): %s" % (hunt_urn, utils.SmartStr(plugin), e))
+      stats.STATS.IncrementCounter(
+          "hunt_output_plugin_errors", fields=[plugin_def.plugin_name])
+
+      plugin_status = output_plugin.OutputPluginBatchProcessingStatus(
+          plugin_descriptor=plugin_def,
+          status="ERROR",
+          summary=utils.SmartStr(e),
+          batch_size=len(results))
+      return plugin_status, e
+
   def RunPlugins(self, hunt_urn, plugins, results, exceptions_by_plugin):
-    for plugin_def, plugin in plugins:
-      try:
-        plugin.ProcessResponses(results)
-        plugin.Flush()
-
-        plugin_status = output_plugin.OutputPluginBatchProcessingStatus(
-            plugin_descriptor=plugin_def,
-            status="SUCCESS",
-            batch_size=len(results))
-        stats.STATS.IncrementCounter(
-            "hunt_results_ran_through_plugin",
-            delta=len(results),
-            fields=[plugin_def.plugin_name])
-
-      except Exception as e:  # pylint: disable=broad-except
-        logging.exception(
-            "Error processing hunt results: hunt %s, "
-            "plugin %s", hunt_urn, utils.SmartStr(plugin))
-        self.Log("Error processing hunt results (hunt %s, "
-                 "plugin %s): %s" % (hunt_urn, utils.SmartStr(plugin), e))
-        stats.STATS.IncrementCounter(
-            "hunt_output_plugin_errors", fields=[plugin_def.plugin_name])
-
-        plugin_status = output_plugin.OutputPluginBatchProcessingStatus(
-            plugin_descriptor=plugin_def,
-            status="ERROR",
-            summary=utils.SmartStr(e),
-            batch_size=len(results))
-        exceptions_by_plugin.setdefault(plugin_def, []).append(e)
-
-      with data_store.DB.GetMutationPool() as pool:
+    """Runs all output plugins of a hunt on a batch of results.
+
+    The plugins run in parallel. This returns only once all of them are done
+    with the batch, so every plugin still sees the batches of a hunt in order.
+
+    Args:
+      hunt_urn: The urn of the hunt the results belong to.
+      plugins: A list of (plugin_def, plugin) tuples.
+      results: A list of hunt results.
+      exceptions_by_plugin: A dict the exceptions raised by the plugins are
+        added to.
+    """
+    outcomes = [None] * len(plugins)
+
+    if len(plugins) == 1:
+      plugin_def, plugin = plugins[0]
+      outcomes[0] = self._RunPlugin(hunt_urn, plugin_def, plugin, results)
+
+    elif plugins:
+
+      def RunOne(index, plugin_def, plugin, event):
+        try:
+          outcomes[index] = self._RunPlugin(hunt_urn, plugin_def, plugin,
+                                            results)
+        finally:
+          event.set()
+
+      pool = self._GetThreadPool()
+      events = []
+      for index, (plugin_def, plugin) in enumerate(plugins):
+        event = threading.Event()
+        events.append(event)
+        pool.AddTask(
+            target=RunOne,
+            args=(index, plugin_def, plugin, event),
+            name="HuntResultsPlugin")
+
+      for event in events:
+        event.wait()
+
+    with data_store.DB.GetMutationPool() as pool:
+      for (plugin_def, _), (plugin_status, exception) in zip(plugins, outcomes):
         implementation.GRRHunt.PluginStatusCollectionForHID(hunt_urn).Add(
             plugin_status, mutation_pool=pool)
-        if plugin_status.status == plugin_status.Status.ERROR:
+        if exception is not None:
           implementation.GRRHunt.PluginErrorCollectionForHID(hunt_urn).Add(
               plugin_status, mutation_pool=pool)
-
-  def ProcessOneHunt(self, exceptions_by_hunt):
-    """Reads results for one hunt and process them."""
-    hunt_results_urn, results = (
-        hunts_results.HuntResultQueue.ClaimNotificationsForCollection(
-            token=self.token, lease_time=self.lifetime))
-    logging.debug("Found %d results for hunt %s", len(results),
-                  hunt_results_urn)
-    if not results:
-      return 0
-
+          exceptions_by_plugin.setdefault(plugin_def, []).append(exception)
+
+  def ProcessHuntBatch(self, hunt_results_urn, notifications, results,
+                       exceptions_by_hunt):
+    """Runs the output plugins of one hunt on a batch of its results.
+
+    Args:
+      hunt_results_urn: The urn of the hunt's result collection.
+      notifications: The HuntResultNotification records of the batch.
+      results: The hunt results the notifications refer to.
+      exceptions_by_hunt: A dict the plugin exceptions are added to.
+
+    Returns:
+      True if the batch was processed, False if the hunt metadata could not be
+      locked.
+    """
     hunt_urn = rdfvalue.RDFURN(hunt_results_urn.Dirname())
-    batch_size = self.BATCH_SIZE
     metadata_urn = hunt_urn.Add("ResultsMetadata")
     exceptions_by_plugin = {}
-    num_processed_for_hunt = 0
-    collection_obj = implementation.GRRHunt.ResultCollectionForHID(hunt_urn)
     try:
       with aff4.FACTORY.OpenWithLock(
           metadata_urn, lease_time=600, token=self.token) as metadata_obj:
         all_plugins, used_plugins = self.LoadPlugins(metadata_obj)
         num_processed = int(
             metadata_obj.Get(metadata_obj.Schema.NUM_PROCESSED_RESULTS))
-        for batch in utils.Grouper(results, batch_size):
-          results = list(
-              collection_obj.MultiResolve(
-                  [r.value.ResultRecord() for r in batch]))
-          self.RunPlugins(hunt_urn, used_plugins, results, exceptions_by_plugin)
-
-          hunts_results.HuntResultQueue.DeleteNotifications(
-              batch, token=self.token)
-          num_processed += len(batch)
-          num_processed_for_hunt += len(batch)
-          self.HeartBeat()
-          metadata_obj.Set(
-              metadata_obj.Schema.NUM_PROCESSED_RESULTS(num_processed))
-          metadata_obj.UpdateLease(600)
-          if self.CheckIfRunningTooLong():
-            logging.warning("Run too long, stopping.")
-            break
+        self.RunPlugins(hunt_urn, used_plugins, results, exceptions_by_plugin)
 
         metadata_obj.Set(metadata_obj.Schema.OUTPUT_PLUGINS(all_plugins))
         metadata_obj.Set(
-            metadata_obj.Schema.NUM_PROCESSED_RESULTS(num_processed))
+            metadata_obj.Schema.NUM_PROCESSED_RESULTS(
+                num_processed + len(notifications)))
     except aff4.LockError:
       logging.warn(
           "ProcessHuntResultCollectionsCronFlow: "
           "Could not get lock on hunt metadata %s.", metadata_urn)
-      return 0
+      return False
 
     if exceptions_by_plugin:
       for plugin, exceptions in iteritems(exceptions_by_plugin):
         exceptions_by_hunt.setdefault(hunt_urn, {}).setdefault(
             plugin, []).extend(exceptions)
 
-    logging.debug("Processed %d results.", num_processed_for_hunt)
-    return len(results)
+    logging.debug("Processed %d results for hunt %s.", len(notifications),
+                  hunt_urn)
+    return True
+
+  def _BatchNotifications(self, notifications_by_collection):
+    """Splits claimed notifications into batches of up to BATCH_SIZE.
+
+    Small hunts share a batch, notifications of hunts with more than
+    BATCH_SIZE results are split over several batches.
+
+    Args:
+      notifications_by_collection: A dict mapping result collection urns to
+        lists of notification records.
+
+    Yields:
+      Lists of (hunt_results_urn, notifications) tuples.
+    """
+    batch = []
+    batch_size = 0
+    for hunt_results_urn, notifications in iteritems(
+        notifications_by_collection):
+      for chunk in utils.Grouper(notifications, self.BATCH_SIZE):
+        if batch and batch_size + len(chunk) > self.BATCH_SIZE:
+          yield batch
+          batch = []
+          batch_size = 0
+        batch.append((hunt_results_urn, chunk))
+        batch_size += len(chunk)
+
+    if batch:
+      yield batch
+
+  def ProcessHunts(self, notifications_by_collection, exceptions_by_hunt):
+    """Reads and processes the results of many hunts.
+
+    The results referred to by a batch of notifications are read from all
+    the hunts' collections with a single data store call.
+
+    Once a chunk of a hunt's results can't be processed because the hunt's
+    metadata is locked, the later chunks of the hunt are skipped too and all
+    of them are released, so the next run retries from the failed chunk and
+    the plugins see the results in order.
+
+    Args:
+      notifications_by_collection: A dict mapping result collection urns to
+        lists of notification records.
+      exceptions_by_hunt: A dict the plugin exceptions are added to.
+
+    Returns:
+      False if the cron job should stop because it ran too long or the
+      metadata of a hunt was locked.
+    """
+    locked_collections = set()
+    batches = list(self._BatchNotifications(notifications_by_collection))
+    for index, batch in enumerate(batches):
+      skipped = [
+          n for hunt_results_urn, notifications in batch
+          if hunt_results_urn in locked_collections for n in notifications
+      ]
+      batch = [(hunt_results_urn, notifications)
+               for hunt_results_urn, notifications in batch
+               if hunt_results_urn not in locked_collections]
+
+      records = [
+          n.value.ResultRecord() for _, notifications in batch
+          for n in notifications
+      ]
+      results_by_collection = (
+          hunts_results.HuntResultCollection.StaticMultiResolve(records))
+
+      processed = []
+      for hunt_results_urn, notifications in batch:
+        logging.debug("Found %d results for hunt %s", len(notifications),
+                      hunt_results_urn)
+        if self.ProcessHuntBatch(hunt_results_urn, notifications,
+                                 results_by_collection.get(
+                                     hunt_results_urn, []),
+                                 exceptions_by_hunt):
+          processed.extend(notifications)
+        else:
+          locked_collections.add(hunt_results_urn)
+          skipped.extend(notifications)
+
+      hunts_results.HuntResultQueue.DeleteNotifications(
+          processed, token=self.token)
+      if skipped:
+        hunts_results.HuntResultQueue.ReleaseRecords(
+            skipped, token=self.token)
+      self.HeartBeat()
+
+      if self.CheckIfRunningTooLong():
+        logging.warning("Run too long, stopping.")
+        # Let the next run pick up the rest right away instead of waiting for
+        # the claims to expire.
+        unprocessed = [
+            n for later_batch in batches[index + 1:]
+            for _, notifications in later_batch for n in notifications
+        ]
+        if unprocessed:
+          hunts_results.HuntResultQueue.ReleaseRecords(
+              unprocessed, token=self.token)
+        return False
+
+    # Claiming again right away would only find the locked hunts again.
+    return not locked_collections
 
   def Start(self):
     self.start_time = rdfvalue.RDFDatetime.Now()
@@ -178,8 +336,14 @@ class ProcessHuntResultCollectionsCronFlow(cronjobs.SystemCronFlow):
     self.max_running_time = self.lifetime * 0.6
 
     while not self.CheckIfRunningTooLong():
-      count = self.ProcessOneHunt(exceptions_by_hunt)
-      if not count:
+      notifications_by_collection = (
+          hunts_results.HuntResultQueue.ClaimNotificationsForAllCollections(
+              token=self.token, lease_time=self.lifetime))
+      if not notifications_by_collection:
+        break
+
+      if not self.ProcessHunts(notifications_by_collection,
+                               exceptions_by_hunt):
         break
 
     if exceptions_by_hunt:
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+"""Benchmarks hunt result processing with many concurrently running hunts."""
+
+import time
+
+
+from builtins import range  # pylint: disable=redefined-builtin
+import pytest
+
+from grr_response_core.lib import flags
+from grr_response_core.lib import rdfvalue
+from grr_response_core.lib.rdfvalues import flows as rdf_flows
+from grr_response_core.lib.rdfvalues import protodict as rdf_protodict
+from grr_response_server import aff4
+from grr_response_server import data_store
+from grr_response_server.hunts import implementation
+from grr_response_server.hunts import results as hunts_results
+from grr_response_server.rdfvalues import output_plugin as rdf_output_plugin
+from grr.test_lib import benchmark_test_lib
+from grr.test_lib import flow_test_lib
+from grr.test_lib import hunt_test_lib
+from grr.test_lib import test_lib
+
+
+@pytest.mark.large
+class ProcessHuntResultsBenchmark(benchmark_test_lib.MicroBenchmarks,
+                                  flow_test_lib.FlowTestsBaseclass,
+                                  hunt_test_lib.StandardHuntTestMixin):
+  """Measures a ProcessHuntResultCollectionsCronFlow run over many hunts."""
+
+  units = "s"
+
+  HUNTS = 200
+  RESULTS_PER_HUNT = 50
+
+  def _CreateHunts(self, num_plugins):
+    """Writes synthetic results and output plugin state for many hunts."""
+    for i in range(self.HUNTS):
+      hunt_urn = rdfvalue.RDFURN("aff4:/hunts/H:%06X%d" % (i, num_plugins))
+      results_urn = hunt_urn.Add("Results")
+
+      state = rdf_protodict.AttributedDict()
+      for j in range(num_plugins):
+        plugin_descriptor = rdf_output_plugin.OutputPluginDescriptor(
+            plugin_name="DummyHuntOutputPlugin")
+        plugin = hunt_test_lib.DummyHuntOutputPlugin(
+            source_urn=results_urn,
+            output_base_urn=results_urn.Add("DummyHuntOutputPlugin"),
+            token=self.token)
+        state["DummyHuntOutputPlugin_%d" % j] = [
+            plugin_descriptor, plugin.state
+        ]
+
+      with data_store.DB.GetMutationPool() as pool:
+        with aff4.FACTORY.Create(
+            hunt_urn.Add("ResultsMetadata"),
+            implementation.HuntResultsMetadata,
+            mutation_pool=pool,
+            mode="rw",
+            token=self.token) as metadata:
+          metadata.Set(metadata.Schema.OUTPUT_PLUGINS(state))
+
+        for j in range(self.RESULTS_PER_HUNT):
+          hunts_results.HuntResultCollection.StaticAdd(
+              results_urn,
+              rdf_flows.GrrMessage(
+                  payload=rdfvalue.RDFString("result %d" % j),
+                  source="C.%016X" % j),
+              mutation_pool=pool)
+
+  def testManyConcurrentHunts(self):
+    for num_plugins in [1, 4]:
+      self._CreateHunts(num_plugins)
+
+      start = time.time()
+      self.ProcessHuntOutputPlugins()
+      self.AddResult(
+          "%d hunts, %d plugins" % (self.HUNTS, num_plugins),
+          time.time() - start, self.HUNTS * self.RESULTS_PER_HUNT)
+
+      # All notifications were processed and deleted.
+      self.assertFalse(
+          hunts_results.HuntResultQueue.ClaimNotificationsForAllCollections(
+              token=self.token))
+
+
+def main(argv):
+  test_lib.main(argv)
+
+
+if __name__ == "__main__":
+  flags.StartMain(main)
@@ -2,6 +2,8 @@
 """Classes to store and manage hunt results.
 """
 
+import collections
+
 from grr_response_core.lib import rdfvalue
 from grr_response_core.lib import registry
 from grr_response_core.lib.rdfvalues import structs as rdf_structs
@@ -92,6 +94,48 @@ class HuntResultQueue(aff4_queue.Queue):
         results.append(record)
     return (f.collection, results)
 
+  @classmethod
+  def ClaimNotificationsForAllCollections(cls,
+                                          token=None,
+                                          start_time=None,
+                                          lease_time=200,
+                                          limit=100000):
+    """Return unclaimed hunt result notifications for all collections.
+
+    Unlike ClaimNotificationsForCollection, this claims the notifications of
+    all hunts in a single pass over the queue.
+
+    Args:
+      token: The security token to perform database operations with.
+
+      start_time: If set, an RDFDateTime indicating at what point to start
+        claiming notifications. Only notifications with a timestamp after this
+        point will be claimed.
+
+      lease_time: How long to claim the notifications for.
+
+      limit: The maximum number of notifications to claim.
+
+    Returns:
+      An OrderedDict mapping collection urns to lists of Record objects which
+      identify GrrMessages within the result collection. The collections are
+      ordered by their earliest notification.
+    """
+    results = collections.OrderedDict()
+    with aff4.FACTORY.OpenWithLock(
+        RESULT_NOTIFICATION_QUEUE,
+        aff4_type=HuntResultQueue,
+        lease_time=300,
+        blocking=True,
+        blocking_sleep_interval=15,
+        blocking_lock_timeout=600,
+        token=token) as queue:
+      for record in queue.ClaimRecords(
+          start_time=start_time, timeout=lease_time, limit=limit):
+        results.setdefault(record.value.result_collection_urn,
+                           []).append(record)
+    return results
+
   @classmethod
   def DeleteNotifications(cls, records, token=None):
     """Delete hunt notifications."""
@@ -624,6 +624,65 @@ class StandardHuntTest(notification_test_lib.NotificationTestMixin,
     self.assertEqual(hunt_test_lib.DummyHuntOutputPlugin.num_calls, 1)
     self.assertListEqual(hunt_test_lib.StatefulDummyHuntOutputPlugin.data, [0])
 
+  def testParallelOutputPluginsProcessBatchesInOrder(self):
+    self.StartHunt(output_plugins=[
+        rdf_output_plugin.OutputPluginDescriptor(
+            plugin_name="StatefulDummyHuntOutputPlugin"),
+        rdf_output_plugin.OutputPluginDescriptor(
+            plugin_name="DummyHuntOutputPlugin")
+    ])
+
+    self.AssignTasksToClients()
+    self.RunHunt(failrate=-1)
+
+    phrccf = process_results.ProcessHuntResultCollectionsCronFlow
+    with utils.Stubber(phrccf, "BATCH_SIZE", 3):
+      self.ProcessHuntOutputPlugins()
+
+    # 10 results are processed in 4 batches by both plugins.
+    self.assertListEqual(hunt_test_lib.StatefulDummyHuntOutputPlugin.data,
+                         [0, 1, 2, 3])
+    self.assertEqual(hunt_test_lib.DummyHuntOutputPlugin.num_calls, 4)
+    self.assertEqual(hunt_test_lib.DummyHuntOutputPlugin.num_responses, 10)
+
+  def testLockedHuntResultsAreRetriedInOrder(self):
+    self.StartHunt(output_plugins=[
+        rdf_output_plugin.OutputPluginDescriptor(
+            plugin_name="StatefulDummyHuntOutputPlugin"),
+        rdf_output_plugin.OutputPluginDescriptor(
+            plugin_name="DummyHuntOutputPlugin")
+    ])
+
+    self.AssignTasksToClients()
+    self.RunHunt(failrate=-1)
+
+    phrccf = process_results.ProcessHuntResultCollectionsCronFlow
+    process_hunt_batch = phrccf.ProcessHuntBatch
+    calls = []
+
+    def ProcessHuntBatch(cron_flow, *args):
+      calls.append(args)
+      # The hunt metadata is locked when the second batch comes up.
+      if len(calls) == 2:
+        return False
+      return process_hunt_batch(cron_flow, *args)
+
+    with utils.Stubber(phrccf, "BATCH_SIZE", 3):
+      with utils.Stubber(phrccf, "ProcessHuntBatch", ProcessHuntBatch):
+        self.ProcessHuntOutputPlugins()
+
+      # Only the batch before the locked one was processed.
+      self.assertListEqual(hunt_test_lib.StatefulDummyHuntOutputPlugin.data,
+                           [0])
+      self.assertEqual(hunt_test_lib.DummyHuntOutputPlugin.num_responses, 3)
+
+      self.ProcessHuntOutputPlugins()
+
+    self.assertListEqual(hunt_test_lib.StatefulDummyHuntOutputPlugin.data,
+                         [0, 1, 2, 3])
+    self.assertEqual(hunt_test_lib.DummyHuntOutputPlugin.num_calls, 4)
+    self.assertEqual(hunt_test_lib.DummyHuntOutputPlugin.num_responses, 10)
+
   def testProcessHuntResultCollectionsCronFlowAbortsIfRunningTooLong(self):
     self.assertEqual(hunt_test_lib.LongRunningDummyHuntOutputPlugin.num_calls,
                      0)
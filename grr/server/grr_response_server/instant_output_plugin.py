@@ -12,7 +12,6 @@ from future.utils import with_metaclass
 from grr_response_core.lib import rdfvalue
 from grr_response_core.lib import registry
 from grr_response_core.lib import utils
-from grr_response_server import aff4
 from grr_response_server import export
 
 
@@ -103,44 +102,18 @@ class InstantOutputPluginWithExportConversion(InstantOutputPlugin):
 
   BATCH_SIZE = 5000
 
-  def __init__(self, *args, **kwargs):
-    super(InstantOutputPluginWithExportConversion, self).__init__(
-        *args, **kwargs)
-    self._cached_metadata = {}
-
   def _GetMetadataForClients(self, client_urns):
     """Fetches metadata for a given list of clients."""
 
-    result = {}
-    metadata_to_fetch = set()
+    fetched_metadata = export.MultiGetMetadata(client_urns, token=self.token)
 
+    result = []
     for urn in client_urns:
-      try:
-        result[urn] = self._cached_metadata[urn]
-      except KeyError:
-        metadata_to_fetch.add(urn)
-
-    if metadata_to_fetch:
-      client_fds = aff4.FACTORY.MultiOpen(
-          metadata_to_fetch, mode="r", token=self.token)
-
-      fetched_metadata = [
-          export.GetMetadata(client_fd, token=self.token)
-          for client_fd in client_fds
-      ]
-      for metadata in fetched_metadata:
-        metadata.source_urn = self.source_urn
-
-        self._cached_metadata[metadata.client_urn] = metadata
-        result[metadata.client_urn] = metadata
-        metadata_to_fetch.remove(metadata.client_urn)
-
-      for urn in metadata_to_fetch:
-        default_mdata = export.ExportedMetadata(source_urn=self.source_urn)
-        result[urn] = default_mdata
-        self._cached_metadata[urn] = default_mdata
-
-    return [result[urn] for urn in client_urns]
+      metadata = fetched_metadata.get(urn) or export.ExportedMetadata()
+      metadata.source_urn = self.source_urn
+      result.append(metadata)
+
+    return result
 
   def GetExportOptions(self):
     """Rerturns export options to be used by export converter."""
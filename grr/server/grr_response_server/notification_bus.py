@@ -0,0 +1,247 @@
+#!/usr/bin/env python
+"""A bus that pushes queue notifications to waiting workers.
+
+Workers normally poll the notification shards of their queues every few
+seconds. When a notification bus is configured, every notification written
+to the data store is also published on the bus and idle workers block on it
+instead of sleeping, so flow state transitions are picked up right away. The
+bus is only a latency optimization: workers still poll the data store with a
+bounded interval, so notifications that never make it onto the bus (e.g. ones
+written by processes on other machines) are still processed.
+"""
+
+import atexit
+import errno
+import logging
+import os
+import socket
+import threading
+
+
+from future.utils import with_metaclass
+
+from grr_response_core import config
+from grr_response_core.lib import registry
+from grr_response_core.lib import stats
+from grr_response_core.lib import utils
+
+
+def _ShardBelongsToQueue(shard, queue):
+  return shard == queue or shard.startswith(queue + "/")
+
+
+class NotificationBus(with_metaclass(registry.MetaclassRegistry, object)):
+  """Base class for notification buses."""
+
+  __abstract = True  # pylint: disable=g-bad-name
+
+  def Publish(self, queue_shards):
+    """Signals that new notifications were written to the given queue shards.
+
+    Args:
+      queue_shards: A list of queue shard urns.
+    """
+    raise NotImplementedError()
+
+  def Wait(self, queues, timeout):
+    """Waits until any of the given queues is notified.
+
+    Args:
+      queues: A list of queue urns.
+      timeout: Maximum time to wait in seconds.
+
+    Returns:
+      A dict mapping each notified queue to a list of its notified shards.
+      Empty if the timeout expired.
+    """
+    raise NotImplementedError()
+
+  def Close(self):
+    """Releases the resources used by the bus."""
+
+
+class LocalNotificationBus(NotificationBus):
+  """A notification bus for workers running in the same process."""
+
+  def __init__(self):
+    super(LocalNotificationBus, self).__init__()
+    self._pending_shards = set()
+    self._condition = threading.Condition()
+
+  def Publish(self, queue_shards):
+    self._PublishLocally(queue_shards)
+
+  def _PublishLocally(self, queue_shards):
+    with self._condition:
+      self._pending_shards.update(utils.SmartStr(s) for s in queue_shards)
+      self._condition.notify_all()
+
+    stats.STATS.IncrementCounter(
+        "notification_bus_published", delta=len(queue_shards))
+
+  def _PopShards(self, queues):
+    """Removes and returns the pending shards of the given queues."""
+    result = {}
+    for queue in queues:
+      queue_str = utils.SmartStr(queue)
+      shards = [
+          s for s in self._pending_shards
+          if _ShardBelongsToQueue(s, queue_str)
+      ]
+      if shards:
+        self._pending_shards.difference_update(shards)
+        result[queue] = [queue.__class__(s) for s in shards]
+    return result
+
+  def Wait(self, queues, timeout):
+    with self._condition:
+      result = self._PopShards(queues)
+      if not result:
+        self._condition.wait(timeout)
+        result = self._PopShards(queues)
+
+    if result:
+      stats.STATS.IncrementCounter("notification_bus_wakeups")
+    return result
+
+
+class SocketNotificationBus(LocalNotificationBus):
+  """A notification bus that fans out to all processes on this machine.
+
+  Every process using the bus binds a unix datagram socket in a shared
+  directory. Published shards are sent to every socket in that directory, a
+  background thread in each process delivers the received shards to its
+  local waiters.
+  """
+
+  # Keep datagrams well below the default maximum datagram size.
+  MAX_DATAGRAM_SIZE = 4096
+
+  def __init__(self, socket_dir=None):
+    super(SocketNotificationBus, self).__init__()
+    if socket_dir is None:
+      socket_dir = config.CONFIG["Server.notification_bus_socket_dir"]
+    self.socket_dir = socket_dir
+    utils.EnsureDirExists(self.socket_dir)
+
+    self.socket_path = os.path.join(self.socket_dir, "%d.sock" % os.getpid())
+    try:
+      os.unlink(self.socket_path)
+    except OSError:
+      pass
+
+    self._receive_socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    self._receive_socket.bind(self.socket_path)
+    self._send_socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    self._send_socket.setblocking(False)
+    self._closed = False
+
+    self._receive_thread = threading.Thread(
+        name="NotificationBusReceiver", target=self._ReceiveLoop)
+    self._receive_thread.daemon = True
+    self._receive_thread.start()
+
+  def _ReceiveLoop(self):
+    while True:
+      try:
+        data = self._receive_socket.recv(self.MAX_DATAGRAM_SIZE)
+      except socket.error as e:
+        if e.errno == errno.EINTR:
+          continue
+        if not self._closed:
+          logging.warning("Notification bus receiver stopped: %s", e)
+        return
+
+      if self._closed:
+        return
+
+      shards = [s for s in data.split("\n") if s]
+      if shards:
+        self._PublishLocally(shards)
+
+  def _Datagrams(self, queue_shards):
+    """Packs the shard names into datagrams of limited size."""
+    current = []
+    current_size = 0
+    for shard in queue_shards:
+      shard = utils.SmartStr(shard)
+      if current and current_size + len(shard) + 1 > self.MAX_DATAGRAM_SIZE:
+        yield "\n".join(current)
+        current = []
+        current_size = 0
+      current.append(shard)
+      current_size += len(shard) + 1
+
+    if current:
+      yield "\n".join(current)
+
+  def Publish(self, queue_shards):
+    self._PublishLocally(queue_shards)
+
+    datagrams = list(self._Datagrams(queue_shards))
+    for name in os.listdir(self.socket_dir):
+      path = os.path.join(self.socket_dir, name)
+      if path == self.socket_path or not name.endswith(".sock"):
+        continue
+
+      for datagram in datagrams:
+        try:
+          self._send_socket.sendto(datagram, path)
+        except socket.error as e:
+          if e.errno in [errno.ECONNREFUSED, errno.ENOENT]:
+            # The process that owned this socket is gone.
+            try:
+              os.unlink(path)
+            except OSError:
+              pass
+            break
+          # A full receive buffer just means the other side is busy, it will
+          # pick up the notifications with its next poll.
+          stats.STATS.IncrementCounter("notification_bus_send_errors")
+          break
+
+  def Close(self):
+    """Stops the receiver thread and removes our socket."""
+    if self._closed:
+      return
+    self._closed = True
+
+    # Wake up the receiver thread, it exits once it sees the bus is closed.
+    try:
+      self._send_socket.sendto("", self.socket_path)
+    except socket.error:
+      pass
+    self._receive_thread.join(5)
+
+    self._send_socket.close()
+    self._receive_socket.close()
+    try:
+      os.unlink(self.socket_path)
+    except OSError:
+      pass
+
+
+# The global notification bus, None if no bus is configured.
+BUS = None
+
+
+def Publish(queue_shards):
+  """Publishes queue shards on the notification bus, if there is one."""
+  if BUS is not None and queue_shards:
+    BUS.Publish(queue_shards)
+
+
+class NotificationBusInit(registry.InitHook):
+  """Init hook class for the notification bus."""
+
+  def RunOnce(self):
+    stats.STATS.RegisterCounterMetric("notification_bus_published")
+    stats.STATS.RegisterCounterMetric("notification_bus_wakeups")
+    stats.STATS.RegisterCounterMetric("notification_bus_send_errors")
+
+    global BUS  # pylint: disable=global-statement
+
+    bus_name = config.CONFIG["Server.notification_bus_class"]
+    if bus_name:
+      BUS = NotificationBus.classes[bus_name]()
+      atexit.register(BUS.Close)
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+"""Benchmarks flow step latency with and without the notification bus."""
+
+import Queue
+import threading
+import time
+
+
+from builtins import range  # pylint: disable=redefined-builtin
+import mock
+import pytest
+
+from grr_response_core.lib import flags
+from grr_response_core.lib import rdfvalue
+from grr_response_server import flow
+from grr_response_server import notification_bus
+from grr_response_server import worker_lib
+from grr.test_lib import benchmark_test_lib
+from grr.test_lib import flow_test_lib
+from grr.test_lib import test_lib
+
+# Times at which LatencyTestFlow processed its messages.
+PROCESSED = Queue.Queue()
+
+
+class LatencyTestFlow(flow.WellKnownFlow):
+  well_known_session_id = rdfvalue.SessionID(flow_name="LatencyTestFlow")
+
+  def ProcessMessage(self, message):
+    PROCESSED.put(time.time())
+
+
+@pytest.mark.large
+class NotificationBusBenchmark(benchmark_test_lib.MicroBenchmarks,
+                               flow_test_lib.FlowTestsBaseclass):
+  """Measures the time from sending a response until a worker processes it."""
+
+  units = "ms"
+
+  STEPS = 20
+
+  def _RunWorker(self, worker_obj, stop):
+    """Mimics GRRWorker.Run() until stop is set."""
+    notified_shards = None
+    while not stop.is_set():
+      processed = worker_obj.RunOnce(notified_shards=notified_shards)
+      notified_shards = None
+      if processed == 0:
+        if notification_bus.BUS is not None:
+          notified_shards = worker_obj.WaitForNotifications()
+        else:
+          time.sleep(worker_obj.SHORT_POLLING_INTERVAL)
+
+  def _MeasureStepLatency(self, name):
+    worker_obj = worker_lib.GRRWorker(token=self.token)
+    stop = threading.Event()
+    worker_thread = threading.Thread(
+        target=self._RunWorker, args=(worker_obj, stop))
+    worker_thread.start()
+
+    try:
+      total = 0
+      for _ in range(self.STEPS):
+        # Let the worker go idle.
+        time.sleep(0.5)
+        start = time.time()
+        self.SendResponse(
+            LatencyTestFlow.well_known_session_id, data="foo", well_known=True)
+        total += PROCESSED.get(timeout=30) - start
+    finally:
+      stop.set()
+      if notification_bus.BUS is not None:
+        notification_bus.BUS.Publish(list(worker_obj.queues))
+      worker_thread.join()
+      worker_obj.thread_pool.Join()
+
+    self.AddResult(name, total / self.STEPS, self.STEPS)
+
+  def testFlowStepLatency(self):
+    """End to end latency of a single flow step."""
+    with test_lib.ConfigOverrider({"Worker.queue_shards": 1}):
+      with mock.patch.object(notification_bus, "BUS", None):
+        self._MeasureStepLatency("Polling")
+
+      with mock.patch.object(notification_bus, "BUS",
+                             notification_bus.LocalNotificationBus()):
+        self._MeasureStepLatency("LocalNotificationBus")
+
+
+def main(argv):
+  test_lib.main(argv)
+
+
+if __name__ == "__main__":
+  flags.StartMain(main)
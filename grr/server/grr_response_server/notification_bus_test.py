@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+"""Tests for the notification bus."""
+
+import os
+import threading
+import time
+
+
+import mock
+
+from grr_response_core.lib import flags
+from grr_response_core.lib import queues
+from grr_response_core.lib import rdfvalue
+from grr_response_core.lib.rdfvalues import flows as rdf_flows
+from grr_response_server import data_store
+from grr_response_server import notification_bus
+from grr_response_server import queue_manager
+from grr.test_lib import test_lib
+
+
+class LocalNotificationBusTest(test_lib.GRRBaseTest):
+  """Tests for the LocalNotificationBus."""
+
+  def setUp(self):
+    super(LocalNotificationBusTest, self).setUp()
+    self.bus = notification_bus.LocalNotificationBus()
+
+  def testWaitReturnsPendingShards(self):
+    shard = queues.FLOWS.Add("1")
+    self.bus.Publish([shard, queues.HUNTS])
+
+    result = self.bus.Wait([queues.FLOWS], timeout=0)
+    self.assertEqual(result, {queues.FLOWS: [shard]})
+
+    # Shards are only returned once.
+    self.assertEqual(self.bus.Wait([queues.FLOWS], timeout=0), {})
+
+    # Shards of other queues are kept.
+    result = self.bus.Wait([queues.FLOWS, queues.HUNTS], timeout=0)
+    self.assertEqual(result, {queues.HUNTS: [queues.HUNTS]})
+
+  def testWaitTimesOut(self):
+    self.bus.Publish([queues.HUNTS])
+    self.assertEqual(self.bus.Wait([queues.FLOWS], timeout=0.1), {})
+
+  def testWaitIsWokenUpByPublish(self):
+    result = {}
+
+    def Wait():
+      result.update(self.bus.Wait([queues.FLOWS], timeout=10))
+
+    waiter = threading.Thread(target=Wait)
+    waiter.start()
+    time.sleep(0.1)
+
+    start = time.time()
+    self.bus.Publish([queues.FLOWS])
+    waiter.join()
+
+    self.assertLess(time.time() - start, 5)
+    self.assertEqual(result, {queues.FLOWS: [queues.FLOWS]})
+
+  def testMutationPoolPublishesNotifications(self):
+    with mock.patch.object(notification_bus, "BUS", self.bus):
+      session_id = rdfvalue.SessionID(queue=queues.FLOWS, flow_name="123456")
+      manager = queue_manager.QueueManager(token=self.token)
+      with data_store.DB.GetMutationPool() as pool:
+        manager.NotifyQueue(
+            rdf_flows.GrrNotification(session_id=session_id),
+            mutation_pool=pool)
+
+      result = self.bus.Wait([queues.FLOWS], timeout=0)
+      self.assertEqual(list(result), [queues.FLOWS])
+
+      notifications = manager.GetNotificationsForShards(result[queues.FLOWS])
+      self.assertEqual([n.session_id for n in notifications], [session_id])
+
+
+class SocketNotificationBusTest(test_lib.GRRBaseTest):
+  """Tests for the SocketNotificationBus."""
+
+  def _CreateBus(self, pid):
+    with mock.patch.object(os, "getpid", return_value=pid):
+      bus = notification_bus.SocketNotificationBus(
+          socket_dir=os.path.join(self.temp_dir, "bus"))
+    self.addCleanup(bus.Close)
+    return bus
+
+  def testPublishIsFannedOutToOtherProcesses(self):
+    publisher = self._CreateBus(1)
+    subscriber = self._CreateBus(2)
+
+    shards = [queues.FLOWS.Add(str(i)) for i in range(1, 5)]
+    publisher.Publish(shards)
+
+    result = subscriber.Wait([queues.FLOWS], timeout=10)
+    # Datagrams might be delivered one by one.
+    received = set(result.get(queues.FLOWS, []))
+    while len(received) < len(shards):
+      result = subscriber.Wait([queues.FLOWS], timeout=10)
+      self.assertTrue(result)
+      received.update(result[queues.FLOWS])
+
+    self.assertEqual(received, set(shards))
+
+    # The publisher sees its own notifications as well.
+    self.assertEqual(
+        set(publisher.Wait([queues.FLOWS], timeout=0)[queues.FLOWS]),
+        set(shards))
+
+  def testStaleSocketsAreRemoved(self):
+    publisher = self._CreateBus(1)
+    stale_path = os.path.join(publisher.socket_dir, "12345.sock")
+    open(stale_path, "wb").close()
+
+    publisher.Publish([queues.FLOWS])
+    self.assertFalse(os.path.exists(stale_path))
+
+  def testCloseStopsReceiverAndRemovesSocket(self):
+    bus = self._CreateBus(1)
+    self.assertTrue(os.path.exists(bus.socket_path))
+
+    bus.Close()
+    self.assertFalse(bus._receive_thread.is_alive())  # pylint: disable=protected-access
+    self.assertFalse(os.path.exists(bus.socket_path))
+
+    # Closing twice is fine.
+    bus.Close()
+
+
+def main(argv):
+  test_lib.main(argv)
+
+
+if __name__ == "__main__":
+  flags.StartMain(main)
@@ -0,0 +1,317 @@
+#!/usr/bin/env python
+"""Compressed posting lists for keyword indices.
+
+Posting lists are stored as bitmaps of dense integers. Following the design of
+roaring bitmaps, the integer space is split into chunks of 2^16 values, each
+stored in a container that is either a sorted array of the values present
+(for sparse chunks) or a bitset (for dense ones).
+"""
+
+import array
+import bisect
+
+from builtins import range  # pylint: disable=redefined-builtin
+from future.utils import iteritems
+
+# Chunks holding more values than this are stored as bitsets. A bitset for a
+# chunk takes 8KB, the same as an array of 4096 16 bit values.
+ARRAY_CONTAINER_MAX_SIZE = 4096
+
+_CHUNK_BITS = 16
+_CHUNK_MASK = (1 << _CHUNK_BITS) - 1
+
+# Bitsets are iterated in words of this many bits.
+_WORD_BITS = 64
+_WORD_HEX_DIGITS = _WORD_BITS // 4
+_BITSET_HEX_DIGITS = (1 << _CHUNK_BITS) // 4
+
+
+def _PopCount(bits):
+  return bin(bits).count("1")
+
+
+class _ArrayContainer(object):
+  """A container storing a sorted array of 16 bit values."""
+
+  def __init__(self, values=None):
+    self.values = values if values is not None else array.array("H")
+
+  def __len__(self):
+    return len(self.values)
+
+  def __iter__(self):
+    return iter(self.values)
+
+  def __contains__(self, low):
+    i = bisect.bisect_left(self.values, low)
+    return i < len(self.values) and self.values[i] == low
+
+  def Add(self, low):
+    """Adds a value, returns False if it was already present."""
+    i = bisect.bisect_left(self.values, low)
+    if i < len(self.values) and self.values[i] == low:
+      return False
+    self.values.insert(i, low)
+    return True
+
+  def Discard(self, low):
+    """Removes a value, returns False if it wasn't present."""
+    i = bisect.bisect_left(self.values, low)
+    if i < len(self.values) and self.values[i] == low:
+      del self.values[i]
+      return True
+    return False
+
+  def Copy(self):
+    return _ArrayContainer(array.array("H", self.values))
+
+  def ToBitset(self):
+    bits = 0
+    for low in self.values:
+      bits |= 1 << low
+    return _BitsetContainer(bits, len(self.values))
+
+  def Intersection(self, other):
+    if isinstance(other, _BitsetContainer):
+      bits = other.bits
+      return _ArrayContainer(
+          array.array("H", [low for low in self.values if bits >> low & 1]))
+
+    smaller, larger = sorted([self.values, other.values], key=len)
+    common = set(larger).intersection(smaller)
+    return _ArrayContainer(array.array("H", sorted(common)))
+
+
+class _BitsetContainer(object):
+  """A container storing 2^16 bits, one for every possible value."""
+
+  def __init__(self, bits=0, size=None):
+    self.bits = bits
+    self.size = _PopCount(bits) if size is None else size
+
+  def __len__(self):
+    return self.size
+
+  def __iter__(self):
+    # Shifting a 8KB integer for every value would be slow, the bitset is
+    # converted to hex once and iterated a word at a time instead.
+    hexed = "%0*x" % (_BITSET_HEX_DIGITS, self.bits)
+    end = len(hexed)
+    for base in range(0, 1 << _CHUNK_BITS, _WORD_BITS):
+      word = int(hexed[end - _WORD_HEX_DIGITS:end], 16)
+      end -= _WORD_HEX_DIGITS
+      while word:
+        lowest = word & -word
+        yield base + lowest.bit_length() - 1
+        word ^= lowest
+
+  def __contains__(self, low):
+    return bool(self.bits >> low & 1)
+
+  def Add(self, low):
+    """Adds a value, returns False if it was already present."""
+    if self.bits >> low & 1:
+      return False
+    self.bits |= 1 << low
+    self.size += 1
+    return True
+
+  def Discard(self, low):
+    """Removes a value, returns False if it wasn't present."""
+    if not self.bits >> low & 1:
+      return False
+    self.bits ^= 1 << low
+    self.size -= 1
+    return True
+
+  def Copy(self):
+    return _BitsetContainer(self.bits, self.size)
+
+  def ToArray(self):
+    return _ArrayContainer(array.array("H", iter(self)))
+
+  def Intersection(self, other):
+    if isinstance(other, _ArrayContainer):
+      return other.Intersection(self)
+
+    result = _BitsetContainer(self.bits & other.bits)
+    if result.size <= ARRAY_CONTAINER_MAX_SIZE:
+      return result.ToArray()
+    return result
+
+
+class Bitmap(object):
+  """A compressed set of non-negative integers.
+
+  Iterating over a bitmap yields its values in increasing order.
+  """
+
+  def __init__(self, values=None):
+    # Sorted keys (the high bits of the values) of the non-empty containers.
+    self._keys = []
+    self._containers = {}
+    self._size = 0
+
+    for value in values or []:
+      self.Add(value)
+
+  def __len__(self):
+    return self._size
+
+  def __iter__(self):
+    for key in self._keys:
+      base = key << _CHUNK_BITS
+      for low in self._containers[key]:
+        yield base + low
+
+  def __contains__(self, value):
+    container = self._containers.get(value >> _CHUNK_BITS)
+    return container is not None and (value & _CHUNK_MASK) in container
+
+  def __and__(self, other):
+    return self.Intersection(other)
+
+  def __repr__(self):
+    return "<Bitmap of %d values>" % self._size
+
+  def Add(self, value):
+    """Adds a value to the bitmap."""
+    key = value >> _CHUNK_BITS
+    container = self._containers.get(key)
+    if container is None:
+      container = self._containers[key] = _ArrayContainer()
+      bisect.insort(self._keys, key)
+
+    if not container.Add(value & _CHUNK_MASK):
+      return
+
+    self._size += 1
+    if (isinstance(container, _ArrayContainer) and
+        len(container) > ARRAY_CONTAINER_MAX_SIZE):
+      self._containers[key] = container.ToBitset()
+
+  def Discard(self, value):
+    """Removes a value from the bitmap if it is present."""
+    key = value >> _CHUNK_BITS
+    container = self._containers.get(key)
+    if container is None or not container.Discard(value & _CHUNK_MASK):
+      return
+
+    self._size -= 1
+    if not container:
+      del self._containers[key]
+      del self._keys[bisect.bisect_left(self._keys, key)]
+    elif (isinstance(container, _BitsetContainer) and
+          len(container) <= ARRAY_CONTAINER_MAX_SIZE // 2):
+      # Only convert back well below the limit, so that a bitmap oscillating
+      # around it doesn't convert its container on every change.
+      self._containers[key] = container.ToArray()
+
+  def Copy(self):
+    """Returns a copy of the bitmap."""
+    result = Bitmap()
+    result._keys = list(self._keys)  # pylint: disable=protected-access
+    result._containers = {  # pylint: disable=protected-access
+        key: container.Copy() for key, container in iteritems(self._containers)
+    }
+    result._size = self._size  # pylint: disable=protected-access
+    return result
+
+  def Intersection(self, other):
+    """Returns a new bitmap with the values present in both bitmaps."""
+    result = Bitmap()
+    if len(other._containers) < len(self._containers):  # pylint: disable=protected-access
+      self, other = other, self  # pylint: disable=self-cls-assignment
+
+    for key, container in iteritems(self._containers):
+      other_container = other._containers.get(key)  # pylint: disable=protected-access
+      if other_container is None:
+        continue
+
+      common = container.Intersection(other_container)
+      if common:
+        result._containers[key] = common  # pylint: disable=protected-access
+        result._size += len(common)  # pylint: disable=protected-access
+
+    result._keys = sorted(result._containers)  # pylint: disable=protected-access
+    return result
+
+
+def Intersect(bitmaps):
+  """Intersects a list of bitmaps, starting with the smallest ones.
+
+  Args:
+    bitmaps: A non-empty list of Bitmap objects.
+
+  Returns:
+    A new Bitmap with the values present in all the given bitmaps.
+  """
+  bitmaps = sorted(bitmaps, key=len)
+  result = bitmaps[0]
+  for bitmap in bitmaps[1:]:
+    if not result:
+      break
+    result = result.Intersection(bitmap)
+
+  if result is bitmaps[0]:
+    result = result.Copy()
+  return result
+
+
+class PostingLists(object):
+  """Posting lists mapping keywords to the string ids of items.
+
+  Item ids are mapped to dense integers in the order they are first indexed, so
+  the posting list of every keyword is a compact Bitmap.
+  """
+
+  def __init__(self):
+    self._dense_ids = {}
+    self._item_ids = []
+    self._bitmaps = {}
+
+  def _DenseId(self, item_id):
+    dense_id = self._dense_ids.get(item_id)
+    if dense_id is None:
+      dense_id = self._dense_ids[item_id] = len(self._item_ids)
+      self._item_ids.append(item_id)
+    return dense_id
+
+  def Add(self, item_id, keywords):
+    """Adds an item to the posting lists of the given keywords."""
+    dense_id = self._DenseId(item_id)
+    for keyword in keywords:
+      bitmap = self._bitmaps.get(keyword)
+      if bitmap is None:
+        bitmap = self._bitmaps[keyword] = Bitmap()
+      bitmap.Add(dense_id)
+
+  def Remove(self, item_id, keyword):
+    """Removes an item from the posting list of a keyword."""
+    dense_id = self._dense_ids.get(item_id)
+    bitmap = self._bitmaps.get(keyword)
+    if dense_id is None or bitmap is None:
+      return
+
+    bitmap.Discard(dense_id)
+    if not bitmap:
+      del self._bitmaps[keyword]
+
+  def Lookup(self, keywords):
+    """Returns a bitmap of the items present in all the given posting lists."""
+    bitmaps = []
+    for keyword in set(keywords):
+      bitmap = self._bitmaps.get(keyword)
+      if bitmap is None:
+        return Bitmap()
+      bitmaps.append(bitmap)
+
+    if not bitmaps:
+      return Bitmap()
+    return Intersect(bitmaps)
+
+  def ItemIds(self, bitmap):
+    """Yields the item ids of the dense ids in the given bitmap."""
+    item_ids = self._item_ids
+    for dense_id in bitmap:
+      yield item_ids[dense_id]
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+"""Tests for grr_response_server.posting_lists."""
+
+import random
+
+
+from builtins import range  # pylint: disable=redefined-builtin
+
+from grr_response_core.lib import flags
+from grr_response_server import posting_lists
+from grr.test_lib import test_lib
+
+
+class BitmapTest(test_lib.GRRBaseTest):
+
+  def testAddDiscard(self):
+    bitmap = posting_lists.Bitmap([5, 1, 70000, 3])
+    bitmap.Add(3)
+    self.assertEqual(list(bitmap), [1, 3, 5, 70000])
+    self.assertEqual(len(bitmap), 4)
+    self.assertIn(70000, bitmap)
+    self.assertNotIn(4, bitmap)
+
+    bitmap.Discard(70000)
+    bitmap.Discard(4)
+    self.assertEqual(list(bitmap), [1, 3, 5])
+    self.assertEqual(len(bitmap), 3)
+
+  def testDenseContainers(self):
+    values = list(range(0, 200000, 3))
+    bitmap = posting_lists.Bitmap(values)
+    self.assertEqual(list(bitmap), values)
+    self.assertEqual(len(bitmap), len(values))
+
+    # Removing most values converts the containers back to arrays.
+    for value in values[100:]:
+      bitmap.Discard(value)
+    self.assertEqual(list(bitmap), values[:100])
+    self.assertEqual(len(bitmap), 100)
+
+  def testIntersection(self):
+    rand = random.Random(42)
+    for sizes in [(10, 10), (10, 100000), (100000, 100000), (5000, 50000)]:
+      sets = [set(rand.randrange(300000) for _ in range(n)) for n in sizes]
+      bitmaps = [posting_lists.Bitmap(s) for s in sets]
+
+      result = posting_lists.Intersect(bitmaps)
+      expected = sorted(sets[0] & sets[1])
+      self.assertEqual(list(result), expected)
+      self.assertEqual(len(result), len(expected))
+      self.assertEqual(list(bitmaps[0] & bitmaps[1]), expected)
+
+  def testIntersectDoesNotModifyArguments(self):
+    bitmap = posting_lists.Bitmap([1, 2, 3])
+    result = posting_lists.Intersect([bitmap])
+    result.Discard(1)
+    self.assertEqual(list(bitmap), [1, 2, 3])
+
+
+class PostingListsTest(test_lib.GRRBaseTest):
+
+  def testLookup(self):
+    lists = posting_lists.PostingLists()
+    lists.Add("C.0000000000000003", [".", "linux"])
+    lists.Add("C.0000000000000001", [".", "windows", "host-1"])
+    lists.Add("C.0000000000000002", [".", "windows"])
+
+    def Lookup(keywords):
+      return list(lists.ItemIds(lists.Lookup(keywords)))
+
+    self.assertEqual(
+        Lookup(["."]),
+        ["C.0000000000000003", "C.0000000000000001", "C.0000000000000002"])
+    self.assertEqual(
+        Lookup(["windows", "."]), ["C.0000000000000001", "C.0000000000000002"])
+    self.assertEqual(Lookup(["windows", "host-1"]), ["C.0000000000000001"])
+    self.assertEqual(Lookup(["windows", "missing"]), [])
+    self.assertEqual(Lookup([]), [])
+
+    lists.Remove("C.0000000000000001", "windows")
+    lists.Remove("C.0000000000000003", "missing")
+    self.assertEqual(Lookup(["windows"]), ["C.0000000000000002"])
+
+
+def main(argv):
+  test_lib.main(argv)
+
+
+if __name__ == "__main__":
+  flags.StartMain(main)
@@ -159,6 +159,21 @@ class QueueManager(object):
     result.frozen_timestamp = self.frozen_timestamp
     return result
 
+  def Merge(self, other):
+    """Adds the pending writes/deletions of another queue manager to ours.
+
+    Args:
+      other: A QueueManager, usually a Copy() of this one. Its pending changes
+        are left untouched.
+    """
+    self.request_queue.extend(other.request_queue)
+    self.response_queue.extend(other.response_queue)
+    self.requests_to_delete.extend(other.requests_to_delete)
+    self.client_messages_to_delete.update(other.client_messages_to_delete)
+    self.new_client_messages.extend(other.new_client_messages)
+    for notification in itervalues(other.notifications):
+      self.QueueNotification(notification, timestamp=notification.timestamp)
+
   def FreezeTimestamp(self):
     """Freezes the timestamp used for resolve/delete database queries.
 
@@ -471,8 +486,18 @@ class QueueManager(object):
     Returns:
       List of rdf_flows.GrrNotification objects
     """
+    return self.GetNotificationsForShards(self.GetAllNotificationShards(queue))
+
+  def GetNotificationsForShards(self, queue_shards):
+    """Returns notifications for the given queue shards.
+
+    Args:
+      queue_shards: A list of queue shard urns.
+    Returns:
+      List of rdf_flows.GrrNotification objects
+    """
     notifications_by_session_id = {}
-    for queue_shard in self.GetAllNotificationShards(queue):
+    for queue_shard in queue_shards:
       self._GetUnsortedNotifications(
           queue_shard, notifications_by_session_id=notifications_by_session_id)
 
@@ -621,6 +646,29 @@ class QueueManager(object):
       return mutation_pool.QueueQueryAndOwn(queue, lease_seconds, limit,
                                             self.frozen_timestamp)
 
+  def MultiQueryAndOwn(self, queues, lease_seconds=10, limit_per_queue=1):
+    """Leases tasks from many queues at once.
+
+    Args:
+      queues: A list of queues to query from.
+      lease_seconds: The tasks will be leased for this long.
+      limit_per_queue: Number of values to fetch from each queue.
+    Returns:
+        A dict mapping each queue to a list of GrrMessage() objects leased.
+    """
+    if data_store.RelationalDBReadEnabled(category="client_messages"):
+      # The relational db has no multi-client lease, each client's messages
+      # are leased with a separate call.
+      lease_time = rdfvalue.Duration("%ds" % lease_seconds)
+      return {
+          queue: data_store.REL_DB.LeaseClientMessages(
+              queue.Split()[0], lease_time=lease_time, limit=limit_per_queue)
+          for queue in queues
+      }
+    with self.data_store.GetMutationPool() as mutation_pool:
+      return mutation_pool.QueueMultiQueryAndOwn(
+          queues, lease_seconds, limit_per_queue, self.frozen_timestamp)
+
 
 class WellKnownQueueManager(QueueManager):
   """A flow manager for well known flows."""
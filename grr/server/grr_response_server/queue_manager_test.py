@@ -207,6 +207,44 @@ class QueueManagerTest(flow_test_lib.FlowTestsBaseclass):
     tasks = manager.QueryAndOwn(test_queue, lease_seconds=100)
     self.assertEqual(len(tasks), 0)
 
+  def testMultiQueryAndOwn(self):
+    queues = [rdfvalue.RDFURN("fooMulti%d" % i) for i in range(3)]
+    tasks = []
+    for queue in queues[:2]:
+      for _ in range(3):
+        tasks.append(
+            rdf_flows.GrrMessage(
+                queue=queue, session_id="aff4:/Test", generate_task_id=True))
+
+    manager = queue_manager.QueueManager(token=self.token)
+    with data_store.DB.GetMutationPool() as pool:
+      manager.Schedule(tasks, pool)
+
+    leased = manager.MultiQueryAndOwn(
+        queues, lease_seconds=100, limit_per_queue=2)
+
+    self.assertEqual(sorted(leased), sorted(queues))
+    self.assertEqual(len(leased[queues[0]]), 2)
+    self.assertEqual(len(leased[queues[1]]), 2)
+    self.assertEqual(leased[queues[2]], [])
+    for queue in queues[:2]:
+      for task in leased[queue]:
+        self.assertEqual(task.queue, queue)
+
+    # Only the remaining, not yet leased tasks are returned.
+    self._current_mock_time += 10
+    leased = manager.MultiQueryAndOwn(
+        queues, lease_seconds=100, limit_per_queue=100)
+    self.assertEqual(len(leased[queues[0]]), 1)
+    self.assertEqual(len(leased[queues[1]]), 1)
+
+    # After the lease expires all tasks are available again.
+    self._current_mock_time += 110
+    leased = manager.MultiQueryAndOwn(
+        queues, lease_seconds=100, limit_per_queue=100)
+    self.assertEqual(len(leased[queues[0]]), 3)
+    self.assertEqual(len(leased[queues[1]]), 3)
+
   def testTaskRetransmissionsAreCorrectlyAccounted(self):
     test_queue = rdfvalue.RDFURN("fooSchedule")
     task = rdf_flows.GrrMessage(
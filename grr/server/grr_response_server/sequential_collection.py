@@ -2,11 +2,15 @@
 """A collection of records stored sequentially.
 """
 
+import bisect
 import collections
-import random
+import logging
 import threading
 import time
 
+
+from future.utils import iteritems
+
 from grr_response_core.lib import rdfvalue
 from grr_response_core.lib import registry
 from grr_response_core.lib.rdfvalues import flows as rdf_flows
@@ -162,6 +166,34 @@ class SequentialCollection(object):
       rdf_value.age = timestamp
       yield rdf_value
 
+  @classmethod
+  def StaticMultiResolve(cls, records):
+    """Looks up values in many collections of this type at once.
+
+    Args:
+      records: A list of Record objects, possibly from many different
+               collections.
+
+    Returns:
+      A dict mapping collection urns to lists of values in the order of the
+      given records.
+    """
+    parse_batch = getattr(cls.RDF_TYPE, "FromManySerializedStrings", None)
+    if parse_batch is None:
+
+      def parse_batch(values):  # pylint: disable=function-redefined
+        return [cls.RDF_TYPE.FromSerializedString(v) for v in values]
+
+    result = {}
+    for collection_urn, items in iteritems(
+        data_store.DB.CollectionMultiReadItems(records)):
+      rdf_values = parse_batch([value for value, _ in items])
+      for rdf_value, (_, timestamp) in zip(rdf_values, items):
+        rdf_value.age = timestamp
+      result[collection_urn] = rdf_values
+
+    return result
+
   def __iter__(self):
     for _, item in self.Scan():
       yield item
@@ -173,48 +205,79 @@ class SequentialCollection(object):
 
 
 class BackgroundIndexUpdater(object):
-  """Updates IndexedSequentialCollection objects in the background."""
+  """Updates IndexedSequentialCollection objects in the background.
+
+  Collections are queued when items are added to them. Every collection is
+  queued at most once, and all collections that are due are updated in one
+  batch.
+  """
   INDEX_DELAY = 240
 
   exit_now = False
 
   def __init__(self):
-    self.to_process = collections.deque()
+    # Maps collection urns to (collection_cls, update_time) in the order they
+    # were queued. All entries use the same delay, so the first one is always
+    # the next one due.
+    self.to_process = collections.OrderedDict()
     self.cv = threading.Condition()
 
   def ExitNow(self):
     with self.cv:
       self.exit_now = True
-      self.to_process.append(None)
       self.cv.notify()
 
   def AddIndexToUpdate(self, collection_cls, index_urn):
+    # This is called for every added item. Most collections are already
+    # queued, which a dict lookup can tell without taking the lock.
+    if index_urn in self.to_process:
+      return
+
     with self.cv:
-      self.to_process.append((collection_cls, index_urn,
-                              time.time() + self.INDEX_DELAY))
+      if index_urn in self.to_process:
+        return
+
+      self.to_process[index_urn] = (collection_cls,
+                                    time.time() + self.INDEX_DELAY)
       self.cv.notify()
 
   def ProcessCollection(self, collection_cls, collection_id):
     collection_cls(collection_id).UpdateIndex()
 
-  def UpdateLoop(self):
-    while not self.exit_now:
-      with self.cv:
-        while not self.to_process:
+  def _PopDueCollections(self):
+    """Waits for queued collections to become due and returns them."""
+    with self.cv:
+      while not self.exit_now:
+        if not self.to_process:
           self.cv.wait()
-        next_update = self.to_process.popleft()
-        if next_update is None:
-          return
-
-      now = time.time()
-      next_cls = next_update[0]
-      next_urn = next_update[1]
-      next_time = next_update[2]
-      while now < next_time:
-        time.sleep(next_time - now)
+          continue
+
         now = time.time()
+        _, (_, next_time) = next(iteritems(self.to_process))
+        if now < next_time:
+          self.cv.wait(next_time - now)
+          continue
+
+        due = []
+        while self.to_process:
+          urn, (collection_cls, update_time) = next(iteritems(self.to_process))
+          if update_time > now:
+            break
+          del self.to_process[urn]
+          due.append((collection_cls, urn))
+        return due
+
+  def UpdateLoop(self):
+    while not self.exit_now:
+      due = self._PopDueCollections()
+      if not due:
+        return
 
-      self.ProcessCollection(next_cls, next_urn)
+      for collection_cls, urn in due:
+        try:
+          self.ProcessCollection(collection_cls, urn)
+        except Exception as e:  # pylint: disable=broad-except
+          logging.exception("Error while updating index of %s: %s", urn, e)
 
 
 BACKGROUND_INDEX_UPDATER = BackgroundIndexUpdater()
@@ -237,8 +300,11 @@ class IndexedSequentialCollection(SequentialCollection):
   Adds an index to SequentialCollection, making it efficient to find the number
   of records present, and to find a particular record number.
 
-  IMPLEMENTATION NOTE: The index is created lazily, and for records older than
-    INDEX_WRITE_DELAY.
+  IMPLEMENTATION NOTE: The number of records is counted in the mutation pools
+    that add them, see data_store.DataStore.CollectionReadCount(). The offset
+    index is created lazily, and for records older than INDEX_WRITE_DELAY.
+    UpdateIndex() compacts the count and removes index entries which were
+    invalidated by late writes.
   """
 
   # How many records between index entries. Subclasses may change this.  The
@@ -259,6 +325,9 @@ class IndexedSequentialCollection(SequentialCollection):
 
   INDEX_WRITE_DELAY = rdfvalue.Duration("3m")
 
+  # The lease time of the lock held while the count is compacted.
+  INDEX_LOCK_LEASE = 600
+
   def __init__(self, *args, **kwargs):
     super(IndexedSequentialCollection, self).__init__(*args, **kwargs)
     self._index = None
@@ -272,6 +341,7 @@ class IndexedSequentialCollection(SequentialCollection):
         self.collection_id):
       self._index[index] = (ts, suffix)
       self._max_indexed = max(index, self._max_indexed)
+    self._index_keys = sorted(self._index)
 
   def _MaybeWriteIndex(self, i, ts, mutation_pool):
     """Write index marker i."""
@@ -282,28 +352,17 @@ class IndexedSequentialCollection(SequentialCollection):
                   self.INDEX_WRITE_DELAY).AsMicrosecondsSinceEpoch():
         mutation_pool.CollectionAddIndex(self.collection_id, i, ts[0], ts[1])
         self._index[i] = ts
+        self._index_keys.append(i)
         self._max_indexed = max(i, self._max_indexed)
 
   def _IndexedScan(self, i, max_records=None):
     """Scan records starting with index i."""
     self._ReadIndex()
 
-    # The record number that we will read next.
-    idx = 0
+    # Find the closest index entry at or before i.
+    idx = self._index_keys[bisect.bisect_right(self._index_keys, i) - 1]
     # The timestamp that we will start reading from.
-    start_ts = 0
-    if i >= self._max_indexed:
-      start_ts = max((0, 0), (self._index[self._max_indexed][0],
-                              self._index[self._max_indexed][1] - 1))
-      idx = self._max_indexed
-    else:
-      try:
-        possible_idx = i - i % self.INDEX_SPACING
-        start_ts = (max(0, self._index[possible_idx][0]),
-                    self._index[possible_idx][1] - 1)
-        idx = possible_idx
-      except KeyError:
-        pass
+    start_ts = max((0, 0), (self._index[idx][0], self._index[idx][1] - 1))
 
     if max_records is not None:
       max_records += i - idx
@@ -331,6 +390,7 @@ class IndexedSequentialCollection(SequentialCollection):
       raise RuntimeError("Index must be >= 0")
 
   def CalculateLength(self):
+    """Counts the records by scanning from the last index entry."""
     self._ReadIndex()
     highest_index = None
     for (i, _, _) in self._IndexedScan(self._max_indexed):
@@ -339,11 +399,102 @@ class IndexedSequentialCollection(SequentialCollection):
       return 0
     return highest_index + 1
 
+  def _ReadCount(self):
+    """Returns the stored record count or None if it is incomplete."""
+    count, deltas, records = data_store.DB.CollectionReadCount(
+        self.collection_id)
+    if count is None:
+      if not deltas and not records:
+        return None
+
+      # Records written before counts were kept have no deltas. Until the
+      # count is compacted, we can only trust the deltas if there are no
+      # records older than the oldest delta.
+      first_counted = min(ts for _, _, ts in deltas + records)
+      for (ts, _) in self.Scan(max_records=1):
+        if ts < first_counted:
+          return None
+      count = 0
+
+    return count + sum(delta for _, delta, _ in deltas) + len(records)
+
   def __len__(self):
-    return self.CalculateLength()
+    count = self._ReadCount()
+    if count is None:
+      return self.CalculateLength()
+    return count
+
+  def _CountRecordsBefore(self, timestamp):
+    result = 0
+    for (ts, _) in self.Scan():
+      if ts >= timestamp:
+        break
+      result += 1
+    return result
+
+  def _CompactCount(self):
+    """Folds the count deltas into the stored count.
+
+    Must be called with the collection locked.
+
+    Returns:
+      The number of records in the collection.
+    """
+    count, deltas, records = data_store.DB.CollectionReadCount(
+        self.collection_id)
+    # Count markers stay around, only the new ones need to be looked at.
+    new_records = [(attr, ts) for attr, is_new, ts in records if is_new]
+    if not deltas and not new_records and count is not None:
+      return count + len(records)
+
+    first_counted = (rdfvalue.RDFDatetime.Now() -
+                     self.INDEX_WRITE_DELAY).AsMicrosecondsSinceEpoch()
+    if deltas or new_records:
+      first_counted = min(
+          first_counted,
+          min([ts for _, _, ts in deltas] + [ts for _, ts in new_records]))
+
+    if count is None:
+      # Count the records that were written before counts were kept.
+      count = self._CountRecordsBefore(first_counted)
+
+    # A delta older than an index entry means records were written late and
+    # the entry now points at the wrong record. A new marker might just be an
+    # overwrite, but we can't tell.
+    self._ReadIndex()
+    invalid = [
+        i for i in self._index_keys if i and self._index[i][0] >= first_counted
+    ]
+
+    count += sum(delta for _, delta, _ in deltas)
+    with data_store.DB.GetMutationPool() as mutation_pool:
+      mutation_pool.CollectionSetCount(
+          self.collection_id,
+          count, [attribute for attribute, _, _ in deltas],
+          seen_records=new_records)
+      if invalid:
+        mutation_pool.CollectionDeleteIndexes(self.collection_id, invalid)
+
+    if invalid:
+      self._index = None
+
+    return count + len(records)
 
   def UpdateIndex(self):
+    """Compacts the record count and extends the offset index."""
+    try:
+      with data_store.DB.LockRetryWrapper(
+          self.collection_id, lease_time=self.INDEX_LOCK_LEASE, blocking=False):
+        count = self._CompactCount()
+    except data_store.DBSubjectLockError:
+      # Someone else is updating this collection right now.
+      return
+
     self._ReadIndex()
+    # There is nothing to index if the last index entry is close to the end.
+    if count - self._max_indexed <= self.INDEX_SPACING:
+      return
+
     for _ in self._IndexedScan(self._max_indexed):
       pass
 
@@ -360,8 +511,15 @@ class IndexedSequentialCollection(SequentialCollection):
         timestamp=timestamp,
         suffix=suffix,
         mutation_pool=mutation_pool)
-    if random.randint(0, cls.INDEX_SPACING) == 0:
-      BACKGROUND_INDEX_UPDATER.AddIndexToUpdate(cls, collection_urn)
+
+    if not isinstance(collection_urn, rdfvalue.RDFURN):
+      collection_urn = rdfvalue.RDFURN(collection_urn)
+    if suffix is None:
+      mutation_pool.CollectionIncrementCount(collection_urn, r[0])
+    else:
+      # The caller picked the key, this might overwrite an existing record.
+      mutation_pool.CollectionCountRecord(collection_urn, r[0], r[1])
+    BACKGROUND_INDEX_UPDATER.AddIndexToUpdate(cls, collection_urn)
     return r
 
 
@@ -84,6 +84,39 @@ class SequentialCollectionTest(aff4_test_lib.AFF4ObjectTest):
     self.assertEqual(even_results[0], 0)
     self.assertEqual(even_results[49], 98)
 
+  def testStaticMultiResolve(self):
+    collections = [
+        self._TestCollection("aff4:/sequential_collection/testMulti%d" % i)
+        for i in range(3)
+    ]
+    records = []
+    with data_store.DB.GetMutationPool() as pool:
+      for i in range(30):
+        collection = collections[i % 3]
+        ts, suffix = collection.Add(rdfvalue.RDFInteger(i), mutation_pool=pool)
+        records.append(
+            data_store.Record(
+                queue_id=collection.collection_id,
+                timestamp=ts,
+                suffix=suffix,
+                subpath="Results",
+                value=None))
+
+    # Reverse the records to check that the results follow their order.
+    results = TestSequentialCollection.StaticMultiResolve(records[::-1])
+    self.assertEqual(len(results), 3)
+    for i, collection in enumerate(collections):
+      self.assertEqual(results[collection.collection_id],
+                       list(range(27 + i, i - 1, -3)))
+
+    missing = data_store.Record(
+        queue_id=rdfvalue.RDFURN("aff4:/sequential_collection/testMulti3"),
+        timestamp=rdfvalue.RDFDatetime.Now().AsMicrosecondsSinceEpoch(),
+        suffix=1,
+        subpath="Results",
+        value=None)
+    self.assertEqual(TestSequentialCollection.StaticMultiResolve([missing]), {})
+
   def testDelete(self):
     collection = self._TestCollection("aff4:/sequential_collection/testDelete")
     with data_store.DB.GetMutationPool() as pool:
@@ -230,6 +263,116 @@ class IndexedSequentialCollectionTest(aff4_test_lib.AFF4ObjectTest):
         for i in range(data_size - spacing + 5, data_size - spacing - 5, -1):
           self.assertEqual(collection[i], i)
 
+  def testLengthIsCounted(self):
+    collection = self._TestCollection(
+        "aff4:/sequential_collection/testLengthIsCounted")
+    for _ in range(3):
+      with data_store.DB.GetMutationPool() as pool:
+        for i in range(10):
+          collection.Add(rdfvalue.RDFInteger(i), mutation_pool=pool)
+
+    self.assertEqual(len(collection), 30)
+
+    collection.UpdateIndex()
+    with test_lib.Instrument(sequential_collection.SequentialCollection,
+                             "Scan") as scan:
+      self.assertEqual(len(collection), 30)
+      self.assertEqual(scan.call_count, 0)
+
+    with data_store.DB.GetMutationPool() as pool:
+      for i in range(5):
+        collection.Add(rdfvalue.RDFInteger(i), mutation_pool=pool)
+
+    self.assertEqual(len(collection), 35)
+
+  def testLengthOfCollectionWithUncountedRecords(self):
+    urn = rdfvalue.RDFURN(
+        "aff4:/sequential_collection/testLengthOfCollectionWithUncounted")
+    collection = self._TestCollection(urn)
+
+    # Records written without updating the count.
+    start = rdfvalue.RDFDatetime.Now() - rdfvalue.Duration("1h")
+    with data_store.DB.GetMutationPool() as pool:
+      for i in range(10):
+        pool.CollectionAddItem(urn, rdfvalue.RDFInteger(i),
+                               start.AsMicrosecondsSinceEpoch() + i)
+    self.assertEqual(len(collection), 10)
+
+    with data_store.DB.GetMutationPool() as pool:
+      for i in range(5):
+        collection.Add(rdfvalue.RDFInteger(i), mutation_pool=pool)
+    self.assertEqual(len(collection), 15)
+
+    collection.UpdateIndex()
+    count, deltas, records = data_store.DB.CollectionReadCount(urn)
+    self.assertEqual(count, 15)
+    self.assertEqual(deltas, [])
+    self.assertEqual(records, [])
+    self.assertEqual(len(collection), 15)
+
+  def testOverwritesAreNotCounted(self):
+    urn = rdfvalue.RDFURN("aff4:/sequential_collection/testOverwrites")
+    collection = self._TestCollection(urn)
+    timestamp = rdfvalue.RDFDatetime.Now().AsMicrosecondsSinceEpoch()
+    with data_store.DB.GetMutationPool() as pool:
+      for i in range(3):
+        collection.Add(
+            rdfvalue.RDFInteger(i),
+            timestamp=timestamp,
+            suffix=i + 1,
+            mutation_pool=pool)
+      collection.Add(
+          rdfvalue.RDFInteger(5),
+          timestamp=timestamp,
+          suffix=1,
+          mutation_pool=pool)
+    self.assertEqual(len(collection), 3)
+
+    collection.UpdateIndex()
+    with data_store.DB.GetMutationPool() as pool:
+      collection.Add(
+          rdfvalue.RDFInteger(6),
+          timestamp=timestamp,
+          suffix=2,
+          mutation_pool=pool)
+    self.assertEqual(len(collection), 3)
+    collection.UpdateIndex()
+    self.assertEqual(len(collection), 3)
+    self.assertEqual(list(collection), [5, 6, 2])
+
+  def testLateWriteInvalidatesIndex(self):
+    spacing = 10
+    with utils.Stubber(sequential_collection.IndexedSequentialCollection,
+                       "INDEX_SPACING", spacing):
+      urn = "aff4:/sequential_collection/testLateWriteInvalidatesIndex"
+      collection = self._TestCollection(urn)
+      start = rdfvalue.RDFDatetime.Now().AsMicrosecondsSinceEpoch()
+      with data_store.DB.GetMutationPool() as pool:
+        for i in range(3 * spacing):
+          collection.Add(
+              rdfvalue.RDFInteger(i), timestamp=start + i, mutation_pool=pool)
+
+      with test_lib.FakeTime(rdfvalue.RDFDatetime.Now() +
+                             rdfvalue.Duration("10m")):
+        collection.UpdateIndex()
+        indexed = self._TestCollection(urn)
+        indexed._ReadIndex()
+        self.assertEqual(
+            sorted(iterkeys(indexed._index)), [0, spacing, 2 * spacing])
+
+        # A record written long after its timestamp moves all later records.
+        with data_store.DB.GetMutationPool() as pool:
+          collection.Add(
+              rdfvalue.RDFInteger(-1), timestamp=start - 1, mutation_pool=pool)
+
+        collection.UpdateIndex()
+
+      collection = self._TestCollection(urn)
+      self.assertEqual(len(collection), 3 * spacing + 1)
+      self.assertEqual(collection[0], -1)
+      for i in [spacing - 1, spacing, 2 * spacing, 3 * spacing]:
+        self.assertEqual(collection[i], i - 1)
+
   def testListing(self):
     test_urn = "aff4:/sequential_collection/testIndexedListing"
     collection = self._TestCollection(test_urn)
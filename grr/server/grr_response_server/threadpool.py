@@ -23,6 +23,7 @@ Example usage:
 """
 from __future__ import division
 
+import collections
 import itertools
 import logging
 import os
@@ -533,3 +534,99 @@ class BatchConverter(object):
 
     finally:
       pool.Stop()
+
+
+class _ReadAheadTask(object):
+  """A task running on a ReadAhead pool whose result is waited for."""
+
+  def __init__(self, target):
+    self.target = target
+    self.result = None
+    self.exception = None
+    self.done = threading.Event()
+
+  def Run(self):
+    try:
+      self.result = self.target()
+    except Exception as e:  # pylint: disable=broad-except
+      self.exception = e
+    finally:
+      self.done.set()
+
+  def Wait(self):
+    """Waits for the task to finish and returns its result."""
+    self.done.wait()
+    if self.exception is not None:
+      raise self.exception  # pylint: disable=raising-bad-type
+    return self.result
+
+
+class ReadAhead(object):
+  """Runs tasks ahead on a thread pool and returns their results in order.
+
+  At most num_threads tasks are pending at any time, so the memory used by the
+  results doesn't grow with the number of tasks. Every ReadAhead owns its
+  thread pool, which is stopped by Close().
+
+  Example usage:
+  >>> with ReadAhead(4) as read_ahead:
+  >>>   for batch in batches:
+  >>>     for result in read_ahead.Add(functools.partial(Read, batch)):
+  >>>       Process(result)
+  >>>   for result in read_ahead.Drain():
+  >>>     Process(result)
+  """
+
+  def __init__(self, num_threads, name="ReadAhead"):
+    """Constructor.
+
+    Args:
+      num_threads: The number of tasks running in parallel. If 0, tasks run
+        inline when they are added.
+      name: The name of the tasks, used in the log.
+    """
+    self.num_threads = num_threads
+    self.name = name
+    self._pending = collections.deque()
+    # The pool is anonymous so it isn't shared and ReadAheads of different
+    # sizes can run at the same time.
+    self._pool = ThreadPool(None, num_threads)
+    self._pool.Start()
+
+  def Add(self, target):
+    """Schedules a task.
+
+    Args:
+      target: A callable without arguments.
+
+    Returns:
+      A list of the results of the oldest tasks which had to be waited for to
+      keep at most num_threads tasks pending.
+
+    Raises:
+      Exception: Any exception raised by one of the returned tasks.
+    """
+    task = _ReadAheadTask(target)
+    self._pool.AddTask(target=task.Run, name=self.name)
+    self._pending.append(task)
+
+    results = []
+    while len(self._pending) > max(self.num_threads - 1, 0):
+      results.append(self._pending.popleft().Wait())
+    return results
+
+  def Drain(self):
+    """Yields the results of all the pending tasks, in order."""
+    while self._pending:
+      yield self._pending.popleft().Wait()
+
+  def Close(self):
+    """Stops the thread pool, waiting for the running tasks."""
+    self._pending.clear()
+    self._pool.Stop()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, unused_type, unused_value, unused_traceback):
+    self.Close()
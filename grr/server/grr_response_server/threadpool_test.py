@@ -371,6 +371,61 @@ class BatchConverterTest(test_lib.GRRBaseTest):
       self.assertEqual(r, str(i) + "*")
 
 
+class ReadAheadTest(test_lib.GRRBaseTest):
+  """ReadAhead tests."""
+
+  def _Run(self, read_ahead, values):
+    results = []
+    for value in values:
+      results.extend(read_ahead.Add(lambda value=value: value * 2))
+    results.extend(read_ahead.Drain())
+    return results
+
+  def testResultsAreReturnedInOrder(self):
+    with threadpool.ReadAhead(4) as read_ahead:
+      self.assertEqual(self._Run(read_ahead, range(20)), list(range(0, 40, 2)))
+
+  def testInline(self):
+    with threadpool.ReadAhead(0) as read_ahead:
+      self.assertEqual(self._Run(read_ahead, range(5)), list(range(0, 10, 2)))
+
+  def testAtMostNumThreadsTasksArePending(self):
+    running = []
+    lock = threading.Lock()
+    max_running = [0]
+
+    def Task():
+      with lock:
+        running.append(1)
+        max_running[0] = max(max_running[0], len(running))
+      time.sleep(0.01)
+      with lock:
+        running.pop()
+
+    with threadpool.ReadAhead(3) as read_ahead:
+      for _ in range(20):
+        read_ahead.Add(Task)
+      list(read_ahead.Drain())
+
+    self.assertLessEqual(max_running[0], 3)
+
+  def testExceptionsAreRaisedToTheCaller(self):
+
+    def Fail():
+      raise ValueError("Task failed")
+
+    with threadpool.ReadAhead(2) as read_ahead:
+      read_ahead.Add(Fail)
+      with self.assertRaises(ValueError):
+        list(read_ahead.Drain())
+
+  def testCloseStopsThePool(self):
+    base_thread_count = threading.active_count()
+    with threadpool.ReadAhead(5):
+      self.assertEqual(threading.active_count(), base_thread_count + 5)
+    self.assertEqual(threading.active_count(), base_thread_count)
+
+
 def main(argv):
   test_lib.main(argv)
 
@@ -3,9 +3,10 @@
 """
 from __future__ import division
 
-import copy
+import bisect
 
 from builtins import range  # pylint: disable=redefined-builtin
+from builtins import zip  # pylint: disable=redefined-builtin
 
 from grr_response_core.lib import rdfvalue
 
@@ -14,7 +15,12 @@ NORMALIZE_MODE_COUNTER = 2
 
 
 class Timeseries(object):
-  """Timeseries contains a sequence of points, each with a timestamp."""
+  """Timeseries contains a sequence of points, each with a timestamp.
+
+  Values and timestamps are kept in two separate lists of the same length, so
+  that the operations below can work on whole columns instead of on lists of
+  points. The timestamps are always sorted.
+  """
 
   def __init__(self, initializer=None):
     """Create a timeseries with an optional initializer.
@@ -26,15 +32,25 @@ class Timeseries(object):
       RuntimeError: If initializer is not understood.
     """
     if initializer is None:
-      self.data = []
+      self.values = []
+      self.timestamps = []
       return
     if isinstance(initializer, Timeseries):
-      self.data = copy.deepcopy(initializer.data)
+      # Values are numbers, a shallow copy of the columns is enough.
+      self.values = list(initializer.values)
+      self.timestamps = list(initializer.timestamps)
       return
     raise RuntimeError("Unrecognized initializer.")
 
+  @property
+  def data(self):
+    """The points of the series as a list of [value, timestamp] lists."""
+    return [list(p) for p in zip(self.values, self.timestamps)]
+
   def _NormalizeTime(self, time):
     """Normalize a time to be an int measured in microseconds."""
+    if time is None:
+      return None
     if isinstance(time, rdfvalue.RDFDatetime):
       return time.AsMicrosecondsSinceEpoch()
     if isinstance(time, rdfvalue.Duration):
@@ -55,18 +71,50 @@ class Timeseries(object):
     """
 
     timestamp = self._NormalizeTime(timestamp)
-    if self.data and timestamp < self.data[-1][1]:
+    if self.timestamps and timestamp < self.timestamps[-1]:
       raise RuntimeError("Next timestamp must be larger.")
-    self.data.append([value, timestamp])
+    self.values.append(value)
+    self.timestamps.append(timestamp)
 
   def MultiAppend(self, value_timestamp_pairs):
     """Adds multiple value<->timestamp pairs.
 
     Args:
       value_timestamp_pairs: Tuples of (value, timestamp).
+
+    Raises:
+      RuntimeError: If the timestamps are not increasing. No points are added
+        in this case.
     """
+    values = []
+    timestamps = []
     for value, timestamp in value_timestamp_pairs:
-      self.Append(value, timestamp)
+      values.append(value)
+      timestamps.append(self._NormalizeTime(timestamp))
+
+    if not timestamps:
+      return
+
+    if ((self.timestamps and timestamps[0] < self.timestamps[-1]) or
+        any(t2 < t1 for t1, t2 in zip(timestamps, timestamps[1:]))):
+      raise RuntimeError("Next timestamp must be larger.")
+
+    self.values.extend(values)
+    self.timestamps.extend(timestamps)
+
+  def _Slice(self, start, stop):
+    self.values = self.values[start:stop]
+    self.timestamps = self.timestamps[start:stop]
+
+  def _RangeIndices(self, start_time, stop_time):
+    """Returns the slice of points with start_time <= timestamp < stop_time."""
+    start = 0
+    stop = len(self.timestamps)
+    if start_time is not None:
+      start = bisect.bisect_left(self.timestamps, start_time)
+    if stop_time is not None:
+      stop = bisect.bisect_left(self.timestamps, stop_time, start)
+    return start, stop
 
   def FilterRange(self, start_time=None, stop_time=None):
     """Filter the series to lie between start_time and stop_time.
@@ -80,11 +128,9 @@ class Timeseries(object):
 
     start_time = self._NormalizeTime(start_time)
     stop_time = self._NormalizeTime(stop_time)
-    self.data = [
-        p for p in self.data
-        if (start_time is None or p[1] >= start_time) and
-        (stop_time is None or p[1] < stop_time)
-    ]
+    start, stop = self._RangeIndices(start_time, stop_time)
+    if start != 0 or stop != len(self.timestamps):
+      self._Slice(start, stop)
 
   def Normalize(self, period, start_time, stop_time, mode=NORMALIZE_MODE_GAUGE):
     """Normalize the series to have a fixed period over a fixed time range.
@@ -122,33 +168,52 @@ class Timeseries(object):
     period = self._NormalizeTime(period)
     start_time = self._NormalizeTime(start_time)
     stop_time = self._NormalizeTime(stop_time)
-    if not self.data:
+    if not self.timestamps:
       return
 
     self.FilterRange(start_time, stop_time)
 
-    grouped = {}
-    for value, timestamp in self.data:
-      offset = timestamp - start_time
-      shifted_offset = offset - (offset % period)
-      grouped.setdefault(shifted_offset, []).append(value)
-
-    self.data = []
-    last_value = None
-    for offset in range(0, stop_time - start_time, period):
-      g = grouped.get(offset)
-      if mode == NORMALIZE_MODE_GAUGE:
-        v = None
-        if g:
-          v = sum(g) / len(g)
-        self.data.append([v, offset + start_time])
-      else:
-        if g:
-          for v in g:
-            if v < last_value:
-              raise RuntimeError("Next value must not be smaller.")
-            last_value = v
-        self.data.append([last_value, offset + start_time])
+    num_buckets = len(range(0, stop_time - start_time, period))
+    out_timestamps = list(range(start_time, start_time + num_buckets * period,
+                                period))
+
+    # Timestamps are sorted, so the points of every output interval are next to
+    # each other and a single pass over the series is enough.
+    if mode == NORMALIZE_MODE_GAUGE:
+      out_values = [None] * num_buckets
+      current_bucket = None
+      total = 0
+      count = 0
+      for value, timestamp in zip(self.values, self.timestamps):
+        bucket = (timestamp - start_time) // period
+        if bucket != current_bucket:
+          if count:
+            out_values[current_bucket] = total / count
+          current_bucket = bucket
+          total = 0
+          count = 0
+        total += value
+        count += 1
+      if count:
+        out_values[current_bucket] = total / count
+
+    else:
+      last_values = {}
+      last_value = None
+      for value, timestamp in zip(self.values, self.timestamps):
+        if last_value is not None and value < last_value:
+          raise RuntimeError("Next value must not be smaller.")
+        last_value = value
+        last_values[(timestamp - start_time) // period] = value
+
+      out_values = []
+      last_value = None
+      for bucket in range(num_buckets):
+        last_value = last_values.get(bucket, last_value)
+        out_values.append(last_value)
+
+    self.values = out_values
+    self.timestamps = out_timestamps
 
   def MakeIncreasing(self):
     """Makes the time series increasing.
@@ -162,15 +227,16 @@ class Timeseries(object):
     larger than the previous level.
 
     """
+    values = self.values
     offset = 0
     last_value = None
-    for p in self.data:
-      if last_value and last_value > p[0]:
+    for i, value in enumerate(values):
+      if last_value and last_value > value:
         # Assume that it was only reset once.
         offset += last_value
-      last_value = p[0]
+      last_value = value
       if offset:
-        p[0] += offset
+        values[i] = value + offset
 
   def ToDeltas(self):
     """Convert the sequence to the sequence of differences between points.
@@ -178,15 +244,17 @@ class Timeseries(object):
     The value of each point v[i] is replaced by v[i+1] - v[i], except for the
     last point which is dropped.
     """
-    if len(self.data) < 2:
-      self.data = []
+    if len(self.timestamps) < 2:
+      self.values = []
+      self.timestamps = []
       return
-    for i in range(0, len(self.data) - 1):
-      if self.data[i][0] is None or self.data[i + 1][0] is None:
-        self.data[i][0] = None
-      else:
-        self.data[i][0] = self.data[i + 1][0] - self.data[i][0]
-    del self.data[-1]
+
+    values = self.values
+    self.values = [
+        None if v1 is None or v2 is None else v2 - v1
+        for v1, v2 in zip(values, values[1:])
+    ]
+    del self.timestamps[-1]
 
   def Add(self, other):
     """Add other to self pointwise.
@@ -201,24 +269,23 @@ class Timeseries(object):
     Raises:
       RuntimeError: other does not contain the same timestamps as self.
     """
-    if len(self.data) != len(other.data):
+    if len(self.timestamps) != len(other.timestamps):
       raise RuntimeError("Can only add series of identical lengths.")
-    for i in range(len(self.data)):
-      if self.data[i][1] != other.data[i][1]:
-        raise RuntimeError("Timestamp mismatch.")
-      if self.data[i][0] is None and other.data[i][0] is None:
-        continue
-      self.data[i][0] = (self.data[i][0] or 0) + (other.data[i][0] or 0)
+    if self.timestamps != other.timestamps:
+      raise RuntimeError("Timestamp mismatch.")
+
+    self.values = [
+        None if v1 is None and v2 is None else (v1 or 0) + (v2 or 0)
+        for v1, v2 in zip(self.values, other.values)
+    ]
 
   def Rescale(self, multiplier):
     """Multiply pointwise by multiplier."""
-    for p in self.data:
-      if p[0] is not None:
-        p[0] *= multiplier
+    self.values = [None if v is None else v * multiplier for v in self.values]
 
   def Mean(self):
     """Return the arithmatic mean of all values."""
-    values = [v for v, _ in self.data if v is not None]
+    values = [v for v in self.values if v is not None]
     if not values:
       return None
 
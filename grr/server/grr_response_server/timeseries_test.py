@@ -28,6 +28,37 @@ class TimeseriesTest(test_lib.GRRBaseTest):
     self.assertEqual([5, 100000], s.data[0])
     self.assertEqual([14, 190000], s.data[-1])
 
+  def testFilterRangeOpenEnded(self):
+    s = self.makeSeries()
+    s.FilterRange(start_time=1000000)
+    self.assertEqual([[95, 1000000], [96, 1010000], [97, 1020000],
+                      [98, 1030000], [99, 1040000], [100, 1050000]], s.data)
+
+    s = self.makeSeries()
+    s.FilterRange(stop_time=80000)
+    self.assertEqual([[1, 60000], [2, 70000]], s.data)
+
+  def testMultiAppend(self):
+    s = timeseries.Timeseries()
+    s.MultiAppend([(1, 10), (2, 20)])
+    s.MultiAppend([(3, 20), (4, 30)])
+    self.assertEqual([[1, 10], [2, 20], [3, 20], [4, 30]], s.data)
+
+    with self.assertRaises(RuntimeError):
+      s.MultiAppend([(5, 40), (6, 35)])
+    with self.assertRaises(RuntimeError):
+      s.MultiAppend([(5, 25)])
+    self.assertEqual(4, len(s.data))
+
+  def testInitializerCopiesPoints(self):
+    s1 = self.makeSeries()
+    s2 = timeseries.Timeseries(s1)
+    s2.Rescale(2)
+    s2.FilterRange(100000, 200000)
+    self.assertEqual(100, len(s1.data))
+    self.assertEqual([1, 60000], s1.data[0])
+    self.assertEqual([10, 100000], s2.data[0])
+
   def testNormalize(self):
     s = self.makeSeries()
     s.Normalize(10 * 10000, 100000, 600000)
@@ -22,6 +22,7 @@ from grr_response_server import data_store
 from grr_response_server import flow
 from grr_response_server import handler_registry
 from grr_response_server import master
+from grr_response_server import notification_bus
 from grr_response_server import queue_manager as queue_manager_lib
 # pylint: disable=unused-import
 from grr_response_server import server_stubs
@@ -108,10 +109,12 @@ class GRRWorker(object):
   def Run(self):
     """Event loop."""
     was_master = False
+    notified_shards = None
     try:
       while 1:
         if master.MASTER_WATCHER.IsMaster():
-          processed = self.RunOnce()
+          processed = self.RunOnce(notified_shards=notified_shards)
+          notified_shards = None
           if not was_master:
             if data_store.RelationalDBReadEnabled(category="message_handlers"):
               data_store.REL_DB.RegisterMessageHandler(
@@ -126,6 +129,10 @@ class GRRWorker(object):
           time.sleep(60)
 
         if processed == 0:
+          if notification_bus.BUS is not None:
+            notified_shards = self.WaitForNotifications()
+            continue
+
           if time.time() - self.last_active > self.SHORT_POLL_TIME:
             interval = self.POLLING_INTERVAL
           else:
@@ -139,6 +146,17 @@ class GRRWorker(object):
       logging.info("Caught interrupt, exiting.")
       self.__class__.thread_pool.Join()
 
+  def WaitForNotifications(self):
+    """Blocks on the notification bus until our queues get notified.
+
+    Returns:
+      A dict mapping notified queues to the list of their notified shards.
+      Empty if nothing was published within the bounded wait time, the next
+      RunOnce() call then just polls the queues as usual.
+    """
+    return notification_bus.BUS.Wait(
+        self.queues, timeout=config.CONFIG["Worker.notification_bus_max_wait"])
+
   def _ProcessMessageHandlerRequests(self, requests):
     """Processes message handler requests."""
     logging.debug("Leased message handler request ids: %s", ",".join(
@@ -162,12 +180,17 @@ class GRRWorker(object):
         str(r.request_id) for r in requests))
     data_store.REL_DB.DeleteMessageHandlerRequests(requests)
 
-  def RunOnce(self):
+  def RunOnce(self, notified_shards=None):
     """Processes one set of messages from Task Scheduler.
 
     The worker processes new jobs from the task master. For each job
     we retrieve the session from the Task Scheduler.
 
+    Args:
+      notified_shards: An optional dict mapping queues to the list of their
+        shards known to have new notifications. For these queues only the
+        given shards are read, other queues are polled as usual.
+
     Returns:
         Total number of messages processed by this call.
     """
@@ -181,7 +204,11 @@ class GRRWorker(object):
       queue_manager.FreezeTimestamp()
 
       fetch_messages_start = time.time()
-      notifications = queue_manager.GetNotifications(queue)
+      if notified_shards and queue in notified_shards:
+        notifications = queue_manager.GetNotificationsForShards(
+            notified_shards[queue])
+      else:
+        notifications = queue_manager.GetNotifications(queue)
       stats.STATS.RecordEvent("worker_time_to_retrieve_notifications",
                               time.time() - fetch_messages_start)
 
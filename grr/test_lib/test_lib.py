@@ -42,6 +42,7 @@ from grr_response_server import artifact
 from grr_response_server import client_index
 from grr_response_server import data_store
 from grr_response_server import email_alerts
+from grr_response_server import export
 from grr_response_server.aff4_objects import aff4_grr
 from grr_response_server.aff4_objects import filestore
 from grr_response_server.aff4_objects import users
@@ -106,6 +107,7 @@ class GRRBaseTest(unittest.TestCase):
     data_store.REL_DB.delegate.ClearTestDB()
 
     aff4.FACTORY.Flush()
+    export.CLIENT_METADATA_CACHE.Flush()
 
     # Create a Foreman and Filestores, they are used in many tests.
     aff4_grr.GRRAFF4Init().Run()